@@ -1,4 +1,6 @@
+import atexit
 import os
+import click
 from flask import Flask
 from dotenv import load_dotenv
 from supabase import create_client, Client
@@ -13,17 +15,37 @@ def create_app():
     app.config.from_object('api.config.Config')
     app.secret_key = os.getenv("FLASK_SECRET_KEY", "super-secret-key")
 
-    # Supabase client
+    # Supabase client (auth, and the tables unless DATA_BACKEND=sqlite)
     SUPABASE_URL = os.getenv('SUPABASE_URL')
     SUPABASE_KEY = os.getenv('SUPABASE_API_KEY')
     
-    if not SUPABASE_URL or not SUPABASE_KEY:
+    if SUPABASE_URL and SUPABASE_KEY:
+        setattr(app, "supabase", create_client(SUPABASE_URL, SUPABASE_KEY))
+    elif app.config['DATA_BACKEND'] == 'supabase':
         raise RuntimeError('SUPABASE_URL and SUPABASE_KEY must be set in environment variables')
-    
-    setattr(app, "supabase", create_client(SUPABASE_URL, SUPABASE_KEY))
+    else:
+        setattr(app, "supabase", None)
+
+    # Every table query goes through these repositories
+    from api.repositories import create_repositories
+    setattr(app, "repos", create_repositories(app.config, app.supabase))
+
+    # Order, fill and balance writes from the trading routes, applied by a
+    # background worker in batches (or in the request with WRITE_BEHIND=0)
+    from api.repositories import WriteBehind
+    setattr(app, "writes", WriteBehind(app.repos,
+                                       max_pending=app.config['WRITE_BEHIND_QUEUE_SIZE'],
+                                       batch_size=app.config['WRITE_BEHIND_BATCH_SIZE'],
+                                       synchronous=not app.config['WRITE_BEHIND']))
+    atexit.register(app.writes.close)
 
-    # Orderbook markets dict (in-memory)
-    setattr(app, "markets", {})
+    # In-memory orderbooks of every loaded market, held by the engine's
+    # MarketRegistry. Each book carries its own lock and releases the GIL
+    # while matching, so threaded servers (gunicorn gthread, waitress) can
+    # match different markets in parallel.
+    from api.utils import ob
+    setattr(app, "markets", ob.MarketRegistry())
+    app.markets.enable_timing(app.config['ORDERBOOK_TIMING'])
 
     # Register blueprints
     from api.routes.main import main_bp
@@ -37,10 +59,41 @@ def create_app():
     app.register_blueprint(user_bp)
     app.register_blueprint(auth_bp)
 
-    # Load all orderbooks from DB on startup
-    from api.utils import load_all_orderbooks_from_db
+    # Books are hydrated on first use (see get_or_create_orderbook), unless
+    # ORDERBOOK_LAZY_LOAD is off and they are all loaded from DB on startup
+    from api.utils import clear_eviction_snapshots, load_all_orderbooks_from_db, save_orderbook_snapshots
     with app.app_context():
+        clear_eviction_snapshots()
+        if not app.config['ORDERBOOK_LAZY_LOAD']:
+            load_all_orderbooks_from_db()
+
+    @app.cli.command('save-orderbook-snapshot')
+    def save_orderbook_snapshot():
+        """Write every active market's orderbook to ORDERBOOK_SNAPSHOT_PATH for fast cold starts."""
+        path = app.config.get('ORDERBOOK_SNAPSHOT_PATH')
+        if not path:
+            raise RuntimeError('ORDERBOOK_SNAPSHOT_PATH must be set to save an orderbook snapshot')
         load_all_orderbooks_from_db()
+        print(f"Saved {save_orderbook_snapshots(path)} orderbooks to {path}")
+
+    @app.cli.command('orderbook-stats')
+    @click.option('--counters', is_flag=True, help='Also print each book\'s engine counters.')
+    def orderbook_stats(counters):
+        """Print order, level and estimated memory figures for every loaded orderbook."""
+        stats = app.markets.all_stats()
+        for market_id, book in stats.items():
+            print(f"{market_id}  orders={book.order_count}  levels={book.level_count}  "
+                  f"capacity={book.order_capacity}  memory={book.memory_bytes / 1024:.1f} KiB  "
+                  f"bytes/order={book.bytes_per_order:.0f}")
+            if counters:
+                print("    " + "  ".join(f"{name}={value}" for name, value in book.as_dict().items()
+                                         if name not in ('order_count', 'level_count', 'order_capacity', 'memory_bytes')))
+        total = sum(book.memory_bytes for book in stats.values())
+        orders = sum(book.order_count for book in stats.values())
+        user_bytes = app.markets.user_table_bytes()
+        print(f"{len(stats)} books, {orders} orders, {total / (1024 * 1024):.1f} MiB "
+              f"({total / orders if orders else 0:.0f} bytes/order)")
+        print(f"{app.markets.user_count()} users interned, {user_bytes / 1024:.1f} KiB")
 
     return app
 
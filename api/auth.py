@@ -7,8 +7,8 @@ auth_bp = Blueprint('auth', __name__)
 def is_admin(user_id):
     """Check if user is admin by looking up in users table"""
     try:
-        user_resp = app.supabase.table('users').select('is_admin').eq('id', user_id).single().execute()
-        return user_resp.data and user_resp.data.get('is_admin', False)
+        user = app.repos.users.get(user_id, 'is_admin')
+        return bool(user and user.get('is_admin', False))
     except Exception:
         return False
 
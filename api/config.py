@@ -5,4 +5,33 @@ class Config:
     SUPABASE_URL = os.getenv('SUPABASE_URL')
     SUPABASE_API_KEY = os.getenv('SUPABASE_API_KEY')
     DEBUG = os.getenv('FLASK_DEBUG', '0') == '1'
+    # Orderbook snapshot file restored at boot (written by `flask save-orderbook-snapshot`)
+    ORDERBOOK_SNAPSHOT_PATH = os.getenv('ORDERBOOK_SNAPSHOT_PATH')
+    # Directory of per-market engine journals; books resume from them at boot
+    ORDERBOOK_JOURNAL_DIR = os.getenv('ORDERBOOK_JOURNAL_DIR')
+    # Time every match in the engine (match_ns / max_match_ns in the book stats)
+    ORDERBOOK_TIMING = os.getenv('ORDERBOOK_TIMING', '0') == '1'
+    # Load each market's book on first use (1) rather than every book at startup (0)
+    ORDERBOOK_LAZY_LOAD = os.getenv('ORDERBOOK_LAZY_LOAD', '1') == '1'
+    # Evict books unused for this many seconds (0: never)
+    ORDERBOOK_IDLE_SECONDS = float(os.getenv('ORDERBOOK_IDLE_SECONDS', '0'))
+    # Evict least recently used books while the books' estimated memory is over this (0: no limit)
+    ORDERBOOK_MEMORY_BUDGET_MB = float(os.getenv('ORDERBOOK_MEMORY_BUDGET_MB', '0'))
+    # Directory evicted books are snapshotted to, so they come back without a full reload
+    ORDERBOOK_EVICT_DIR = os.getenv('ORDERBOOK_EVICT_DIR')
+    # Open orders fetched per query when loading the books at startup
+    ORDERBOOK_LOAD_PAGE_SIZE = int(os.getenv('ORDERBOOK_LOAD_PAGE_SIZE', '1000'))
+    # Concurrent order streams at startup, each over its own shard of markets
+    ORDERBOOK_LOAD_WORKERS = int(os.getenv('ORDERBOOK_LOAD_WORKERS', '4'))
+    # Where the app's tables live: 'supabase', or 'sqlite' to run offline
+    DATA_BACKEND = os.getenv('DATA_BACKEND', 'supabase')
+    # SQLite database file for DATA_BACKEND=sqlite (default: in memory)
+    SQLITE_PATH = os.getenv('SQLITE_PATH', ':memory:')
+    # Record orders, fills and balance changes from a background worker (1), or
+    # within the request (0; the default on Vercel, which freezes idle threads)
+    WRITE_BEHIND = os.getenv('WRITE_BEHIND', '0' if os.getenv('VERCEL') else '1') == '1'
+    # Queued writes before the trading routes turn orders away with a 503
+    WRITE_BEHIND_QUEUE_SIZE = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', '10000'))
+    # Queued writes the worker applies per batch
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '500'))
     # Add other config options as needed 
\ No newline at end of file
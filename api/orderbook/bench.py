@@ -0,0 +1,326 @@
+"""Benchmark suite for the matching engine: throughput and tail latency with
+deep resting books.
+
+    python bench.py                                    # every workload at 10k, 100k and 1M resting
+    python bench.py --sizes 10000 --ops 50000 --workloads churn mixed
+    python bench.py --json run.json                    # save the results
+    python bench.py --baseline run.json                # compare with a saved run
+    python bench.py --engine py --sizes 10000          # the pure-Python engine
+
+Books are prefilled from a fixed seed with non-crossing orders (bids 1-49,
+asks 51-99), so two runs with the same arguments do the same work. Workloads:
+  add       - add resting orders that never match
+  churn     - add a resting order, then cancel a random resting order
+  match     - a fill-and-kill buy that takes liquidity, then a replenishing ask
+  sweep     - a fill-and-kill buy that clears the best 2-10 ask levels; the
+              levels are put back, untimed, with one batch add
+  snapshot  - snapshot() of the whole book, and restore() of the bytes
+  mixed     - both tokens: passive adds near the touch, cancels, amends,
+              small aggressive orders, depth and BBO reads, quotes
+
+Latencies are per call and include the Python call overhead; bench_engine.cpp
+times the engine without it. The garbage collector is paused while timing.
+"""
+import argparse
+import datetime
+import gc
+import importlib
+import json
+import os
+import platform
+import random
+import struct
+import sys
+import time
+from contextlib import contextmanager
+
+ENGINES = {"cpp": "orderbook_cpp", "py": "orderbook_py"}
+WORKLOADS = ("add", "churn", "match", "sweep", "snapshot", "mixed")
+USER = "bench"
+BATCH = 10_000
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+@contextmanager
+def timing():
+    gc.collect()
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+
+
+class Book:
+    """Wraps an Orderbook prefilled with `size` resting orders and tracks the
+    engine ids of resting orders."""
+
+    def __init__(self, ob, size, rng, tokens=1):
+        self.ob = ob
+        self.rng = rng
+        self.tokens = tokens
+        self.request = struct.Struct(ob.ORDER_REQUEST_FORMAT)
+        self.book = ob.Orderbook()
+        self.book.reserve(size)
+        self.resting = []
+        for start in range(0, size, BATCH):
+            requests = b"".join(self.resting_request() for _ in range(min(BATCH, size - start)))
+            order_ids, _ = self.book.add_orders_batch(requests, USER)
+            self.resting.extend(memoryview(order_ids))
+
+    def random_resting(self):
+        """(side, price, quantity, token) of an order that never crosses"""
+        rng = self.rng
+        token = self.ob.Token.YES if self.tokens == 1 or rng.random() < 0.5 else self.ob.Token.NO
+        if rng.random() < 0.5:
+            return self.ob.Side.Buy, rng.randint(1, 49), rng.randint(1, 100), token
+        return self.ob.Side.Sell, rng.randint(51, 99), rng.randint(1, 100), token
+
+    def resting_request(self):
+        side, price, quantity, token = self.random_resting()
+        return self.request.pack(price, quantity, int(self.ob.OrderType.GoodTillCancel), int(side), int(token))
+
+    def add(self, order_type, side, price, quantity, token=None):
+        token = self.ob.Token.YES if token is None else token
+        return self.book.add_order(order_type, side, price, quantity, USER, token)
+
+    def add_resting(self):
+        side, price, quantity, token = self.random_resting()
+        self.resting.append(self.add(self.ob.OrderType.GoodTillCancel, side, price, quantity, token).order_id)
+
+    def pop_random(self):
+        resting = self.resting
+        index = self.rng.randrange(len(resting))
+        resting[index], resting[-1] = resting[-1], resting[index]
+        return resting.pop()
+
+
+def result(workload, size, ops, elapsed_ns, latencies, **extra):
+    latencies.sort()
+    return {
+        "workload": workload, "size": size, "ops": ops,
+        "ops_per_sec": round(ops / (elapsed_ns / 1e9)),
+        "p50_ns": percentile(latencies, 50), "p99_ns": percentile(latencies, 99),
+        "p999_ns": percentile(latencies, 99.9), "max_ns": latencies[-1],
+        **extra,
+    }
+
+
+def bench_add(ob, size, args, rng):
+    book = Book(ob, size, rng)
+    latencies = []
+    with timing():
+        start = time.perf_counter_ns()
+        for _ in range(args.ops):
+            t0 = time.perf_counter_ns()
+            book.add_resting()
+            latencies.append(time.perf_counter_ns() - t0)
+        elapsed = time.perf_counter_ns() - start
+    return [result("add", size, args.ops, elapsed, latencies)]
+
+
+def bench_churn(ob, size, args, rng):
+    book = Book(ob, size, rng)
+    latencies = []
+    with timing():
+        start = time.perf_counter_ns()
+        for _ in range(args.ops // 2):
+            t0 = time.perf_counter_ns()
+            book.add_resting()
+            t1 = time.perf_counter_ns()
+            order_id = book.pop_random()
+            t2 = time.perf_counter_ns()
+            book.book.cancel_order(order_id)
+            t3 = time.perf_counter_ns()
+            latencies.append(t1 - t0)
+            latencies.append(t3 - t2)
+        elapsed = time.perf_counter_ns() - start
+    return [result("churn", size, args.ops, elapsed, latencies)]
+
+
+def bench_match(ob, size, args, rng):
+    book = Book(ob, size, rng)
+    latencies = []
+    with timing():
+        start = time.perf_counter_ns()
+        for _ in range(args.ops // 2):
+            quantity = rng.randint(1, 200)
+            t0 = time.perf_counter_ns()
+            book.add(ob.OrderType.FillAndKill, ob.Side.Buy, 99, quantity)
+            t1 = time.perf_counter_ns()
+            book.add(ob.OrderType.GoodTillCancel, ob.Side.Sell, rng.randint(51, 99), quantity)
+            t2 = time.perf_counter_ns()
+            latencies.append(t1 - t0)
+            latencies.append(t2 - t1)
+        elapsed = time.perf_counter_ns() - start
+    return [result("match", size, args.ops, elapsed, latencies)]
+
+
+def bench_sweep(ob, size, args, rng):
+    book = Book(ob, 0, rng)
+    # Half bids, half asks; each ask level's requests are kept so a swept
+    # level can be put back exactly as it was
+    gtc = int(ob.OrderType.GoodTillCancel)
+    bids = [book.request.pack(rng.randint(1, 49), rng.randint(1, 100), gtc, int(ob.Side.Buy), int(ob.Token.YES))
+            for _ in range(size // 2)]
+    levels = {price: [] for price in range(51, 100)}
+    for _ in range(size - size // 2):
+        price = rng.randint(51, 99)
+        levels[price].append(book.request.pack(price, rng.randint(1, 100), gtc, int(ob.Side.Sell), int(ob.Token.YES)))
+    levels = {price: b"".join(requests) for price, requests in levels.items()}
+    book.book.add_orders_batch(b"".join(bids) + b"".join(levels.values()), USER)
+
+    fill_size = struct.calcsize(ob.FILL_RECORD_FORMAT)
+    latencies, fills = [], 0
+    with timing():
+        for _ in range(args.sweeps):
+            depth = rng.randint(2, 10)
+            t0 = time.perf_counter_ns()
+            swept = book.add(ob.OrderType.FillAndKill, ob.Side.Buy, 50 + depth, 2 ** 32 - 1)
+            latencies.append(time.perf_counter_ns() - t0)
+            fills += memoryview(swept.fills).nbytes // fill_size
+            book.book.add_orders_batch(b"".join(levels[price] for price in range(51, 51 + depth)), USER)
+    return [result("sweep", size, args.sweeps, sum(latencies), latencies, fills_per_op=round(fills / args.sweeps, 1))]
+
+
+def bench_snapshot(ob, size, args, rng):
+    book = Book(ob, size, rng, tokens=2)
+    snapshots, restores = [], []
+    with timing():
+        for _ in range(args.snapshots):
+            t0 = time.perf_counter_ns()
+            data = book.book.snapshot()
+            t1 = time.perf_counter_ns()
+            restored = ob.Orderbook.restore(data)
+            t2 = time.perf_counter_ns()
+            snapshots.append(t1 - t0)
+            restores.append(t2 - t1)
+            del restored
+    mb = len(data) / 1e6
+    return [result("snapshot", size, args.snapshots, sum(snapshots), snapshots, bytes=len(data),
+                   mb_per_sec=round(mb * args.snapshots / (sum(snapshots) / 1e9), 1)),
+            result("restore", size, args.snapshots, sum(restores), restores, bytes=len(data),
+                   mb_per_sec=round(mb * args.snapshots / (sum(restores) / 1e9), 1))]
+
+
+def bench_mixed(ob, size, args, rng):
+    book = Book(ob, size, rng, tokens=2)
+    tokens = (ob.Token.YES, ob.Token.NO)
+    gtc, fak = ob.OrderType.GoodTillCancel, ob.OrderType.FillAndKill
+    latencies = []
+    with timing():
+        start = time.perf_counter_ns()
+        for _ in range(args.ops):
+            roll = rng.random()
+            token = rng.choice(tokens)
+            if roll < 0.35 or not book.resting:
+                # Passive, near the touch
+                if rng.random() < 0.5:
+                    side, price = ob.Side.Buy, rng.randint(40, 49)
+                else:
+                    side, price = ob.Side.Sell, rng.randint(51, 60)
+                quantity = rng.randint(1, 100)
+                t0 = time.perf_counter_ns()
+                book.resting.append(book.add(gtc, side, price, quantity, token).order_id)
+            elif roll < 0.6:
+                order_id = book.pop_random()
+                t0 = time.perf_counter_ns()
+                book.book.cancel_order(order_id)
+            elif roll < 0.7:
+                order_id = book.resting[rng.randrange(len(book.resting))]
+                order = book.book.get_order(order_id)
+                price = order.get_price() if order else 50
+                new_price = price if rng.random() < 0.5 else (price - 1 if price < 50 else price + 1)
+                t0 = time.perf_counter_ns()
+                book.book.amend_order(order_id, min(max(new_price, 1), 99), rng.randint(1, 100))
+            elif roll < 0.8:
+                side = rng.choice((ob.Side.Buy, ob.Side.Sell))
+                price = 60 if side == ob.Side.Buy else 40
+                quantity = rng.randint(1, 50)
+                t0 = time.perf_counter_ns()
+                book.add(fak, side, price, quantity, token)
+            elif roll < 0.9:
+                t0 = time.perf_counter_ns()
+                book.book.get_depth(token, 10)
+            elif roll < 0.95:
+                t0 = time.perf_counter_ns()
+                book.book.get_bbo(token)
+            else:
+                side, quantity = rng.choice((ob.Side.Buy, ob.Side.Sell)), rng.randint(1, 500)
+                t0 = time.perf_counter_ns()
+                book.book.quote(side, token, quantity)
+            latencies.append(time.perf_counter_ns() - t0)
+        elapsed = time.perf_counter_ns() - start
+    return [result("mixed", size, args.ops, elapsed, latencies)]
+
+
+BENCHES = {"add": bench_add, "churn": bench_churn, "match": bench_match, "sweep": bench_sweep,
+           "snapshot": bench_snapshot, "mixed": bench_mixed}
+
+
+def change(new, old):
+    return f"{(new - old) / old:+.1%}" if old else "n/a"
+
+
+def report(row, baseline):
+    line = (f"{row['workload']:<9} {row['size']:>9,} resting  {row['ops_per_sec']:>11,} ops/s  "
+            f"p50 {row['p50_ns']:>9,} ns  p99 {row['p99_ns']:>9,} ns  p999 {row['p999_ns']:>10,} ns")
+    if "fills_per_op" in row:
+        line += f"  {row['fills_per_op']:,} fills/op"
+    if "mb_per_sec" in row:
+        line += f"  {row['mb_per_sec']:,} MB/s"
+    old = baseline.get((row["workload"], row["size"]))
+    if old:
+        line += f"  [ops/s {change(row['ops_per_sec'], old['ops_per_sec'])}, p99 {change(row['p99_ns'], old['p99_ns'])}]"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="cpp")
+    parser.add_argument("--workloads", choices=WORKLOADS, nargs="+", default=list(WORKLOADS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--ops", type=int, default=200_000, help="timed calls per add, churn, match and mixed run")
+    parser.add_argument("--sweeps", type=int, default=500, help="timed sweeps per sweep run")
+    parser.add_argument("--snapshots", type=int, default=20, help="timed snapshots and restores per snapshot run")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", metavar="PATH", help="write the results here")
+    parser.add_argument("--baseline", metavar="PATH", help="show changes against results saved with --json")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    ob = importlib.import_module(ENGINES[args.engine])
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {(row["workload"], row["size"]): row for row in json.load(f)["results"]}
+
+    started = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    results = []
+    for size in args.sizes:
+        for workload in args.workloads:
+            for row in BENCHES[workload](ob, size, args, random.Random(args.seed)):
+                report(row, baseline)
+                results.append(row)
+
+    if args.json:
+        run = {
+            "engine": ob.__name__,
+            "started": started,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("json", "baseline")},
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(run, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+// bench_engine.cpp - native throughput/latency benchmark for the matching engine
+//
+// Times the engine directly, without the Python call overhead that dominates
+// bench.py, so changes to order storage and matching show up clearly.
+//
+//   g++ -O2 -std=c++20 bench_engine.cpp -o bench_engine
+//   ./bench_engine [ops]
+//
+// Every book is prefilled with non-crossing YES orders (bids 1-49, asks
+// 51-99), then two workloads run against it:
+//   add/cancel - add a resting order, then cancel a random resting order
+//   match      - a fill-and-kill buy that takes liquidity, then a replenishing ask
+#define ORDERBOOK_NO_BINDINGS
+#include "orderbook_bindings.cpp"
+
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include <random>
+
+namespace {
+
+using Clock = std::chrono::steady_clock;
+
+const std::string BenchUser = "9d626b36-4f08-4f7b-b0ea-036ac880be3e";
+
+struct Bench {
+    Orderbook book;
+    std::vector<OrderId> resting;
+    std::mt19937_64 rng{ 42 };
+
+    std::uint32_t Uniform(std::uint32_t lo, std::uint32_t hi) {
+        return std::uniform_int_distribution<std::uint32_t>(lo, hi)(rng);
+    }
+
+    OrderId Add(OrderType type, Side side, Price price, Quantity quantity) {
+        return book.AddOrder(type, side, price, quantity, BenchUser, Token::YES).orderId_;
+    }
+
+    void AddResting() {
+        if (Uniform(0, 1) == 0)
+            resting.push_back(Add(OrderType::GoodTillCancel, Side::Buy, Uniform(1, 49), Uniform(1, 100)));
+        else
+            resting.push_back(Add(OrderType::GoodTillCancel, Side::Sell, Uniform(51, 99), Uniform(1, 100)));
+    }
+
+    explicit Bench(std::size_t size) {
+        resting.reserve(size + 1);
+        for (std::size_t i = 0; i < size; ++i)
+            AddResting();
+    }
+};
+
+std::int64_t Percentile(std::vector<std::int64_t>& samples, double pct) {
+    std::sort(samples.begin(), samples.end());
+    auto index = std::min(samples.size() - 1, static_cast<std::size_t>(samples.size() * pct / 100.0));
+    return samples[index];
+}
+
+void Report(const char* name, std::size_t size, std::size_t ops, Clock::duration elapsed,
+            std::vector<std::int64_t>& latencies) {
+    double seconds = std::chrono::duration<double>(elapsed).count();
+    std::printf("%-11s %9zu resting  %12.0f ops/s  p50 %6lld ns  p99 %6lld ns\n",
+                name, size, ops / seconds,
+                static_cast<long long>(Percentile(latencies, 50)),
+                static_cast<long long>(Percentile(latencies, 99)));
+}
+
+std::int64_t Nanos(Clock::time_point from, Clock::time_point to) {
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(to - from).count();
+}
+
+void BenchAddCancel(std::size_t size, std::size_t ops) {
+    Bench bench(size);
+    std::vector<std::int64_t> latencies;
+    latencies.reserve(ops);
+
+    auto start = Clock::now();
+    for (std::size_t i = 0; i < ops / 2; ++i) {
+        auto t0 = Clock::now();
+        bench.AddResting();
+        auto t1 = Clock::now();
+        std::size_t index = bench.Uniform(0, static_cast<std::uint32_t>(bench.resting.size() - 1));
+        std::swap(bench.resting[index], bench.resting.back());
+        bench.book.CancelOrder(bench.resting.back());
+        bench.resting.pop_back();
+        auto t2 = Clock::now();
+        latencies.push_back(Nanos(t0, t1));
+        latencies.push_back(Nanos(t1, t2));
+    }
+    Report("add/cancel", size, ops, Clock::now() - start, latencies);
+}
+
+void BenchMatch(std::size_t size, std::size_t ops) {
+    Bench bench(size);
+    std::vector<std::int64_t> latencies;
+    latencies.reserve(ops);
+
+    auto start = Clock::now();
+    for (std::size_t i = 0; i < ops / 2; ++i) {
+        Quantity quantity = bench.Uniform(1, 200);
+        auto t0 = Clock::now();
+        bench.Add(OrderType::FillAndKill, Side::Buy, 99, quantity);
+        auto t1 = Clock::now();
+        bench.Add(OrderType::GoodTillCancel, Side::Sell, bench.Uniform(51, 99), quantity);
+        auto t2 = Clock::now();
+        latencies.push_back(Nanos(t0, t1));
+        latencies.push_back(Nanos(t1, t2));
+    }
+    Report("match", size, ops, Clock::now() - start, latencies);
+}
+
+} // namespace
+
+int main(int argc, char** argv) {
+    std::size_t ops = argc > 1 ? std::strtoull(argv[1], nullptr, 10) : 1'000'000;
+    for (std::size_t size : { 10'000, 100'000, 1'000'000 }) {
+        BenchAddCancel(size, ops);
+        BenchMatch(size, ops);
+    }
+    return 0;
+}
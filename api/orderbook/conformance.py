@@ -0,0 +1,524 @@
+"""Conformance suite shared by orderbook_cpp and orderbook_py.
+
+    python conformance.py                 # every engine that imports
+    python conformance.py --engine py     # only the pure-Python engine
+    python conformance.py --seeds 50      # longer differential run
+
+Every check runs against each engine. When both import, a differential
+run then drives them with the same random operations and requires equal
+results, snapshots and journal bytes, and each engine must restore and
+replay the other's output.
+"""
+import argparse
+import importlib
+import os
+import pickle
+import random
+import struct
+import sys
+import tempfile
+import traceback
+
+ENGINES = {"cpp": "orderbook_cpp", "py": "orderbook_py"}
+
+
+def fills_of(ob, result):
+    return list(struct.iter_unpack(ob.FILL_RECORD_FORMAT, result.fills))
+
+
+def check_price_time_priority(ob):
+    book = ob.Orderbook()
+    first = book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 60, 5, "a", ob.Token.YES).order_id
+    second = book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 60, 5, "b", ob.Token.YES).order_id
+    cheaper = book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 59, 2, "c", ob.Token.YES).order_id
+    fills = fills_of(ob, book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 60, 8, "t", ob.Token.YES))
+    assert [(fill[2], fill[3], fill[5]) for fill in fills] == [(cheaper, 59, 2), (first, 60, 5), (second, 60, 1)]
+    assert book.get_order(second).get_remaining_quantity() == 4
+    assert book.size() == 1
+
+
+def check_mint(ob):
+    book = ob.Orderbook()
+    maker = book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 40, 10, "m", ob.Token.NO).order_id
+    result = book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 65, 4, "t", ob.Token.YES)
+    (fill,) = fills_of(ob, result)
+    assert fill[2:9] == (maker, 60, 40, 4, int(ob.Token.YES), int(ob.Side.Buy), int(ob.MatchType.Mint))
+    (trade,) = result.trades
+    assert trade.get_match_type() == ob.MatchType.Mint and trade.get_ask_trade().order_id == maker
+
+
+def check_fill_and_kill(ob):
+    book = ob.Orderbook()
+    book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 50, 3, "m", ob.Token.NO)
+    result = book.add_order(ob.OrderType.FillAndKill, ob.Side.Buy, 55, 10, "t", ob.Token.NO)
+    assert sum(fill[5] for fill in fills_of(ob, result)) == 3
+    assert book.get_order(result.order_id) is None and book.size() == 0
+    assert len(book.add_order(ob.OrderType.FillAndKill, ob.Side.Sell, 1, 10, "t", ob.Token.NO).fills) == 0
+
+
+def check_external_ids(ob):
+    book = ob.Orderbook()
+    book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 30, 5, "u", ob.Token.YES, "db-1")
+    assert book.get_order("db-1").get_external_id() == "db-1"
+    expect_error(ValueError, book.add_order, ob.OrderType.GoodTillCancel, ob.Side.Buy, 30, 5, "u", ob.Token.YES, "db-1")
+    expect_error(ValueError, book.add_order, ob.OrderType.GoodTillCancel, ob.Side.Buy, 30, 5, "u", ob.Token.YES,
+                 "x" * (ob.ID_FIELD_SIZE + 1))
+    assert book.cancel_order("db-1") == 5 and book.cancel_order("db-1") == 0
+    assert book.get_order("db-1") is None
+
+
+def check_validation(ob):
+    book = ob.Orderbook(5)
+    for price in (0, 3, 100):
+        expect_error(ValueError, book.add_order, ob.OrderType.GoodTillCancel, ob.Side.Buy, price, 1, "u", ob.Token.YES)
+    expect_error(ValueError, ob.Orderbook, 3)
+    expect_error(TypeError, book.add_order, ob.OrderType.GoodTillCancel, ob.Side.Buy, -5, 1, "u", ob.Token.YES)
+    assert book.get_tick_size() == 5 and book.get_pair_price() == ob.PAIR_PRICE
+
+
+def check_amend(ob):
+    book = ob.Orderbook()
+    first = book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 60, 10, "a", ob.Token.YES, "first").order_id
+    second = book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 60, 10, "b", ob.Token.YES).order_id
+    # Shrinking keeps priority, growing loses it
+    assert len(book.amend_order("first", 60, 4).fills) == 0
+    assert fills_of(ob, book.add_order(ob.OrderType.FillAndKill, ob.Side.Buy, 60, 1, "t", ob.Token.YES))[0][2] == first
+    book.amend_order(first, 60, 20)
+    assert fills_of(ob, book.add_order(ob.OrderType.FillAndKill, ob.Side.Buy, 60, 1, "t", ob.Token.YES))[0][2] == second
+    order = book.get_order(first)
+    assert (order.get_initial_quantity(), order.get_remaining_quantity()) == (21, 20)
+    # A reprice that crosses trades like an incoming order
+    bid = book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 50, 12, "c", ob.Token.YES).order_id
+    result = book.amend_order(bid, 60, 12)
+    assert [(fill[2], fill[5]) for fill in fills_of(ob, result)] == [(second, 9), (first, 3)]
+    assert result.order_id == bid and book.get_order(bid) is None
+    assert book.get_order(first).get_remaining_quantity() == 17
+    assert book.amend_order(12345, 50, 1) is None
+    expect_error(ValueError, book.amend_order, first, 60, 0)
+    # Shares filled since the caller's expected_qty are not handed back
+    book.add_order(ob.OrderType.FillAndKill, ob.Side.Buy, 60, 5, "t", ob.Token.YES)
+    result = book.amend_order(first, 60, 17, expected_qty=17)
+    assert result.previous_quantity == 12 and book.get_order(first).get_remaining_quantity() == 12
+    expect_error(ValueError, book.amend_order, first, 60, 5, 17)
+    book.check_invariants()
+
+
+def check_batches(ob):
+    book = ob.Orderbook()
+    requests = b"".join(struct.pack(ob.ORDER_REQUEST_FORMAT, price, 10, int(ob.OrderType.GoodTillCancel),
+                                    int(ob.Side.Sell), int(ob.Token.YES)) for price in (70, 71, 72))
+    order_ids, fills = book.add_orders_batch(requests, "maker", ["q1", "q2", "q3"])
+    assert len(order_ids) == 3 and len(fills) == 0 and memoryview(order_ids).format == "I"
+    take = struct.pack(ob.ORDER_REQUEST_FORMAT, 71, 15, int(ob.OrderType.FillAndKill), int(ob.Side.Buy),
+                       int(ob.Token.YES))
+    _, fills = book.add_orders_batch(take + take, "taker")
+    records = list(struct.iter_unpack(ob.FILL_RECORD_FORMAT, fills))
+    assert [(record[0], record[5]) for record in records] == [(0, 10), (0, 5), (1, 5)]
+    assert records[0][10].rstrip(b"\0") == b"q1" and records[0][12].rstrip(b"\0") == b"maker"
+    expect_error(ValueError, book.add_orders_batch, requests[:-1], "maker")
+    expect_error(ValueError, book.add_orders_batch, requests, "maker", ["q9"])
+    assert book.size() == 1
+    assert book.cancel_orders_batch(struct.pack("<2I", memoryview(order_ids)[2], 999)) == 1
+    assert book.cancel_orders_batch(["q1", "q2"]) == 0
+
+
+def check_market_data(ob):
+    book = ob.Orderbook()
+    for price, quantity in ((40, 5), (40, 7), (38, 1)):
+        book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, price, quantity, "u", ob.Token.YES)
+    book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 45, 3, "u", ob.Token.YES)
+    depth = book.get_depth(ob.Token.YES, 1)
+    assert [(level.price, level.quantity, level.order_count) for level in depth.get_bids()] == [(40, 12, 2)]
+    assert len(book.get_order_infos(ob.Token.YES).get_bids()) == 2
+    records = list(struct.iter_unpack(ob.DEPTH_RECORD_FORMAT, book.get_depth_records(ob.Token.YES, 5)))
+    assert records == [(40, 12, 2, 0), (38, 1, 1, 0), (45, 3, 1, 1)]
+    top = book.get_bbo(ob.Token.YES)
+    assert (top.bid.price, top.ask.price) == (40, 45) and book.get_bbo(ob.Token.NO).bid is None
+
+
+def check_quote(ob):
+    rng = random.Random(7)
+    for _ in range(50):
+        book = ob.Orderbook()
+        for _ in range(rng.randint(0, 60)):
+            book.add_order(ob.OrderType.GoodTillCancel, rng.choice([ob.Side.Buy, ob.Side.Sell]), rng.randint(1, 99),
+                           rng.randint(1, 20), "m", rng.choice([ob.Token.YES, ob.Token.NO]))
+        side, token = rng.choice([ob.Side.Buy, ob.Side.Sell]), rng.choice([ob.Token.YES, ob.Token.NO])
+        quantity, limit = rng.randint(1, 300), rng.choice([None, rng.randint(1, 99)])
+        before = book.snapshot()
+        quote = book.quote(side, token, quantity, limit)
+        assert book.snapshot() == before
+        price = limit if limit is not None else (99 if side == ob.Side.Buy else 1)
+        fills = fills_of(ob, book.add_order(ob.OrderType.FillAndKill, side, price, quantity, "t", token))
+        assert quote.quantity == sum(fill[5] for fill in fills)
+        assert quote.total_cost == sum(fill[5] * fill[3] for fill in fills)
+        assert quote.worst_price == (fills[-1][3] if fills else 0)
+
+
+def check_snapshots(ob):
+    book = random_book(ob, random.Random(3), 500)
+    data = book.snapshot()
+    restored = ob.Orderbook.restore(memoryview(data))
+    assert restored.snapshot() == data and restored.size() == book.size()
+    assert pickle.loads(pickle.dumps(book)).snapshot() == data
+    expect_error(ValueError, ob.Orderbook.restore, data[:-1])
+    expect_error(ValueError, ob.Orderbook.restore, b"nope" + data[4:])
+
+
+def check_journal(ob):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "book.journal")
+        book = ob.Orderbook()
+        book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 55, 10, "a", ob.Token.YES, "before")
+        book.open_journal(path)
+        expect_error(ValueError, book.open_journal, path)
+        rng = random.Random(5)
+        random_ops(ob, book, rng, 300)
+        sequence = book.journal_sequence()
+        book.sync_journal()
+        book.close_journal()
+        assert sequence > 1 and book.journal_sequence() == 0
+        assert ob.Orderbook.replay(path).snapshot() == book.snapshot()
+
+        # A torn last record ends the journal; resuming carries on from there
+        with open(path, "r+b") as file:
+            file.truncate(os.path.getsize(path) - 3)
+        resumed = ob.Orderbook.replay(path, resume=True)
+        assert resumed.journal_sequence() == sequence - 1
+        resumed.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 5, 1, "z", ob.Token.NO)
+        resumed.close_journal()
+        assert ob.Orderbook.replay(path).snapshot() == resumed.snapshot()
+        expect_error(ValueError, ob.Orderbook.open_journal, ob.Orderbook(), path)
+
+
+def check_registry(ob):
+    registry = ob.MarketRegistry()
+    first = registry.create("m1", 5)
+    second = random_book(ob, random.Random(13), 300)
+    users = {user_id for user_id in [f"u{i}" for i in range(6)] + ["batch"] if snapshot_orders(second, user_id)}
+    registry.add("m2", second)
+    second.check_invariants()
+    assert registry.user_count() == len(users) and registry.user_table_bytes() > 0
+    expect_error(ValueError, registry.create, "m1")
+    expect_error(ValueError, registry.add, "m2", ob.Orderbook())
+    assert registry.get("m1") is first and registry.get("m3") is None
+    assert len(registry) == 2 and "m2" in registry and registry.market_ids() == ["m1", "m2"]
+    assert [market_id for market_id, _ in registry.items()] == ["m1", "m2"]
+
+    for price in (5, 10, 15):
+        first.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, price, 2, "u1", ob.Token.YES)
+    first.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 95, 2, "u2", ob.Token.NO)
+    stats = registry.stats("m1")
+    assert (stats.order_count, stats.level_count) == (4, 4) and stats.memory_bytes > 0
+    assert stats.order_capacity >= 4 and registry.stats("m3") is None
+    assert stats.bytes_per_order == stats.memory_bytes / 4 and ob.Orderbook().stats().bytes_per_order == 0
+    assert registry.user_count() == len(users | {"u1", "u2"})
+    assert set(registry.all_stats()) == {"m1", "m2"}
+
+    expected = {"m1": [order.get_order_id() for order in first.orders_for_user("u1")],
+                "m2": user_orders(ob, second, "u1")}
+    assert {market_id: [order.get_order_id() for order in orders]
+            for market_id, orders in registry.orders_for_user("u1").items()} == expected
+    cancelled = registry.cancel_all_for_user("u1")
+    assert {market_id: [order.get_order_id() for order in orders] for market_id, orders in cancelled.items()} == expected
+    assert registry.cancel_all_for_user("u1") == {} and registry.orders_for_user("u1") == {}
+    assert first.size() == 1 and not user_orders(ob, second, "u1")
+    resting = second.size()
+    assert registry.cancel_all("m2") == resting and second.size() == 0
+    assert registry.cancel_all("m3") == 0
+    first.check_invariants()
+    second.check_invariants()
+
+    assert registry.drop("m1") and not registry.drop("m1")
+    assert len(registry) == 1 and first.size() == 1
+
+
+def check_user_index(ob):
+    book = random_book(ob, random.Random(17), 1500)
+    for user_id in [f"u{i}" for i in range(6)] + ["batch", "nobody"]:
+        resting = snapshot_orders(book, user_id)
+        orders = book.orders_for_user(user_id)
+        assert [order.get_order_id() for order in orders] == sorted(resting)
+        for order in orders:
+            assert order.get_user_id() == user_id and resting[order.get_order_id()][3] == order.get_remaining_quantity()
+
+        exposure = book.open_exposure(user_id)
+        assert exposure.order_count == len(resting)
+        for token in (ob.Token.YES, ob.Token.NO):
+            for side, quantity_field, notional_field in ((ob.Side.Buy, "buy_quantity", "buy_notional"),
+                                                         (ob.Side.Sell, "sell_quantity", "sell_notional")):
+                mine = [(price, remaining) for (order_side, order_token, price, remaining) in resting.values()
+                        if order_side == int(side) and order_token == int(token)]
+                assert getattr(exposure.get(token), quantity_field) == sum(remaining for _, remaining in mine)
+                assert getattr(exposure.get(token), notional_field) == sum(price * remaining for price, remaining in mine)
+
+    every = book.all_orders()
+    assert len(every) == book.size() and [order.get_order_id() for order in every] == sorted(
+        order_id for user_id in {order.get_user_id() for order in every}
+        for order_id in snapshot_orders(book, user_id))
+
+    before = book.size()
+    cancelled = book.cancel_all_for_user("u3")
+    assert [order.get_order_id() for order in cancelled] == sorted(snapshot_orders(random_book(ob, random.Random(17), 1500), "u3"))
+    assert book.size() == before - len(cancelled) and not book.orders_for_user("u3")
+    assert book.open_exposure("u3").order_count == 0 and book.cancel_all_for_user("u3") == []
+    book.check_invariants()
+    restored = ob.Orderbook.restore(book.snapshot())
+    assert [order.get_order_id() for order in restored.orders_for_user("u1")] == \
+           [order.get_order_id() for order in book.orders_for_user("u1")]
+    restored.check_invariants()
+
+
+def snapshot_orders(book, user_id):
+    """{order id: (side, token, price, remaining)} of a user's resting orders, read off a snapshot."""
+    data = memoryview(book.snapshot())
+    orders, offset = {}, 24
+    for _ in range(struct.unpack_from("<I", data, 20)[0]):
+        order_id, _, side, token, _, price, _, remaining = struct.unpack_from("<IBBBBIII", data, offset)
+        offset += 20
+        strings = []
+        for _ in range(2):
+            (length,) = struct.unpack_from("<H", data, offset)
+            strings.append(bytes(data[offset + 2:offset + 2 + length]).decode())
+            offset += 2 + length
+        if strings[0] == user_id:
+            orders[order_id] = (side, token, price, remaining)
+    return orders
+
+
+def user_orders(ob, book, user_id):
+    return sorted(snapshot_orders(book, user_id))
+
+
+def counters(stats):
+    """Engine counters that both engines must agree on (not memory or timings)."""
+    return {name: value for name, value in stats.as_dict().items()
+            if name not in ("order_count", "level_count", "order_capacity", "memory_bytes", "match_ns", "max_match_ns")}
+
+
+def check_invariants_hold(ob):
+    book = random_book(ob, random.Random(11), 2000)
+    book.check_invariants()
+
+
+def check_counters(ob):
+    book = ob.Orderbook()
+    for price in range(51, 56):
+        book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, price, 5, "maker", ob.Token.YES)
+    book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 40, 5, "minter", ob.Token.NO)
+    book.add_order(ob.OrderType.FillAndKill, ob.Side.Buy, 99, 12, "taker", ob.Token.YES)
+    book.add_order(ob.OrderType.FillAndKill, ob.Side.Buy, 10, 1, "taker", ob.Token.YES)
+    book.amend_order(4, 54, 9)
+    book.cancel_order(5)
+    book.cancel_order(5)
+    stats = book.stats()
+    assert counters(stats) == {
+        "orders_added": 8, "orders_cancelled": 1, "orders_filled": 3, "orders_amended": 1, "fills": 3,
+        "quantity_filled": 12, "match_calls": 8, "levels_touched": 3, "max_match_length": 3, "timing": False,
+    }, counters(stats)
+    assert stats.match_ns == stats.max_match_ns == 0
+
+    book.enable_timing()
+    book.add_order(ob.OrderType.FillAndKill, ob.Side.Buy, 99, 1, "taker", ob.Token.YES)
+    stats = book.stats()
+    assert stats.timing and stats.fills == 4 and stats.match_ns >= stats.max_match_ns > 0
+    book.reset_stats()
+    stats = book.stats()
+    assert all(value == 0 for value in counters(stats).values() if value is not True) and stats.match_ns == 0
+    assert stats.timing and stats.order_count == book.size() == 3
+
+    registry = ob.MarketRegistry()
+    registry.enable_timing()
+    registry.add("m1", book)
+    added = registry.create("m2")
+    added.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 40, 5, "u", ob.Token.YES)
+    assert registry.stats("m2").timing and registry.stats("m2").orders_added == 1
+    registry.enable_timing(False)
+    registry.reset_stats()
+    assert not any(stats.timing or stats.orders_added for stats in registry.all_stats().values())
+
+
+def check_market_view(ob):
+    book = ob.Orderbook()
+    empty = book.market_view()
+    assert book.sequence() == empty.sequence == 0 and book.market_view() is empty
+
+    book.add_order(ob.OrderType.FillAndKill, ob.Side.Buy, 60, 5, "u", ob.Token.YES)
+    assert book.sequence() == 0 and book.market_view() is empty
+    assert not book.cancel_order(1) and book.amend_order(1, 50, 1) is None and book.sequence() == 0
+
+    ask = book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 60, 5, "u", ob.Token.YES, "ask").order_id
+    book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 30, 4, "u", ob.Token.NO)
+    book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 30, 2, "v", ob.Token.NO)
+    view = book.market_view()
+    assert view.sequence == book.sequence() == 3 and view.digest != empty.digest
+    assert [(level.price, level.quantity, level.order_count) for level in view.get(ob.Token.YES).get_asks()] == [(60, 5, 1)]
+    assert [(level.price, level.quantity, level.order_count) for level in view.no.get_bids()] == [(30, 6, 2)]
+    assert not view.yes.get_bids() and not view.no.get_asks()
+
+    # A partial fill, an amend and a cancel each move the sequence
+    book.add_order(ob.OrderType.FillAndKill, ob.Side.Buy, 60, 1, "t", ob.Token.YES)
+    book.amend_order(ask, 60, 4)
+    assert book.sequence() == 5 and book.market_view().sequence == 5
+    book.cancel_order("ask")
+    assert book.sequence() == 6
+
+    # Same levels, same digest, whatever the sequence
+    book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 60, 5, "u", ob.Token.YES)
+    again = book.market_view()
+    assert again.sequence == 7 and again.digest == view.digest and again is book.market_view()
+    assert ob.Orderbook.restore(book.snapshot()).market_view().digest == view.digest
+
+
+CHECKS = [
+    check_price_time_priority, check_mint, check_fill_and_kill, check_external_ids, check_validation, check_amend,
+    check_batches, check_market_data, check_quote, check_snapshots, check_journal, check_registry,
+    check_user_index, check_counters, check_market_view, check_invariants_hold,
+]
+
+
+def expect_error(error, function, *args):
+    try:
+        function(*args)
+    except error:
+        return
+    raise AssertionError(f"{function.__name__}{args!r:.80} did not raise {error.__name__}")
+
+
+def random_book(ob, rng, operations):
+    book = ob.Orderbook()
+    random_ops(ob, book, rng, operations)
+    return book
+
+
+def random_ops(ob, book, rng, operations):
+    """Drives a book with a random mix of every mutating call; returns what
+    each call returned, in comparable form."""
+    results, order_ids = [], []
+    sides, tokens = [ob.Side.Buy, ob.Side.Sell], [ob.Token.YES, ob.Token.NO]
+    tick = book.get_tick_size()
+    for op in range(operations):
+        roll = rng.random()
+        side, token = rng.choice(sides), rng.choice(tokens)
+        price, quantity = rng.randint(1, (ob.PAIR_PRICE - 1) // tick) * tick, rng.randint(1, 30)
+        if roll < 0.45 or not order_ids:
+            order_type = ob.OrderType.FillAndKill if rng.random() < 0.25 else ob.OrderType.GoodTillCancel
+            external_id = f"e{op}" if rng.random() < 0.7 else ""
+            result = book.add_order(order_type, side, price, quantity, f"u{rng.randint(0, 5)}", token, external_id)
+            order_ids.append(result.order_id)
+            results.append((result.order_id, bytes(result.fills)))
+        elif roll < 0.55:
+            count = rng.randint(1, 6)
+            requests = b"".join(struct.pack(ob.ORDER_REQUEST_FORMAT, rng.randint(1, (ob.PAIR_PRICE - 1) // tick) * tick,
+                                            rng.randint(1, 30), rng.randint(0, 1), rng.randint(0, 1), rng.randint(0, 1))
+                                for _ in range(count))
+            external_ids = [f"b{op}-{i}" for i in range(count)] if rng.random() < 0.5 else None
+            ids, fills = book.add_orders_batch(requests, "batch", external_ids)
+            order_ids += list(memoryview(ids))
+            results.append((list(memoryview(ids)), bytes(fills)))
+        elif roll < 0.7:
+            results.append(book.cancel_order(rng.choice(order_ids)))
+        elif roll < 0.75:
+            results.append(book.cancel_orders_batch(struct.pack("<3I", *(rng.choice(order_ids) for _ in range(3)))))
+        elif roll < 0.8:
+            results.append(book.cancel_order(f"e{rng.randint(0, op)}"))
+        elif roll < 0.89:
+            result = book.amend_order(rng.choice(order_ids), price, quantity)
+            results.append(None if result is None else (result.order_id, bytes(result.fills)))
+        elif roll < 0.9:
+            if rng.random() < 0.9:
+                results.append([describe(order) for order in book.cancel_all_for_user(f"u{rng.randint(0, 5)}")])
+            else:
+                results.append(book.cancel_all())
+        else:
+            quote = book.quote(side, token, quantity * 5, rng.choice([None, price]))
+            top = book.get_bbo(token)
+            user_id = f"u{rng.randint(0, 5)}"
+            exposure = book.open_exposure(user_id).get(token)
+            results.append((quote.quantity, quote.total_cost, quote.worst_price,
+                            bytes(book.get_depth_records(token, 5)),
+                            top.bid and (top.bid.price, top.bid.quantity, top.bid.order_count),
+                            [describe(order) for order in book.orders_for_user(user_id)],
+                            (exposure.buy_quantity, exposure.buy_notional, exposure.sell_quantity,
+                             exposure.sell_notional)))
+    return results
+
+
+def describe(order):
+    return (order.get_order_id(), int(order.get_side()), int(order.get_token()), order.get_price(),
+            order.get_initial_quantity(), order.get_remaining_quantity(), order.get_external_id())
+
+
+def differential(engines, seeds):
+    """Same operations on every engine: equal results, snapshots and journals,
+    and each engine's snapshots and journals load in the others."""
+    cpp, py = engines["cpp"], engines["py"]
+    with tempfile.TemporaryDirectory() as directory:
+        for seed in range(seeds):
+            tick = (1, 1, 5)[seed % 3]
+            outputs = {}
+            for name, ob in engines.items():
+                path = os.path.join(directory, f"{name}-{seed}.journal")
+                book = ob.Orderbook(tick)
+                book.open_journal(path)
+                results = random_ops(ob, book, random.Random(seed), 2000)
+                book.check_invariants()
+                book.close_journal()
+                with open(path, "rb") as file:
+                    outputs[name] = (results, book.snapshot(), file.read(), path,
+                                     (counters(book.stats()), book.sequence(), book.market_view().digest))
+            (cpp_results, cpp_snapshot, cpp_journal, cpp_path, cpp_counters) = outputs["cpp"]
+            (py_results, py_snapshot, py_journal, py_path, py_counters) = outputs["py"]
+            for index, (expected, got) in enumerate(zip(cpp_results, py_results)):
+                assert expected == got, f"seed {seed}: operation {index} differs: {expected!r:.200} != {got!r:.200}"
+            assert cpp_snapshot == py_snapshot, f"seed {seed}: snapshots differ"
+            assert cpp_journal == py_journal, f"seed {seed}: journals differ"
+            assert cpp_counters == py_counters, f"seed {seed}: counters differ: {cpp_counters} != {py_counters}"
+            assert py.Orderbook.restore(cpp_snapshot).snapshot() == cpp_snapshot
+            assert cpp.Orderbook.restore(py_snapshot).snapshot() == py_snapshot
+            assert py.Orderbook.replay(cpp_path).snapshot() == cpp_snapshot
+            assert cpp.Orderbook.replay(py_path).snapshot() == py_snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", choices=sorted(ENGINES), action="append",
+                        help="engine to test (default: every engine that imports)")
+    parser.add_argument("--seeds", type=int, default=10, help="differential runs when both engines are tested")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    engines = {}
+    for name in args.engine or sorted(ENGINES):
+        try:
+            engines[name] = importlib.import_module(ENGINES[name])
+        except ImportError as e:
+            if args.engine:
+                raise
+            print(f"skip {ENGINES[name]}: {e}")
+
+    failures = 0
+    for name, ob in engines.items():
+        for check in CHECKS:
+            try:
+                check(ob)
+                print(f"ok   {name} {check.__name__}")
+            except Exception:
+                failures += 1
+                print(f"FAIL {name} {check.__name__}")
+                traceback.print_exc()
+    if len(engines) == 2:
+        try:
+            differential(engines, args.seeds)
+            print(f"ok   differential ({args.seeds} seeds)")
+        except Exception:
+            failures += 1
+            print("FAIL differential")
+            traceback.print_exc()
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
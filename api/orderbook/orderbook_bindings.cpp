@@ -1,29 +1,54 @@
 // orderbook_bindings.cpp - FIXED VERSION
+//
+// Define ORDERBOOK_NO_BINDINGS before including this file to get the plain
+// C++ engine without pybind11 (see bench_engine.cpp).
+#ifndef ORDERBOOK_NO_BINDINGS
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
 #include <pybind11/operators.h>
+#endif
 
 #include <iostream>
 #include <algorithm>
 #include <tuple>
 #include <memory>
-#include <map>
+#include <bit>
 #include <unordered_map>
-#include <list>
+#include <unordered_set>
+#include <mutex>
+#include <shared_mutex>
 #include <vector>
-#include <numeric>
+#include <limits>
+#include <optional>
+#include <array>
+#include <stdexcept>
+#include <string>
+#include <string_view>
+#include <cstring>
+#include <chrono>
+#include <cstddef>
+#include <type_traits>
 
-enum class OrderType {
+#if defined(__unix__) || defined(__APPLE__)
+#include <cerrno>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#define ORDERBOOK_HAS_MMAP 1
+#endif
+
+enum class OrderType : std::uint8_t {
     GoodTillCancel,
     FillAndKill
 };
 
-enum class Side {
+enum class Side : std::uint8_t {
     Buy,
     Sell
 };
 
-enum class Token {
+enum class Token : std::uint8_t {
     YES,
     NO
 };
@@ -35,10 +60,90 @@ using OrderId = std::uint32_t;
 struct LevelInfo {
     Price price_;
     Quantity quantity_;
+    std::uint32_t orderCount_ = 0;
 };
 
 using LevelInfos = std::vector<LevelInfo>;
 
+// Best bid and best ask of one token's book; either side may be empty.
+struct TopOfBook {
+    std::optional<LevelInfo> bid_;
+    std::optional<LevelInfo> ask_;
+};
+
+// What an order would trade against if it arrived now: how much of it can
+// fill, what that costs (or, for a sell, raises) in total, and the worst
+// price it reaches. Prices are what the order itself pays or receives.
+struct Quote {
+    Quantity quantity_ = 0;
+    std::uint64_t totalCost_ = 0;
+    Price worstPrice_ = 0;
+
+    double AveragePrice() const { return quantity_ ? static_cast<double>(totalCost_) / quantity_ : 0.0; }
+};
+
+// What a book has done since it was built or its counters were last
+// reset. The counts are bumped under the book's lock, so they cost a few
+// adds and are always on; the match timers only run while timing is enabled.
+struct EngineCounters {
+    std::uint64_t ordersAdded_ = 0;
+    std::uint64_t ordersCancelled_ = 0;
+    // Incoming and resting orders whose whole quantity traded
+    std::uint64_t ordersFilled_ = 0;
+    std::uint64_t ordersAmended_ = 0;
+    std::uint64_t fills_ = 0;
+    std::uint64_t quantityFilled_ = 0;
+    // Runs of the match loop: every good-till-cancel add, every fill-and-kill
+    // that can trade, and every amend that reprices or grows an order
+    std::uint64_t matchCalls_ = 0;
+    // Price levels traded against, summed over match calls
+    std::uint64_t levelsTouched_ = 0;
+    // Most fills produced by a single match call
+    std::uint64_t maxMatchLength_ = 0;
+    std::uint64_t matchNanos_ = 0;
+    std::uint64_t maxMatchNanos_ = 0;
+};
+
+// Size of one book: resting orders, occupied price levels over both tokens
+// and sides, order slots allocated, and an estimate of the heap memory the
+// book holds on to (a journal's mapped file is not counted); plus its
+// counters and whether match timing is on.
+struct BookStats {
+    std::size_t orderCount_ = 0;
+    std::size_t levelCount_ = 0;
+    std::size_t orderCapacity_ = 0;
+    std::size_t memoryBytes_ = 0;
+    EngineCounters counters_;
+    bool timing_ = false;
+
+    // Memory per resting order, overheads included; 0 for an empty book.
+    double BytesPerOrder() const {
+        return orderCount_ ? static_cast<double>(memoryBytes_) / orderCount_ : 0.0;
+    }
+};
+
+// What one user's resting orders in one token have committed: open
+// quantity and notional (price x open quantity) on each side. Buy notional
+// is cash set aside; sell quantity is shares promised.
+struct TokenExposure {
+    std::uint64_t buyQuantity_ = 0;
+    std::uint64_t buyNotional_ = 0;
+    std::uint64_t sellQuantity_ = 0;
+    std::uint64_t sellNotional_ = 0;
+};
+
+struct Exposure {
+    std::uint32_t orderCount_ = 0;
+    TokenExposure yes_;
+    TokenExposure no_;
+};
+
+// Heap bytes behind a string; short strings live inside the object itself.
+inline std::size_t StringHeapBytes(const std::string& value) {
+    static const std::size_t inlineCapacity = std::string{}.capacity();
+    return value.capacity() > inlineCapacity ? value.capacity() + 1 : 0;
+}
+
 class OrderbookLevelInfos {
 public:
     OrderbookLevelInfos(const LevelInfos& bids, const LevelInfos& asks)
@@ -52,19 +157,151 @@ private:
     LevelInfos bids_;
 };
 
+// Full depth of both tokens as of one book sequence number, plus a digest
+// of the levels that only changes when they do (e.g. for an HTTP ETag).
+// Immutable once built: a book hands out the same view until its next
+// mutation.
+struct MarketView {
+    MarketView(std::uint64_t sequence, OrderbookLevelInfos yes, OrderbookLevelInfos no)
+        : sequence_(sequence), digest_(Digest(yes, no)), yes_(std::move(yes)), no_(std::move(no)) {}
+
+    std::uint64_t sequence_;
+    std::uint64_t digest_;
+    OrderbookLevelInfos yes_;
+    OrderbookLevelInfos no_;
+
+    // FNV-1a over the level count and (price, quantity, order count) of
+    // every level, YES then NO, bids then asks.
+    static std::uint64_t Digest(const OrderbookLevelInfos& yes, const OrderbookLevelInfos& no) {
+        std::uint64_t hash = 0xcbf29ce484222325;
+        auto mix = [&hash](std::uint64_t value) { hash = (hash ^ value) * 0x100000001b3; };
+        for (const OrderbookLevelInfos* depth : { &yes, &no }) {
+            for (const LevelInfos* levels : { &depth->GetBids(), &depth->GetAsks() }) {
+                mix(levels->size());
+                for (const LevelInfo& level : *levels) {
+                    mix(level.price_);
+                    mix(level.quantity_);
+                    mix(level.orderCount_);
+                }
+            }
+        }
+        return hash;
+    }
+};
+
+// Index of an order's slot in the OrderPool. Slots are stable for as long
+// as the order rests, so they double as intrusive list links.
+using OrderSlot = std::uint32_t;
+constexpr OrderSlot NullSlot = std::numeric_limits<OrderSlot>::max();
+
+// Dense handle for an interned user id (see UserTable).
+using UserHandle = std::uint32_t;
+
+// Interns user ids as dense handles, so resting orders carry four bytes
+// instead of a 36-character UUID each. Handles are never reused. One table
+// is shared by every book of a MarketRegistry, so it locks itself: lookups
+// share the lock and only a first sighting of a user takes it exclusively.
+// Names sit in chunks that double in size and never move, so resolving a
+// handle the caller already holds (the hot path, once per fill) takes no lock.
+class UserTable {
+public:
+    UserHandle Intern(const std::string& userId) {
+        {
+            std::shared_lock lock{ mutex_ };
+            auto it = handles_.find(userId);
+            if (it != handles_.end())
+                return it->second;
+        }
+        std::unique_lock lock{ mutex_ };
+        auto it = handles_.find(userId);
+        if (it != handles_.end())
+            return it->second;
+        if (size_ == Capacity)
+            throw std::length_error("User table exhausted");
+        const UserHandle handle = size_;
+        auto [chunk, offset] = Locate(handle);
+        if (!chunks_[chunk])
+            chunks_[chunk] = std::make_unique<std::string[]>(FirstChunkSize << chunk);
+        std::string& name = chunks_[chunk][offset];
+        name = userId;
+        handles_.emplace(name, handle);
+        ++size_;
+        return handle;
+    }
+
+    std::optional<UserHandle> Find(const std::string& userId) const {
+        std::shared_lock lock{ mutex_ };
+        auto it = handles_.find(userId);
+        if (it == handles_.end())
+            return std::nullopt;
+        return it->second;
+    }
+
+    // `handle` must have come from Intern, which publishes the name before
+    // the handle can reach another thread.
+    const std::string& Name(UserHandle handle) const {
+        auto [chunk, offset] = Locate(handle);
+        return chunks_[chunk][offset];
+    }
+
+    std::size_t Size() const {
+        std::shared_lock lock{ mutex_ };
+        return size_;
+    }
+
+    std::size_t MemoryBytes() const {
+        std::shared_lock lock{ mutex_ };
+        std::size_t bytes = handles_.bucket_count() * sizeof(void*) +
+                            handles_.size() * (sizeof(std::pair<const std::string_view, UserHandle>) + 2 * sizeof(void*));
+        for (std::size_t chunk = 0; chunk < ChunkCount && chunks_[chunk]; ++chunk)
+            bytes += (FirstChunkSize << chunk) * sizeof(std::string);
+        for (UserHandle handle = 0; handle < size_; ++handle)
+            bytes += StringHeapBytes(Name(handle));
+        return bytes;
+    }
+
+private:
+    static constexpr std::size_t FirstChunkBits = 10;
+    static constexpr std::size_t FirstChunkSize = std::size_t{ 1 } << FirstChunkBits;
+    static constexpr std::size_t ChunkCount = 22;
+    static constexpr std::size_t Capacity = FirstChunkSize * ((std::size_t{ 1 } << ChunkCount) - 1);
+    static_assert(Capacity <= std::numeric_limits<UserHandle>::max());
+
+    // Chunk k holds handles [FirstChunkSize * (2^k - 1), FirstChunkSize * (2^(k+1) - 1)).
+    static std::pair<std::size_t, std::size_t> Locate(UserHandle handle) {
+        const std::size_t biased = std::size_t{ handle } + FirstChunkSize;
+        const std::size_t chunk = std::bit_width(biased) - 1 - FirstChunkBits;
+        return { chunk, biased - (FirstChunkSize << chunk) };
+    }
+
+    std::array<std::unique_ptr<std::string[]>, ChunkCount> chunks_;
+    UserHandle size_ = 0;
+    std::unordered_map<std::string_view, UserHandle> handles_;
+    mutable std::shared_mutex mutex_;
+};
+
+// A resting order's slot: fixed-size and trivially copyable, so slabs of
+// them stay dense and a level's queue walk touches one cache line per order.
+// Ids live elsewhere: the user as a UserTable handle, the external id in the
+// pool's cold storage (OrderPool::ExternalId).
 class Order {
 public:
-    // Constructor WITH Token (new version)
-    Order(OrderType orderType, OrderId orderId, Side side, Price price, Quantity quantity, 
-          const std::string& user_id, Token token)
-        : orderType_(orderType), orderId_(orderId), side_(side), price_(price), 
-          initialQuantity_(quantity), remainingQuantity_(quantity), user_id_(user_id), token_(token) {}
-
-    // Constructor WITHOUT Token (backward compatibility)
-    Order(OrderType orderType, OrderId orderId, Side side, Price price, Quantity quantity, 
-          const std::string& user_id)
-        : orderType_(orderType), orderId_(orderId), side_(side), price_(price), 
-          initialQuantity_(quantity), remainingQuantity_(quantity), user_id_(user_id), token_(Token::YES) {}
+    Order() = default;
+
+    // Re-initialises a recycled pool slot in place.
+    void Reset(OrderType orderType, OrderId orderId, Side side, Price price, Quantity quantity,
+               UserHandle user, Token token) {
+        orderType_ = orderType;
+        orderId_ = orderId;
+        side_ = side;
+        price_ = price;
+        initialQuantity_ = quantity;
+        remainingQuantity_ = quantity;
+        user_ = user;
+        token_ = token;
+        prev_ = NullSlot;
+        next_ = NullSlot;
+    }
 
     OrderId GetOrderId() const { return orderId_; }
     OrderType GetOrderType() const { return orderType_; }
@@ -72,7 +309,7 @@ public:
     Price GetPrice() const { return price_; }
     Quantity GetRemainingQuantity() const { return remainingQuantity_; }
     Quantity GetInitialQuantity() const { return initialQuantity_; }
-    std::string GetUserId() const { return user_id_; }
+    UserHandle GetUser() const { return user_; }
     Token GetToken() const { return token_; }
     bool IsFilled() const { return GetRemainingQuantity() == 0; }
 
@@ -83,18 +320,368 @@ public:
     }
     
 private:
-    OrderType orderType_;        
-    OrderId orderId_;           
+    friend class OrderPool;
+    friend struct PriceLevel;
+    friend class Orderbook;
+
+    OrderId orderId_ = 0;
+    Price price_ = 0;
+    Quantity initialQuantity_ = 0;
+    Quantity remainingQuantity_ = 0;
+    UserHandle user_ = 0;
+    // Neighbours in the price level's FIFO queue; next_ also links free slots.
+    OrderSlot prev_ = NullSlot;
+    OrderSlot next_ = NullSlot;
+    // Neighbours among the same user's resting orders.
+    OrderSlot userPrev_ = NullSlot;
+    OrderSlot userNext_ = NullSlot;
+    OrderType orderType_ = OrderType::GoodTillCancel;
+    Side side_ = Side::Buy;
+    Token token_ = Token::YES;
+};
+
+static_assert(std::is_trivially_copyable_v<Order> && sizeof(Order) == 40, "Order must stay a compact POD slot");
+
+// A copy of an order as handed to callers, with its ids resolved back to
+// strings, so it stays valid after the book's lock is released.
+class OrderDetails : public Order {
+public:
+    OrderDetails(const Order& order, std::string userId, std::string externalId)
+        : Order(order), userId_(std::move(userId)), externalId_(std::move(externalId)) {}
+
+    const std::string& GetUserId() const { return userId_; }
+    // Caller-supplied id (the database UUID); empty when none was given.
+    const std::string& GetExternalId() const { return externalId_; }
+
+private:
+    std::string userId_;
+    std::string externalId_;
+};
+
+// Orders live in fixed-size slabs threaded onto an intrusive free list.
+// Adding, filling and cancelling only move slots between the free list and
+// the price levels; the heap is touched only when every slot is taken and a
+// new slab is needed (or up front, via Reserve).
+class OrderPool {
+public:
+    static constexpr std::size_t SlabBits = 12;
+    static constexpr std::size_t SlabSize = std::size_t{ 1 } << SlabBits;
+
+    Order& operator[](OrderSlot slot) { return slabs_[slot >> SlabBits][slot & (SlabSize - 1)]; }
+    const Order& operator[](OrderSlot slot) const { return slabs_[slot >> SlabBits][slot & (SlabSize - 1)]; }
+
+    // Cold storage beside each slot, touched only on add, cancel and
+    // lookup by id, never while walking a level. A recycled slot reuses
+    // its buffer, so adds do not allocate once the pool is warm.
+    std::string& ExternalId(OrderSlot slot) { return externalIds_[slot >> SlabBits][slot & (SlabSize - 1)]; }
+    const std::string& ExternalId(OrderSlot slot) const { return externalIds_[slot >> SlabBits][slot & (SlabSize - 1)]; }
+
+    OrderSlot Allocate() {
+        if (freeHead_ == NullSlot)
+            Grow();
+        OrderSlot slot = freeHead_;
+        freeHead_ = (*this)[slot].next_;
+        ++size_;
+        return slot;
+    }
+
+    void Release(OrderSlot slot) {
+        Order& order = (*this)[slot];
+        order.prev_ = NullSlot;
+        order.next_ = freeHead_;
+        freeHead_ = slot;
+        --size_;
+    }
+
+    void Reserve(std::size_t count) {
+        while (Capacity() < count)
+            Grow();
+    }
+
+    std::size_t Size() const { return size_; }
+    std::size_t Capacity() const { return slabs_.size() * SlabSize; }
+
+    // Free slots keep their id buffers for reuse, so every slot is counted.
+    std::size_t MemoryBytes() const {
+        std::size_t bytes = (slabs_.capacity() + externalIds_.capacity()) * sizeof(slabs_[0]) +
+                            Capacity() * (sizeof(Order) + sizeof(std::string));
+        for (std::size_t slot = 0; slot < Capacity(); ++slot)
+            bytes += StringHeapBytes(ExternalId(static_cast<OrderSlot>(slot)));
+        return bytes;
+    }
+
+private:
+    void Grow() {
+        if (Capacity() + SlabSize > NullSlot)
+            throw std::length_error("Order pool exhausted");
+        const auto base = static_cast<OrderSlot>(Capacity());
+        slabs_.push_back(std::make_unique<Order[]>(SlabSize));
+        externalIds_.push_back(std::make_unique<std::string[]>(SlabSize));
+        Order* slab = slabs_.back().get();
+        // Thread the new slots so they are handed out in ascending order
+        for (std::size_t i = SlabSize; i-- > 0;) {
+            slab[i].next_ = freeHead_;
+            freeHead_ = base + static_cast<OrderSlot>(i);
+        }
+    }
+
+    std::vector<std::unique_ptr<Order[]>> slabs_;
+    std::vector<std::unique_ptr<std::string[]>> externalIds_;
+    OrderSlot freeHead_ = NullSlot;
+    std::size_t size_ = 0;
+};
+
+// Open-addressing map from OrderId to pool slot. Linear probing with
+// backward-shift deletion leaves no tombstones, and the table only
+// reallocates when it passes half full, so steady-state inserts and erases
+// never touch the heap. OrderId 0 is never issued and marks an empty bucket.
+class OrderIndex {
+public:
+    OrderIndex() { Rehash(1024); }
+
+    OrderSlot Find(OrderId orderId) const {
+        for (std::size_t i = Home(orderId); ; i = (i + 1) & mask_) {
+            if (entries_[i].orderId_ == orderId)
+                return entries_[i].slot_;
+            if (entries_[i].orderId_ == 0)
+                return NullSlot;
+        }
+    }
+
+    bool Insert(OrderId orderId, OrderSlot slot) {
+        if ((size_ + 1) * 2 > entries_.size())
+            Rehash(entries_.size() * 2);
+        std::size_t i = Home(orderId);
+        for (; entries_[i].orderId_ != 0; i = (i + 1) & mask_) {
+            if (entries_[i].orderId_ == orderId)
+                return false;
+        }
+        entries_[i] = Entry{ orderId, slot };
+        ++size_;
+        return true;
+    }
+
+    bool Erase(OrderId orderId) {
+        std::size_t hole = Home(orderId);
+        for (; entries_[hole].orderId_ != orderId; hole = (hole + 1) & mask_) {
+            if (entries_[hole].orderId_ == 0)
+                return false;
+        }
+        // Shift later members of the probe run back so lookups never stop
+        // early at the hole.
+        for (std::size_t next = (hole + 1) & mask_; entries_[next].orderId_ != 0; next = (next + 1) & mask_) {
+            std::size_t home = Home(entries_[next].orderId_);
+            bool stays = hole <= next ? (hole < home && home <= next) : (hole < home || home <= next);
+            if (stays)
+                continue;
+            entries_[hole] = entries_[next];
+            hole = next;
+        }
+        entries_[hole] = Entry{};
+        --size_;
+        return true;
+    }
+
+    void Reserve(std::size_t count) {
+        std::size_t buckets = entries_.size();
+        while (count * 2 > buckets)
+            buckets *= 2;
+        if (buckets != entries_.size())
+            Rehash(buckets);
+    }
+
+    std::size_t Size() const { return size_; }
+    std::size_t MemoryBytes() const { return entries_.capacity() * sizeof(Entry); }
+
+private:
+    struct Entry {
+        OrderId orderId_ = 0;
+        OrderSlot slot_ = NullSlot;
+    };
+
+    std::size_t Home(OrderId orderId) const {
+        // Fibonacci hashing spreads sequential ids across the table
+        return static_cast<std::size_t>((orderId * 0x9E3779B97F4A7C15ull) >> shift_);
+    }
+
+    void Rehash(std::size_t buckets) {
+        std::vector<Entry> old = std::move(entries_);
+        entries_.assign(buckets, Entry{});
+        mask_ = buckets - 1;
+        shift_ = 64;
+        for (std::size_t n = buckets; n > 1; n >>= 1)
+            --shift_;
+        size_ = 0;
+        for (const auto& entry : old) {
+            if (entry.orderId_ != 0)
+                Insert(entry.orderId_, entry.slot_);
+        }
+    }
+
+    std::vector<Entry> entries_;
+    std::size_t mask_ = 0;
+    unsigned shift_ = 64;
+    std::size_t size_ = 0;
+};
+
+// A price level's FIFO queue, linked through the orders' own slots, plus
+// running totals kept up to date on every add, fill and cancel so market
+// data never has to walk the orders.
+struct PriceLevel {
+    OrderSlot head_ = NullSlot;
+    OrderSlot tail_ = NullSlot;
+    Quantity quantity_ = 0;
+    std::uint32_t orderCount_ = 0;
+
+    void Push(OrderPool& pool, OrderSlot slot) {
+        Order& order = pool[slot];
+        order.prev_ = tail_;
+        order.next_ = NullSlot;
+        if (tail_ != NullSlot)
+            pool[tail_].next_ = slot;
+        else
+            head_ = slot;
+        tail_ = slot;
+        quantity_ += order.GetRemainingQuantity();
+        ++orderCount_;
+    }
+
+    void Erase(OrderPool& pool, OrderSlot slot) {
+        Order& order = pool[slot];
+        if (order.prev_ != NullSlot)
+            pool[order.prev_].next_ = order.next_;
+        else
+            head_ = order.next_;
+        if (order.next_ != NullSlot)
+            pool[order.next_].prev_ = order.prev_;
+        else
+            tail_ = order.prev_;
+        order.prev_ = order.next_ = NullSlot;
+        quantity_ -= order.GetRemainingQuantity();
+        --orderCount_;
+    }
+
+    void OnFill(Quantity quantity) { quantity_ -= quantity; }
+    // An order in the queue had its open quantity cut without trading.
+    void OnReduce(Quantity quantity) { quantity_ -= quantity; }
+
+    bool Empty() const { return head_ == NullSlot; }
+
+    LevelInfo ToLevelInfo(Price price) const { return LevelInfo{ price, quantity_, orderCount_ }; }
+};
+
+// One side of one token's book, stored as a flat array of price levels
+// indexed by tick. A bitmap of non-empty levels and a cached best tick make
+// finding a level or the best price O(1) across the bounded price range of a
+// binary market; walking to the next level scans the bitmap a word at a time.
+class PriceLadder {
+public:
+    static constexpr std::size_t NoTick = std::numeric_limits<std::size_t>::max();
+
+    PriceLadder(Side side, Price tickSize, Price pairPrice)
+        : side_(side), tickSize_(tickSize), levels_(pairPrice / tickSize + 1),
+          occupied_((levels_.size() + 63) / 64, 0) {}
+
+    bool Empty() const { return best_ == NoTick; }
+    std::size_t LevelCount() const { return levelCount_; }
+    std::size_t MemoryBytes() const {
+        return levels_.capacity() * sizeof(PriceLevel) + occupied_.capacity() * sizeof(std::uint64_t);
+    }
+
+    std::size_t BestTick() const { return best_; }
+    Price TickPrice(std::size_t tick) const { return static_cast<Price>(tick) * tickSize_; }
+    PriceLevel& LevelAt(std::size_t tick) { return levels_[tick]; }
+    const PriceLevel& LevelAt(std::size_t tick) const { return levels_[tick]; }
+    PriceLevel& Level(Price price) { return levels_[price / tickSize_]; }
+
+    // The next non-empty level after `tick`, moving away from the best price.
+    std::size_t NextTick(std::size_t tick) const {
+        return side_ == Side::Buy ? HighestBelow(tick) : LowestAbove(tick);
+    }
+
+    void Push(OrderPool& pool, OrderSlot slot, Price price) {
+        std::size_t tick = price / tickSize_;
+        PriceLevel& level = levels_[tick];
+        if (level.Empty())
+            Mark(tick);
+        level.Push(pool, slot);
+    }
+
+    void Erase(OrderPool& pool, OrderSlot slot, Price price) {
+        std::size_t tick = price / tickSize_;
+        PriceLevel& level = levels_[tick];
+        level.Erase(pool, slot);
+        if (level.Empty())
+            Unmark(tick);
+    }
+
+private:
+    void Mark(std::size_t tick) {
+        occupied_[tick / 64] |= std::uint64_t{ 1 } << (tick % 64);
+        ++levelCount_;
+        if (best_ == NoTick || (side_ == Side::Buy ? tick > best_ : tick < best_))
+            best_ = tick;
+    }
+
+    void Unmark(std::size_t tick) {
+        occupied_[tick / 64] &= ~(std::uint64_t{ 1 } << (tick % 64));
+        --levelCount_;
+        if (tick == best_)
+            best_ = NextTick(tick);
+    }
+
+    std::size_t HighestBelow(std::size_t tick) const {
+        if (tick == 0)
+            return NoTick;
+        std::size_t bit = tick - 1;
+        std::size_t word = bit / 64;
+        std::uint64_t bits = occupied_[word] & (~std::uint64_t{ 0 } >> (63 - bit % 64));
+        while (true) {
+            if (bits)
+                return word * 64 + 63 - std::countl_zero(bits);
+            if (word == 0)
+                return NoTick;
+            bits = occupied_[--word];
+        }
+    }
+
+    std::size_t LowestAbove(std::size_t tick) const {
+        std::size_t bit = tick + 1;
+        if (bit >= levels_.size())
+            return NoTick;
+        std::size_t word = bit / 64;
+        std::uint64_t bits = occupied_[word] & (~std::uint64_t{ 0 } << (bit % 64));
+        while (true) {
+            if (bits)
+                return word * 64 + std::countr_zero(bits);
+            if (++word == occupied_.size())
+                return NoTick;
+            bits = occupied_[word];
+        }
+    }
+
     Side side_;
-    Price price_;
-    Quantity initialQuantity_;    
-    Quantity remainingQuantity_;
-    std::string user_id_;
-    Token token_;
+    Price tickSize_;
+    std::vector<PriceLevel> levels_;
+    std::vector<std::uint64_t> occupied_;
+    std::size_t best_ = NoTick;
+    std::size_t levelCount_ = 0;
+};
+
+// How a trade was produced. Direct trades cross a bid and an ask of the same
+// token. Mint trades pair a YES buy with a NO buy whose prices add up to at
+// least the pair price: together the two buyers fund one complete YES+NO set.
+enum class MatchType : std::uint8_t {
+    Direct,
+    Mint
 };
 
-using OrderPointer = std::shared_ptr<Order>;
-using OrderPointers = std::list<OrderPointer>;
+// One YES share plus one NO share always settles to $1.00 (100 cents). This
+// is the default price scale; a book can use finer units via its pair price.
+constexpr Price PairPrice = 100;
+
+constexpr std::size_t TokenIndex(Token token) { return token == Token::YES ? 0 : 1; }
+constexpr Token Complement(Token token) { return token == Token::YES ? Token::NO : Token::YES; }
 
 struct TradeInfo {
     OrderId orderId_;
@@ -102,238 +689,2247 @@ struct TradeInfo {
     Quantity quantity_;
 };
 
+// For Direct trades the bid/ask infos are the buyer and seller of token_.
+// For Mint trades the bid info is the YES buyer and the ask info is the NO
+// buyer; each info carries the price that order actually pays.
 class Trade {
 public:
-    Trade(const TradeInfo& bidTrade, const TradeInfo& askTrade)
-        : bidTrade_(bidTrade), askTrade_(askTrade) {}
+    Trade(const TradeInfo& bidTrade, const TradeInfo& askTrade,
+          Token token = Token::YES, MatchType matchType = MatchType::Direct)
+        : bidTrade_(bidTrade), askTrade_(askTrade), token_(token), matchType_(matchType) {}
     
     const TradeInfo& GetBidTrade() const { return bidTrade_; }
     const TradeInfo& GetAskTrade() const { return askTrade_; }
+    Token GetToken() const { return token_; }
+    MatchType GetMatchType() const { return matchType_; }
 
 private:
     TradeInfo bidTrade_;
     TradeInfo askTrade_;
+    Token token_;
+    MatchType matchType_;
 };
 
 using Trades = std::vector<Trade>;
 
-class Orderbook {
-private:
-    struct OrderEntry {
-        OrderPointer order_{ nullptr };
-        OrderPointers::iterator location_;
-    };
-    
-    std::map<Price, OrderPointers, std::greater<Price>> bids_;
-    std::map<Price, OrderPointers, std::less<Price>> asks_;
-    std::unordered_map<OrderId, OrderEntry> orders_;
-    OrderId next_order_id_ = 1;
+// Packed records exchanged with Python. Their layouts are part of the Python
+// interface (ORDER_REQUEST_FORMAT, FILL_RECORD_FORMAT, DEPTH_RECORD_FORMAT),
+// so fields are only ever appended.
+struct OrderRequest {
+    Price price_;
+    Quantity quantity_;
+    std::uint8_t orderType_;
+    std::uint8_t side_;
+    std::uint8_t token_;
+    std::uint8_t padding_;
+};
+static_assert(sizeof(OrderRequest) == 12);
+
+// External and user ids travel in fill records as fixed-width, NUL-padded
+// fields so records stay fixed-size; longer ids are rejected on entry.
+constexpr std::size_t IdFieldSize = 64;
+using IdField = std::array<char, IdFieldSize>;
+
+inline IdField ToIdField(const std::string& id) {
+    IdField field{};
+    std::copy_n(id.data(), std::min(id.size(), IdFieldSize), field.data());
+    return field;
+}
+
+// One fill seen from the incoming (taker) order, carrying everything needed
+// to settle it. token_ and side_ are the taker's; the maker trades the same
+// token on the other side, or, for a mint, buys the complementary token.
+// takerPrice_ is what the taker pays or receives; for mints it differs from
+// the maker's own price.
+struct FillRecord {
+    std::uint32_t requestIndex_;
+    OrderId takerOrderId_;
+    OrderId makerOrderId_;
+    Price takerPrice_;
+    Price makerPrice_;
+    Quantity quantity_;
+    std::uint8_t token_;
+    std::uint8_t side_;
+    std::uint8_t matchType_;
+    std::uint8_t padding_;
+    IdField takerExternalId_;
+    IdField makerExternalId_;
+    IdField takerUserId_;
+    IdField makerUserId_;
+};
+static_assert(sizeof(FillRecord) == 28 + 4 * IdFieldSize);
+
+// The bid/ask view of a fill, as produced before fills were packed.
+inline Trade ToTrade(const FillRecord& fill) {
+    TradeInfo taker{ fill.takerOrderId_, fill.takerPrice_, fill.quantity_ };
+    TradeInfo maker{ fill.makerOrderId_, fill.makerPrice_, fill.quantity_ };
+    if (static_cast<MatchType>(fill.matchType_) == MatchType::Mint)
+        return static_cast<Token>(fill.token_) == Token::YES ? Trade{ taker, maker, Token::YES, MatchType::Mint }
+                                                              : Trade{ maker, taker, Token::YES, MatchType::Mint };
+    const Token token = static_cast<Token>(fill.token_);
+    return static_cast<Side>(fill.side_) == Side::Buy ? Trade{ taker, maker, token, MatchType::Direct }
+                                                      : Trade{ maker, taker, token, MatchType::Direct };
+}
+
+// One price level; bids come first, best to worst, then asks.
+struct DepthRecord {
+    Price price_;
+    Quantity quantity_;
+    std::uint32_t orderCount_;
+    std::uint8_t side_;
+    std::uint8_t padding_[3];
+};
+static_assert(sizeof(DepthRecord) == 16);
 
+// Owns a contiguous array of records so Python can read it through the
+// buffer protocol without copying.
+template <typename Record>
+class RecordBuffer {
 public:
-    // Method WITH Token (new version)
-    Trades AddOrder(OrderType orderType, Side side, Price price, Quantity quantity, 
-                   const std::string& user_id, Token token) {
-        auto order = std::make_shared<Order>(orderType, next_order_id_++, side, price, quantity, user_id, token);
-        return AddOrderInternal(order);
-    }
+    RecordBuffer() = default;
+    explicit RecordBuffer(std::vector<Record> records) : records_(std::move(records)) {}
 
-    // Method WITHOUT Token (backward compatibility)
-    Trades AddOrder(OrderType orderType, Side side, Price price, Quantity quantity, const std::string& user_id) {
-        auto order = std::make_shared<Order>(orderType, next_order_id_++, side, price, quantity, user_id);
-        return AddOrderInternal(order);
+    const Record* Data() const { return records_.data(); }
+    std::size_t Size() const { return records_.size(); }
+    std::vector<Record>& Records() { return records_; }
+    const std::vector<Record>& Records() const { return records_; }
+
+private:
+    std::vector<Record> records_;
+};
+
+// What AddOrder hands back: the engine id assigned to the new order and the
+// fills it produced on entry.
+struct AddOrderResult {
+    OrderId orderId_ = 0;
+    RecordBuffer<FillRecord> fills_;
+
+    Trades GetTrades() const {
+        Trades trades;
+        trades.reserve(fills_.Size());
+        for (const auto& fill : fills_.Records())
+            trades.push_back(ToTrade(fill));
+        return trades;
     }
-    
-    Trades AddOrderInternal(OrderPointer order) {
-        if (orders_.find(order->GetOrderId()) != orders_.end())
-            return {};
+};
 
-        if (order->GetOrderType() == OrderType::FillAndKill &&
-            !CanMatch(order->GetSide(), order->GetPrice()))
-            return {};
+// What AmendOrder hands back: an AddOrderResult for the amended order plus
+// the open quantity it had just before the amend.
+struct AmendResult : AddOrderResult {
+    Quantity previousQuantity_ = 0;
+};
 
-        OrderPointers::iterator iterator;
-        if (order->GetSide() == Side::Buy) {
-            auto& orderList = bids_[order->GetPrice()];
-            orderList.push_back(order);
-            iterator = std::prev(orderList.end());
-        } else {
-            auto& orderList = asks_[order->GetPrice()];
-            orderList.push_back(order);
-            iterator = std::prev(orderList.end());
-        }
+struct BatchResult {
+    std::vector<OrderId> orderIds_;
+    std::vector<FillRecord> fills_;
+};
 
-        orders_.insert({order->GetOrderId(), OrderEntry{order, iterator}});
-        return MatchOrders();
+// Little-endian field codec for Orderbook snapshots. Fields are copied
+// with memcpy, so the format is only written and read on little-endian hosts.
+static_assert(std::endian::native == std::endian::little);
+
+class SnapshotWriter {
+public:
+    template <typename T>
+    void Put(T value) {
+        static_assert(std::is_trivially_copyable_v<T>);
+        data_.append(reinterpret_cast<const char*>(&value), sizeof(value));
     }
 
-    bool CanMatch(Side side, Price price) const {
-        if (side == Side::Buy) {
-            if (asks_.empty())
-                return false;
-            const auto& [bestAsk, _] = *asks_.begin();
-            return price >= bestAsk;
-        } else {
-            if (bids_.empty())
-                return false;
-            const auto& [bestBid, _] = *bids_.begin();
-            return price <= bestBid;
-        }
+    void PutString(const std::string& value) {
+        Put(static_cast<std::uint16_t>(value.size()));
+        data_.append(value);
     }
 
-    Trades MatchOrders() {
-        Trades trades;
-        trades.reserve(orders_.size());
+    std::string Take() { return std::move(data_); }
+    void Clear() { data_.clear(); }
+    const std::string& Data() const { return data_; }
 
-        while (true) {
-            if (bids_.empty() || asks_.empty())
-                break;
-            
-            auto& [bidPrice, bidOrders] = *bids_.begin();
-            auto& [askPrice, askOrders] = *asks_.begin();
+private:
+    std::string data_;
+};
 
-            if (bidPrice < askPrice)
-                break;
+class SnapshotReader {
+public:
+    SnapshotReader(const char* data, std::size_t size) : data_(data), size_(size) {}
+
+    template <typename T>
+    T Get() {
+        static_assert(std::is_trivially_copyable_v<T>);
+        T value;
+        std::memcpy(&value, Take(sizeof(T)), sizeof(T));
+        return value;
+    }
 
-            while (!bidOrders.empty() && !askOrders.empty()) {
-                auto& bid = bidOrders.front();
-                auto& ask = askOrders.front();
+    std::string GetString() {
+        auto length = Get<std::uint16_t>();
+        return std::string(Take(length), length);
+    }
 
-                Quantity quantity = std::min(bid->GetRemainingQuantity(), ask->GetRemainingQuantity());
-                bid->Fill(quantity);
-                ask->Fill(quantity);
+    bool AtEnd() const { return offset_ == size_; }
 
-                if (bid->IsFilled()) {
-                    bidOrders.pop_front();
-                    orders_.erase(bid->GetOrderId());
-                }
-                if (ask->IsFilled()) {
-                    askOrders.pop_front();
-                    orders_.erase(ask->GetOrderId());
-                }
+private:
+    const char* Take(std::size_t count) {
+        if (size_ - offset_ < count)
+            throw std::invalid_argument("Snapshot is truncated");
+        const char* at = data_ + offset_;
+        offset_ += count;
+        return at;
+    }
 
-                trades.push_back(Trade{
-                    TradeInfo{bid->GetOrderId(), ask->GetPrice(), quantity},
-                    TradeInfo{ask->GetOrderId(), ask->GetPrice(), quantity}
-                });
-            }
+    const char* data_;
+    std::size_t size_;
+    std::size_t offset_ = 0;
+};
 
-            if (bidOrders.empty())
-                bids_.erase(bidPrice);
-            if (askOrders.empty())
-                asks_.erase(askPrice);
+// A file mapped read-write (or read-only) into memory that can grow. Bytes
+// copied into the mapping are in the page cache at once, so they survive a
+// process crash; Sync() also flushes them to disk.
+class MappedFile {
+public:
+#ifdef ORDERBOOK_HAS_MMAP
+    MappedFile(const std::string& path, bool writable) : path_(path), writable_(writable) {
+        fd_ = ::open(path.c_str(), writable ? O_RDWR | O_CREAT : O_RDONLY, 0644);
+        if (fd_ < 0)
+            Fail("open");
+        struct stat info;
+        if (::fstat(fd_, &info) != 0) {
+            ::close(fd_);
+            Fail("stat");
         }
+        size_ = static_cast<std::size_t>(info.st_size);
+        if (size_ > 0)
+            Map();
+    }
 
-        return trades;
+    ~MappedFile() {
+        Unmap();
+        ::close(fd_);
     }
 
-    void CancelOrder(OrderId orderId) {
-        auto it = orders_.find(orderId);
-        if (it == orders_.end())
+    // Extends the file to at least `size` bytes, growing geometrically so
+    // appends remap rarely.
+    void Grow(std::size_t size) {
+        if (size <= size_)
             return;
+        std::size_t newSize = std::max({ size, size_ * 2, MinGrowth });
+        if (::ftruncate(fd_, static_cast<off_t>(newSize)) != 0)
+            Fail("grow");
+        Unmap();
+        size_ = newSize;
+        Map();
+    }
 
-        const auto& [order, orderIterator] = it->second;
-        orders_.erase(orderId);
+    void Truncate(std::size_t size) {
+        Unmap();
+        if (::ftruncate(fd_, static_cast<off_t>(size)) != 0)
+            Fail("truncate");
+        size_ = size;
+        if (size_ > 0)
+            Map();
+    }
 
-        auto price = order->GetPrice();
-        if (order->GetSide() == Side::Sell) {
-            auto& orderList = asks_.at(price);
-            orderList.erase(orderIterator);
-            if (orderList.empty())
-                asks_.erase(price);
-        } else {
-            auto& orderList = bids_.at(price);
-            orderList.erase(orderIterator);
-            if (orderList.empty())
-                bids_.erase(price);
-        }
+    void Sync(std::size_t length) {
+        if (data_ && ::msync(data_, std::min(length, size_), MS_SYNC) != 0)
+            Fail("sync");
     }
 
-    std::size_t Size() const { return orders_.size(); }
+private:
+    static constexpr std::size_t MinGrowth = std::size_t{ 1 } << 20;
 
-    OrderbookLevelInfos GetOrderInfos() const {
-        LevelInfos bidInfos, askInfos;
-        bidInfos.reserve(bids_.size());
-        askInfos.reserve(asks_.size());
+    void Map() {
+        void* mapped = ::mmap(nullptr, size_, writable_ ? PROT_READ | PROT_WRITE : PROT_READ, MAP_SHARED, fd_, 0);
+        if (mapped == MAP_FAILED)
+            Fail("map");
+        data_ = static_cast<char*>(mapped);
+    }
 
-        auto CreateLevelInfos = [](Price price, const OrderPointers& orders) {
-            return LevelInfo{price, std::accumulate(orders.begin(), orders.end(), (Quantity)0,
-                [](Quantity runningSum, const OrderPointer& order) {
-                    return runningSum + order->GetRemainingQuantity();
-                })};
-        };
+    void Unmap() {
+        if (data_)
+            ::munmap(data_, size_);
+        data_ = nullptr;
+    }
 
-        for (const auto& [price, orders] : bids_)
-            bidInfos.push_back(CreateLevelInfos(price, orders));
-        for (const auto& [price, orders] : asks_)
-            askInfos.push_back(CreateLevelInfos(price, orders));
-        
-        return OrderbookLevelInfos{bidInfos, askInfos};
+    [[noreturn]] void Fail(const char* what) const {
+        throw std::runtime_error(std::string("Cannot ") + what + " " + path_ + ": " + std::strerror(errno));
     }
-};
 
-namespace py = pybind11;
+    std::string path_;
+    bool writable_;
+    int fd_ = -1;
+#else
+    MappedFile(const std::string&, bool) { throw std::runtime_error("Orderbook journals need a POSIX platform"); }
+    void Grow(std::size_t) {}
+    void Truncate(std::size_t) {}
+    void Sync(std::size_t) {}
 
-PYBIND11_MODULE(orderbook_cpp, m) {
-    m.doc() = "C++ Orderbook for Prediction Markets";
+private:
+#endif
 
-    // Enums
-    py::enum_<OrderType>(m, "OrderType")
-        .value("GoodTillCancel", OrderType::GoodTillCancel)
-        .value("FillAndKill", OrderType::FillAndKill);
+public:
+    MappedFile(const MappedFile&) = delete;
+    MappedFile& operator=(const MappedFile&) = delete;
 
-    py::enum_<Side>(m, "Side")
-        .value("Buy", Side::Buy)
-        .value("Sell", Side::Sell);
+    char* Data() { return data_; }
+    const char* Data() const { return data_; }
+    std::size_t Size() const { return size_; }
 
-    py::enum_<Token>(m, "Token")
-        .value("YES", Token::YES)
-        .value("NO", Token::NO);
+private:
+    char* data_ = nullptr;
+    std::size_t size_ = 0;
+};
 
-    // LevelInfo
-    py::class_<LevelInfo>(m, "LevelInfo")
-        .def(py::init<Price, Quantity>())
-        .def_readwrite("price", &LevelInfo::price_)
-        .def_readwrite("quantity", &LevelInfo::quantity_);
+// Journal file format, version 1 (all integers little-endian):
+//   magic "OBJL", u16 version, u16 reserved, then records, each a
+//   JournalRecordHeader followed by its payload.
+// The first record is a Snapshot (Orderbook::Snapshot bytes) of the book
+// when journaling began; after it come the book's events in order:
+//   Add:    u32 id, u8 type, u8 side, u8 token, u8 0, u32 price,
+//           u32 quantity, user id and external id (u16-length-prefixed)
+//   Cancel: u32 id
+//   Amend:  u32 id, u32 new price, u32 new open quantity
+//   Fill:   u32 taker id, u32 maker id, u32 taker price, u32 maker price,
+//           u32 quantity, u8 match type, 3 bytes 0, taker and maker
+//           external ids (u16-length-prefixed)
+// Sequence numbers count records from 1. A checksum over each record lets a
+// reader find where a write torn by a crash ends the journal.
+enum class JournalRecord : std::uint8_t {
+    Snapshot = 1,
+    Add = 2,
+    Cancel = 3,
+    Fill = 4,
+    Amend = 5
+};
 
-    // OrderbookLevelInfos
-    py::class_<OrderbookLevelInfos>(m, "OrderbookLevelInfos")
-        .def(py::init<const LevelInfos&, const LevelInfos&>())
-        .def("get_asks", &OrderbookLevelInfos::GetAsks)
-        .def("get_bids", &OrderbookLevelInfos::GetBids);
+struct JournalRecordHeader {
+    std::uint32_t length_;
+    std::uint32_t checksum_;
+    std::uint64_t sequence_;
+    std::uint8_t type_;
+    std::uint8_t padding_[7];
+};
+static_assert(sizeof(JournalRecordHeader) == 24);
 
-    // TradeInfo
-    py::class_<TradeInfo>(m, "TradeInfo")
-        .def(py::init<OrderId, Price, Quantity>())
-        .def_readwrite("order_id", &TradeInfo::orderId_)
-        .def_readwrite("price", &TradeInfo::price_)
-        .def_readwrite("quantity", &TradeInfo::quantity_);
+constexpr std::uint32_t JournalMagic = 0x4C4A424F;  // "OBJL"
+constexpr std::uint16_t JournalVersion = 1;
+constexpr std::size_t JournalHeaderSize = 8;
 
-    // Trade
-    py::class_<Trade>(m, "Trade")
-        .def(py::init<const TradeInfo&, const TradeInfo&>())
-        .def("get_bid_trade", &Trade::GetBidTrade)
-        .def("get_ask_trade", &Trade::GetAskTrade);
+// FNV-1a over the sequence number, record type and payload.
+inline std::uint32_t JournalChecksum(std::uint64_t sequence, std::uint8_t type, const char* data, std::size_t length) {
+    std::uint32_t hash = 2166136261u;
+    auto mix = [&hash](const char* bytes, std::size_t count) {
+        for (std::size_t i = 0; i < count; ++i) {
+            hash ^= static_cast<std::uint8_t>(bytes[i]);
+            hash *= 16777619u;
+        }
+    };
+    mix(reinterpret_cast<const char*>(&sequence), sizeof(sequence));
+    mix(reinterpret_cast<const char*>(&type), sizeof(type));
+    mix(data, length);
+    return hash;
+}
 
-    // Order
-    py::class_<Order>(m, "Order")
-        .def("get_order_id", &Order::GetOrderId)
-        .def("get_order_type", &Order::GetOrderType)
-        .def("get_side", &Order::GetSide)
-        .def("get_price", &Order::GetPrice)
-        .def("get_remaining_quantity", &Order::GetRemainingQuantity)
-        .def("get_initial_quantity", &Order::GetInitialQuantity)
-        .def("get_user_id", &Order::GetUserId)
-        .def("get_token", &Order::GetToken)
-        .def("is_filled", &Order::IsFilled);
-
-    // Orderbook - Main class
-    py::class_<Orderbook>(m, "Orderbook")
-        .def(py::init<>())
-        .def("add_order", py::overload_cast<OrderType, Side, Price, Quantity, const std::string&, Token>(&Orderbook::AddOrder), 
-             "Add an order with token to the orderbook")
-        .def("add_order", py::overload_cast<OrderType, Side, Price, Quantity, const std::string&>(&Orderbook::AddOrder), 
-             "Add an order to the orderbook (defaults to YES token)")
-        .def("cancel_order", &Orderbook::CancelOrder, "Cancel an order")
-        .def("size", &Orderbook::Size, "Get number of orders")
-        .def("get_order_infos", &Orderbook::GetOrderInfos, "Get market data");
-}
\ No newline at end of file
+// Appends records to a journal file through a growing memory mapping.
+class Journal {
+public:
+    // Starts a new journal; the file must be missing or empty.
+    explicit Journal(const std::string& path) : file_(path, true) {
+        if (file_.Size() != 0)
+            throw std::invalid_argument("Journal " + path + " already has events; resume it with Orderbook.replay");
+        file_.Grow(JournalHeaderSize);
+        std::memcpy(file_.Data(), &JournalMagic, sizeof(JournalMagic));
+        std::memcpy(file_.Data() + sizeof(JournalMagic), &JournalVersion, sizeof(JournalVersion));
+        end_ = JournalHeaderSize;
+    }
+
+    // Continues an existing journal after its last valid record.
+    Journal(const std::string& path, std::size_t end, std::uint64_t sequence)
+        : file_(path, true), end_(end), sequence_(sequence) {}
+
+    // Trims the space preallocated past the last record.
+    ~Journal() {
+        try {
+            file_.Truncate(end_);
+        } catch (const std::exception&) {
+        }
+    }
+
+    // Payload for the next record; Commit() writes it out.
+    SnapshotWriter& Begin() {
+        record_.Clear();
+        return record_;
+    }
+
+    void Commit(JournalRecord type) {
+        const std::string& payload = record_.Data();
+        file_.Grow(end_ + sizeof(JournalRecordHeader) + payload.size());
+        JournalRecordHeader header{};
+        header.length_ = static_cast<std::uint32_t>(payload.size());
+        header.sequence_ = sequence_ + 1;
+        header.type_ = static_cast<std::uint8_t>(type);
+        header.checksum_ = JournalChecksum(header.sequence_, header.type_, payload.data(), payload.size());
+        std::memcpy(file_.Data() + end_, &header, sizeof(header));
+        std::memcpy(file_.Data() + end_ + sizeof(header), payload.data(), payload.size());
+        end_ += sizeof(header) + payload.size();
+        sequence_ = header.sequence_;
+    }
+
+    std::uint64_t Sequence() const { return sequence_; }
+    void Sync() { file_.Sync(end_); }
+
+private:
+    MappedFile file_;
+    std::size_t end_ = 0;
+    std::uint64_t sequence_ = 0;
+    SnapshotWriter record_;
+};
+
+// Walks the valid records of a journal file. Reading stops at the end of
+// the data, at never-written space or at the first torn record.
+class JournalReader {
+public:
+    explicit JournalReader(const std::string& path) : file_(path, false) {
+        std::uint32_t magic = 0;
+        std::uint16_t version = 0;
+        if (file_.Size() >= JournalHeaderSize) {
+            std::memcpy(&magic, file_.Data(), sizeof(magic));
+            std::memcpy(&version, file_.Data() + sizeof(magic), sizeof(version));
+        }
+        if (magic != JournalMagic)
+            throw std::invalid_argument("Not an orderbook journal: " + path);
+        if (version != JournalVersion)
+            throw std::invalid_argument("Unsupported journal version " + std::to_string(version));
+        offset_ = JournalHeaderSize;
+    }
+
+    bool Next() {
+        const std::size_t available = file_.Size() - offset_;
+        if (available < sizeof(JournalRecordHeader))
+            return false;
+        JournalRecordHeader header;
+        std::memcpy(&header, file_.Data() + offset_, sizeof(header));
+        if (header.sequence_ != sequence_ + 1 || header.length_ > available - sizeof(header))
+            return false;
+        const char* payload = file_.Data() + offset_ + sizeof(header);
+        if (JournalChecksum(header.sequence_, header.type_, payload, header.length_) != header.checksum_)
+            return false;
+        type_ = static_cast<JournalRecord>(header.type_);
+        payload_ = payload;
+        length_ = header.length_;
+        sequence_ = header.sequence_;
+        offset_ += sizeof(header) + header.length_;
+        return true;
+    }
+
+    JournalRecord Type() const { return type_; }
+    const char* PayloadData() const { return payload_; }
+    std::size_t PayloadSize() const { return length_; }
+    SnapshotReader Payload() const { return SnapshotReader{ payload_, length_ }; }
+    std::uint64_t Sequence() const { return sequence_; }
+    // Byte offset just past the last valid record.
+    std::size_t End() const { return offset_; }
+
+private:
+    MappedFile file_;
+    std::size_t offset_ = 0;
+    std::uint64_t sequence_ = 0;
+    JournalRecord type_ = JournalRecord::Snapshot;
+    const char* payload_ = nullptr;
+    std::size_t length_ = 0;
+};
+
+class Orderbook {
+private:
+    // Each token of the market gets its own book; YES and NO orders never
+    // share a price level.
+    struct TokenBook {
+        PriceLadder bids_;
+        PriceLadder asks_;
+
+        TokenBook(Price tickSize, Price pairPrice)
+            : bids_(Side::Buy, tickSize, pairPrice), asks_(Side::Sell, tickSize, pairPrice) {}
+    };
+
+    Price tickSize_;
+    Price pairPrice_;
+    std::array<TokenBook, 2> books_;
+    OrderPool pool_;
+    OrderIndex orders_;
+    // Resting orders by external id, so callers holding only the database
+    // UUID can cancel or look up without knowing the engine id. Keys view
+    // the ids held in the pool's cold storage.
+    std::unordered_map<std::string_view, OrderSlot> externalIds_;
+    // Interned user ids; shared with the other books of a MarketRegistry.
+    std::shared_ptr<UserTable> userTable_;
+    // Each user's resting orders, linked through the orders' own slots, so
+    // per-user queries cost O(that user's orders) rather than O(book).
+    struct UserOrders {
+        OrderSlot head_ = NullSlot;
+        OrderSlot tail_ = NullSlot;
+        std::uint32_t count_ = 0;
+    };
+    std::unordered_map<UserHandle, UserOrders> userOrders_;
+    OrderId next_order_id_ = 1;
+    // Bumped by every add, cancel and amend that changes the resting orders
+    std::uint64_t sequence_ = 0;
+    // Built on demand by GetMarketView; stale once sequence_ moves past it
+    mutable std::shared_ptr<MarketView> view_;
+    EngineCounters counters_;
+    bool timing_ = false;
+    // Optional event log; every accepted add, cancel and fill goes to it.
+    std::unique_ptr<Journal> journal_;
+    // Guards all of the above. Public methods lock it, so the bindings can
+    // drop the GIL around engine work.
+    mutable std::mutex mutex_;
+
+    TokenBook& GetBook(Token token) { return books_[TokenIndex(token)]; }
+    const TokenBook& GetBook(Token token) const { return books_[TokenIndex(token)]; }
+
+    // A resting level that an incoming order could trade against, expressed
+    // as the price the incoming order would effectively pay or receive.
+    struct Candidate {
+        PriceLevel* level_{ nullptr };
+        Price effectivePrice_{ 0 };
+        MatchType matchType_{ MatchType::Direct };
+    };
+
+    // Best level on the opposite side of the incoming order's own token.
+    Candidate DirectCandidate(Side side, Token token, Price price) {
+        auto& book = GetBook(token);
+        if (side == Side::Buy) {
+            if (book.asks_.Empty())
+                return {};
+            Price askPrice = book.asks_.TickPrice(book.asks_.BestTick());
+            if (askPrice > price)
+                return {};
+            return Candidate{ &book.asks_.LevelAt(book.asks_.BestTick()), askPrice, MatchType::Direct };
+        }
+        if (book.bids_.Empty())
+            return {};
+        Price bidPrice = book.bids_.TickPrice(book.bids_.BestTick());
+        if (bidPrice < price)
+            return {};
+        return Candidate{ &book.bids_.LevelAt(book.bids_.BestTick()), bidPrice, MatchType::Direct };
+    }
+
+    // Best resting buy of the complementary token that, together with an
+    // incoming buy at price, funds a complete pair.
+    Candidate MintCandidate(Side side, Token token, Price price) {
+        if (side != Side::Buy)
+            return {};
+        auto& book = GetBook(Complement(token));
+        if (book.bids_.Empty())
+            return {};
+        Price bidPrice = book.bids_.TickPrice(book.bids_.BestTick());
+        if (bidPrice + price < pairPrice_)
+            return {};
+        return Candidate{ &book.bids_.LevelAt(book.bids_.BestTick()), pairPrice_ - bidPrice, MatchType::Mint };
+    }
+
+    // Price priority first (cheaper for a buyer, richer for a seller), then
+    // time priority between the heads of the two queues.
+    bool IsBetter(Side side, const Candidate& lhs, const Candidate& rhs) const {
+        if (lhs.effectivePrice_ != rhs.effectivePrice_)
+            return side == Side::Buy ? lhs.effectivePrice_ < rhs.effectivePrice_
+                                     : lhs.effectivePrice_ > rhs.effectivePrice_;
+        return pool_[lhs.level_->head_].GetOrderId() < pool_[rhs.level_->head_].GetOrderId();
+    }
+
+    PriceLadder& GetLadder(Side side, Token token) {
+        auto& book = GetBook(token);
+        return side == Side::Buy ? book.bids_ : book.asks_;
+    }
+
+    static Price CheckTickSize(Price tickSize, Price pairPrice) {
+        if (tickSize == 0 || pairPrice % tickSize != 0 || pairPrice < 2 * tickSize)
+            throw std::invalid_argument("Pair price must be a multiple of a non-zero tick size, at least two ticks");
+        return tickSize;
+    }
+
+    // Unlinks a resting order from every index and returns its slot to the pool.
+    void RemoveResting(OrderSlot slot) {
+        const Order& order = pool_[slot];
+        UnlinkUser(slot);
+        orders_.Erase(order.GetOrderId());
+        if (!pool_.ExternalId(slot).empty())
+            externalIds_.erase(pool_.ExternalId(slot));
+        GetLadder(order.GetSide(), order.GetToken()).Erase(pool_, slot, order.GetPrice());
+        pool_.Release(slot);
+    }
+
+    OrderSlot FindSlot(const std::string& externalId) const {
+        auto it = externalIds_.find(externalId);
+        return it == externalIds_.end() ? NullSlot : it->second;
+    }
+
+    void ValidatePrice(Price price) const {
+        if (price < tickSize_ || price >= pairPrice_ || price % tickSize_ != 0)
+            throw std::invalid_argument("Price " + std::to_string(price) + " must be a multiple of the tick size " +
+                                        std::to_string(tickSize_) + " below " + std::to_string(pairPrice_));
+    }
+
+public:
+    // tickSize is the smallest price increment and pairPrice the value of a
+    // complete YES+NO pair, both in the same price units (cents by default).
+    // Books made by a MarketRegistry share its user table; others get their own.
+    explicit Orderbook(Price tickSize = 1, Price pairPrice = PairPrice, std::shared_ptr<UserTable> userTable = nullptr)
+        : tickSize_(CheckTickSize(tickSize, pairPrice)), pairPrice_(pairPrice),
+          books_{ TokenBook{ tickSize, pairPrice }, TokenBook{ tickSize, pairPrice } },
+          userTable_(userTable ? std::move(userTable) : std::make_shared<UserTable>()) {}
+
+    Price GetTickSize() const { return tickSize_; }
+    Price GetPairPrice() const { return pairPrice_; }
+
+    // Method WITH Token (new version). externalId is the caller's own id for
+    // the order (the database UUID); while the order rests it can be used in
+    // place of the returned engine id.
+    AddOrderResult AddOrder(OrderType orderType, Side side, Price price, Quantity quantity, 
+                            const std::string& user_id, Token token, const std::string& externalId = {}) {
+        ValidatePrice(price);
+        ValidateIds(user_id, externalId);
+        std::scoped_lock lock{ mutex_ };
+        if (!externalId.empty() && FindSlot(externalId) != NullSlot)
+            throw std::invalid_argument("Duplicate external order id " + externalId);
+        AddOrderResult result;
+        result.orderId_ = AddOrderInternal(orderType, side, price, quantity, userTable_->Intern(user_id), token,
+                                           externalId, 0, result.fills_.Records());
+        return result;
+    }
+
+    // Method WITHOUT Token (backward compatibility)
+    AddOrderResult AddOrder(OrderType orderType, Side side, Price price, Quantity quantity, const std::string& user_id) {
+        return AddOrder(orderType, side, price, quantity, user_id, Token::YES);
+    }
+
+    // Adds a batch of orders for one user under a single lock acquisition.
+    // The whole batch is validated before anything is applied, so a bad
+    // record rejects the batch rather than leaving it half done. externalIds
+    // is either empty or has one (possibly empty) id per request.
+    BatchResult AddOrders(const std::vector<OrderRequest>& requests, const std::string& userId,
+                          const std::vector<std::string>& externalIds = {}) {
+        if (!externalIds.empty() && externalIds.size() != requests.size())
+            throw std::invalid_argument("Expected one external id per order request");
+        for (std::size_t i = 0; i < requests.size(); ++i)
+            ValidateRequest(requests[i], i);
+        ValidateIds(userId, {});
+        for (const auto& externalId : externalIds)
+            ValidateIds({}, externalId);
+
+        std::scoped_lock lock{ mutex_ };
+        if (!externalIds.empty()) {
+            std::unordered_set<std::string_view> seen;
+            for (const auto& externalId : externalIds) {
+                if (!externalId.empty() && (FindSlot(externalId) != NullSlot || !seen.insert(externalId).second))
+                    throw std::invalid_argument("Duplicate external order id " + externalId);
+            }
+        }
+
+        static const std::string NoExternalId;
+        const UserHandle user = userTable_->Intern(userId);
+        BatchResult result;
+        result.orderIds_.reserve(requests.size());
+        for (std::size_t i = 0; i < requests.size(); ++i) {
+            const OrderRequest& request = requests[i];
+            result.orderIds_.push_back(AddOrderInternal(
+                static_cast<OrderType>(request.orderType_), static_cast<Side>(request.side_), request.price_,
+                request.quantity_, user, static_cast<Token>(request.token_),
+                externalIds.empty() ? NoExternalId : externalIds[i], static_cast<std::uint32_t>(i), result.fills_));
+        }
+        return result;
+    }
+
+    // Returns false when no such order is resting.
+    // Cancels a resting order; returns the open quantity it took off the
+    // book, 0 when no such order is resting.
+    Quantity CancelOrder(OrderId orderId) {
+        std::scoped_lock lock{ mutex_ };
+        return CancelWithQuantity(orders_.Find(orderId));
+    }
+
+    Quantity CancelOrder(const std::string& externalId) {
+        std::scoped_lock lock{ mutex_ };
+        return CancelWithQuantity(FindSlot(externalId));
+    }
+
+    // Changes a resting order's price and open quantity, keeping its ids.
+    // Shrinking it at the same price is O(1) and keeps its place in the
+    // queue; any other change takes it off the book, matches it at the new
+    // price like an incoming order and rests the remainder at the back of
+    // the new level, all under one lock. Fills already made are kept, so the
+    // order's initial quantity moves by the same amount as its open one.
+    // expectedQuantity is the open quantity the caller last saw: whatever
+    // filled since then is taken off the new quantity under the same lock,
+    // so fills racing the amend are not handed back. Returns nothing when no
+    // such order is resting.
+    std::optional<AmendResult> AmendOrder(OrderId orderId, Price price, Quantity quantity,
+                                          std::optional<Quantity> expectedQuantity = std::nullopt) {
+        ValidatePrice(price);
+        std::scoped_lock lock{ mutex_ };
+        return AmendInternal(orders_.Find(orderId), price, quantity, expectedQuantity);
+    }
+
+    std::optional<AmendResult> AmendOrder(const std::string& externalId, Price price, Quantity quantity,
+                                          std::optional<Quantity> expectedQuantity = std::nullopt) {
+        ValidatePrice(price);
+        std::scoped_lock lock{ mutex_ };
+        return AmendInternal(FindSlot(externalId), price, quantity, expectedQuantity);
+    }
+
+    // Cancels every listed order that is still resting; returns how many were.
+    std::size_t CancelOrders(const std::vector<OrderId>& orderIds) {
+        std::scoped_lock lock{ mutex_ };
+        std::size_t cancelled = 0;
+        for (OrderId orderId : orderIds)
+            cancelled += CancelSlot(orders_.Find(orderId));
+        return cancelled;
+    }
+
+    std::size_t CancelOrders(const std::vector<std::string>& externalIds) {
+        std::scoped_lock lock{ mutex_ };
+        std::size_t cancelled = 0;
+        for (const auto& externalId : externalIds)
+            cancelled += CancelSlot(FindSlot(externalId));
+        return cancelled;
+    }
+
+    // Cancels every resting order, in snapshot order; returns how many there were.
+    std::size_t CancelAll() {
+        std::scoped_lock lock{ mutex_ };
+        return CancelSlots(RestingSlots([](const Order&) { return true; }));
+    }
+
+    // Cancels every resting order placed by userId, oldest first, and
+    // returns copies of them as they were when cancelled.
+    std::vector<OrderDetails> CancelAllForUser(const std::string& userId) {
+        std::scoped_lock lock{ mutex_ };
+        std::vector<OrderDetails> cancelled;
+        for (OrderSlot slot : UserSlots(userId)) {
+            cancelled.push_back(Details(slot));
+            CancelSlot(slot);
+        }
+        return cancelled;
+    }
+
+    // Copies of userId's resting orders, oldest (lowest engine id) first.
+    std::vector<OrderDetails> GetUserOrders(const std::string& userId) const {
+        std::scoped_lock lock{ mutex_ };
+        std::vector<OrderDetails> orders;
+        for (OrderSlot slot : UserSlots(userId))
+            orders.push_back(Details(slot));
+        return orders;
+    }
+
+    // Copies of every resting order, oldest first.
+    std::vector<OrderDetails> GetAllOrders() const {
+        std::scoped_lock lock{ mutex_ };
+        std::vector<OrderDetails> orders;
+        orders.reserve(orders_.Size());
+        for (const auto& [user, userOrders] : userOrders_)
+            for (OrderSlot slot = userOrders.head_; slot != NullSlot; slot = pool_[slot].userNext_)
+                orders.push_back(Details(slot));
+        std::sort(orders.begin(), orders.end(),
+                  [](const OrderDetails& lhs, const OrderDetails& rhs) { return lhs.GetOrderId() < rhs.GetOrderId(); });
+        return orders;
+    }
+
+    // What userId's resting orders have committed, per token and side.
+    Exposure GetExposure(const std::string& userId) const {
+        std::scoped_lock lock{ mutex_ };
+        Exposure exposure;
+        auto user = userTable_->Find(userId);
+        auto it = user ? userOrders_.find(*user) : userOrders_.end();
+        if (it == userOrders_.end())
+            return exposure;
+        exposure.orderCount_ = it->second.count_;
+        for (OrderSlot slot = it->second.head_; slot != NullSlot; slot = pool_[slot].userNext_) {
+            const Order& order = pool_[slot];
+            TokenExposure& token = order.GetToken() == Token::YES ? exposure.yes_ : exposure.no_;
+            const std::uint64_t notional = std::uint64_t{ order.GetPrice() } * order.GetRemainingQuantity();
+            if (order.GetSide() == Side::Buy) {
+                token.buyQuantity_ += order.GetRemainingQuantity();
+                token.buyNotional_ += notional;
+            } else {
+                token.sellQuantity_ += order.GetRemainingQuantity();
+                token.sellNotional_ += notional;
+            }
+        }
+        return exposure;
+    }
+
+    // Copy of a resting order, or nothing if it is not (or no longer) resting.
+    std::optional<OrderDetails> GetOrder(OrderId orderId) const {
+        std::scoped_lock lock{ mutex_ };
+        OrderSlot slot = orders_.Find(orderId);
+        if (slot == NullSlot)
+            return std::nullopt;
+        return Details(slot);
+    }
+
+    std::optional<OrderDetails> GetOrder(const std::string& externalId) const {
+        std::scoped_lock lock{ mutex_ };
+        OrderSlot slot = FindSlot(externalId);
+        if (slot == NullSlot)
+            return std::nullopt;
+        return Details(slot);
+    }
+
+    // Pre-sizes order storage so building a book of `count` resting orders
+    // never has to grow the pool or the id index.
+    void Reserve(std::size_t count) {
+        std::scoped_lock lock{ mutex_ };
+        pool_.Reserve(count);
+        orders_.Reserve(count);
+        externalIds_.reserve(count);
+    }
+
+    std::size_t Size() const {
+        std::scoped_lock lock{ mutex_ };
+        return orders_.Size();
+    }
+
+    // Moves the book onto another user table, re-interning the users of
+    // its resting orders; MarketRegistry uses this so all its books share one.
+    void ShareUserTable(std::shared_ptr<UserTable> userTable) {
+        std::scoped_lock lock{ mutex_ };
+        if (userTable == userTable_)
+            return;
+        std::unordered_map<UserHandle, UserOrders> userOrders;
+        userOrders.reserve(userOrders_.size());
+        for (const auto& [user, orders] : userOrders_) {
+            const UserHandle handle = userTable->Intern(userTable_->Name(user));
+            for (OrderSlot slot = orders.head_; slot != NullSlot; slot = pool_[slot].userNext_)
+                pool_[slot].user_ = handle;
+            userOrders.emplace(handle, orders);
+        }
+        userOrders_ = std::move(userOrders);
+        userTable_ = std::move(userTable);
+    }
+
+    BookStats GetStats() const {
+        std::scoped_lock lock{ mutex_ };
+        BookStats stats;
+        stats.orderCount_ = orders_.Size();
+        stats.orderCapacity_ = pool_.Capacity();
+        stats.memoryBytes_ = sizeof(Orderbook) + pool_.MemoryBytes() + orders_.MemoryBytes();
+        for (const auto& book : books_) {
+            stats.levelCount_ += book.bids_.LevelCount() + book.asks_.LevelCount();
+            stats.memoryBytes_ += book.bids_.MemoryBytes() + book.asks_.MemoryBytes();
+        }
+        // Node-based maps: a bucket array plus one node (key, value, link, cached hash) per entry.
+        // External id keys view the pool's strings, and user names live in the
+        // (possibly shared) user table, so neither is counted again here.
+        stats.memoryBytes_ += externalIds_.bucket_count() * sizeof(void*) +
+                              externalIds_.size() * (sizeof(std::pair<const std::string_view, OrderSlot>) + 2 * sizeof(void*));
+        stats.memoryBytes_ += userOrders_.bucket_count() * sizeof(void*) +
+                              userOrders_.size() * (sizeof(std::pair<const UserHandle, UserOrders>) + 2 * sizeof(void*));
+        stats.counters_ = counters_;
+        stats.timing_ = timing_;
+        return stats;
+    }
+
+    // Zeroes the counters reported by GetStats; sizes are unaffected.
+    void ResetCounters() {
+        std::scoped_lock lock{ mutex_ };
+        counters_ = EngineCounters{};
+    }
+
+    // Times every match call (two clock reads each) while enabled.
+    void EnableTiming(bool enabled) {
+        std::scoped_lock lock{ mutex_ };
+        timing_ = enabled;
+    }
+
+    OrderbookLevelInfos GetOrderInfos(Token token) const {
+        std::scoped_lock lock{ mutex_ };
+        const auto& book = GetBook(token);
+        return DepthInternal(token, std::max(book.bids_.LevelCount(), book.asks_.LevelCount()));
+    }
+
+    // Top `levels` price levels of each side, best first. Reads the running
+    // level totals, so the cost is O(levels) whatever the book's size.
+    OrderbookLevelInfos GetDepth(Token token, std::size_t levels) const {
+        std::scoped_lock lock{ mutex_ };
+        return DepthInternal(token, levels);
+    }
+
+    // Same levels as GetDepth, packed for zero-copy export: bids best first,
+    // then asks best first, each record tagged with its side.
+    std::vector<DepthRecord> GetDepthRecords(Token token, std::size_t levels) const {
+        std::scoped_lock lock{ mutex_ };
+        const auto& book = GetBook(token);
+        std::vector<DepthRecord> records;
+        records.reserve(std::min(levels, book.bids_.LevelCount()) + std::min(levels, book.asks_.LevelCount()));
+        for (const PriceLadder* ladder : { &book.bids_, &book.asks_ }) {
+            const auto side = static_cast<std::uint8_t>(ladder == &book.bids_ ? Side::Buy : Side::Sell);
+            std::size_t count = 0;
+            for (std::size_t tick = ladder->BestTick(); tick != PriceLadder::NoTick && count < levels;
+                 tick = ladder->NextTick(tick), ++count) {
+                const PriceLevel& level = ladder->LevelAt(tick);
+                records.push_back(DepthRecord{ ladder->TickPrice(tick), level.quantity_, level.orderCount_, side, {} });
+            }
+        }
+        return records;
+    }
+
+    // Changes whenever the resting orders do, so comparing two reads tells
+    // whether anything happened in between.
+    std::uint64_t Sequence() const {
+        std::scoped_lock lock{ mutex_ };
+        return sequence_;
+    }
+
+    // Full depth of both tokens, shared between callers until the next
+    // mutation, so polling an idle book costs a lock and a pointer copy.
+    std::shared_ptr<MarketView> GetMarketView() const {
+        std::scoped_lock lock{ mutex_ };
+        if (!view_ || view_->sequence_ != sequence_) {
+            const auto& yes = GetBook(Token::YES);
+            const auto& no = GetBook(Token::NO);
+            view_ = std::make_shared<MarketView>(
+                sequence_, DepthInternal(Token::YES, std::max(yes.bids_.LevelCount(), yes.asks_.LevelCount())),
+                DepthInternal(Token::NO, std::max(no.bids_.LevelCount(), no.asks_.LevelCount())));
+        }
+        return view_;
+    }
+
+    TopOfBook GetBbo(Token token) const {
+        std::scoped_lock lock{ mutex_ };
+        const auto& book = GetBook(token);
+        TopOfBook top;
+        if (!book.bids_.Empty())
+            top.bid_ = book.bids_.LevelAt(book.bids_.BestTick()).ToLevelInfo(book.bids_.TickPrice(book.bids_.BestTick()));
+        if (!book.asks_.Empty())
+            top.ask_ = book.asks_.LevelAt(book.asks_.BestTick()).ToLevelInfo(book.asks_.TickPrice(book.asks_.BestTick()));
+        return top;
+    }
+
+    // Prices an incoming order of `quantity` without touching the book: walks
+    // the levels it would take, in the same order as matching would (direct
+    // asks and, for buys, mintable complementary bids), optionally no further
+    // than a limit price. O(levels walked).
+    Quote GetQuote(Side side, Token token, Quantity quantity, std::optional<Price> limit = std::nullopt) const {
+        std::scoped_lock lock{ mutex_ };
+        const auto& book = GetBook(token);
+        const PriceLadder& direct = side == Side::Buy ? book.asks_ : book.bids_;
+        const PriceLadder* mint = side == Side::Buy ? &GetBook(Complement(token)).bids_ : nullptr;
+        std::size_t directTick = direct.BestTick();
+        std::size_t mintTick = mint ? mint->BestTick() : PriceLadder::NoTick;
+
+        Quote quote;
+        while (quote.quantity_ < quantity) {
+            const bool hasDirect = directTick != PriceLadder::NoTick;
+            const bool hasMint = mintTick != PriceLadder::NoTick;
+            if (!hasDirect && !hasMint)
+                break;
+            const Price directPrice = hasDirect ? direct.TickPrice(directTick) : 0;
+            const Price mintPrice = hasMint ? pairPrice_ - mint->TickPrice(mintTick) : 0;
+            // Only buys can mint, and a buy takes the cheaper of the two
+            const bool useMint = hasMint && (!hasDirect || mintPrice < directPrice);
+            const Price price = useMint ? mintPrice : directPrice;
+            if (limit && (side == Side::Buy ? price > *limit : price < *limit))
+                break;
+
+            const PriceLevel& level = useMint ? mint->LevelAt(mintTick) : direct.LevelAt(directTick);
+            const Quantity take = std::min(quantity - quote.quantity_, level.quantity_);
+            quote.quantity_ += take;
+            quote.totalCost_ += std::uint64_t{ take } * price;
+            quote.worstPrice_ = price;
+            if (useMint)
+                mintTick = mint->NextTick(mintTick);
+            else
+                directTick = direct.NextTick(directTick);
+        }
+        return quote;
+    }
+
+    // Snapshot format, version 1 (all integers little-endian):
+    //   magic "OBSN", u16 version, u16 reserved,
+    //   u32 tick size, u32 pair price, u32 next order id, u32 order count,
+    //   then every resting order in priority order (token, side, level best
+    //   first, queue head first): u32 id, u8 type, u8 side, u8 token, u8 0,
+    //   u32 price, u32 initial quantity, u32 remaining quantity,
+    //   u16-length-prefixed user id and external id.
+    // Engine ids are kept, so restored books match exactly as the original.
+    static constexpr std::uint32_t SnapshotMagic = 0x4E53424F;  // "OBSN"
+    static constexpr std::uint16_t SnapshotVersion = 1;
+
+    std::string Snapshot() const {
+        std::scoped_lock lock{ mutex_ };
+        SnapshotWriter writer;
+        WriteSnapshot(writer);
+        return writer.Take();
+    }
+
+    // Rebuilds a book from Snapshot() output without matching. Anything
+    // malformed or inconsistent raises std::invalid_argument.
+    static std::unique_ptr<Orderbook> Restore(const char* data, std::size_t size) {
+        SnapshotReader reader{ data, size };
+        if (reader.Get<std::uint32_t>() != SnapshotMagic)
+            throw std::invalid_argument("Not an orderbook snapshot");
+        auto version = reader.Get<std::uint16_t>();
+        if (version != SnapshotVersion)
+            throw std::invalid_argument("Unsupported snapshot version " + std::to_string(version));
+        reader.Get<std::uint16_t>();
+        auto tickSize = reader.Get<Price>();
+        auto pairPrice = reader.Get<Price>();
+        auto book = std::make_unique<Orderbook>(tickSize, pairPrice);
+        book->next_order_id_ = reader.Get<OrderId>();
+        auto count = reader.Get<std::uint32_t>();
+        // Every order takes at least 24 bytes, so a corrupt count cannot
+        // make Reserve allocate more than the input could describe
+        if (count > size / 24)
+            throw std::invalid_argument("Snapshot is truncated");
+        book->Reserve(count);
+
+        for (std::uint32_t i = 0; i < count; ++i) {
+            auto orderId = reader.Get<OrderId>();
+            auto orderType = reader.Get<std::uint8_t>();
+            auto side = reader.Get<std::uint8_t>();
+            auto token = reader.Get<std::uint8_t>();
+            reader.Get<std::uint8_t>();
+            OrderRequest request{ reader.Get<Price>(), 0, orderType, side, token, 0 };
+            auto initialQuantity = reader.Get<Quantity>();
+            request.quantity_ = reader.Get<Quantity>();
+            auto userId = reader.GetString();
+            auto externalId = reader.GetString();
+
+            book->ValidateRequest(request, i);
+            ValidateIds(userId, externalId);
+            if (orderId == 0 || orderId >= book->next_order_id_ || book->orders_.Find(orderId) != NullSlot)
+                throw std::invalid_argument("Snapshot order " + std::to_string(i) + " has an invalid id");
+            if (request.quantity_ == 0 || request.quantity_ > initialQuantity)
+                throw std::invalid_argument("Snapshot order " + std::to_string(i) + " has an invalid quantity");
+
+            OrderSlot slot = book->pool_.Allocate();
+            Order& order = book->pool_[slot];
+            order.Reset(static_cast<OrderType>(orderType), orderId, static_cast<Side>(side), request.price_,
+                        initialQuantity, book->userTable_->Intern(userId), static_cast<Token>(token));
+            order.Fill(initialQuantity - request.quantity_);
+            book->pool_.ExternalId(slot).assign(externalId);
+            book->GetLadder(order.GetSide(), order.GetToken()).Push(book->pool_, slot, order.GetPrice());
+            book->orders_.Insert(orderId, slot);
+            book->LinkUser(slot);
+            if (!externalId.empty() && !book->externalIds_.emplace(book->pool_.ExternalId(slot), slot).second)
+                throw std::invalid_argument("Duplicate external order id " + externalId);
+        }
+        if (!reader.AtEnd())
+            throw std::invalid_argument("Unexpected data after the snapshot's last order");
+
+        // A crossed book or unminted complementary bids cannot come out of a
+        // live book, so reject them rather than leave matching half-done
+        try {
+            book->CheckInvariants();
+        } catch (const std::logic_error& e) {
+            throw std::invalid_argument(std::string("Inconsistent snapshot: ") + e.what());
+        }
+        return book;
+    }
+
+    // Starts journaling to a new (missing or empty) file. The journal opens
+    // with a snapshot of the current state, so Replay needs nothing else.
+    void OpenJournal(const std::string& path) {
+        std::scoped_lock lock{ mutex_ };
+        if (journal_)
+            throw std::invalid_argument("Book is already journaling");
+        auto journal = std::make_unique<Journal>(path);
+        WriteSnapshot(journal->Begin());
+        journal->Commit(JournalRecord::Snapshot);
+        journal_ = std::move(journal);
+    }
+
+    void CloseJournal() {
+        std::scoped_lock lock{ mutex_ };
+        journal_.reset();
+    }
+
+    // Flushes journaled events to disk (they already survive a process
+    // crash once written; this covers a machine crash).
+    void SyncJournal() {
+        std::scoped_lock lock{ mutex_ };
+        if (journal_)
+            journal_->Sync();
+    }
+
+    // Sequence number of the last journaled record, 0 when not journaling.
+    std::uint64_t JournalSequence() const {
+        std::scoped_lock lock{ mutex_ };
+        return journal_ ? journal_->Sequence() : 0;
+    }
+
+    // Rebuilds a book from a journal: restores its opening snapshot, then
+    // re-runs every add and cancel through the matcher. The fills this
+    // produces must equal the journaled ones, otherwise the replay diverged
+    // and std::invalid_argument is raised. A torn record at the end (a crash
+    // mid-write) ends the journal there. With resume, the rebuilt book
+    // carries on appending to the same file.
+    static std::unique_ptr<Orderbook> Replay(const std::string& path, bool resume) {
+        std::unique_ptr<Orderbook> book;
+        std::size_t end = 0;
+        std::uint64_t sequence = 0;
+        {
+            JournalReader reader{ path };
+            if (!reader.Next() || reader.Type() != JournalRecord::Snapshot)
+                throw std::invalid_argument("Journal " + path + " does not start with a snapshot");
+            book = Restore(reader.PayloadData(), reader.PayloadSize());
+
+            std::vector<FillRecord> fills;
+            std::size_t verified = 0;
+            auto diverged = [&reader]() {
+                return std::invalid_argument("Journal replay diverged at sequence " + std::to_string(reader.Sequence()));
+            };
+            while (reader.Next()) {
+                SnapshotReader payload = reader.Payload();
+                switch (reader.Type()) {
+                case JournalRecord::Add: {
+                    if (verified != fills.size())
+                        throw diverged();
+                    auto orderId = payload.Get<OrderId>();
+                    OrderRequest request{};
+                    request.orderType_ = payload.Get<std::uint8_t>();
+                    request.side_ = payload.Get<std::uint8_t>();
+                    request.token_ = payload.Get<std::uint8_t>();
+                    payload.Get<std::uint8_t>();
+                    request.price_ = payload.Get<Price>();
+                    request.quantity_ = payload.Get<Quantity>();
+                    auto userId = payload.GetString();
+                    auto externalId = payload.GetString();
+                    book->ValidateRequest(request, 0);
+                    ValidateIds(userId, externalId);
+                    if (orderId != book->next_order_id_ || (!externalId.empty() && book->FindSlot(externalId) != NullSlot))
+                        throw diverged();
+                    fills.clear();
+                    verified = 0;
+                    book->AddOrderInternal(static_cast<OrderType>(request.orderType_), static_cast<Side>(request.side_),
+                                           request.price_, request.quantity_, book->userTable_->Intern(userId),
+                                           static_cast<Token>(request.token_), externalId, 0, fills);
+                    break;
+                }
+                case JournalRecord::Fill: {
+                    auto takerOrderId = payload.Get<OrderId>();
+                    auto makerOrderId = payload.Get<OrderId>();
+                    auto takerPrice = payload.Get<Price>();
+                    auto makerPrice = payload.Get<Price>();
+                    auto quantity = payload.Get<Quantity>();
+                    if (verified == fills.size())
+                        throw diverged();
+                    const FillRecord& fill = fills[verified++];
+                    if (fill.takerOrderId_ != takerOrderId || fill.makerOrderId_ != makerOrderId ||
+                        fill.takerPrice_ != takerPrice || fill.makerPrice_ != makerPrice || fill.quantity_ != quantity)
+                        throw diverged();
+                    break;
+                }
+                case JournalRecord::Cancel: {
+                    if (verified != fills.size() || !book->CancelSlot(book->orders_.Find(payload.Get<OrderId>())))
+                        throw diverged();
+                    break;
+                }
+                case JournalRecord::Amend: {
+                    auto orderId = payload.Get<OrderId>();
+                    auto price = payload.Get<Price>();
+                    auto quantity = payload.Get<Quantity>();
+                    book->ValidatePrice(price);
+                    OrderSlot slot = book->orders_.Find(orderId);
+                    if (verified != fills.size() || slot == NullSlot)
+                        throw diverged();
+                    book->ValidateAmend(slot, quantity);
+                    fills.clear();
+                    verified = 0;
+                    book->AmendSlot(slot, price, quantity, fills);
+                    break;
+                }
+                default:
+                    throw std::invalid_argument("Unexpected journal record at sequence " +
+                                                std::to_string(reader.Sequence()));
+                }
+            }
+            end = reader.End();
+            sequence = reader.Sequence();
+        }
+        if (resume)
+            book->journal_ = std::make_unique<Journal>(path, end, sequence);
+        return book;
+    }
+
+    // Walks every queue and index and throws std::logic_error at the first
+    // inconsistency. O(resting orders); meant for tests, not the hot path.
+    void CheckInvariants() const {
+        std::scoped_lock lock{ mutex_ };
+        std::size_t resting = 0;
+        for (Token token : { Token::YES, Token::NO }) {
+            const auto& book = GetBook(token);
+            for (Side side : { Side::Buy, Side::Sell }) {
+                const PriceLadder& ladder = side == Side::Buy ? book.bids_ : book.asks_;
+                std::size_t levels = 0;
+                for (std::size_t tick = ladder.BestTick(); tick != PriceLadder::NoTick; tick = ladder.NextTick(tick)) {
+                    const PriceLevel& level = ladder.LevelAt(tick);
+                    Quantity quantity = 0;
+                    std::uint32_t count = 0;
+                    OrderSlot prev = NullSlot;
+                    for (OrderSlot slot = level.head_; slot != NullSlot; slot = pool_[slot].next_) {
+                        const Order& order = pool_[slot];
+                        Require(order.prev_ == prev, "Broken queue links");
+                        Require(order.GetToken() == token && order.GetSide() == side &&
+                                order.GetPrice() == ladder.TickPrice(tick), "Order queued at the wrong level");
+                        Require(!order.IsFilled() && order.GetOrderType() == OrderType::GoodTillCancel,
+                                "Filled or fill-and-kill order left resting");
+                        Require(orders_.Find(order.GetOrderId()) == slot, "Resting order missing from the id index");
+                        Require(pool_.ExternalId(slot).empty() || FindSlot(pool_.ExternalId(slot)) == slot,
+                                "Resting order missing from the external id index");
+                        quantity += order.GetRemainingQuantity();
+                        ++count;
+                        prev = slot;
+                    }
+                    Require(count > 0 && level.tail_ == prev, "Empty or mislinked level marked occupied");
+                    Require(level.quantity_ == quantity && level.orderCount_ == count, "Level totals out of date");
+                    ++levels;
+                    resting += count;
+                }
+                Require(levels == ladder.LevelCount(), "Level count out of date");
+            }
+            if (!book.bids_.Empty() && !book.asks_.Empty())
+                Require(book.bids_.BestTick() < book.asks_.BestTick(), "Book is crossed");
+        }
+        Require(resting == orders_.Size(), "Id index holds orders that are not resting");
+        Require(externalIds_.size() <= resting, "External id index holds orders that are not resting");
+        std::size_t linked = 0;
+        for (const auto& [user, orders] : userOrders_) {
+            Require(user < userTable_->Size(), "User index holds an unknown user handle");
+            std::uint32_t count = 0;
+            OrderSlot prev = NullSlot;
+            for (OrderSlot slot = orders.head_; slot != NullSlot; slot = pool_[slot].userNext_) {
+                const Order& order = pool_[slot];
+                Require(order.userPrev_ == prev && order.GetUser() == user, "Broken user order links");
+                Require(orders_.Find(order.GetOrderId()) == slot, "User index holds an order that is not resting");
+                ++count;
+                prev = slot;
+            }
+            Require(count > 0 && count == orders.count_ && orders.tail_ == prev, "User order count out of date");
+            linked += count;
+        }
+        Require(linked == resting, "Resting order missing from the user index");
+        const auto& yes = GetBook(Token::YES).bids_;
+        const auto& no = GetBook(Token::NO).bids_;
+        if (!yes.Empty() && !no.Empty())
+            Require(yes.TickPrice(yes.BestTick()) + no.TickPrice(no.BestTick()) < pairPrice_,
+                    "Complementary bids left unminted");
+    }
+
+private:
+    static void Require(bool condition, const char* message) {
+        if (!condition)
+            throw std::logic_error(message);
+    }
+
+    // Everything below assumes mutex_ is held by the caller.
+
+    void WriteSnapshot(SnapshotWriter& writer) const {
+        writer.Put(SnapshotMagic);
+        writer.Put(SnapshotVersion);
+        writer.Put(std::uint16_t{ 0 });
+        writer.Put(tickSize_);
+        writer.Put(pairPrice_);
+        writer.Put(next_order_id_);
+        writer.Put(static_cast<std::uint32_t>(orders_.Size()));
+        for (const auto& book : books_) {
+            for (const PriceLadder* ladder : { &book.bids_, &book.asks_ }) {
+                for (std::size_t tick = ladder->BestTick(); tick != PriceLadder::NoTick; tick = ladder->NextTick(tick)) {
+                    for (OrderSlot slot = ladder->LevelAt(tick).head_; slot != NullSlot; slot = pool_[slot].next_) {
+                        const Order& order = pool_[slot];
+                        writer.Put(order.GetOrderId());
+                        writer.Put(static_cast<std::uint8_t>(order.GetOrderType()));
+                        writer.Put(static_cast<std::uint8_t>(order.GetSide()));
+                        writer.Put(static_cast<std::uint8_t>(order.GetToken()));
+                        writer.Put(std::uint8_t{ 0 });
+                        writer.Put(order.GetPrice());
+                        writer.Put(order.GetInitialQuantity());
+                        writer.Put(order.GetRemainingQuantity());
+                        writer.PutString(UserName(order));
+                        writer.PutString(pool_.ExternalId(slot));
+                    }
+                }
+            }
+        }
+    }
+
+    // Matches and, if anything is left of a good-till-cancel order, rests
+    // it. Fills are appended to `fills`, tagged with requestIndex.
+    OrderId AddOrderInternal(OrderType orderType, Side side, Price price, Quantity quantity,
+                             UserHandle user, Token token, const std::string& externalId,
+                             std::uint32_t requestIndex, std::vector<FillRecord>& fills) {
+        OrderSlot slot = pool_.Allocate();
+        Order& order = pool_[slot];
+        order.Reset(orderType, next_order_id_++, side, price, quantity, user, token);
+        pool_.ExternalId(slot).assign(externalId);
+        const OrderId orderId = order.GetOrderId();
+        ++counters_.ordersAdded_;
+        if (journal_)
+            JournalAdd(slot);
+
+        if (order.GetOrderType() == OrderType::FillAndKill &&
+            !CanMatch(order.GetSide(), order.GetToken(), order.GetPrice())) {
+            pool_.Release(slot);
+            return orderId;
+        }
+
+        // From here on the order either trades or rests
+        ++sequence_;
+        MatchOrder(slot, requestIndex, fills);
+        if (order.IsFilled() || order.GetOrderType() == OrderType::FillAndKill) {
+            pool_.Release(slot);
+            return orderId;
+        }
+
+        GetLadder(order.GetSide(), order.GetToken()).Push(pool_, slot, order.GetPrice());
+        orders_.Insert(orderId, slot);
+        if (!externalId.empty())
+            externalIds_.emplace(pool_.ExternalId(slot), slot);
+        LinkUser(slot);
+        return orderId;
+    }
+
+    bool CanMatch(Side side, Token token, Price price) {
+        return DirectCandidate(side, token, price).level_ != nullptr ||
+               MintCandidate(side, token, price).level_ != nullptr;
+    }
+
+    // Matches an incoming order against resting liquidity before it rests.
+    // Since the book is never left crossed, only the incoming order can
+    // trade, and it always trades at the resting (maker) order's price.
+    void MatchOrder(OrderSlot slot, std::uint32_t requestIndex, std::vector<FillRecord>& fills) {
+        Order& order = pool_[slot];
+        const Side side = order.GetSide();
+        const Token token = order.GetToken();
+        const Price price = order.GetPrice();
+        const std::string* takerUser = nullptr;
+        const auto start = timing_ ? std::chrono::steady_clock::now() : std::chrono::steady_clock::time_point{};
+        const PriceLevel* lastLevel = nullptr;
+        std::uint64_t matches = 0;
+
+        while (!order.IsFilled()) {
+            Candidate direct = DirectCandidate(side, token, price);
+            Candidate mint = MintCandidate(side, token, price);
+            if (!direct.level_ && !mint.level_)
+                break;
+
+            const Candidate& best = !mint.level_ ? direct
+                                  : !direct.level_ ? mint
+                                  : IsBetter(side, direct, mint) ? direct : mint;
+
+            if (best.level_ != lastLevel) {
+                lastLevel = best.level_;
+                ++counters_.levelsTouched_;
+            }
+            OrderSlot restingSlot = best.level_->head_;
+            Order& resting = pool_[restingSlot];
+            if (!takerUser)
+                takerUser = &UserName(order);
+            Quantity quantity = std::min(order.GetRemainingQuantity(), resting.GetRemainingQuantity());
+            order.Fill(quantity);
+            resting.Fill(quantity);
+            best.level_->OnFill(quantity);
+
+            // The taker always trades at the maker's level: the maker's own
+            // price for a direct match, its complement for a mint
+            fills.push_back(FillRecord{ requestIndex, order.GetOrderId(), resting.GetOrderId(),
+                                        best.effectivePrice_, resting.GetPrice(), quantity,
+                                        static_cast<std::uint8_t>(token), static_cast<std::uint8_t>(side),
+                                        static_cast<std::uint8_t>(best.matchType_), 0,
+                                        ToIdField(pool_.ExternalId(slot)), ToIdField(pool_.ExternalId(restingSlot)),
+                                        ToIdField(*takerUser), ToIdField(UserName(resting)) });
+            if (journal_)
+                JournalFill(fills.back(), slot, restingSlot);
+            ++matches;
+            counters_.quantityFilled_ += quantity;
+
+            if (resting.IsFilled()) {
+                ++counters_.ordersFilled_;
+                RemoveResting(restingSlot);
+            }
+        }
+
+        ++counters_.matchCalls_;
+        counters_.fills_ += matches;
+        counters_.maxMatchLength_ = std::max(counters_.maxMatchLength_, matches);
+        if (order.IsFilled())
+            ++counters_.ordersFilled_;
+        if (timing_) {
+            const auto elapsed = std::chrono::duration_cast<std::chrono::nanoseconds>(
+                std::chrono::steady_clock::now() - start).count();
+            counters_.matchNanos_ += static_cast<std::uint64_t>(elapsed);
+            counters_.maxMatchNanos_ = std::max(counters_.maxMatchNanos_, static_cast<std::uint64_t>(elapsed));
+        }
+    }
+
+    std::optional<AmendResult> AmendInternal(OrderSlot slot, Price price, Quantity quantity,
+                                             std::optional<Quantity> expectedQuantity) {
+        if (slot == NullSlot)
+            return std::nullopt;
+        const Quantity remaining = pool_[slot].GetRemainingQuantity();
+        if (expectedQuantity && *expectedQuantity > remaining) {
+            const Quantity filledSince = *expectedQuantity - remaining;
+            if (quantity <= filledSince)
+                throw std::invalid_argument("The order filled past the amended quantity");
+            quantity -= filledSince;
+        }
+        ValidateAmend(slot, quantity);
+        AmendResult result;
+        result.orderId_ = pool_[slot].GetOrderId();
+        result.previousQuantity_ = remaining;
+        AmendSlot(slot, price, quantity, result.fills_.Records());
+        return result;
+    }
+
+    void ValidateAmend(OrderSlot slot, Quantity quantity) const {
+        const Order& order = pool_[slot];
+        if (quantity == 0)
+            throw std::invalid_argument("Amended quantity must be positive; cancel the order instead");
+        if (quantity > std::numeric_limits<Quantity>::max() - (order.GetInitialQuantity() - order.GetRemainingQuantity()))
+            throw std::invalid_argument("Amended quantity is too large");
+    }
+
+    void AmendSlot(OrderSlot slot, Price price, Quantity quantity, std::vector<FillRecord>& fills) {
+        Order& order = pool_[slot];
+        ++counters_.ordersAmended_;
+        ++sequence_;
+        if (journal_) {
+            SnapshotWriter& record = journal_->Begin();
+            record.Put(order.GetOrderId());
+            record.Put(price);
+            record.Put(quantity);
+            journal_->Commit(JournalRecord::Amend);
+        }
+
+        PriceLadder& ladder = GetLadder(order.GetSide(), order.GetToken());
+        const Quantity filled = order.GetInitialQuantity() - order.GetRemainingQuantity();
+        if (price == order.GetPrice() && quantity <= order.GetRemainingQuantity()) {
+            ladder.Level(price).OnReduce(order.GetRemainingQuantity() - quantity);
+            order.remainingQuantity_ = quantity;
+            order.initialQuantity_ = filled + quantity;
+            return;
+        }
+
+        ladder.Erase(pool_, slot, order.GetPrice());
+        order.price_ = price;
+        order.remainingQuantity_ = quantity;
+        order.initialQuantity_ = filled + quantity;
+        MatchOrder(slot, 0, fills);
+        if (!order.IsFilled()) {
+            ladder.Push(pool_, slot, price);
+            return;
+        }
+        UnlinkUser(slot);
+        orders_.Erase(order.GetOrderId());
+        if (!pool_.ExternalId(slot).empty())
+            externalIds_.erase(pool_.ExternalId(slot));
+        pool_.Release(slot);
+    }
+
+    bool CancelSlot(OrderSlot slot) {
+        if (slot == NullSlot)
+            return false;
+        if (journal_) {
+            journal_->Begin().Put(pool_[slot].GetOrderId());
+            journal_->Commit(JournalRecord::Cancel);
+        }
+        RemoveResting(slot);
+        ++counters_.ordersCancelled_;
+        ++sequence_;
+        return true;
+    }
+
+    Quantity CancelWithQuantity(OrderSlot slot) {
+        if (slot == NullSlot)
+            return 0;
+        const Quantity remaining = pool_[slot].GetRemainingQuantity();
+        CancelSlot(slot);
+        return remaining;
+    }
+
+    std::size_t CancelSlots(const std::vector<OrderSlot>& slots) {
+        for (OrderSlot slot : slots)
+            CancelSlot(slot);
+        return slots.size();
+    }
+
+    void LinkUser(OrderSlot slot) {
+        Order& order = pool_[slot];
+        UserOrders& orders = userOrders_[order.GetUser()];
+        order.userPrev_ = orders.tail_;
+        order.userNext_ = NullSlot;
+        if (orders.tail_ == NullSlot)
+            orders.head_ = slot;
+        else
+            pool_[orders.tail_].userNext_ = slot;
+        orders.tail_ = slot;
+        ++orders.count_;
+    }
+
+    void UnlinkUser(OrderSlot slot) {
+        const Order& order = pool_[slot];
+        auto it = userOrders_.find(order.GetUser());
+        UserOrders& orders = it->second;
+        if (order.userPrev_ == NullSlot)
+            orders.head_ = order.userNext_;
+        else
+            pool_[order.userPrev_].userNext_ = order.userNext_;
+        if (order.userNext_ == NullSlot)
+            orders.tail_ = order.userPrev_;
+        else
+            pool_[order.userNext_].userPrev_ = order.userPrev_;
+        if (--orders.count_ == 0)
+            userOrders_.erase(it);
+    }
+
+    // Slots of userId's resting orders, oldest (lowest engine id) first.
+    // Amends and restores can reorder the list, hence the sort.
+    std::vector<OrderSlot> UserSlots(const std::string& userId) const {
+        std::vector<OrderSlot> slots;
+        auto user = userTable_->Find(userId);
+        auto it = user ? userOrders_.find(*user) : userOrders_.end();
+        if (it == userOrders_.end())
+            return slots;
+        slots.reserve(it->second.count_);
+        for (OrderSlot slot = it->second.head_; slot != NullSlot; slot = pool_[slot].userNext_)
+            slots.push_back(slot);
+        std::sort(slots.begin(), slots.end(), [this](OrderSlot lhs, OrderSlot rhs) {
+            return pool_[lhs].GetOrderId() < pool_[rhs].GetOrderId();
+        });
+        return slots;
+    }
+
+    // Slots of the resting orders that pass `keep`, in snapshot order: YES
+    // then NO, bids then asks, best price first, queue order within a level.
+    template <typename Predicate>
+    std::vector<OrderSlot> RestingSlots(Predicate keep) const {
+        std::vector<OrderSlot> slots;
+        for (const auto& book : books_) {
+            for (const PriceLadder* ladder : { &book.bids_, &book.asks_ }) {
+                for (std::size_t tick = ladder->BestTick(); tick != PriceLadder::NoTick; tick = ladder->NextTick(tick)) {
+                    for (OrderSlot slot = ladder->LevelAt(tick).head_; slot != NullSlot; slot = pool_[slot].next_) {
+                        if (keep(pool_[slot]))
+                            slots.push_back(slot);
+                    }
+                }
+            }
+        }
+        return slots;
+    }
+
+    void JournalAdd(OrderSlot slot) {
+        const Order& order = pool_[slot];
+        SnapshotWriter& record = journal_->Begin();
+        record.Put(order.GetOrderId());
+        record.Put(static_cast<std::uint8_t>(order.GetOrderType()));
+        record.Put(static_cast<std::uint8_t>(order.GetSide()));
+        record.Put(static_cast<std::uint8_t>(order.GetToken()));
+        record.Put(std::uint8_t{ 0 });
+        record.Put(order.GetPrice());
+        record.Put(order.GetInitialQuantity());
+        record.PutString(UserName(order));
+        record.PutString(pool_.ExternalId(slot));
+        journal_->Commit(JournalRecord::Add);
+    }
+
+    void JournalFill(const FillRecord& fill, OrderSlot taker, OrderSlot maker) {
+        SnapshotWriter& record = journal_->Begin();
+        record.Put(fill.takerOrderId_);
+        record.Put(fill.makerOrderId_);
+        record.Put(fill.takerPrice_);
+        record.Put(fill.makerPrice_);
+        record.Put(fill.quantity_);
+        record.Put(fill.matchType_);
+        record.Put(std::array<std::uint8_t, 3>{});
+        record.PutString(pool_.ExternalId(taker));
+        record.PutString(pool_.ExternalId(maker));
+        journal_->Commit(JournalRecord::Fill);
+    }
+
+    const std::string& UserName(const Order& order) const {
+        return userTable_->Name(order.GetUser());
+    }
+
+    OrderDetails Details(OrderSlot slot) const {
+        return OrderDetails{ pool_[slot], UserName(pool_[slot]), pool_.ExternalId(slot) };
+    }
+
+    OrderbookLevelInfos DepthInternal(Token token, std::size_t levels) const {
+        const auto& book = GetBook(token);
+        return OrderbookLevelInfos{ CollectLevels(book.bids_, levels), CollectLevels(book.asks_, levels) };
+    }
+
+    void ValidateRequest(const OrderRequest& request, std::size_t index) const {
+        if (request.orderType_ > static_cast<std::uint8_t>(OrderType::FillAndKill) ||
+            request.side_ > static_cast<std::uint8_t>(Side::Sell) ||
+            request.token_ > static_cast<std::uint8_t>(Token::NO))
+            throw std::invalid_argument("Order request " + std::to_string(index) + " has an invalid enum value");
+        ValidatePrice(request.price_);
+    }
+
+    static void ValidateIds(const std::string& userId, const std::string& externalId) {
+        if (userId.size() > IdFieldSize || externalId.size() > IdFieldSize)
+            throw std::invalid_argument("User and external ids are limited to " + std::to_string(IdFieldSize) +
+                                        " bytes");
+    }
+
+    static LevelInfos CollectLevels(const PriceLadder& ladder, std::size_t levels) {
+        LevelInfos infos;
+        infos.reserve(std::min(levels, ladder.LevelCount()));
+        for (std::size_t tick = ladder.BestTick(); tick != PriceLadder::NoTick && infos.size() < levels;
+             tick = ladder.NextTick(tick))
+            infos.push_back(ladder.LevelAt(tick).ToLevelInfo(ladder.TickPrice(tick)));
+        return infos;
+    }
+};
+
+// Owns the book of every loaded market, keyed by market id. Books are held
+// by shared pointer, so a caller still using a book after its market is
+// dropped finishes safely. mutex_ only guards the map: bulk operations take
+// the books they need under it, then work on each one under that book's own
+// lock, so a mass cancel never holds up matching in other markets.
+class MarketRegistry {
+public:
+    using BookPtr = std::shared_ptr<Orderbook>;
+
+    // Creates an empty book for a market that does not have one yet.
+    BookPtr Create(const std::string& marketId, Price tickSize = 1, Price pairPrice = PairPrice) {
+        auto book = std::make_shared<Orderbook>(tickSize, pairPrice, users_);
+        Add(marketId, book);
+        return book;
+    }
+
+    // Takes in a book built elsewhere, e.g. restored from a snapshot or
+    // replayed from a journal, and moves it onto the shared user table.
+    void Add(const std::string& marketId, BookPtr book) {
+        if (!book)
+            throw std::invalid_argument("Cannot register a null book");
+        book->ShareUserTable(users_);
+        std::scoped_lock lock{ mutex_ };
+        auto [it, added] = books_.emplace(marketId, std::move(book));
+        if (!added)
+            throw std::invalid_argument("Market " + marketId + " already has a book");
+        it->second->EnableTiming(timing_);
+    }
+
+    // The market's book, or null when it has none.
+    BookPtr Get(const std::string& marketId) const {
+        std::scoped_lock lock{ mutex_ };
+        auto it = books_.find(marketId);
+        return it == books_.end() ? nullptr : it->second;
+    }
+
+    // Removes a market's book and closes its journal; returns false when
+    // the market had no book.
+    bool Drop(const std::string& marketId) {
+        BookPtr book;
+        {
+            std::scoped_lock lock{ mutex_ };
+            auto it = books_.find(marketId);
+            if (it == books_.end())
+                return false;
+            book = std::move(it->second);
+            books_.erase(it);
+        }
+        book->CloseJournal();
+        return true;
+    }
+
+    bool Contains(const std::string& marketId) const {
+        std::scoped_lock lock{ mutex_ };
+        return books_.count(marketId) != 0;
+    }
+
+    std::size_t Size() const {
+        std::scoped_lock lock{ mutex_ };
+        return books_.size();
+    }
+
+    // Every (market id, book) pair, sorted by market id.
+    std::vector<std::pair<std::string, BookPtr>> Books() const {
+        std::vector<std::pair<std::string, BookPtr>> books;
+        {
+            std::scoped_lock lock{ mutex_ };
+            books.assign(books_.begin(), books_.end());
+        }
+        std::sort(books.begin(), books.end(), [](const auto& lhs, const auto& rhs) { return lhs.first < rhs.first; });
+        return books;
+    }
+
+    // Cancels every resting order in one market; 0 when it has no book.
+    std::size_t CancelAll(const std::string& marketId) {
+        BookPtr book = Get(marketId);
+        return book ? book->CancelAll() : 0;
+    }
+
+    // Cancels a user's resting orders in every market. Returns what was
+    // cancelled in each market that had any.
+    std::vector<std::pair<std::string, std::vector<OrderDetails>>> CancelAllForUser(const std::string& userId) {
+        std::vector<std::pair<std::string, std::vector<OrderDetails>>> cancelled;
+        for (const auto& [marketId, book] : Books()) {
+            auto orders = book->CancelAllForUser(userId);
+            if (!orders.empty())
+                cancelled.emplace_back(marketId, std::move(orders));
+        }
+        return cancelled;
+    }
+
+    // A user's resting orders in every market that has any.
+    std::vector<std::pair<std::string, std::vector<OrderDetails>>> GetUserOrders(const std::string& userId) const {
+        std::vector<std::pair<std::string, std::vector<OrderDetails>>> orders;
+        for (const auto& [marketId, book] : Books()) {
+            auto userOrders = book->GetUserOrders(userId);
+            if (!userOrders.empty())
+                orders.emplace_back(marketId, std::move(userOrders));
+        }
+        return orders;
+    }
+
+    std::optional<BookStats> GetStats(const std::string& marketId) const {
+        BookPtr book = Get(marketId);
+        if (!book)
+            return std::nullopt;
+        return book->GetStats();
+    }
+
+    std::vector<std::pair<std::string, BookStats>> GetAllStats() const {
+        std::vector<std::pair<std::string, BookStats>> stats;
+        for (const auto& [marketId, book] : Books())
+            stats.emplace_back(marketId, book->GetStats());
+        return stats;
+    }
+
+    void ResetCounters() {
+        for (const auto& [marketId, book] : Books())
+            book->ResetCounters();
+    }
+
+    // Turns match timing on or off for every book, including books added later.
+    void EnableTiming(bool enabled) {
+        std::scoped_lock lock{ mutex_ };
+        timing_ = enabled;
+        for (const auto& [marketId, book] : books_)
+            book->EnableTiming(enabled);
+    }
+
+    // Every user id ever seen by a book here is interned once, however many
+    // markets it trades in; books' own stats leave the table out.
+    const UserTable& Users() const { return *users_; }
+
+private:
+    std::unordered_map<std::string, BookPtr> books_;
+    std::shared_ptr<UserTable> users_ = std::make_shared<UserTable>();
+    bool timing_ = false;
+    mutable std::mutex mutex_;
+};
+
+#ifndef ORDERBOOK_NO_BINDINGS
+namespace py = pybind11;
+
+using OrderIdBuffer = RecordBuffer<OrderId>;
+using FillBuffer = RecordBuffer<FillRecord>;
+using DepthBuffer = RecordBuffer<DepthRecord>;
+
+// Exposes packed records as raw bytes; wrap with FILL_RECORD_DTYPE and
+// friends, or iterate with struct.iter_unpack.
+template <typename Record>
+static void BindRecordBuffer(py::module_& m, const char* name) {
+    py::class_<RecordBuffer<Record>>(m, name, py::buffer_protocol())
+        .def_buffer([](RecordBuffer<Record>& records) {
+            return py::buffer_info(const_cast<Record*>(records.Data()), 1,
+                                   py::format_descriptor<std::uint8_t>::format(), 1,
+                                   { records.Size() * sizeof(Record) }, { std::size_t{ 1 } }, true);
+        })
+        .def("__len__", &RecordBuffer<Record>::Size);
+}
+
+// Copies a C-contiguous buffer (NumPy array, bytes, memoryview, ...) into
+// records. Items must be either whole records or raw bytes; the field layout
+// itself is not inspected. Must be called with the GIL held.
+template <typename Record>
+static std::vector<Record> CopyRecords(py::handle source, const char* what) {
+    Py_buffer view;
+    if (PyObject_GetBuffer(source.ptr(), &view, PyBUF_C_CONTIGUOUS) != 0)
+        throw py::error_already_set();
+    const bool valid = (view.itemsize == 1 || view.itemsize == sizeof(Record)) && view.len % sizeof(Record) == 0;
+    std::vector<Record> records;
+    if (valid) {
+        records.resize(view.len / sizeof(Record));
+        std::memcpy(records.data(), view.buf, view.len);
+    }
+    PyBuffer_Release(&view);
+    if (!valid)
+        throw std::invalid_argument(std::string(what) + " buffer must hold packed " +
+                                    std::to_string(sizeof(Record)) + "-byte records");
+    return records;
+}
+
+// Restores a book straight from any C-contiguous buffer (bytes, mmap,
+// memoryview slice). The GIL is released while parsing; the buffer view
+// keeps the memory alive meanwhile.
+static std::shared_ptr<Orderbook> RestoreFromBuffer(py::handle source) {
+    Py_buffer view;
+    if (PyObject_GetBuffer(source.ptr(), &view, PyBUF_C_CONTIGUOUS) != 0)
+        throw py::error_already_set();
+    try {
+        std::shared_ptr<Orderbook> book;
+        {
+            py::gil_scoped_release release;
+            book = Orderbook::Restore(static_cast<const char*>(view.buf), static_cast<std::size_t>(view.len));
+        }
+        PyBuffer_Release(&view);
+        return book;
+    } catch (...) {
+        PyBuffer_Release(&view);
+        throw;
+    }
+}
+
+static py::bytes SnapshotBytes(const Orderbook& book) {
+    std::string data;
+    {
+        py::gil_scoped_release release;
+        data = book.Snapshot();
+    }
+    return py::bytes(data);
+}
+
+static py::dict OrdersByMarket(const std::vector<std::pair<std::string, std::vector<OrderDetails>>>& orders) {
+    py::dict byMarket;
+    for (const auto& [marketId, marketOrders] : orders)
+        byMarket[py::str(marketId)] = py::cast(marketOrders);
+    return byMarket;
+}
+
+// numpy.dtype() spec matching a packed record, padding included.
+static py::dict RecordDtype(std::initializer_list<std::tuple<const char*, const char*, std::size_t>> fields,
+                            std::size_t itemsize) {
+    py::list names, formats, offsets;
+    for (const auto& [name, format, offset] : fields) {
+        names.append(name);
+        formats.append(format);
+        offsets.append(offset);
+    }
+    py::dict dtype;
+    dtype["names"] = names;
+    dtype["formats"] = formats;
+    dtype["offsets"] = offsets;
+    dtype["itemsize"] = itemsize;
+    return dtype;
+}
+
+PYBIND11_MODULE(orderbook_cpp, m) {
+    m.doc() = "C++ Orderbook for Prediction Markets";
+
+    // Enums
+    py::enum_<OrderType>(m, "OrderType")
+        .value("GoodTillCancel", OrderType::GoodTillCancel)
+        .value("FillAndKill", OrderType::FillAndKill);
+
+    py::enum_<Side>(m, "Side")
+        .value("Buy", Side::Buy)
+        .value("Sell", Side::Sell);
+
+    py::enum_<Token>(m, "Token")
+        .value("YES", Token::YES)
+        .value("NO", Token::NO);
+
+    py::enum_<MatchType>(m, "MatchType")
+        .value("Direct", MatchType::Direct)
+        .value("Mint", MatchType::Mint);
+
+    m.attr("PAIR_PRICE") = PairPrice;
+    m.attr("SNAPSHOT_VERSION") = Orderbook::SnapshotVersion;
+
+    // Packed batch records: struct formats plus numpy.dtype() specs
+    m.attr("ORDER_REQUEST_FORMAT") = "<IIBBBx";
+    m.attr("ORDER_REQUEST_DTYPE") = RecordDtype(
+        { { "price", "<u4", offsetof(OrderRequest, price_) },
+          { "quantity", "<u4", offsetof(OrderRequest, quantity_) },
+          { "order_type", "<u1", offsetof(OrderRequest, orderType_) },
+          { "side", "<u1", offsetof(OrderRequest, side_) },
+          { "token", "<u1", offsetof(OrderRequest, token_) } },
+        sizeof(OrderRequest));
+    m.attr("ID_FIELD_SIZE") = IdFieldSize;
+    m.attr("FILL_RECORD_FORMAT") = "<IIIIIIBBBx64s64s64s64s";
+    m.attr("FILL_RECORD_DTYPE") = RecordDtype(
+        { { "request_index", "<u4", offsetof(FillRecord, requestIndex_) },
+          { "taker_order_id", "<u4", offsetof(FillRecord, takerOrderId_) },
+          { "maker_order_id", "<u4", offsetof(FillRecord, makerOrderId_) },
+          { "taker_price", "<u4", offsetof(FillRecord, takerPrice_) },
+          { "maker_price", "<u4", offsetof(FillRecord, makerPrice_) },
+          { "quantity", "<u4", offsetof(FillRecord, quantity_) },
+          { "token", "<u1", offsetof(FillRecord, token_) },
+          { "side", "<u1", offsetof(FillRecord, side_) },
+          { "match_type", "<u1", offsetof(FillRecord, matchType_) },
+          { "taker_external_id", "S64", offsetof(FillRecord, takerExternalId_) },
+          { "maker_external_id", "S64", offsetof(FillRecord, makerExternalId_) },
+          { "taker_user_id", "S64", offsetof(FillRecord, takerUserId_) },
+          { "maker_user_id", "S64", offsetof(FillRecord, makerUserId_) } },
+        sizeof(FillRecord));
+    m.attr("DEPTH_RECORD_FORMAT") = "<IIIB3x";
+    m.attr("DEPTH_RECORD_DTYPE") = RecordDtype(
+        { { "price", "<u4", offsetof(DepthRecord, price_) },
+          { "quantity", "<u4", offsetof(DepthRecord, quantity_) },
+          { "order_count", "<u4", offsetof(DepthRecord, orderCount_) },
+          { "side", "<u1", offsetof(DepthRecord, side_) } },
+        sizeof(DepthRecord));
+
+    // LevelInfo
+    py::class_<LevelInfo>(m, "LevelInfo")
+        .def(py::init<Price, Quantity, std::uint32_t>(),
+             py::arg("price"), py::arg("quantity"), py::arg("order_count") = 0)
+        .def_readwrite("price", &LevelInfo::price_)
+        .def_readwrite("quantity", &LevelInfo::quantity_)
+        .def_readwrite("order_count", &LevelInfo::orderCount_);
+
+    // TopOfBook
+    py::class_<TopOfBook>(m, "TopOfBook")
+        .def_readonly("bid", &TopOfBook::bid_)
+        .def_readonly("ask", &TopOfBook::ask_);
+
+    // Quote
+    py::class_<Quote>(m, "Quote")
+        .def_readonly("quantity", &Quote::quantity_, "Quantity that would fill now")
+        .def_readonly("total_cost", &Quote::totalCost_, "Sum of price x quantity over the fills")
+        .def_readonly("worst_price", &Quote::worstPrice_, "Last (worst) price reached; 0 when nothing fills")
+        .def_property_readonly("average_price", &Quote::AveragePrice)
+        .def("__repr__", [](const Quote& quote) {
+            return "<Quote quantity=" + std::to_string(quote.quantity_) + " total_cost=" +
+                   std::to_string(quote.totalCost_) + " worst_price=" + std::to_string(quote.worstPrice_) + ">";
+        });
+
+    // OrderbookLevelInfos
+    py::class_<OrderbookLevelInfos>(m, "OrderbookLevelInfos")
+        .def(py::init<const LevelInfos&, const LevelInfos&>())
+        .def("get_asks", &OrderbookLevelInfos::GetAsks)
+        .def("get_bids", &OrderbookLevelInfos::GetBids);
+
+    // MarketView
+    py::class_<MarketView, std::shared_ptr<MarketView>>(m, "MarketView")
+        .def_readonly("sequence", &MarketView::sequence_)
+        .def_readonly("digest", &MarketView::digest_, "Changes only when the levels do; usable as an ETag")
+        .def_readonly("yes", &MarketView::yes_)
+        .def_readonly("no", &MarketView::no_)
+        .def("get", [](const MarketView& view, Token token) { return token == Token::YES ? view.yes_ : view.no_; },
+             py::arg("token"))
+        .def("__repr__", [](const MarketView& view) {
+            return "<MarketView sequence=" + std::to_string(view.sequence_) + " digest=" + std::to_string(view.digest_) + ">";
+        });
+
+    // TradeInfo
+    py::class_<TradeInfo>(m, "TradeInfo")
+        .def(py::init<OrderId, Price, Quantity>())
+        .def_readwrite("order_id", &TradeInfo::orderId_)
+        .def_readwrite("price", &TradeInfo::price_)
+        .def_readwrite("quantity", &TradeInfo::quantity_);
+
+    // Trade
+    py::class_<Trade>(m, "Trade")
+        .def(py::init<const TradeInfo&, const TradeInfo&, Token, MatchType>(),
+             py::arg("bid_trade"), py::arg("ask_trade"),
+             py::arg("token") = Token::YES, py::arg("match_type") = MatchType::Direct)
+        .def("get_bid_trade", &Trade::GetBidTrade)
+        .def("get_ask_trade", &Trade::GetAskTrade)
+        .def("get_token", &Trade::GetToken)
+        .def("get_match_type", &Trade::GetMatchType);
+
+    // AddOrderResult
+    py::class_<AddOrderResult>(m, "AddOrderResult")
+        .def_readonly("order_id", &AddOrderResult::orderId_)
+        .def_property_readonly("fills", [](AddOrderResult& result) -> FillBuffer& { return result.fills_; },
+                               py::return_value_policy::reference_internal,
+                               "Packed FILL_RECORD_DTYPE records, readable without copying")
+        .def_property_readonly("trades", &AddOrderResult::GetTrades);
+
+    // AmendResult
+    py::class_<AmendResult, AddOrderResult>(m, "AmendResult")
+        .def_readonly("previous_quantity", &AmendResult::previousQuantity_);
+
+    // Batch results, readable in place through the buffer protocol
+    py::class_<OrderIdBuffer>(m, "OrderIdBuffer", py::buffer_protocol())
+        .def_buffer([](OrderIdBuffer& ids) {
+            return py::buffer_info(const_cast<OrderId*>(ids.Data()), sizeof(OrderId),
+                                   py::format_descriptor<OrderId>::format(), 1,
+                                   { ids.Size() }, { sizeof(OrderId) }, true);
+        })
+        .def("__len__", &OrderIdBuffer::Size);
+
+    BindRecordBuffer<FillRecord>(m, "FillBuffer");
+    BindRecordBuffer<DepthRecord>(m, "DepthBuffer");
+
+    // Order
+    py::class_<OrderDetails>(m, "Order")
+        .def("get_order_id", &OrderDetails::GetOrderId)
+        .def("get_order_type", &OrderDetails::GetOrderType)
+        .def("get_side", &OrderDetails::GetSide)
+        .def("get_price", &OrderDetails::GetPrice)
+        .def("get_remaining_quantity", &OrderDetails::GetRemainingQuantity)
+        .def("get_initial_quantity", &OrderDetails::GetInitialQuantity)
+        .def("get_user_id", &OrderDetails::GetUserId)
+        .def("get_token", &OrderDetails::GetToken)
+        .def("get_external_id", &OrderDetails::GetExternalId)
+        .def("is_filled", &OrderDetails::IsFilled);
+
+    // BookStats
+    py::class_<BookStats> bookStats(m, "BookStats");
+    bookStats
+        .def_readonly("order_count", &BookStats::orderCount_, "Resting orders")
+        .def_readonly("level_count", &BookStats::levelCount_, "Occupied price levels over both tokens and sides")
+        .def_readonly("order_capacity", &BookStats::orderCapacity_, "Order slots allocated")
+        .def_readonly("memory_bytes", &BookStats::memoryBytes_, "Estimated heap bytes held by the book")
+        .def_property_readonly("bytes_per_order", &BookStats::BytesPerOrder,
+                               "memory_bytes / order_count, or 0.0 for an empty book")
+        .def("__repr__", [](const BookStats& stats) {
+            return "<BookStats order_count=" + std::to_string(stats.orderCount_) + " level_count=" +
+                   std::to_string(stats.levelCount_) + " order_capacity=" + std::to_string(stats.orderCapacity_) +
+                   " memory_bytes=" + std::to_string(stats.memoryBytes_) + ">";
+        });
+    static constexpr std::pair<const char*, std::uint64_t EngineCounters::*> CounterFields[] = {
+        { "orders_added", &EngineCounters::ordersAdded_ },
+        { "orders_cancelled", &EngineCounters::ordersCancelled_ },
+        { "orders_filled", &EngineCounters::ordersFilled_ },
+        { "orders_amended", &EngineCounters::ordersAmended_ },
+        { "fills", &EngineCounters::fills_ },
+        { "quantity_filled", &EngineCounters::quantityFilled_ },
+        { "match_calls", &EngineCounters::matchCalls_ },
+        { "levels_touched", &EngineCounters::levelsTouched_ },
+        { "max_match_length", &EngineCounters::maxMatchLength_ },
+        { "match_ns", &EngineCounters::matchNanos_ },
+        { "max_match_ns", &EngineCounters::maxMatchNanos_ },
+    };
+    for (const auto& [name, field] : CounterFields)
+        bookStats.def_property_readonly(name, [field = field](const BookStats& stats) { return stats.counters_.*field; });
+    bookStats
+        .def_readonly("timing", &BookStats::timing_, "Whether match_ns and max_match_ns are being collected")
+        .def("as_dict", [](const BookStats& stats) {
+            py::dict values;
+            values["order_count"] = stats.orderCount_;
+            values["level_count"] = stats.levelCount_;
+            values["order_capacity"] = stats.orderCapacity_;
+            values["memory_bytes"] = stats.memoryBytes_;
+            for (const auto& [name, field] : CounterFields)
+                values[name] = stats.counters_.*field;
+            values["timing"] = stats.timing_;
+            return values;
+        }, "Every figure as a flat dict, e.g. for a metrics exporter");
+
+    // Exposure
+    py::class_<TokenExposure>(m, "TokenExposure")
+        .def_readonly("buy_quantity", &TokenExposure::buyQuantity_)
+        .def_readonly("buy_notional", &TokenExposure::buyNotional_, "Sum of price x open quantity over resting buys")
+        .def_readonly("sell_quantity", &TokenExposure::sellQuantity_)
+        .def_readonly("sell_notional", &TokenExposure::sellNotional_, "Sum of price x open quantity over resting sells")
+        .def("__repr__", [](const TokenExposure& exposure) {
+            return "<TokenExposure buy_quantity=" + std::to_string(exposure.buyQuantity_) + " buy_notional=" +
+                   std::to_string(exposure.buyNotional_) + " sell_quantity=" + std::to_string(exposure.sellQuantity_) +
+                   " sell_notional=" + std::to_string(exposure.sellNotional_) + ">";
+        });
+
+    py::class_<Exposure>(m, "Exposure")
+        .def_readonly("order_count", &Exposure::orderCount_)
+        .def_readonly("yes", &Exposure::yes_)
+        .def_readonly("no", &Exposure::no_)
+        .def("get", [](const Exposure& exposure, Token token) { return token == Token::YES ? exposure.yes_ : exposure.no_; },
+             py::arg("token"), "The TokenExposure of one token")
+        .def("__repr__", [](const Exposure& exposure) {
+            return "<Exposure order_count=" + std::to_string(exposure.orderCount_) + ">";
+        });
+
+    // Orderbook - Main class. Every book has its own lock, so engine calls
+    // release the GIL and books of different markets match in parallel.
+    // Books are shared with the MarketRegistry that holds them.
+    py::class_<Orderbook, std::shared_ptr<Orderbook>>(m, "Orderbook")
+        .def(py::init<Price, Price>(), py::arg("tick_size") = 1, py::arg("pair_price") = PairPrice)
+        .def("get_tick_size", &Orderbook::GetTickSize)
+        .def("get_pair_price", &Orderbook::GetPairPrice)
+        .def("add_order", py::overload_cast<OrderType, Side, Price, Quantity, const std::string&, Token, const std::string&>(&Orderbook::AddOrder),
+             py::call_guard<py::gil_scoped_release>(),
+             py::arg("order_type"), py::arg("side"), py::arg("price"), py::arg("quantity"), py::arg("user_id"),
+             py::arg("token"), py::arg("external_id") = "",
+             "Add an order with token (and optional external id) to the orderbook; returns its engine id and trades")
+        .def("add_order", py::overload_cast<OrderType, Side, Price, Quantity, const std::string&>(&Orderbook::AddOrder),
+             py::call_guard<py::gil_scoped_release>(),
+             "Add an order to the orderbook (defaults to YES token)")
+        .def("cancel_order", py::overload_cast<OrderId>(&Orderbook::CancelOrder), py::call_guard<py::gil_scoped_release>(), py::arg("order_id"),
+             "Cancel an order by engine id; returns the open quantity taken off, 0 if it is not resting")
+        .def("cancel_order", py::overload_cast<const std::string&>(&Orderbook::CancelOrder), py::call_guard<py::gil_scoped_release>(),
+             py::arg("external_id"),
+             "Cancel an order by external id; returns the open quantity taken off, 0 if it is not resting")
+        .def("amend_order", py::overload_cast<OrderId, Price, Quantity, std::optional<Quantity>>(&Orderbook::AmendOrder),
+             py::call_guard<py::gil_scoped_release>(), py::arg("order_id"), py::arg("new_price"), py::arg("new_qty"),
+             py::arg("expected_qty") = py::none(),
+             "Change a resting order's price and open quantity (less what filled since expected_qty, if given); "
+             "returns the fills a reprice produced and the old open quantity as an AmendResult, "
+             "or None if the order is not resting")
+        .def("amend_order", py::overload_cast<const std::string&, Price, Quantity, std::optional<Quantity>>(&Orderbook::AmendOrder),
+             py::call_guard<py::gil_scoped_release>(), py::arg("external_id"), py::arg("new_price"), py::arg("new_qty"),
+             py::arg("expected_qty") = py::none(),
+             "Amend an order by external id; returns None if it is not resting")
+        .def("add_orders_batch",
+             [](Orderbook& book, py::buffer requests, const std::string& userId,
+                std::optional<std::vector<std::string>> externalIds) {
+                 auto records = CopyRecords<OrderRequest>(requests, "Order request");
+                 BatchResult result;
+                 {
+                     py::gil_scoped_release release;
+                     result = book.AddOrders(records, userId, externalIds.value_or(std::vector<std::string>{}));
+                 }
+                 return py::make_tuple(OrderIdBuffer{ std::move(result.orderIds_) },
+                                       FillBuffer{ std::move(result.fills_) });
+             },
+             py::arg("requests"), py::arg("user_id"), py::arg("external_ids") = py::none(),
+             "Add packed ORDER_REQUEST_DTYPE records for one user without holding the GIL; "
+             "returns (order_ids, fills) buffers")
+        .def("cancel_orders_batch",
+             [](Orderbook& book, py::buffer orderIds) {
+                 auto ids = CopyRecords<OrderId>(orderIds, "Order id");
+                 py::gil_scoped_release release;
+                 return book.CancelOrders(ids);
+             },
+             py::arg("order_ids"),
+             "Cancel a buffer of uint32 engine ids; returns how many were resting")
+        .def("cancel_orders_batch",
+             [](Orderbook& book, const std::vector<std::string>& externalIds) {
+                 py::gil_scoped_release release;
+                 return book.CancelOrders(externalIds);
+             },
+             py::arg("external_ids"),
+             "Cancel a list of external ids; returns how many were resting")
+        .def("cancel_all", &Orderbook::CancelAll, py::call_guard<py::gil_scoped_release>(),
+             "Cancel every resting order; returns how many there were")
+        .def("cancel_all_for_user", &Orderbook::CancelAllForUser, py::call_guard<py::gil_scoped_release>(),
+             py::arg("user_id"), "Cancel every resting order of one user; returns the cancelled orders, oldest first")
+        .def("orders_for_user", &Orderbook::GetUserOrders, py::call_guard<py::gil_scoped_release>(),
+             py::arg("user_id"), "Copies of one user's resting orders, oldest first")
+        .def("all_orders", &Orderbook::GetAllOrders, py::call_guard<py::gil_scoped_release>(),
+             "Copies of every resting order, oldest first")
+        .def("open_exposure", &Orderbook::GetExposure, py::call_guard<py::gil_scoped_release>(),
+             py::arg("user_id"), "Open quantity and notional one user's resting orders commit, per token and side")
+        .def("get_order", py::overload_cast<OrderId>(&Orderbook::GetOrder, py::const_), py::call_guard<py::gil_scoped_release>(),
+             py::arg("order_id"),
+             "Look up a resting order by engine id (None if not resting)")
+        .def("get_order", py::overload_cast<const std::string&>(&Orderbook::GetOrder, py::const_), py::call_guard<py::gil_scoped_release>(),
+             py::arg("external_id"),
+             "Look up a resting order by external id (None if not resting)")
+        .def("size", &Orderbook::Size, py::call_guard<py::gil_scoped_release>(), "Get number of orders")
+        .def("stats", &Orderbook::GetStats, py::call_guard<py::gil_scoped_release>(),
+             "Order and level counts, allocated order slots, estimated memory and engine counters")
+        .def("reset_stats", &Orderbook::ResetCounters, py::call_guard<py::gil_scoped_release>(),
+             "Zero the engine counters (orders added, fills, match timings, ...)")
+        .def("enable_timing", &Orderbook::EnableTiming, py::call_guard<py::gil_scoped_release>(),
+             py::arg("enabled") = true, "Collect match_ns and max_match_ns (two clock reads per match)")
+        .def("reserve", &Orderbook::Reserve, py::call_guard<py::gil_scoped_release>(), py::arg("count"),
+             "Pre-size order storage for `count` resting orders")
+        .def("get_order_infos", &Orderbook::GetOrderInfos, py::call_guard<py::gil_scoped_release>(), py::arg("token") = Token::YES,
+             "Get market data for one token's book")
+        .def("get_depth", &Orderbook::GetDepth, py::call_guard<py::gil_scoped_release>(), py::arg("token"), py::arg("levels"),
+             "Get the top N price levels of each side for one token")
+        .def("get_depth_records",
+             [](const Orderbook& book, Token token, std::size_t levels) {
+                 return DepthBuffer{ book.GetDepthRecords(token, levels) };
+             },
+             py::call_guard<py::gil_scoped_release>(), py::arg("token"), py::arg("levels"),
+             "Get the top N levels of each side as packed DEPTH_RECORD_DTYPE records")
+        .def("sequence", &Orderbook::Sequence, py::call_guard<py::gil_scoped_release>(),
+             "Number that changes whenever the resting orders do")
+        .def("market_view", &Orderbook::GetMarketView, py::call_guard<py::gil_scoped_release>(),
+             "Full depth of both tokens with its sequence number and digest, cached until the next change")
+        .def("get_bbo", &Orderbook::GetBbo, py::call_guard<py::gil_scoped_release>(), py::arg("token"),
+             "Get best bid and ask (None when a side is empty) for one token")
+        .def("quote", &Orderbook::GetQuote, py::call_guard<py::gil_scoped_release>(), py::arg("side"), py::arg("token"),
+             py::arg("quantity"), py::arg("limit_price") = py::none(),
+             "Price an incoming order without changing the book: fillable quantity, total cost, "
+             "average and worst price")
+        .def("snapshot", &SnapshotBytes,
+             "Serialize the resting orders, in priority order, to versioned binary snapshot bytes")
+        .def_static("restore", &RestoreFromBuffer, py::arg("data"),
+                    "Build a book from snapshot() output held in any buffer (bytes, mmap, memoryview)")
+        .def(py::pickle(&SnapshotBytes,
+                        [](const py::bytes& data) { return RestoreFromBuffer(data); }))
+        .def("open_journal", &Orderbook::OpenJournal, py::call_guard<py::gil_scoped_release>(), py::arg("path"),
+             "Start journaling adds, cancels and fills to a new memory-mapped file")
+        .def("close_journal", &Orderbook::CloseJournal, py::call_guard<py::gil_scoped_release>())
+        .def("sync_journal", &Orderbook::SyncJournal, py::call_guard<py::gil_scoped_release>(),
+             "Flush journaled events to disk")
+        .def("journal_sequence", &Orderbook::JournalSequence, py::call_guard<py::gil_scoped_release>(),
+             "Sequence number of the last journaled record (0 when not journaling)")
+        .def_static("replay",
+                    [](const std::string& path, bool resume) {
+                        return std::shared_ptr<Orderbook>{ Orderbook::Replay(path, resume) };
+                    },
+                    py::call_guard<py::gil_scoped_release>(), py::arg("path"), py::arg("resume") = false,
+                    "Rebuild a book from a journal; with resume=True it keeps journaling to the same file")
+        .def("check_invariants", &Orderbook::CheckInvariants, py::call_guard<py::gil_scoped_release>(),
+             "Verify queues, level totals and indexes; raises RuntimeError on corruption");
+
+    // MarketRegistry - every loaded market's book behind one handle
+    py::class_<MarketRegistry>(m, "MarketRegistry")
+        .def(py::init<>())
+        .def("create", &MarketRegistry::Create, py::call_guard<py::gil_scoped_release>(),
+             py::arg("market_id"), py::arg("tick_size") = 1, py::arg("pair_price") = PairPrice,
+             "Create and register an empty book; raises ValueError if the market already has one")
+        .def("add", &MarketRegistry::Add, py::call_guard<py::gil_scoped_release>(), py::arg("market_id"), py::arg("book"),
+             "Register an existing book (restored or replayed); raises ValueError if the market already has one")
+        .def("get", &MarketRegistry::Get, py::call_guard<py::gil_scoped_release>(), py::arg("market_id"),
+             "The market's book, or None")
+        .def("drop", &MarketRegistry::Drop, py::call_guard<py::gil_scoped_release>(), py::arg("market_id"),
+             "Remove a market's book and close its journal; returns False if it had none")
+        .def("items", &MarketRegistry::Books, py::call_guard<py::gil_scoped_release>(),
+             "List of (market_id, book) pairs, sorted by market id")
+        .def("market_ids",
+             [](const MarketRegistry& registry) {
+                 std::vector<std::string> marketIds;
+                 for (auto& [marketId, book] : registry.Books())
+                     marketIds.push_back(marketId);
+                 return marketIds;
+             },
+             py::call_guard<py::gil_scoped_release>(), "Sorted ids of the markets with a book")
+        .def("cancel_all", &MarketRegistry::CancelAll, py::call_guard<py::gil_scoped_release>(), py::arg("market_id"),
+             "Cancel every resting order in one market; returns how many there were")
+        .def("cancel_all_for_user",
+             [](MarketRegistry& registry, const std::string& userId) {
+                 std::vector<std::pair<std::string, std::vector<OrderDetails>>> cancelled;
+                 {
+                     py::gil_scoped_release release;
+                     cancelled = registry.CancelAllForUser(userId);
+                 }
+                 return OrdersByMarket(cancelled);
+             },
+             py::arg("user_id"),
+             "Cancel a user's resting orders in every market; returns {market_id: [orders]} for markets that had any")
+        .def("orders_for_user",
+             [](const MarketRegistry& registry, const std::string& userId) {
+                 std::vector<std::pair<std::string, std::vector<OrderDetails>>> orders;
+                 {
+                     py::gil_scoped_release release;
+                     orders = registry.GetUserOrders(userId);
+                 }
+                 return OrdersByMarket(orders);
+             },
+             py::arg("user_id"), "A user's resting orders as {market_id: [orders]}, oldest first")
+        .def("stats", &MarketRegistry::GetStats, py::call_guard<py::gil_scoped_release>(), py::arg("market_id"),
+             "BookStats of one market's book, or None")
+        .def("all_stats",
+             [](const MarketRegistry& registry) {
+                 std::vector<std::pair<std::string, BookStats>> stats;
+                 {
+                     py::gil_scoped_release release;
+                     stats = registry.GetAllStats();
+                 }
+                 py::dict byMarket;
+                 for (const auto& [marketId, bookStats] : stats)
+                     byMarket[py::str(marketId)] = bookStats;
+                 return byMarket;
+             },
+             "{market_id: BookStats} for every book")
+        .def("reset_stats", &MarketRegistry::ResetCounters, py::call_guard<py::gil_scoped_release>(),
+             "Zero the engine counters of every book")
+        .def("enable_timing", &MarketRegistry::EnableTiming, py::call_guard<py::gil_scoped_release>(),
+             py::arg("enabled") = true, "Turn match timing on or off for every book, including books added later")
+        .def("user_count", [](const MarketRegistry& registry) { return registry.Users().Size(); },
+             "Distinct user ids interned across all books")
+        .def("user_table_bytes", [](const MarketRegistry& registry) { return registry.Users().MemoryBytes(); },
+             "Estimated heap bytes held by the shared user id table")
+        .def("__len__", &MarketRegistry::Size)
+        .def("__contains__", &MarketRegistry::Contains, py::arg("market_id"));
+}
+#endif
@@ -0,0 +1,1458 @@
+"""Pure-Python orderbook engine with the same interface as orderbook_cpp.
+
+Used where the compiled extension is not available (only a Windows build
+is shipped). Books are interchangeable with orderbook_cpp: they assign the
+same engine ids, produce the same fills, and read and write the same
+snapshot and journal bytes. conformance.py runs one suite against both.
+
+Each side of a token's book is an array of price levels indexed by tick,
+with a bytearray of occupied ticks so finding the next level is a C-speed
+scan. A level queues its orders in a deque. Cancelled orders stay in the
+deque, marked dead, until they reach the head; a level compacts its deque
+once dead entries outnumber live ones.
+"""
+import array
+import enum
+import os
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+
+class OrderType(enum.IntEnum):
+    GoodTillCancel = 0
+    FillAndKill = 1
+
+
+class Side(enum.IntEnum):
+    Buy = 0
+    Sell = 1
+
+
+class Token(enum.IntEnum):
+    YES = 0
+    NO = 1
+
+
+class MatchType(enum.IntEnum):
+    Direct = 0
+    Mint = 1
+
+
+PAIR_PRICE = 100
+SNAPSHOT_VERSION = 1
+
+# Packed batch records: struct formats plus numpy.dtype() specs
+ORDER_REQUEST_FORMAT = "<IIBBBx"
+ORDER_REQUEST_DTYPE = {
+    'names': ['price', 'quantity', 'order_type', 'side', 'token'],
+    'formats': ['<u4', '<u4', '<u1', '<u1', '<u1'],
+    'offsets': [0, 4, 8, 9, 10],
+    'itemsize': 12,
+}
+ID_FIELD_SIZE = 64
+FILL_RECORD_FORMAT = "<IIIIIIBBBx64s64s64s64s"
+FILL_RECORD_DTYPE = {
+    'names': ['request_index', 'taker_order_id', 'maker_order_id', 'taker_price', 'maker_price', 'quantity',
+              'token', 'side', 'match_type', 'taker_external_id', 'maker_external_id', 'taker_user_id',
+              'maker_user_id'],
+    'formats': ['<u4', '<u4', '<u4', '<u4', '<u4', '<u4', '<u1', '<u1', '<u1', 'S64', 'S64', 'S64', 'S64'],
+    'offsets': [0, 4, 8, 12, 16, 20, 24, 25, 26, 28, 92, 156, 220],
+    'itemsize': 284,
+}
+DEPTH_RECORD_FORMAT = "<IIIB3x"
+DEPTH_RECORD_DTYPE = {
+    'names': ['price', 'quantity', 'order_count', 'side'],
+    'formats': ['<u4', '<u4', '<u4', '<u1'],
+    'offsets': [0, 4, 8, 12],
+    'itemsize': 16,
+}
+
+_ORDER_REQUEST = struct.Struct(ORDER_REQUEST_FORMAT)
+_FILL_RECORD = struct.Struct(FILL_RECORD_FORMAT)
+_DEPTH_RECORD = struct.Struct(DEPTH_RECORD_FORMAT)
+_U32_MAX = 0xFFFFFFFF
+
+# Snapshot format (see Orderbook::Snapshot in orderbook_bindings.cpp)
+_SNAPSHOT_MAGIC = 0x4E53424F  # "OBSN"
+_SNAPSHOT_HEADER = struct.Struct("<IHHIIII")
+_SNAPSHOT_ORDER = struct.Struct("<IBBBBIII")
+_STRING_LENGTH = struct.Struct("<H")
+
+# Journal format (see the Journal comment in orderbook_bindings.cpp)
+_JOURNAL_MAGIC = 0x4C4A424F  # "OBJL"
+_JOURNAL_VERSION = 1
+_JOURNAL_FILE_HEADER = struct.Struct("<IHxx")
+_JOURNAL_RECORD_HEADER = struct.Struct("<IIQB7x")
+_JOURNAL_SNAPSHOT, _JOURNAL_ADD, _JOURNAL_CANCEL, _JOURNAL_FILL, _JOURNAL_AMEND = 1, 2, 3, 4, 5
+_JOURNAL_ADD_FIELDS = struct.Struct("<IBBBBII")
+_JOURNAL_FILL_FIELDS = struct.Struct("<IIIIIB3x")
+_JOURNAL_AMEND_FIELDS = struct.Struct("<III")
+_U32 = struct.Struct("<I")
+
+
+def _check_u32(*values):
+    for value in values:
+        if not isinstance(value, int) or not 0 <= value <= _U32_MAX:
+            raise TypeError(f"Expected an unsigned 32-bit integer, got {value!r}")
+
+
+def _copy_records(source, record_size, what):
+    """Bytes of a C-contiguous buffer holding whole records (or raw bytes)."""
+    view = memoryview(source)
+    if not view.c_contiguous:
+        raise BufferError("Buffer is not C-contiguous")
+    if view.itemsize not in (1, record_size) or view.nbytes % record_size:
+        raise ValueError(f"{what} buffer must hold packed {record_size}-byte records")
+    return view.tobytes()
+
+
+def _pack_string(value):
+    data = value.encode()
+    return _STRING_LENGTH.pack(len(data)) + data
+
+
+class _Reader:
+    """Little-endian field reader over snapshot and journal payloads."""
+
+    __slots__ = ('data', 'offset')
+
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+
+    def take(self, codec):
+        if len(self.data) - self.offset < codec.size:
+            raise ValueError("Snapshot is truncated")
+        values = codec.unpack_from(self.data, self.offset)
+        self.offset += codec.size
+        return values
+
+    def string(self):
+        (length,) = self.take(_STRING_LENGTH)
+        if len(self.data) - self.offset < length:
+            raise ValueError("Snapshot is truncated")
+        value = bytes(self.data[self.offset:self.offset + length]).decode()
+        self.offset += length
+        return value
+
+    def at_end(self):
+        return self.offset == len(self.data)
+
+
+class LevelInfo:
+    __slots__ = ('price', 'quantity', 'order_count')
+
+    def __init__(self, price, quantity, order_count=0):
+        self.price = price
+        self.quantity = quantity
+        self.order_count = order_count
+
+
+class TopOfBook:
+    """Best bid and best ask of one token's book; either may be None."""
+
+    __slots__ = ('bid', 'ask')
+
+    def __init__(self, bid=None, ask=None):
+        self.bid = bid
+        self.ask = ask
+
+
+class Quote:
+    """What an order would trade against if it arrived now."""
+
+    __slots__ = ('quantity', 'total_cost', 'worst_price')
+
+    def __init__(self, quantity=0, total_cost=0, worst_price=0):
+        self.quantity = quantity
+        self.total_cost = total_cost
+        self.worst_price = worst_price
+
+    @property
+    def average_price(self):
+        return self.total_cost / self.quantity if self.quantity else 0.0
+
+    def __repr__(self):
+        return f"<Quote quantity={self.quantity} total_cost={self.total_cost} worst_price={self.worst_price}>"
+
+
+# Engine counters, in BookStats.as_dict() order; see EngineCounters in orderbook_bindings.cpp
+_COUNTERS = ('orders_added', 'orders_cancelled', 'orders_filled', 'orders_amended', 'fills', 'quantity_filled',
+             'match_calls', 'levels_touched', 'max_match_length', 'match_ns', 'max_match_ns')
+
+
+class BookStats:
+    """Size of one book, where memory_bytes estimates the objects the book
+    holds, plus its engine counters and whether match timing is on."""
+
+    __slots__ = ('order_count', 'level_count', 'order_capacity', 'memory_bytes') + _COUNTERS + ('timing',)
+
+    def __init__(self, order_count=0, level_count=0, order_capacity=0, memory_bytes=0, counters=None, timing=False):
+        self.order_count = order_count
+        self.level_count = level_count
+        self.order_capacity = order_capacity
+        self.memory_bytes = memory_bytes
+        for name in _COUNTERS:
+            setattr(self, name, counters[name] if counters else 0)
+        self.timing = timing
+
+    def as_dict(self):
+        """Every figure as a flat dict, e.g. for a metrics exporter"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @property
+    def bytes_per_order(self):
+        """memory_bytes / order_count, or 0.0 for an empty book"""
+        return self.memory_bytes / self.order_count if self.order_count else 0.0
+
+    def __repr__(self):
+        return (f"<BookStats order_count={self.order_count} level_count={self.level_count} "
+                f"order_capacity={self.order_capacity} memory_bytes={self.memory_bytes}>")
+
+
+class TokenExposure:
+    """What a user's resting orders in one token commit, per side."""
+
+    __slots__ = ('buy_quantity', 'buy_notional', 'sell_quantity', 'sell_notional')
+
+    def __init__(self):
+        self.buy_quantity = 0
+        self.buy_notional = 0
+        self.sell_quantity = 0
+        self.sell_notional = 0
+
+    def __repr__(self):
+        return (f"<TokenExposure buy_quantity={self.buy_quantity} buy_notional={self.buy_notional} "
+                f"sell_quantity={self.sell_quantity} sell_notional={self.sell_notional}>")
+
+
+class Exposure:
+    __slots__ = ('order_count', 'yes', 'no')
+
+    def __init__(self):
+        self.order_count = 0
+        self.yes = TokenExposure()
+        self.no = TokenExposure()
+
+    def get(self, token):
+        """The TokenExposure of one token"""
+        return self.yes if token == Token.YES else self.no
+
+    def __repr__(self):
+        return f"<Exposure order_count={self.order_count}>"
+
+
+class OrderbookLevelInfos:
+    __slots__ = ('_bids', '_asks')
+
+    def __init__(self, bids, asks):
+        self._bids = list(bids)
+        self._asks = list(asks)
+
+    def get_asks(self):
+        return list(self._asks)
+
+    def get_bids(self):
+        return list(self._bids)
+
+
+class MarketView:
+    """Full depth of both tokens as of one book sequence number, plus a
+    digest of the levels that only changes when they do (e.g. for an ETag)."""
+
+    __slots__ = ('sequence', 'digest', 'yes', 'no')
+
+    def __init__(self, sequence, yes, no):
+        self.sequence = sequence
+        self.yes = yes
+        self.no = no
+        # FNV-1a over the level count and (price, quantity, order count) of
+        # every level, YES then NO, bids then asks
+        digest = 0xcbf29ce484222325
+        for depth in (yes, no):
+            for levels in (depth._bids, depth._asks):
+                for value in (len(levels),) + tuple(value for level in levels
+                                                    for value in (level.price, level.quantity, level.order_count)):
+                    digest = ((digest ^ value) * 0x100000001b3) & 0xFFFFFFFFFFFFFFFF
+        self.digest = digest
+
+    def get(self, token):
+        return self.yes if token == Token.YES else self.no
+
+    def __repr__(self):
+        return f"<MarketView sequence={self.sequence} digest={self.digest}>"
+
+
+class TradeInfo:
+    __slots__ = ('order_id', 'price', 'quantity')
+
+    def __init__(self, order_id, price, quantity):
+        self.order_id = order_id
+        self.price = price
+        self.quantity = quantity
+
+
+class Trade:
+    """For direct trades the bid/ask infos are the buyer and seller of the
+    token; for mints they are the YES buyer and the NO buyer."""
+
+    __slots__ = ('_bid_trade', '_ask_trade', '_token', '_match_type')
+
+    def __init__(self, bid_trade, ask_trade, token=Token.YES, match_type=MatchType.Direct):
+        self._bid_trade = bid_trade
+        self._ask_trade = ask_trade
+        self._token = token
+        self._match_type = match_type
+
+    def get_bid_trade(self):
+        return self._bid_trade
+
+    def get_ask_trade(self):
+        return self._ask_trade
+
+    def get_token(self):
+        return self._token
+
+    def get_match_type(self):
+        return self._match_type
+
+
+def _to_trade(fill):
+    """The bid/ask view of an unpacked fill record."""
+    _, taker_id, maker_id, taker_price, maker_price, quantity, token, side, match_type = fill[:9]
+    taker = TradeInfo(taker_id, taker_price, quantity)
+    maker = TradeInfo(maker_id, maker_price, quantity)
+    if match_type == MatchType.Mint:
+        if token == Token.YES:
+            return Trade(taker, maker, Token.YES, MatchType.Mint)
+        return Trade(maker, taker, Token.YES, MatchType.Mint)
+    if side == Side.Buy:
+        return Trade(taker, maker, Token(token), MatchType.Direct)
+    return Trade(maker, taker, Token(token), MatchType.Direct)
+
+
+class OrderIdBuffer(array.array):
+    """Engine ids of a batch, readable through the buffer protocol (format "I")."""
+
+    def __new__(cls, ids=()):
+        return super().__new__(cls, 'I', ids)
+
+
+class FillBuffer(bytes):
+    """Packed FILL_RECORD_DTYPE records; len() counts records, as in orderbook_cpp."""
+
+    def __len__(self):
+        return super().__len__() // _FILL_RECORD.size
+
+
+class DepthBuffer(bytes):
+    """Packed DEPTH_RECORD_DTYPE records; len() counts records."""
+
+    def __len__(self):
+        return super().__len__() // _DEPTH_RECORD.size
+
+
+class AddOrderResult:
+    __slots__ = ('order_id', 'fills')
+
+    def __init__(self, order_id, fills):
+        self.order_id = order_id
+        self.fills = fills
+
+    @property
+    def trades(self):
+        return [_to_trade(fill) for fill in _FILL_RECORD.iter_unpack(self.fills)]
+
+
+class AmendResult(AddOrderResult):
+    __slots__ = ('previous_quantity',)
+
+    def __init__(self, order_id, fills, previous_quantity):
+        super().__init__(order_id, fills)
+        self.previous_quantity = previous_quantity
+
+
+class Order:
+    __slots__ = ('_order_type', '_order_id', '_side', '_price', '_initial_quantity', '_remaining_quantity',
+                 '_user_id', '_token', '_external_id', '_resting')
+
+    def __init__(self, order_type, order_id, side, price, quantity, user_id, token=Token.YES, external_id=""):
+        self._order_type = order_type
+        self._order_id = order_id
+        self._side = side
+        self._price = price
+        self._initial_quantity = quantity
+        self._remaining_quantity = quantity
+        self._user_id = user_id
+        self._token = token
+        self._external_id = external_id
+        # False once the order leaves its level's queue (see _Level)
+        self._resting = False
+
+    def _copy(self):
+        order = Order(self._order_type, self._order_id, self._side, self._price, self._initial_quantity,
+                      self._user_id, self._token, self._external_id)
+        order._remaining_quantity = self._remaining_quantity
+        return order
+
+    def get_order_id(self):
+        return self._order_id
+
+    def get_order_type(self):
+        return self._order_type
+
+    def get_side(self):
+        return self._side
+
+    def get_price(self):
+        return self._price
+
+    def get_remaining_quantity(self):
+        return self._remaining_quantity
+
+    def get_initial_quantity(self):
+        return self._initial_quantity
+
+    def get_user_id(self):
+        return self._user_id
+
+    def get_token(self):
+        return self._token
+
+    def get_external_id(self):
+        return self._external_id
+
+    def is_filled(self):
+        return self._remaining_quantity == 0
+
+
+class _Level:
+    """A price level's FIFO queue plus running totals of its live orders."""
+
+    __slots__ = ('orders', 'quantity', 'order_count')
+
+    def __init__(self):
+        self.orders = deque()
+        self.quantity = 0
+        self.order_count = 0
+
+    def head(self):
+        orders = self.orders
+        while not orders[0]._resting:
+            orders.popleft()
+        return orders[0]
+
+    def live_orders(self):
+        return (order for order in self.orders if order._resting)
+
+    def push(self, order):
+        order._resting = True
+        self.orders.append(order)
+        self.quantity += order._remaining_quantity
+        self.order_count += 1
+
+    def erase(self, order):
+        order._resting = False
+        self.quantity -= order._remaining_quantity
+        self.order_count -= 1
+        if not self.order_count:
+            self.orders.clear()
+        elif len(self.orders) > 2 * self.order_count + 16:
+            self.orders = deque(self.live_orders())
+
+
+class _Ladder:
+    """One side of one token's book: levels indexed by tick."""
+
+    __slots__ = ('side', 'tick_size', 'levels', 'occupied', 'best', 'level_count')
+
+    def __init__(self, side, tick_size, pair_price):
+        count = pair_price // tick_size + 1
+        self.side = side
+        self.tick_size = tick_size
+        self.levels = [_Level() for _ in range(count)]
+        self.occupied = bytearray(count)
+        self.best = None
+        self.level_count = 0
+
+    def next_tick(self, tick):
+        """The next non-empty level after `tick`, moving away from the best price."""
+        if self.side == Side.Buy:
+            found = self.occupied.rfind(1, 0, tick)
+        else:
+            found = self.occupied.find(1, tick + 1)
+        return None if found < 0 else found
+
+    def ticks(self):
+        tick = self.best
+        while tick is not None:
+            yield tick
+            tick = self.next_tick(tick)
+
+    def level(self, price):
+        return self.levels[price // self.tick_size]
+
+    def push(self, order):
+        tick = order._price // self.tick_size
+        level = self.levels[tick]
+        if not level.order_count:
+            self.occupied[tick] = 1
+            self.level_count += 1
+            if self.best is None or (tick > self.best if self.side == Side.Buy else tick < self.best):
+                self.best = tick
+        level.push(order)
+
+    def erase(self, order):
+        tick = order._price // self.tick_size
+        level = self.levels[tick]
+        level.erase(order)
+        if not level.order_count:
+            self.occupied[tick] = 0
+            self.level_count -= 1
+            if tick == self.best:
+                self.best = self.next_tick(tick)
+
+
+def _journal_checksum(sequence, record_type, payload):
+    """FNV-1a over the sequence number, record type and payload."""
+    checksum = 2166136261
+    for byte in struct.pack("<QB", sequence, record_type):
+        checksum = ((checksum ^ byte) * 16777619) & 0xFFFFFFFF
+    for byte in payload:
+        checksum = ((checksum ^ byte) * 16777619) & 0xFFFFFFFF
+    return checksum
+
+
+class _Journal:
+    """Appends records to a journal file. Each record goes out in one write,
+    so, like orderbook_cpp's mapped journal, it survives a process crash."""
+
+    def __init__(self, path, end=None, sequence=0):
+        try:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        except OSError as e:
+            raise RuntimeError(f"Cannot open {path}: {e.strerror}") from None
+        if end is None:
+            if os.fstat(self.fd).st_size != 0:
+                os.close(self.fd)
+                raise ValueError(f"Journal {path} already has events; resume it with Orderbook.replay")
+            self._write(_JOURNAL_FILE_HEADER.pack(_JOURNAL_MAGIC, _JOURNAL_VERSION))
+        else:
+            os.ftruncate(self.fd, end)
+            os.lseek(self.fd, end, os.SEEK_SET)
+        self.sequence = sequence
+
+    def commit(self, record_type, payload):
+        sequence = self.sequence + 1
+        header = _JOURNAL_RECORD_HEADER.pack(len(payload), _journal_checksum(sequence, record_type, payload),
+                                             sequence, record_type)
+        self._write(header + payload)
+        self.sequence = sequence
+
+    def sync(self):
+        os.fsync(self.fd)
+
+    def close(self):
+        os.close(self.fd)
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+
+def _read_journal(path):
+    """Yields (sequence, type, payload, end offset) for each valid record."""
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except OSError as e:
+        raise RuntimeError(f"Cannot open {path}: {e.strerror}") from None
+    magic, version = (_JOURNAL_FILE_HEADER.unpack_from(data) if len(data) >= _JOURNAL_FILE_HEADER.size
+                      else (0, 0))
+    if magic != _JOURNAL_MAGIC:
+        raise ValueError(f"Not an orderbook journal: {path}")
+    if version != _JOURNAL_VERSION:
+        raise ValueError(f"Unsupported journal version {version}")
+    offset, sequence = _JOURNAL_FILE_HEADER.size, 0
+    header_size = _JOURNAL_RECORD_HEADER.size
+    # Reading stops at the end of the data or at the first torn record
+    while len(data) - offset >= header_size:
+        length, checksum, record_sequence, record_type = _JOURNAL_RECORD_HEADER.unpack_from(data, offset)
+        if record_sequence != sequence + 1 or length > len(data) - offset - header_size:
+            break
+        payload = data[offset + header_size:offset + header_size + length]
+        if _journal_checksum(record_sequence, record_type, payload) != checksum:
+            break
+        offset += header_size + length
+        sequence = record_sequence
+        yield sequence, record_type, payload, offset
+
+
+def _restore(data):
+    return Orderbook.restore(data)
+
+
+class _UserTable:
+    """Interns user ids, so every resting order of a user, in every book of
+    a registry, holds the same string object. (orderbook_cpp stores a dense
+    handle per order instead.)"""
+
+    def __init__(self):
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def intern(self, user_id):
+        name = self._names.get(user_id)
+        if name is None:
+            with self._lock:
+                name = self._names.setdefault(user_id, user_id)
+        return name
+
+    def memory_bytes(self):
+        with self._lock:
+            return sys.getsizeof(self._names) + sum(sys.getsizeof(name) for name in self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+
+class Orderbook:
+    """Order book of one binary market. Public methods take the book's lock,
+    so books can be shared between threads."""
+
+    def __init__(self, tick_size=1, pair_price=PAIR_PRICE):
+        _check_u32(tick_size, pair_price)
+        if tick_size == 0 or pair_price % tick_size or pair_price < 2 * tick_size:
+            raise ValueError("Pair price must be a multiple of a non-zero tick size, at least two ticks")
+        self._tick_size = tick_size
+        self._pair_price = pair_price
+        # Indexed [token][side]
+        self._books = tuple((_Ladder(Side.Buy, tick_size, pair_price), _Ladder(Side.Sell, tick_size, pair_price))
+                            for _ in Token)
+        self._orders = {}
+        self._external_ids = {}
+        # Each user's resting orders, so per-user queries cost O(that user's orders)
+        self._users = {}
+        # Shared with the other books once the book joins a MarketRegistry
+        self._user_table = _UserTable()
+        self._next_order_id = 1
+        # Bumped by every add, cancel and amend that changes the resting orders
+        self._sequence = 0
+        self._view = None
+        self._counters = dict.fromkeys(_COUNTERS, 0)
+        self._timing = False
+        self._journal = None
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        return _restore, (self.snapshot(),)
+
+    def get_tick_size(self):
+        return self._tick_size
+
+    def get_pair_price(self):
+        return self._pair_price
+
+    def add_order(self, order_type, side, price, quantity, user_id, token=Token.YES, external_id=""):
+        """Add an order (and optional external id); returns its engine id and fills"""
+        _check_u32(price, quantity)
+        order_type, side, token = OrderType(order_type), Side(side), Token(token)
+        self._validate_price(price)
+        self._validate_ids(user_id, external_id)
+        with self._lock:
+            if external_id and external_id in self._external_ids:
+                raise ValueError(f"Duplicate external order id {external_id}")
+            fills = bytearray()
+            order_id = self._add_order(order_type, side, price, quantity, user_id, token, external_id, 0, fills)
+            return AddOrderResult(order_id, FillBuffer(fills))
+
+    def add_orders_batch(self, requests, user_id, external_ids=None):
+        """Add packed ORDER_REQUEST_DTYPE records for one user; returns (order_ids, fills).
+        The whole batch is validated before anything is applied."""
+        data = _copy_records(requests, _ORDER_REQUEST.size, "Order request")
+        parsed = list(_ORDER_REQUEST.iter_unpack(data))
+        external_ids = list(external_ids or ())
+        if external_ids and len(external_ids) != len(parsed):
+            raise ValueError("Expected one external id per order request")
+        for index, request in enumerate(parsed):
+            self._validate_request(request, index)
+        self._validate_ids(user_id, "")
+        for external_id in external_ids:
+            self._validate_ids("", external_id)
+
+        with self._lock:
+            seen = set()
+            for external_id in external_ids:
+                if external_id and (external_id in self._external_ids or external_id in seen):
+                    raise ValueError(f"Duplicate external order id {external_id}")
+                seen.add(external_id)
+
+            order_ids, fills = OrderIdBuffer(), bytearray()
+            for index, (price, quantity, order_type, side, token) in enumerate(parsed):
+                order_ids.append(self._add_order(OrderType(order_type), Side(side), price, quantity, user_id,
+                                                 Token(token), external_ids[index] if external_ids else "",
+                                                 index, fills))
+            return order_ids, FillBuffer(fills)
+
+    def cancel_order(self, order_id):
+        """Cancel an order by engine or external id; returns the open quantity
+        taken off, 0 if it is not resting"""
+        with self._lock:
+            order = self._find(order_id)
+            remaining = order._remaining_quantity if order is not None else 0
+            self._cancel(order)
+            return remaining
+
+    def cancel_orders_batch(self, order_ids):
+        """Cancel a buffer of uint32 engine ids or a list of external ids; returns how many were resting"""
+        try:
+            data = _copy_records(order_ids, _U32.size, "Order id")
+            keys = [order_id for (order_id,) in _U32.iter_unpack(data)]
+        except TypeError:
+            keys = list(order_ids)
+            if not all(isinstance(key, str) for key in keys):
+                raise TypeError("Expected a buffer of uint32 engine ids or a list of external ids") from None
+        with self._lock:
+            return sum(self._cancel(self._find(key)) for key in keys)
+
+    def cancel_all(self):
+        """Cancel every resting order, in snapshot order; returns how many there were"""
+        with self._lock:
+            orders = list(self._resting_orders())
+            for order in orders:
+                self._cancel(order)
+            return len(orders)
+
+    def cancel_all_for_user(self, user_id):
+        """Cancel every resting order of one user; returns the cancelled orders, oldest first"""
+        with self._lock:
+            orders = self._user_orders(user_id)
+            cancelled = [order._copy() for order in orders]
+            for order in orders:
+                self._cancel(order)
+            return cancelled
+
+    def orders_for_user(self, user_id):
+        """Copies of one user's resting orders, oldest first"""
+        with self._lock:
+            return [order._copy() for order in self._user_orders(user_id)]
+
+    def all_orders(self):
+        """Copies of every resting order, oldest first"""
+        with self._lock:
+            return [order._copy() for order in sorted(self._orders.values(), key=lambda order: order._order_id)]
+
+    def open_exposure(self, user_id):
+        """Open quantity and notional one user's resting orders commit, per token and side"""
+        with self._lock:
+            exposure = Exposure()
+            orders = self._users.get(user_id, {})
+            exposure.order_count = len(orders)
+            for order in orders.values():
+                token = exposure.get(order._token)
+                if order._side == Side.Buy:
+                    token.buy_quantity += order._remaining_quantity
+                    token.buy_notional += order._price * order._remaining_quantity
+                else:
+                    token.sell_quantity += order._remaining_quantity
+                    token.sell_notional += order._price * order._remaining_quantity
+            return exposure
+
+    def amend_order(self, order_id, new_price, new_qty, expected_qty=None):
+        """Change a resting order's price and open quantity; returns the fills a
+        reprice produced and the old open quantity as an AmendResult, or None
+        if it is not resting. Shrinking at the same price keeps the order's
+        place in the queue. expected_qty is the open quantity the caller last
+        saw: what filled since then is taken off new_qty under the same lock."""
+        _check_u32(new_price, new_qty)
+        if expected_qty is not None:
+            _check_u32(expected_qty)
+        self._validate_price(new_price)
+        with self._lock:
+            order = self._find(order_id)
+            if order is None:
+                return None
+            remaining = order._remaining_quantity
+            if expected_qty is not None and expected_qty > remaining:
+                filled_since = expected_qty - remaining
+                if new_qty <= filled_since:
+                    raise ValueError("The order filled past the amended quantity")
+                new_qty -= filled_since
+            self._validate_amend(order, new_qty)
+            fills = bytearray()
+            self._amend(order, new_price, new_qty, fills)
+            return AmendResult(order._order_id, FillBuffer(fills), remaining)
+
+    def get_order(self, order_id):
+        """Copy of a resting order by engine or external id (None if not resting)"""
+        with self._lock:
+            order = self._find(order_id)
+            return None if order is None else order._copy()
+
+    def size(self):
+        with self._lock:
+            return len(self._orders)
+
+    def stats(self):
+        """Order and level counts, allocated order slots and estimated memory"""
+        with self._lock:
+            getsizeof = sys.getsizeof
+            memory = getsizeof(self) + getsizeof(self._orders) + getsizeof(self._external_ids)
+            memory += getsizeof(self._users) + sum(getsizeof(orders) for orders in self._users.values())
+            # User ids are interned in the (possibly shared) user table, so not counted here
+            for order in self._orders.values():
+                memory += getsizeof(order) + getsizeof(order._external_id)
+            levels = 0
+            for book in self._books:
+                for ladder in book:
+                    levels += ladder.level_count
+                    memory += getsizeof(ladder.levels) + getsizeof(ladder.occupied)
+                    memory += sum(getsizeof(level) + getsizeof(level.orders) for level in ladder.levels)
+            return BookStats(len(self._orders), levels, len(self._orders), memory, self._counters, self._timing)
+
+    def reset_stats(self):
+        """Zero the engine counters (orders added, fills, match timings, ...)"""
+        with self._lock:
+            self._counters = dict.fromkeys(_COUNTERS, 0)
+
+    def enable_timing(self, enabled=True):
+        """Collect match_ns and max_match_ns (two clock reads per match)"""
+        with self._lock:
+            self._timing = enabled
+
+    def _share_user_table(self, user_table):
+        """Moves the book onto a registry's user table, re-interning the
+        users of its resting orders"""
+        with self._lock:
+            if user_table is self._user_table:
+                return
+            users = {}
+            for user_id, orders in self._users.items():
+                user_id = user_table.intern(user_id)
+                for order in orders.values():
+                    order._user_id = user_id
+                users[user_id] = orders
+            self._users = users
+            self._user_table = user_table
+
+    def reserve(self, count):
+        """Kept for interface parity; Python containers size themselves."""
+        _check_u32(count)
+
+    def get_order_infos(self, token=Token.YES):
+        with self._lock:
+            bids, asks = self._books[token]
+            return self._depth(token, max(bids.level_count, asks.level_count))
+
+    def sequence(self):
+        """Number that changes whenever the resting orders do"""
+        with self._lock:
+            return self._sequence
+
+    def market_view(self):
+        """Full depth of both tokens with its sequence number and digest, cached until the next change"""
+        with self._lock:
+            if self._view is None or self._view.sequence != self._sequence:
+                depth = [self._depth(token, max(bids.level_count, asks.level_count))
+                         for token, (bids, asks) in zip(Token, self._books)]
+                self._view = MarketView(self._sequence, *depth)
+            return self._view
+
+    def get_depth(self, token, levels):
+        """Top `levels` price levels of each side, best first"""
+        with self._lock:
+            return self._depth(token, levels)
+
+    def get_depth_records(self, token, levels):
+        """Same levels as get_depth, packed as DEPTH_RECORD_DTYPE records (bids, then asks)"""
+        with self._lock:
+            records = bytearray()
+            for ladder in self._books[token]:
+                for count, tick in enumerate(ladder.ticks()):
+                    if count >= levels:
+                        break
+                    level = ladder.levels[tick]
+                    records += _DEPTH_RECORD.pack(tick * ladder.tick_size, level.quantity, level.order_count,
+                                                  ladder.side)
+            return DepthBuffer(records)
+
+    def get_bbo(self, token):
+        """Best bid and ask (None when a side is empty) for one token"""
+        with self._lock:
+            bids, asks = self._books[token]
+            return TopOfBook(self._level_info(bids, bids.best), self._level_info(asks, asks.best))
+
+    def quote(self, side, token, quantity, limit_price=None):
+        """Price an incoming order without changing the book, walking levels in
+        the order matching would take them"""
+        with self._lock:
+            bids, asks = self._books[token]
+            direct = asks if side == Side.Buy else bids
+            mint = self._books[1 - token][Side.Buy] if side == Side.Buy else None
+            direct_tick = direct.best
+            mint_tick = mint.best if mint else None
+
+            quote = Quote()
+            while quote.quantity < quantity:
+                if direct_tick is None and mint_tick is None:
+                    break
+                direct_price = direct_tick * self._tick_size if direct_tick is not None else 0
+                mint_price = self._pair_price - mint_tick * self._tick_size if mint_tick is not None else 0
+                # Only buys can mint, and a buy takes the cheaper of the two
+                use_mint = mint_tick is not None and (direct_tick is None or mint_price < direct_price)
+                price = mint_price if use_mint else direct_price
+                if limit_price is not None and (price > limit_price if side == Side.Buy else price < limit_price):
+                    break
+                level = mint.levels[mint_tick] if use_mint else direct.levels[direct_tick]
+                take = min(quantity - quote.quantity, level.quantity)
+                quote.quantity += take
+                quote.total_cost += take * price
+                quote.worst_price = price
+                if use_mint:
+                    mint_tick = mint.next_tick(mint_tick)
+                else:
+                    direct_tick = direct.next_tick(direct_tick)
+            return quote
+
+    def snapshot(self):
+        """Serialize the resting orders, in priority order, to versioned binary snapshot bytes"""
+        with self._lock:
+            return self._snapshot()
+
+    @staticmethod
+    def restore(data):
+        """Build a book from snapshot() output held in any buffer (bytes, mmap, memoryview)"""
+        reader = _Reader(memoryview(data).cast('B'))
+        magic, version, _, tick_size, pair_price, next_order_id, count = reader.take(_SNAPSHOT_HEADER)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError("Not an orderbook snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        book = Orderbook(tick_size, pair_price)
+        book._next_order_id = next_order_id
+        if count > len(reader.data) // 24:
+            raise ValueError("Snapshot is truncated")
+
+        for index in range(count):
+            order_id, order_type, side, token, _, price, initial, remaining = reader.take(_SNAPSHOT_ORDER)
+            user_id = reader.string()
+            external_id = reader.string()
+            book._validate_request((price, remaining, order_type, side, token), index)
+            book._validate_ids(user_id, external_id)
+            if order_id == 0 or order_id >= book._next_order_id or order_id in book._orders:
+                raise ValueError(f"Snapshot order {index} has an invalid id")
+            if remaining == 0 or remaining > initial:
+                raise ValueError(f"Snapshot order {index} has an invalid quantity")
+
+            user_id = book._user_table.intern(user_id)
+            order = Order(OrderType(order_type), order_id, Side(side), price, initial, user_id, Token(token),
+                          external_id)
+            order._remaining_quantity = remaining
+            book._books[token][side].push(order)
+            book._orders[order_id] = order
+            book._users.setdefault(user_id, {})[order_id] = order
+            if external_id:
+                if external_id in book._external_ids:
+                    raise ValueError(f"Duplicate external order id {external_id}")
+                book._external_ids[external_id] = order
+        if not reader.at_end():
+            raise ValueError("Unexpected data after the snapshot's last order")
+
+        # A crossed book or unminted complementary bids cannot come out of a
+        # live book, so reject them rather than leave matching half-done
+        try:
+            book.check_invariants()
+        except RuntimeError as e:
+            raise ValueError(f"Inconsistent snapshot: {e}") from None
+        return book
+
+    def open_journal(self, path):
+        """Start journaling adds, cancels, amends and fills to a new file"""
+        with self._lock:
+            if self._journal:
+                raise ValueError("Book is already journaling")
+            journal = _Journal(path)
+            journal.commit(_JOURNAL_SNAPSHOT, self._snapshot())
+            self._journal = journal
+
+    def close_journal(self):
+        with self._lock:
+            if self._journal:
+                self._journal.close()
+            self._journal = None
+
+    def sync_journal(self):
+        """Flush journaled events to disk"""
+        with self._lock:
+            if self._journal:
+                self._journal.sync()
+
+    def journal_sequence(self):
+        """Sequence number of the last journaled record (0 when not journaling)"""
+        with self._lock:
+            return self._journal.sequence if self._journal else 0
+
+    @staticmethod
+    def replay(path, resume=False):
+        """Rebuild a book from a journal, verifying that re-running its adds,
+        cancels and amends reproduces the journaled fills; with resume=True the
+        book keeps journaling to the same file"""
+        records = _read_journal(path)
+        first = next(records, None)
+        if first is None or first[1] != _JOURNAL_SNAPSHOT:
+            raise ValueError(f"Journal {path} does not start with a snapshot")
+        book = Orderbook.restore(first[2])
+        sequence, end = first[0], first[3]
+
+        fills, verified = bytearray(), 0
+        fill_size = _FILL_RECORD.size
+
+        def diverged():
+            return ValueError(f"Journal replay diverged at sequence {sequence}")
+
+        for sequence, record_type, payload, end in records:
+            reader = _Reader(payload)
+            if record_type == _JOURNAL_ADD:
+                if verified * fill_size != len(fills):
+                    raise diverged()
+                order_id, order_type, side, token, _, price, quantity = reader.take(_JOURNAL_ADD_FIELDS)
+                user_id = reader.string()
+                external_id = reader.string()
+                book._validate_request((price, quantity, order_type, side, token), 0)
+                book._validate_ids(user_id, external_id)
+                if order_id != book._next_order_id or (external_id and external_id in book._external_ids):
+                    raise diverged()
+                fills.clear()
+                verified = 0
+                book._add_order(OrderType(order_type), Side(side), price, quantity, user_id, Token(token),
+                                external_id, 0, fills)
+            elif record_type == _JOURNAL_FILL:
+                taker_id, maker_id, taker_price, maker_price, quantity, _ = reader.take(_JOURNAL_FILL_FIELDS)
+                if verified * fill_size == len(fills):
+                    raise diverged()
+                fill = _FILL_RECORD.unpack_from(fills, verified * fill_size)
+                verified += 1
+                if fill[1:6] != (taker_id, maker_id, taker_price, maker_price, quantity):
+                    raise diverged()
+            elif record_type == _JOURNAL_CANCEL:
+                (order_id,) = reader.take(_U32)
+                if verified * fill_size != len(fills) or not book._cancel(book._orders.get(order_id)):
+                    raise diverged()
+            elif record_type == _JOURNAL_AMEND:
+                order_id, price, quantity = reader.take(_JOURNAL_AMEND_FIELDS)
+                book._validate_price(price)
+                order = book._orders.get(order_id)
+                if verified * fill_size != len(fills) or order is None:
+                    raise diverged()
+                book._validate_amend(order, quantity)
+                fills.clear()
+                verified = 0
+                book._amend(order, price, quantity, fills)
+            else:
+                raise ValueError(f"Unexpected journal record at sequence {sequence}")
+        if resume:
+            book._journal = _Journal(path, end, sequence)
+        return book
+
+    def check_invariants(self):
+        """Verify queues, level totals and indexes; raises RuntimeError on corruption"""
+        with self._lock:
+            resting = 0
+            for token in Token:
+                bids, asks = self._books[token]
+                for ladder in (bids, asks):
+                    levels = 0
+                    for tick in ladder.ticks():
+                        level = ladder.levels[tick]
+                        quantity = count = 0
+                        for order in level.live_orders():
+                            self._require(order._token == token and order._side == ladder.side and
+                                          order._price == tick * ladder.tick_size, "Order queued at the wrong level")
+                            self._require(order._remaining_quantity > 0 and
+                                          order._order_type == OrderType.GoodTillCancel,
+                                          "Filled or fill-and-kill order left resting")
+                            self._require(self._orders.get(order._order_id) is order,
+                                          "Resting order missing from the id index")
+                            self._require(not order._external_id or
+                                          self._external_ids.get(order._external_id) is order,
+                                          "Resting order missing from the external id index")
+                            quantity += order._remaining_quantity
+                            count += 1
+                        self._require(count > 0, "Empty or mislinked level marked occupied")
+                        self._require(level.quantity == quantity and level.order_count == count,
+                                      "Level totals out of date")
+                        levels += 1
+                        resting += count
+                    self._require(levels == ladder.level_count, "Level count out of date")
+                if bids.best is not None and asks.best is not None:
+                    self._require(bids.best < asks.best, "Book is crossed")
+            self._require(resting == len(self._orders), "Id index holds orders that are not resting")
+            self._require(len(self._external_ids) <= resting, "External id index holds orders that are not resting")
+            linked = 0
+            for user_id, orders in self._users.items():
+                self._require(orders and all(order._user_id == user_id and self._orders.get(order_id) is order
+                                             for order_id, order in orders.items()),
+                              "User index holds an order that is not resting")
+                linked += len(orders)
+            self._require(linked == resting, "Resting order missing from the user index")
+            yes, no = self._books[Token.YES][Side.Buy], self._books[Token.NO][Side.Buy]
+            if yes.best is not None and no.best is not None:
+                self._require((yes.best + no.best) * self._tick_size < self._pair_price,
+                              "Complementary bids left unminted")
+
+    @staticmethod
+    def _require(condition, message):
+        if not condition:
+            raise RuntimeError(message)
+
+    # Everything below assumes _lock is held by the caller.
+
+    def _find(self, order_id):
+        if isinstance(order_id, str):
+            return self._external_ids.get(order_id)
+        return self._orders.get(order_id)
+
+    def _add_order(self, order_type, side, price, quantity, user_id, token, external_id, request_index, fills):
+        """Matches and, if anything is left of a good-till-cancel order, rests
+        it. Fills are appended to `fills`, tagged with request_index."""
+        user_id = self._user_table.intern(user_id)
+        order = Order(order_type, self._next_order_id, side, price, quantity, user_id, token, external_id)
+        self._next_order_id += 1
+        self._counters['orders_added'] += 1
+        if self._journal:
+            self._journal.commit(_JOURNAL_ADD, _JOURNAL_ADD_FIELDS.pack(
+                order._order_id, order_type, side, token, 0, price, quantity
+            ) + _pack_string(user_id) + _pack_string(external_id))
+
+        if order_type == OrderType.FillAndKill and not self._can_match(side, token, price):
+            return order._order_id
+        # From here on the order either trades or rests
+        self._sequence += 1
+        self._match(order, request_index, fills)
+        if not order._remaining_quantity or order_type == OrderType.FillAndKill:
+            return order._order_id
+
+        self._books[token][side].push(order)
+        self._orders[order._order_id] = order
+        if external_id:
+            self._external_ids[external_id] = order
+        self._users.setdefault(user_id, {})[order._order_id] = order
+        return order._order_id
+
+    def _direct_candidate(self, side, token, price):
+        """Best level on the opposite side of the incoming order's own token,
+        as (level, price the incoming order gets, match type)"""
+        bids, asks = self._books[token]
+        if side == Side.Buy:
+            if asks.best is None or asks.best * self._tick_size > price:
+                return None
+            return asks.levels[asks.best], asks.best * self._tick_size, MatchType.Direct
+        if bids.best is None or bids.best * self._tick_size < price:
+            return None
+        return bids.levels[bids.best], bids.best * self._tick_size, MatchType.Direct
+
+    def _mint_candidate(self, side, token, price):
+        """Best resting buy of the complementary token that, with an incoming
+        buy at price, funds a complete pair"""
+        if side != Side.Buy:
+            return None
+        bids = self._books[1 - token][Side.Buy]
+        if bids.best is None or bids.best * self._tick_size + price < self._pair_price:
+            return None
+        return bids.levels[bids.best], self._pair_price - bids.best * self._tick_size, MatchType.Mint
+
+    def _can_match(self, side, token, price):
+        return (self._direct_candidate(side, token, price) is not None or
+                self._mint_candidate(side, token, price) is not None)
+
+    def _match(self, order, request_index, fills):
+        """Matches an incoming order against resting liquidity at the resting
+        (maker) orders' prices; the book is never left crossed."""
+        side, token, price = order._side, order._token, order._price
+        counters = self._counters
+        start = time.perf_counter_ns() if self._timing else 0
+        last_level, matches = None, 0
+        while order._remaining_quantity:
+            direct = self._direct_candidate(side, token, price)
+            mint = self._mint_candidate(side, token, price)
+            if direct is None and mint is None:
+                break
+            if mint is None:
+                best = direct
+            elif direct is None:
+                best = mint
+            elif direct[1] != mint[1]:
+                # Price priority first, then time priority between the queue heads
+                best = direct if (direct[1] < mint[1] if side == Side.Buy else direct[1] > mint[1]) else mint
+            else:
+                best = direct if direct[0].head()._order_id < mint[0].head()._order_id else mint
+            level, effective_price, match_type = best
+            if level is not last_level:
+                last_level = level
+                counters['levels_touched'] += 1
+
+            resting = level.head()
+            quantity = min(order._remaining_quantity, resting._remaining_quantity)
+            order._remaining_quantity -= quantity
+            resting._remaining_quantity -= quantity
+            level.quantity -= quantity
+
+            fills += _FILL_RECORD.pack(request_index, order._order_id, resting._order_id, effective_price,
+                                       resting._price, quantity, token, side, match_type,
+                                       order._external_id.encode(), resting._external_id.encode(),
+                                       order._user_id.encode(), resting._user_id.encode())
+            if self._journal:
+                self._journal.commit(_JOURNAL_FILL, _JOURNAL_FILL_FIELDS.pack(
+                    order._order_id, resting._order_id, effective_price, resting._price, quantity, match_type
+                ) + _pack_string(order._external_id) + _pack_string(resting._external_id))
+            matches += 1
+            counters['quantity_filled'] += quantity
+
+            if not resting._remaining_quantity:
+                counters['orders_filled'] += 1
+                self._remove_resting(resting)
+
+        counters['match_calls'] += 1
+        counters['fills'] += matches
+        counters['max_match_length'] = max(counters['max_match_length'], matches)
+        if not order._remaining_quantity:
+            counters['orders_filled'] += 1
+        if self._timing:
+            elapsed = time.perf_counter_ns() - start
+            counters['match_ns'] += elapsed
+            counters['max_match_ns'] = max(counters['max_match_ns'], elapsed)
+
+    def _remove_resting(self, order):
+        del self._orders[order._order_id]
+        if order._external_id:
+            del self._external_ids[order._external_id]
+        self._unlink_user(order)
+        self._books[order._token][order._side].erase(order)
+
+    def _unlink_user(self, order):
+        orders = self._users[order._user_id]
+        del orders[order._order_id]
+        if not orders:
+            del self._users[order._user_id]
+
+    def _user_orders(self, user_id):
+        """user_id's resting orders, oldest (lowest engine id) first"""
+        return sorted(self._users.get(user_id, {}).values(), key=lambda order: order._order_id)
+
+    def _cancel(self, order):
+        if order is None:
+            return False
+        if self._journal:
+            self._journal.commit(_JOURNAL_CANCEL, _U32.pack(order._order_id))
+        self._remove_resting(order)
+        self._counters['orders_cancelled'] += 1
+        self._sequence += 1
+        return True
+
+    def _validate_amend(self, order, quantity):
+        if quantity == 0:
+            raise ValueError("Amended quantity must be positive; cancel the order instead")
+        if quantity > _U32_MAX - (order._initial_quantity - order._remaining_quantity):
+            raise ValueError("Amended quantity is too large")
+
+    def _amend(self, order, price, quantity, fills):
+        self._counters['orders_amended'] += 1
+        self._sequence += 1
+        if self._journal:
+            self._journal.commit(_JOURNAL_AMEND, _JOURNAL_AMEND_FIELDS.pack(order._order_id, price, quantity))
+        ladder = self._books[order._token][order._side]
+        filled = order._initial_quantity - order._remaining_quantity
+        if price == order._price and quantity <= order._remaining_quantity:
+            ladder.level(price).quantity -= order._remaining_quantity - quantity
+            order._remaining_quantity = quantity
+            order._initial_quantity = filled + quantity
+            return
+
+        # The old queue entry is now dead, so a fresh copy takes the order's place
+        ladder.erase(order)
+        moved = order._copy()
+        moved._price = price
+        moved._remaining_quantity = quantity
+        moved._initial_quantity = filled + quantity
+        self._orders[moved._order_id] = moved
+        if moved._external_id:
+            self._external_ids[moved._external_id] = moved
+        self._users[moved._user_id][moved._order_id] = moved
+        self._match(moved, 0, fills)
+        if moved._remaining_quantity:
+            ladder.push(moved)
+            return
+        del self._orders[moved._order_id]
+        if moved._external_id:
+            del self._external_ids[moved._external_id]
+        self._unlink_user(moved)
+
+    def _depth(self, token, levels):
+        bids, asks = self._books[token]
+        return OrderbookLevelInfos(self._collect_levels(bids, levels), self._collect_levels(asks, levels))
+
+    @staticmethod
+    def _collect_levels(ladder, levels):
+        infos = []
+        for tick in ladder.ticks():
+            if len(infos) >= levels:
+                break
+            infos.append(Orderbook._level_info(ladder, tick))
+        return infos
+
+    @staticmethod
+    def _level_info(ladder, tick):
+        if tick is None:
+            return None
+        level = ladder.levels[tick]
+        return LevelInfo(tick * ladder.tick_size, level.quantity, level.order_count)
+
+    def _validate_price(self, price):
+        if price < self._tick_size or price >= self._pair_price or price % self._tick_size:
+            raise ValueError(f"Price {price} must be a multiple of the tick size {self._tick_size} "
+                             f"below {self._pair_price}")
+
+    def _validate_request(self, request, index):
+        price, _, order_type, side, token = request
+        if order_type > OrderType.FillAndKill or side > Side.Sell or token > Token.NO:
+            raise ValueError(f"Order request {index} has an invalid enum value")
+        self._validate_price(price)
+
+    @staticmethod
+    def _validate_ids(user_id, external_id):
+        if len(user_id.encode()) > ID_FIELD_SIZE or len(external_id.encode()) > ID_FIELD_SIZE:
+            raise ValueError(f"User and external ids are limited to {ID_FIELD_SIZE} bytes")
+
+    def _resting_orders(self):
+        """Resting orders in snapshot order: YES then NO, bids then asks, best
+        price first, queue order within a level."""
+        for book in self._books:
+            for ladder in book:
+                for tick in ladder.ticks():
+                    yield from ladder.levels[tick].live_orders()
+
+    def _snapshot(self):
+        parts = [_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, self._tick_size, self._pair_price,
+                                       self._next_order_id, len(self._orders))]
+        for order in self._resting_orders():
+            parts.append(_SNAPSHOT_ORDER.pack(order._order_id, order._order_type, order._side, order._token, 0,
+                                              order._price, order._initial_quantity, order._remaining_quantity))
+            parts.append(_pack_string(order._user_id))
+            parts.append(_pack_string(order._external_id))
+        return b"".join(parts)
+
+
+class MarketRegistry:
+    """Owns the book of every loaded market, keyed by market id. The lock
+    only guards the dict: bulk operations take the books they need under it
+    and then work on each under that book's own lock."""
+
+    def __init__(self):
+        self._books = {}
+        self._user_table = _UserTable()
+        self._timing = False
+        self._lock = threading.Lock()
+
+    def create(self, market_id, tick_size=1, pair_price=PAIR_PRICE):
+        """Create and register an empty book; raises ValueError if the market already has one"""
+        book = Orderbook(tick_size, pair_price)
+        self.add(market_id, book)
+        return book
+
+    def add(self, market_id, book):
+        """Register an existing book (restored or replayed); raises ValueError if the market already has one"""
+        if not isinstance(book, Orderbook):
+            raise TypeError("Expected an Orderbook")
+        book._share_user_table(self._user_table)
+        with self._lock:
+            if market_id in self._books:
+                raise ValueError(f"Market {market_id} already has a book")
+            self._books[market_id] = book
+            book.enable_timing(self._timing)
+
+    def get(self, market_id):
+        """The market's book, or None"""
+        with self._lock:
+            return self._books.get(market_id)
+
+    def drop(self, market_id):
+        """Remove a market's book and close its journal; returns False if it had none"""
+        with self._lock:
+            book = self._books.pop(market_id, None)
+        if book is None:
+            return False
+        book.close_journal()
+        return True
+
+    def items(self):
+        """List of (market_id, book) pairs, sorted by market id"""
+        with self._lock:
+            return sorted(self._books.items(), key=lambda item: item[0])
+
+    def market_ids(self):
+        """Sorted ids of the markets with a book"""
+        return [market_id for market_id, _ in self.items()]
+
+    def cancel_all(self, market_id):
+        """Cancel every resting order in one market; returns how many there were"""
+        book = self.get(market_id)
+        return book.cancel_all() if book is not None else 0
+
+    def cancel_all_for_user(self, user_id):
+        """Cancel a user's resting orders in every market; returns {market_id: [orders]} for markets that had any"""
+        cancelled = {}
+        for market_id, book in self.items():
+            orders = book.cancel_all_for_user(user_id)
+            if orders:
+                cancelled[market_id] = orders
+        return cancelled
+
+    def orders_for_user(self, user_id):
+        """A user's resting orders as {market_id: [orders]}, oldest first"""
+        orders = {}
+        for market_id, book in self.items():
+            user_orders = book.orders_for_user(user_id)
+            if user_orders:
+                orders[market_id] = user_orders
+        return orders
+
+    def stats(self, market_id):
+        """BookStats of one market's book, or None"""
+        book = self.get(market_id)
+        return None if book is None else book.stats()
+
+    def all_stats(self):
+        """{market_id: BookStats} for every book"""
+        return {market_id: book.stats() for market_id, book in self.items()}
+
+    def reset_stats(self):
+        """Zero the engine counters of every book"""
+        for _, book in self.items():
+            book.reset_stats()
+
+    def enable_timing(self, enabled=True):
+        """Turn match timing on or off for every book, including books added later"""
+        with self._lock:
+            self._timing = enabled
+            for book in self._books.values():
+                book.enable_timing(enabled)
+
+    def user_count(self):
+        """Distinct user ids interned across all books"""
+        return len(self._user_table)
+
+    def user_table_bytes(self):
+        """Estimated memory held by the shared user id table"""
+        return self._user_table.memory_bytes()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._books)
+
+    def __contains__(self, market_id):
+        with self._lock:
+            return market_id in self._books
@@ -0,0 +1,181 @@
+"""Concurrent add/cancel storm against orderbook_cpp, then invariant checks.
+
+    python stress.py                      # 8 threads over 4 markets
+    python stress.py --threads 16 --markets 1 --ops 50000
+
+Worker threads pick markets at random, so some books are hit by several
+threads at once while others match in parallel. Each worker adds single and
+batched orders, cancels its own and other workers' orders by engine and
+external id, and reads depth. Once every thread has joined, each book must
+pass check_invariants() and every order's fills, cancel and remaining
+quantity must add up to what was placed.
+"""
+import argparse
+import random
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+
+import orderbook_cpp as ob
+
+GTC = ob.OrderType.GoodTillCancel
+FAK = ob.OrderType.FillAndKill
+SIDES = (ob.Side.Buy, ob.Side.Sell)
+TOKENS = (ob.Token.YES, ob.Token.NO)
+
+
+class Worker(threading.Thread):
+    def __init__(self, index, books, shared, ops, seed):
+        super().__init__(name=f"worker-{index}")
+        self.books = books
+        self.shared = shared        # per market: (engine id, external id) of every placed order
+        self.ops = ops
+        self.rng = random.Random(seed)
+        self.placed = {}            # (market, engine id) -> (quantity, order type)
+        self.fills = []             # (market, engine id, quantity) for both sides of every trade
+        self.cancelled = []         # (market, engine id) for every cancel that found the order
+        self.error = None
+
+    def run(self):
+        try:
+            for op in range(self.ops):
+                self.step(op)
+        except Exception as e:
+            self.error = e
+
+    def random_order(self):
+        rng = self.rng
+        order_type = FAK if rng.random() < 0.2 else GTC
+        return order_type, rng.choice(SIDES), rng.randint(1, 99), rng.randint(1, 20), rng.choice(TOKENS)
+
+    def step(self, op):
+        rng = self.rng
+        market = rng.randrange(len(self.books))
+        book = self.books[market]
+        roll = rng.random()
+        if roll < 0.45:
+            order_type, side, price, quantity, token = self.random_order()
+            external_id = f"{self.name}-{op}"
+            result = book.add_order(order_type, side, price, quantity, self.name, token, external_id)
+            self.placed[(market, result.order_id)] = (quantity, order_type)
+            self.shared[market].append((result.order_id, external_id))
+            for trade in result.trades:
+                for info in (trade.get_bid_trade(), trade.get_ask_trade()):
+                    self.fills.append((market, info.order_id, info.quantity))
+        elif roll < 0.55:
+            self.add_batch(market, book)
+        elif roll < 0.8:
+            pending = self.shared[market]
+            if pending:
+                order_id, external_id = pending[rng.randrange(len(pending))]
+                if external_id and rng.random() < 0.5:
+                    cancelled = book.cancel_order(external_id)
+                else:
+                    cancelled = book.cancel_order(order_id)
+                if cancelled:
+                    self.cancelled.append((market, order_id))
+        elif roll < 0.9:
+            # Batch cancels only report a count, so send single-id batches
+            # to keep track of exactly which orders were taken off
+            pending = self.shared[market]
+            for _ in range(min(8, len(pending))):
+                order_id, _ = pending[rng.randrange(len(pending))]
+                if book.cancel_orders_batch(struct.pack("<I", order_id)):
+                    self.cancelled.append((market, order_id))
+        else:
+            book.get_depth(rng.choice(TOKENS), 10)
+            book.get_bbo(rng.choice(TOKENS))
+
+    def add_batch(self, market, book):
+        orders = [self.random_order() for _ in range(self.rng.randint(1, 16))]
+        requests = b"".join(struct.pack(ob.ORDER_REQUEST_FORMAT, price, quantity, int(order_type), int(side), int(token))
+                            for order_type, side, price, quantity, token in orders)
+        order_ids, fills = book.add_orders_batch(requests, self.name)
+        for order_id, (order_type, _, _, quantity, _) in zip(memoryview(order_ids), orders):
+            self.placed[(market, order_id)] = (quantity, order_type)
+            self.shared[market].append((order_id, ""))
+        for fill in struct.iter_unpack(ob.FILL_RECORD_FORMAT, fills):
+            _, taker_id, maker_id, _, _, quantity = fill[:6]
+            self.fills.append((market, taker_id, quantity))
+            self.fills.append((market, maker_id, quantity))
+
+
+def verify(books, workers):
+    """Returns a list of problems; empty when the books are consistent."""
+    problems = []
+    for market, book in enumerate(books):
+        try:
+            book.check_invariants()
+        except RuntimeError as e:
+            problems.append(f"market {market}: {e}")
+
+    placed, filled, cancels = {}, Counter(), Counter()
+    for worker in workers:
+        placed.update(worker.placed)
+        for market, order_id, quantity in worker.fills:
+            filled[(market, order_id)] += quantity
+        cancels.update(worker.cancelled)
+
+    for key in filled.keys() - placed.keys():
+        problems.append(f"fill for unknown order {key}")
+    for key, count in cancels.items():
+        if count > 1:
+            problems.append(f"order {key} cancelled {count} times")
+
+    resting = Counter()
+    for (market, order_id), (quantity, order_type) in placed.items():
+        order = books[market].get_order(order_id)
+        done = filled[(market, order_id)]
+        if done > quantity:
+            problems.append(f"order {(market, order_id)} overfilled: {done} of {quantity}")
+        if order is not None:
+            resting[market] += 1
+            if order_type == FAK or cancels[(market, order_id)]:
+                problems.append(f"order {(market, order_id)} still resting after cancel or fill-and-kill")
+            elif order.get_remaining_quantity() != quantity - done:
+                problems.append(f"order {(market, order_id)} remaining {order.get_remaining_quantity()}, "
+                                f"expected {quantity - done}")
+        elif order_type == GTC and not cancels[(market, order_id)] and done != quantity:
+            problems.append(f"order {(market, order_id)} vanished with {quantity - done} unfilled")
+
+    for market, book in enumerate(books):
+        if book.size() != resting[market]:
+            problems.append(f"market {market}: size() {book.size()} but {resting[market]} orders resting")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--markets", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=20_000, help="operations per thread")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    books = [ob.Orderbook() for _ in range(args.markets)]
+    shared = [[] for _ in range(args.markets)]
+    workers = [Worker(i, books, shared, args.ops, args.seed + i) for i in range(args.threads)]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    problems = [f"{worker.name} crashed: {worker.error!r}" for worker in workers if worker.error]
+    problems += verify(books, workers)
+    total = args.threads * args.ops
+    print(f"{total:,} operations on {args.threads} threads over {args.markets} markets in {elapsed:.2f}s "
+          f"({total / elapsed:,.0f} ops/s), {sum(book.size() for book in books):,} orders resting")
+    for problem in problems[:20]:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,82 @@
 # Test script
+import os
+import struct
+import tempfile
+
 import orderbook_cpp as ob
 
 book = ob.Orderbook()
 
 # Test new token-aware method
-trades = book.add_order(
+result = book.add_order(
     ob.OrderType.GoodTillCancel,
     ob.Side.Buy,
-    6500,  # $65.00
+    65,    # $0.65
     100,   # quantity
     "alice",
-    ob.Token.YES  # NEW: specify token
+    ob.Token.YES,  # NEW: specify token
+    "order-1"      # external id (the database UUID)
+)
+
+print(f"Order id: {result.order_id}")
+print(f"Trades: {len(result.trades)}")
+print(f"Orders: {book.size()}")
+# Top of book and depth come from per-level running totals
+bbo = book.get_bbo(ob.Token.YES)
+print(f"YES best bid: {bbo.bid.price} x {bbo.bid.quantity}" if bbo.bid else "YES best bid: -")
+depth = book.get_depth(ob.Token.YES, 5)
+print(f"YES bid levels: {[(level.price, level.quantity, level.order_count) for level in depth.get_bids()]}")
+# Same levels as packed records, readable in place via memoryview or NumPy
+records = book.get_depth_records(ob.Token.YES, 5)
+print(f"YES depth records: {list(struct.iter_unpack(ob.DEPTH_RECORD_FORMAT, records))}")
+
+# Resting orders can be looked up and cancelled by external id
+print(f"Lookup: {book.get_order('order-1').get_order_id()}")
+print(f"Cancelled: {book.cancel_order('order-1')}, orders: {book.size()}")
+
+# Batches go through packed records (a NumPy array with ORDER_REQUEST_DTYPE works too)
+quotes = b"".join(
+    struct.pack(ob.ORDER_REQUEST_FORMAT, price, 10, int(ob.OrderType.GoodTillCancel), int(ob.Side.Sell), int(ob.Token.YES))
+    for price in (70, 71, 72)
 )
+order_ids, fills = book.add_orders_batch(quotes, "maker", ["quote-1", "quote-2", "quote-3"])
+print(f"Batch ids: {list(memoryview(order_ids))}, fills: {len(fills)}")
+order_ids, fills = book.add_orders_batch(
+    struct.pack(ob.ORDER_REQUEST_FORMAT, 71, 15, int(ob.OrderType.FillAndKill), int(ob.Side.Buy), int(ob.Token.YES)), "bob"
+)
+# Fill records carry both orders' engine ids, external ids and user ids
+for record in struct.iter_unpack(ob.FILL_RECORD_FORMAT, fills):
+    maker_external_id = record[10].rstrip(b"\0").decode()
+    maker_user_id = record[12].rstrip(b"\0").decode()
+    print(f"Fill: {record[5]} @ {record[3]} against {maker_external_id} ({maker_user_id})")
+print(f"Batch cancelled: {book.cancel_orders_batch(['quote-1', 'quote-2', 'quote-3'])}, orders: {book.size()}")
+
+# Snapshots restore an identical book (pickle uses the same format)
+book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, 60, 25, "alice", ob.Token.NO, "order-2")
+restored = ob.Orderbook.restore(book.snapshot())
+print(f"Restored: {restored.size()} orders, order-2 engine id {restored.get_order('order-2').get_order_id()}")
+
+# A journal records every add, cancel and fill; replay rebuilds the book from it
+journal = os.path.join(tempfile.mkdtemp(), "book.journal")
+journaled = ob.Orderbook()
+journaled.open_journal(journal)
+journaled.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 55, 10, "alice", ob.Token.YES, "order-3")
+journaled.add_order(ob.OrderType.FillAndKill, ob.Side.Buy, 55, 4, "bob", ob.Token.YES)
+journaled.close_journal()
+replayed = ob.Orderbook.replay(journal)
+print(f"Replayed: {replayed.size()} orders, order-3 remaining {replayed.get_order('order-3').get_remaining_quantity()}")
+
+# Amending down at the same price keeps queue priority; a reprice can trade
+book.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, 65, 10, "maker", ob.Token.NO, "order-4")
+book.amend_order("order-4", 65, 6)
+amended = book.amend_order("order-2", 65, 25)
+print(f"Amended order-2: {book.get_order('order-2').get_price()} x {book.get_order('order-2').get_remaining_quantity()}, trades: {len(amended.trades)}")
+
+# Quotes price an order against the book without changing it (here a mint against order-2)
+quote = book.quote(ob.Side.Buy, ob.Token.YES, 25)
+print(f"Quote: {quote.quantity} fillable @ avg {quote.average_price:.2f}, worst {quote.worst_price}, cost {quote.total_cost}")
 
-print(f"Trades: {len(trades)}")
-print(f"Orders: {book.size()}")
\ No newline at end of file
+# Each user's resting orders are indexed: exposure and mass cancel cost O(their orders)
+exposure = book.open_exposure("alice")
+print(f"Alice: {exposure.order_count} orders, NO buy notional {exposure.no.buy_notional}")
+print(f"Cancelled for alice: {[order.get_external_id() for order in book.cancel_all_for_user('alice')]}, orders: {book.size()}")
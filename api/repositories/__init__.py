@@ -0,0 +1,19 @@
+"""Data access for the app's tables (app.repos), served by Supabase or, with
+DATA_BACKEND=sqlite, by a local SQLite database"""
+from api.repositories.tables import (Repositories, MarketRepository, OrderRepository, UserRepository,
+                                     PositionRepository, TransactionRepository, TradeRepository,
+                                     NotificationRepository)
+from api.repositories.supabase_backend import SupabaseBackend
+from api.repositories.sqlite_backend import SQLiteBackend
+from api.repositories.write_behind import WriteBehind, WritesPending
+
+def create_repositories(config, supabase=None):
+    """The repositories for the configured backend"""
+    backend = config.get('DATA_BACKEND', 'supabase')
+    if backend == 'sqlite':
+        return Repositories(SQLiteBackend(config.get('SQLITE_PATH') or ':memory:'))
+    if backend == 'supabase':
+        if supabase is None:
+            raise RuntimeError('The supabase data backend needs a Supabase client')
+        return Repositories(SupabaseBackend(supabase))
+    raise RuntimeError(f"Unknown DATA_BACKEND {backend!r}; use 'supabase' or 'sqlite'")
@@ -0,0 +1,248 @@
+"""Repository backend over a local SQLite database, for running and load
+testing the app without Supabase. The schema mirrors the Supabase tables the
+app uses; numeric columns hold dollars on the cent grid, as they do there."""
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+
+SCHEMA = """
+create table if not exists markets (
+    id text primary key,
+    title text,
+    description text,
+    category text,
+    token text,
+    status text not null default 'active',
+    end_date text,
+    yes_price numeric,
+    no_price numeric,
+    total_volume numeric not null default 0,
+    tick_size numeric not null default 0.01,
+    resolution boolean,
+    resolved_at text,
+    resolve_date text,
+    created_at text
+);
+create table if not exists orders (
+    id text primary key,
+    market_id text not null,
+    user_id text not null,
+    side text not null,
+    token text not null,
+    price numeric not null,
+    size integer not null,
+    filled integer not null default 0,
+    status text not null default 'open',
+    filled_at text,
+    created_at text
+);
+create index if not exists orders_market_status_idx on orders (market_id, status, created_at);
+create index if not exists orders_user_idx on orders (user_id, created_at);
+create table if not exists users (
+    id text primary key,
+    username text,
+    display_name text,
+    email text,
+    balance numeric not null default 1000,
+    total_volume numeric not null default 0,
+    is_admin boolean not null default 0,
+    created_at text
+);
+create table if not exists positions (
+    user_id text not null,
+    market_id text not null,
+    yes_shares integer not null default 0,
+    no_shares integer not null default 0,
+    realized_pnl numeric not null default 0,
+    updated_at text,
+    primary key (user_id, market_id)
+);
+create table if not exists transactions (
+    id text primary key,
+    user_id text not null,
+    amount numeric not null,
+    type text,
+    description text,
+    market_id text,
+    order_id text,
+    created_at text
+);
+create index if not exists transactions_user_idx on transactions (user_id, created_at);
+create table if not exists trades (
+    id text primary key,
+    market_id text not null,
+    buyer_order_id text,
+    seller_order_id text,
+    buyer_id text,
+    seller_id text,
+    token text,
+    price numeric,
+    size integer,
+    match_type text not null default 'direct',
+    created_at text
+);
+create index if not exists trades_market_created_at_idx on trades (market_id, created_at);
+create table if not exists notifications (
+    id text primary key,
+    user_id text not null,
+    type text,
+    message text,
+    created_at text
+);
+create table if not exists applied_batches (
+    batch_id text not null,
+    function_name text not null,
+    applied_at text,
+    primary key (batch_id, function_name)
+);
+"""
+
+# The database functions of supabase/migrations/*_atomic_increments.sql, as
+# statements run for each delta; the last one returns the changed row. The
+# dollar columns are REAL here, so money is added as whole cents - the
+# stored value taken to integer cents first - and only then scaled back.
+FUNCTIONS = {
+    'add_balances': [
+        'update users set balance = (cast(round(balance * 100) as integer) + :cents) / 100.0 '
+        'where id = :user_id returning *',
+    ],
+    'add_position_shares': [
+        'insert into positions (user_id, market_id, yes_shares, no_shares, updated_at) '
+        'values (:user_id, :market_id, 0, 0, :now) on conflict (user_id, market_id) do nothing',
+        'update positions set yes_shares = max(0, yes_shares + :yes_shares), '
+        'no_shares = max(0, no_shares + :no_shares), updated_at = :now '
+        'where user_id = :user_id and market_id = :market_id returning *',
+    ],
+    'add_order_fills': [
+        "update orders set filled = filled + :quantity, "
+        "status = case when status = 'open' and filled + :quantity >= size then 'filled' else status end, "
+        "filled_at = case when status = 'open' and filled + :quantity >= size then :now else filled_at end "
+        "where id = :order_id returning *",
+    ],
+    'add_market_trades': [
+        'update markets set total_volume = '
+        '(cast(round(coalesce(total_volume, 0) * 100) as integer) + :volume_cents) / 100.0, '
+        'yes_price = :yes_price_cents / 100.0, no_price = (100 - :yes_price_cents) / 100.0 '
+        'where id = :market_id returning *',
+    ],
+}
+
+OPERATORS = {'eq': '=', 'neq': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+# Booleans come back as True/False, like they do from PostgREST
+sqlite3.register_converter('boolean', lambda value: value not in (b'0', b''))
+
+class SQLiteBackend:
+    """Runs repository primitives on one SQLite connection (a file, or
+    ':memory:'), serialized by a lock so request threads can share it. Bulk
+    writes run in a single transaction."""
+
+    def __init__(self, path=':memory:'):
+        self.connection = sqlite3.connect(path, check_same_thread=False,
+                                          detect_types=sqlite3.PARSE_DECLTYPES)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+        self.columns = {
+            table: {column[1] for column in self.connection.execute(f'pragma table_info({table})')}
+            for (table,) in self.connection.execute("select name from sqlite_master where type = 'table'")
+        }
+
+    def _check(self, table, columns):
+        unknown = set(columns) - self.columns.get(table, set())
+        if unknown:
+            raise ValueError(f"unknown column(s) of {table}: {', '.join(sorted(unknown))}")
+
+    def _where(self, table, where):
+        self._check(table, [column for column, _, _ in where])
+        clauses, params = [], []
+        for column, op, value in where:
+            if op == 'in':
+                clauses.append(f'"{column}" in ({", ".join("?" * len(value))})' if value else '0')
+                params.extend(value)
+            else:
+                clauses.append(f'"{column}" {OPERATORS[op]} ?')
+                params.append(value)
+        return (' where ' + ' and '.join(clauses) if clauses else ''), params
+
+    def _defaults(self, table, row):
+        # Stand-ins for the database defaults Postgres fills in
+        columns = self.columns[table]
+        defaults = {}
+        if 'id' in columns and row.get('id') is None:
+            defaults['id'] = str(uuid.uuid4())
+        if 'created_at' in columns and row.get('created_at') is None:
+            defaults['created_at'] = datetime.now(timezone.utc).isoformat()
+        return {**row, **defaults}
+
+    def select(self, table, columns='*', where=(), order=(), limit=None, offset=None, after=None):
+        names = [name.strip() for name in columns.split(',')] if columns != '*' else []
+        self._check(table, names + [column for column, _ in order or ()] + [column for column, _ in after or ()])
+        sql_columns = ', '.join(f'"{name}"' for name in names) or '*'
+        clause, params = self._where(table, where)
+        if after:
+            # A row value comparison, which the (market_id, status, created_at) index can serve
+            key = ', '.join(f'"{column}"' for column, _ in after)
+            clause += (' and ' if clause else ' where ') + f'({key}) > ({", ".join("?" * len(after))})'
+            params += [value for _, value in after]
+        sql = f'select {sql_columns} from "{table}"{clause}'
+        if order:
+            sql += ' order by ' + ', '.join(f'"{column}" {"desc" if desc else "asc"}' for column, desc in order)
+        if limit is not None or offset:
+            sql += ' limit ? offset ?'
+            params += [-1 if limit is None else limit, offset or 0]
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def _write(self, table, rows, conflict=None):
+        stored = []
+        with self.lock, self.connection:
+            for row in rows:
+                row = self._defaults(table, row)
+                self._check(table, row)
+                names = ', '.join(f'"{name}"' for name in row)
+                marks = ', '.join('?' * len(row))
+                sql = f'insert into "{table}" ({names}) values ({marks}){conflict(row) if conflict else ""} returning *'
+                stored.extend(dict(found) for found in self.connection.execute(sql, list(row.values())))
+        return stored
+
+    def insert(self, table, rows):
+        return self._write(table, rows)
+
+    def upsert(self, table, rows, key=('id',)):
+        def conflict(row):
+            assignments = ', '.join(f'"{name}" = excluded."{name}"' for name in row if name not in key)
+            target = ', '.join(f'"{name}"' for name in key)
+            return f' on conflict ({target}) do ' + (f'update set {assignments}' if assignments else 'nothing')
+        return self._write(table, rows, conflict)
+
+    def update(self, table, values, where):
+        self._check(table, values)
+        assignments = ', '.join(f'"{name}" = ?' for name in values)
+        clause, params = self._where(table, where)
+        sql = f'update "{table}" set {assignments}{clause} returning *'
+        with self.lock, self.connection:
+            return [dict(row) for row in self.connection.execute(sql, list(values.values()) + params)]
+
+    def call(self, function, params):
+        """Run the SQLite version of a database function in supabase/migrations:
+        each delta is one atomic update, all of them in one transaction. A
+        call with a batch_id already recorded for the function changes nothing."""
+        statements = FUNCTIONS[function]
+        params = dict(params)
+        batch_id = params.pop('batch_id', None)
+        (rows,) = params.values()
+        now = datetime.now(timezone.utc).isoformat()
+        changed = []
+        with self.lock, self.connection:
+            if batch_id is not None and not self.connection.execute(
+                    'insert or ignore into applied_batches (batch_id, function_name, applied_at) values (?, ?, ?)',
+                    (batch_id, function, now)).rowcount:
+                return []
+            for row in rows:
+                for sql in statements:
+                    found = self.connection.execute(sql, {**row, 'now': now}).fetchall()
+                changed.extend(dict(found_row) for found_row in found)
+        return changed
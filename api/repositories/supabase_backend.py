@@ -0,0 +1,53 @@
+"""Repository backend over a Supabase (PostgREST) client"""
+
+class SupabaseBackend:
+    """Runs repository primitives as PostgREST requests: one round trip each,
+    bulk inserts and upserts included"""
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _where(query, where):
+        for column, op, value in where:
+            query = getattr(query, 'in_' if op == 'in' else op)(column, value)
+        return query
+
+    @staticmethod
+    def _after(after):
+        # PostgREST has no row value comparison, so (a, b) > (x, y) is
+        # spelled a > x or (a = x and b > y); values are quoted as they may
+        # hold commas, colons or parentheses
+        def quoted(value):
+            return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+        branches = []
+        for i, (column, value) in enumerate(after):
+            terms = [f'{earlier}.eq.{quoted(earlier_value)}' for earlier, earlier_value in after[:i]]
+            terms.append(f'{column}.gt.{quoted(value)}')
+            branches.append(f"and({','.join(terms)})" if len(terms) > 1 else terms[0])
+        return ','.join(branches)
+
+    def select(self, table, columns='*', where=(), order=(), limit=None, offset=None, after=None):
+        query = self._where(self.client.table(table).select(columns), where)
+        if after:
+            query = query.or_(self._after(list(after)))
+        for column, desc in order or ():
+            query = query.order(column, desc=desc)
+        if limit is not None:
+            query = query.limit(limit)
+        if offset:
+            query = query.offset(offset)
+        return query.execute().data or []
+
+    def insert(self, table, rows):
+        return self.client.table(table).insert(rows).execute().data or []
+
+    def upsert(self, table, rows, key=('id',)):
+        return self.client.table(table).upsert(rows, on_conflict=','.join(key)).execute().data or []
+
+    def update(self, table, values, where):
+        return self._where(self.client.table(table).update(values), where).execute().data or []
+
+    def call(self, function, params):
+        """Run one of the database functions in supabase/migrations (an RPC)"""
+        return self.client.rpc(function, params).execute().data or []
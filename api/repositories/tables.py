@@ -0,0 +1,210 @@
+"""Repositories for the app's tables, over a pluggable backend.
+
+A backend runs four primitives on one table - select, insert, upsert and
+update - with filters given as (column, op, value) tuples, op being one of
+eq, neq, in, gt, gte, lt or lte. select can also page by keyset: after is a
+list of (column, value) pairs, and only rows ordered strictly after that key
+come back. Increments (balances, positions, fills, market volume) go
+through the backend's call primitive instead, which runs a database function
+applying many deltas atomically, in one round trip, and at most once per
+batch id when given one. Everything the routes ask of the database
+is a method here, so a query can be batched or tuned in one place whichever
+backend serves it. Inserts and upserts take one row or a list of rows and
+write a list in a single call.
+"""
+
+def _rows(rows):
+    return [rows] if isinstance(rows, dict) else list(rows)
+
+def _first(rows):
+    return rows[0] if rows else None
+
+def _batch(params, batch_id):
+    # An increment call with a batch_id is applied at most once per id, so
+    # a retry after a lost response does not apply its deltas twice
+    return params if batch_id is None else {**params, 'batch_id': batch_id}
+
+class TableRepository:
+    """Rows of one table keyed by id. Subclasses add the table's own queries."""
+    table = None
+    key = ('id',)
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, row_id, columns='*'):
+        """One row by id, or None"""
+        return _first(self.backend.select(self.table, columns, [('id', 'eq', row_id)], limit=1))
+
+    def get_many(self, row_ids, columns='*'):
+        """The rows with these ids that exist, in one call"""
+        row_ids = list(row_ids)
+        return self.backend.select(self.table, columns, [('id', 'in', row_ids)]) if row_ids else []
+
+    def insert(self, rows):
+        """Insert a row or a list of rows; returns them as stored"""
+        rows = _rows(rows)
+        return self.backend.insert(self.table, rows) if rows else []
+
+    def upsert(self, rows):
+        """Insert or replace a row or a list of rows on the table's key; returns them as stored"""
+        rows = _rows(rows)
+        return self.backend.upsert(self.table, rows, self.key) if rows else []
+
+    def update(self, row_id, values):
+        """Update one row by id; returns it as stored, or None if there is no such row"""
+        return _first(self.backend.update(self.table, values, [('id', 'eq', row_id)]))
+
+    def update_many(self, row_ids, values, where=()):
+        """Give every row in row_ids (and matching where) the same values, in one call"""
+        row_ids = list(row_ids)
+        if not row_ids:
+            return []
+        return self.backend.update(self.table, values, [('id', 'in', row_ids), *where])
+
+class MarketRepository(TableRepository):
+    table = 'markets'
+
+    def list(self, status=None, columns='*'):
+        """Markets, optionally only those with the given status"""
+        where = [('status', 'eq', status)] if status else []
+        return self.backend.select(self.table, columns, where)
+
+    def add_trades(self, trades, batch_id=None):
+        """Add traded value to markets' volume and set both prices from the
+        last YES price, given {market_id: (volume, yes_price)} in cents;
+        returns the changed rows"""
+        rows = [{'market_id': market_id, 'volume_cents': volume, 'yes_price_cents': yes_price}
+                for market_id, (volume, yes_price) in trades.items()]
+        return self.backend.call('add_market_trades', _batch({'trades': rows}, batch_id)) if rows else []
+
+class OrderRepository(TableRepository):
+    table = 'orders'
+
+    def find(self, order_id, user_id=None, market_id=None, columns='*'):
+        """An order by id, only if it belongs to the user (and market) given"""
+        where = [('id', 'eq', order_id)]
+        if user_id is not None:
+            where.append(('user_id', 'eq', user_id))
+        if market_id is not None:
+            where.append(('market_id', 'eq', market_id))
+        return _first(self.backend.select(self.table, columns, where, limit=1))
+
+    def for_user(self, user_id, market_id=None, status=None, columns='*'):
+        """A user's orders, newest first"""
+        where = [('user_id', 'eq', user_id)]
+        if market_id:
+            where.append(('market_id', 'eq', market_id))
+        if status:
+            where.append(('status', 'eq', status))
+        return self.backend.select(self.table, columns, where, order=[('created_at', True)])
+
+    def open_pages(self, market_ids, created_after=None, page_size=1000, columns='*'):
+        """Open orders of the given markets, oldest first (ties by id), in
+        pages of up to page_size rows; optionally only those placed after a
+        time. Each page is one query resuming from the last row of the one
+        before, so deep pages cost no more than the first."""
+        market_ids = list(market_ids)
+        if not market_ids:
+            return
+        if columns != '*':
+            # The keyset needs both columns of the last row
+            columns = ', '.join(dict.fromkeys([*(name.strip() for name in columns.split(',')), 'created_at', 'id']))
+        where = [('market_id', 'in', market_ids), ('status', 'eq', 'open')]
+        if created_after is not None:
+            where.append(('created_at', 'gt', created_after))
+        after = None
+        while True:
+            page = self.backend.select(self.table, columns, where, order=[('created_at', False), ('id', False)],
+                                       limit=page_size, after=after)
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            after = [('created_at', page[-1]['created_at']), ('id', page[-1]['id'])]
+
+    def add_filled(self, fills, batch_id=None):
+        """Add to orders' filled shares, given {order_id: shares}, marking the
+        open ones now complete filled; returns the changed rows"""
+        rows = [{'order_id': order_id, 'quantity': quantity} for order_id, quantity in fills.items()]
+        return self.backend.call('add_order_fills', _batch({'fills': rows}, batch_id)) if rows else []
+
+    def cancel_open(self, market_id):
+        """Mark every open order of a market cancelled"""
+        return self.backend.update(self.table, {'status': 'cancelled'},
+                                   [('market_id', 'eq', market_id), ('status', 'eq', 'open')])
+
+class UserRepository(TableRepository):
+    table = 'users'
+
+    def add_balances(self, deltas, batch_id=None):
+        """Credit (or, negative, debit) balances, given {user_id: cents};
+        returns the changed rows (users without a profile are skipped)"""
+        rows = [{'user_id': user_id, 'cents': cents} for user_id, cents in deltas.items()]
+        return self.backend.call('add_balances', _batch({'deltas': rows}, batch_id)) if rows else []
+
+class PositionRepository(TableRepository):
+    """Positions are keyed by (user_id, market_id)"""
+    table = 'positions'
+    key = ('user_id', 'market_id')
+
+    def get(self, user_id, market_id, columns='*'):
+        where = [('user_id', 'eq', user_id), ('market_id', 'eq', market_id)]
+        return _first(self.backend.select(self.table, columns, where, limit=1))
+
+    def update(self, user_id, market_id, values):
+        where = [('user_id', 'eq', user_id), ('market_id', 'eq', market_id)]
+        return _first(self.backend.update(self.table, values, where))
+
+    def add_shares(self, deltas, batch_id=None):
+        """Add to (or, negative, take from) positions, never below zero,
+        creating missing ones, given {(user_id, market_id): (yes_shares,
+        no_shares)}; returns the changed rows"""
+        rows = [{'user_id': user_id, 'market_id': market_id, 'yes_shares': yes_shares, 'no_shares': no_shares}
+                for (user_id, market_id), (yes_shares, no_shares) in deltas.items()]
+        return self.backend.call('add_position_shares', _batch({'deltas': rows}, batch_id)) if rows else []
+
+    def for_user(self, user_id, market_id=None, limit=None):
+        where = [('user_id', 'eq', user_id)]
+        if market_id:
+            where.append(('market_id', 'eq', market_id))
+        return self.backend.select(self.table, '*', where, limit=limit)
+
+    def for_market(self, market_id):
+        return self.backend.select(self.table, '*', [('market_id', 'eq', market_id)])
+
+class TransactionRepository(TableRepository):
+    table = 'transactions'
+
+    def recent(self, user_id, limit=5):
+        """A user's latest transactions, newest first"""
+        return self.backend.select(self.table, '*', [('user_id', 'eq', user_id)],
+                                   order=[('created_at', True)], limit=limit)
+
+class TradeRepository(TableRepository):
+    table = 'trades'
+
+    def for_market(self, market_id, limit=50, offset=0):
+        """A market's trades, newest first"""
+        return self.backend.select(self.table, '*', [('market_id', 'eq', market_id)],
+                                   order=[('created_at', True)], limit=limit, offset=offset)
+
+class NotificationRepository(TableRepository):
+    table = 'notifications'
+
+    def recent(self, user_id, limit=5):
+        return self.backend.select(self.table, '*', [('user_id', 'eq', user_id)],
+                                   order=[('created_at', True)], limit=limit)
+
+class Repositories:
+    """Every table's repository over one backend (app.repos)"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.markets = MarketRepository(backend)
+        self.orders = OrderRepository(backend)
+        self.users = UserRepository(backend)
+        self.positions = PositionRepository(backend)
+        self.transactions = TransactionRepository(backend)
+        self.trades = TradeRepository(backend)
+        self.notifications = NotificationRepository(backend)
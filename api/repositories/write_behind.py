@@ -0,0 +1,307 @@
+"""Write-behind persistence for the trading routes (app.writes).
+
+Requests match in memory and queue what has to reach the database: rows to
+insert, upsert or update, and increments - an order's fill progress, a
+user's balance, a position's shares, a market's volume and last price. One
+background worker takes the queue in batches and applies each batch as
+bulk inserts and upserts plus one atomic call per kind of increment,
+which the database applies at most once per batch. A call that fails is
+retried, with backoff, until it goes through: the engine has already
+matched what is queued, so a write is never dropped, and while the
+database is failing the queue stops draining and fills. The queue is
+bounded; writers wait for room when it is full, and has_room() reports
+full at once while the worker is stuck on a failing call.
+
+Queued increments are not in the database yet, so code that checks a
+balance or a position reads it through read_balance / read_position, which
+add the pending ones, and code that reads back rows it may just have
+written calls flush() first.
+"""
+import threading
+import time
+import uuid
+from collections import deque
+
+# Longest wait, in seconds, between retries of a failing call
+MAX_RETRY_DELAY = 5.0
+
+# Batches whose increments are remembered after they are applied, so a read
+# that overlapped them can tell what it may or may not have seen
+HISTORY = 64
+
+class WritesPending(RuntimeError):
+    """Queued writes did not reach the database in time, so rows read now may
+    be stale; routes answer 503 and the client retries"""
+
+class WriteBehind:
+    """A bounded queue of writes and the worker thread that applies them.
+    With synchronous=True (serverless, where a background thread may be
+    frozen between requests) every write is applied in the calling thread,
+    and a call still failing after its retries raises to the request."""
+
+    def __init__(self, repos, max_pending=10_000, batch_size=500, retries=5, retry_delay=0.1,
+                 synchronous=False):
+        self.repos = repos
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.synchronous = synchronous
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.queued = 0  # writes ever queued; the sequence number of the last one
+        self.applied = 0  # writes applied, in queue order
+        self.pending_balances = {}  # queued, not yet taken by the worker
+        self.pending_shares = {}
+        self.in_flight = None  # increments of the batch being applied
+        self.completed = 0  # batches applied; the number of the last one
+        self.history = deque(maxlen=HISTORY)  # (number, increments) of recent batches
+        self.stalled = False  # the worker is retrying a call that keeps failing
+        self.closed = False
+        self.worker = None
+        self.apply_lock = threading.Lock()
+
+    # Writes
+
+    def insert(self, table, rows):
+        """Insert a row or a list of rows into a table (a Repositories attribute name).
+        Rows without an id get one here, so a retried insert can be an upsert."""
+        rows = [rows] if isinstance(rows, dict) else list(rows)
+        self._put('insert', table, [row if row.get('id') else {**row, 'id': str(uuid.uuid4())}
+                                    for row in rows])
+
+    def upsert(self, table, rows):
+        """Insert or replace a row or a list of rows on the table's key"""
+        self._put('upsert', table, [rows] if isinstance(rows, dict) else list(rows))
+
+    def update(self, table, row_id, values):
+        """Update one row by id"""
+        self._put('update', table, 'update', (row_id, values))
+
+    def update_many(self, table, row_ids, values, where=()):
+        """Give every row in row_ids (and matching where) the same values"""
+        self._put('update', table, 'update_many', (list(row_ids), values, list(where)))
+
+    def add_filled(self, order_id, quantity):
+        """Add to an order's filled shares, marking it filled once it is"""
+        self._put('filled', order_id, quantity)
+
+    def add_balance(self, user_id, cents):
+        """Credit (or, negative, debit) a user's balance"""
+        self._put('balance', user_id, cents)
+
+    def add_shares(self, user_id, market_id, yes_shares=0, no_shares=0):
+        """Add to (or, negative, take from) a user's position in a market"""
+        self._put('shares', user_id, market_id, yes_shares, no_shares)
+
+    def add_trades(self, market_id, volume, yes_price):
+        """Add traded value (cents) to a market's volume and set its last YES price (cents)"""
+        self._put('market', market_id, volume, yes_price)
+
+    # Reads of what is still queued
+
+    def read_balance(self, user_id, read):
+        """Call read() for the user's row and return (row, cents still to be
+        added to their balance by queued writes). A batch the worker applies
+        while read() runs may or may not be in the row, so only its debits
+        are counted: never its credits twice."""
+        row, queued, uncertain = self._read_with_pending(read, 'balances', user_id, 0)
+        return row, queued + sum(min(cents, 0) for cents in uncertain)
+
+    def read_position(self, user_id, market_id, read):
+        """Call read() for the user's position row and return (row, (YES, NO)
+        shares still to be added by queued writes), counted as in read_balance"""
+        row, queued, uncertain = self._read_with_pending(read, 'shares', (user_id, market_id), (0, 0))
+        return row, (queued[0] + sum(min(yes, 0) for yes, _ in uncertain),
+                     queued[1] + sum(min(no, 0) for _, no in uncertain))
+
+    def has_room(self, timeout=5.0):
+        """Wait up to timeout seconds for the queue to have room; False if it is still full.
+        Routes ask before changing the books, so a full queue turns requests
+        away instead of piling up matched but unrecorded orders. While the
+        worker is stuck retrying a failing call the queue cannot drain, so
+        it is reported full without waiting."""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            if self.stalled:
+                return False
+            while len(self.queue) >= self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def flush(self, timeout=5.0):
+        """Wait until every write queued so far is applied; False on timeout.
+        Callers that go on to read rows back must not read them on False."""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            target = self.queued
+            while self.applied < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self, timeout=30.0):
+        """Apply what is queued and stop the worker"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.worker is not None:
+            self.worker.join(timeout)
+
+    # Queue and worker
+
+    def _put(self, kind, *args):
+        write = (kind, args)
+        if self.synchronous:
+            with self.apply_lock:
+                self._apply([write])
+            return
+        with self.condition:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self.worker.start()
+            while len(self.queue) >= self.max_pending:
+                self.condition.wait()
+            self.queue.append(write)
+            self.queued += 1
+            self._track(kind, args, 1)
+            self.condition.notify_all()
+
+    def _track(self, kind, args, sign, balances=None, shares=None):
+        # Increments queued but not taken by the worker, for read_balance /
+        # read_position (or, with balances and shares given, those of a batch)
+        balances = self.pending_balances if balances is None else balances
+        shares = self.pending_shares if shares is None else shares
+        if kind == 'balance':
+            user_id, cents = args
+            total = balances.get(user_id, 0) + sign * cents
+            if total:
+                balances[user_id] = total
+            else:
+                balances.pop(user_id, None)
+        elif kind == 'shares':
+            user_id, market_id, yes_shares, no_shares = args
+            yes_total, no_total = shares.get((user_id, market_id), (0, 0))
+            total = (yes_total + sign * yes_shares, no_total + sign * no_shares)
+            if total != (0, 0):
+                shares[(user_id, market_id)] = total
+            else:
+                shares.pop((user_id, market_id), None)
+
+    def _read_with_pending(self, read, kind, key, zero):
+        # The row, the increments still queued (in no row yet) and those of
+        # every batch applied at some point during read() (maybe in the row)
+        while True:
+            with self.condition:
+                completed = self.completed
+            row = read()
+            with self.condition:
+                if self.completed - completed > len(self.history):
+                    continue  # too many batches overlapped the read to tell; read again
+                uncertain = [increments[kind].get(key, zero)
+                             for number, increments in self.history if number > completed]
+                if self.in_flight is not None:
+                    uncertain.append(self.in_flight[kind].get(key, zero))
+                return row, getattr(self, 'pending_' + kind).get(key, zero), uncertain
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+                # From queued to in flight in one step, so a reader sees the
+                # batch's increments in exactly one of the two
+                self.in_flight = {'balances': {}, 'shares': {}}
+                for kind, args in batch:
+                    self._track(kind, args, -1)
+                    self._track(kind, args, 1, self.in_flight['balances'], self.in_flight['shares'])
+                self.condition.notify_all()
+            self._apply(batch)
+            with self.condition:
+                self.completed += 1
+                self.history.append((self.completed, self.in_flight))
+                self.in_flight = None
+                self.applied += len(batch)
+                self.condition.notify_all()
+
+    def _attempt(self, description, write, retry=None):
+        # Call write() until it succeeds, with retry() (when given) in place
+        # of it after a failure, as the failed call may have landed anyway
+        attempt = 0
+        while True:
+            try:
+                result = (retry if attempt and retry else write)()
+            except Exception as e:
+                attempt += 1
+                if attempt > self.retries:
+                    if self.synchronous:
+                        raise
+                    print(f"Write-behind still failing on {description} after {attempt} attempts: {e}")
+                    with self.condition:
+                        self.stalled = True
+                        self.condition.notify_all()
+                time.sleep(min(self.retry_delay * 2 ** (attempt - 1), MAX_RETRY_DELAY))
+                continue
+            if attempt > self.retries:
+                with self.condition:
+                    self.stalled = False
+                    self.condition.notify_all()
+            return result
+
+    def _apply(self, batch):
+        """Apply a batch: its inserts and upserts as one call per table, in the
+        order the tables first appear, then its updates in queue order, then
+        its increments, summed per key. Rows a write updates or increments
+        are inserted by an earlier write, so they exist by then."""
+        inserts, upserts, updates = {}, {}, []
+        filled, balances, shares, markets = {}, {}, {}, {}
+        for kind, args in batch:
+            if kind == 'insert':
+                inserts.setdefault(args[0], []).extend(args[1])
+            elif kind == 'upsert':
+                upserts.setdefault(args[0], []).extend(args[1])
+            elif kind == 'update':
+                updates.append(args)
+            elif kind == 'filled':
+                filled[args[0]] = filled.get(args[0], 0) + args[1]
+            elif kind == 'balance':
+                balances[args[0]] = balances.get(args[0], 0) + args[1]
+            elif kind == 'shares':
+                key = (args[0], args[1])
+                yes_shares, no_shares = shares.get(key, (0, 0))
+                shares[key] = (yes_shares + args[2], no_shares + args[3])
+            elif kind == 'market':
+                volume, _ = markets.get(args[0], (0, None))
+                markets[args[0]] = (volume + args[1], args[2])
+
+        for table, rows in inserts.items():
+            repo = getattr(self.repos, table)
+            self._attempt(f"{len(rows)} {table} inserts", lambda: repo.insert(rows), lambda: repo.upsert(rows))
+        for table, rows in upserts.items():
+            self._attempt(f"{len(rows)} {table} upserts", lambda: getattr(self.repos, table).upsert(rows))
+        for table, method, update_args in updates:
+            self._attempt(f"{table} {method}", lambda: getattr(getattr(self.repos, table), method)(*update_args))
+
+        # One atomic call per kind of increment, however many keys it covers,
+        # each tagged with the batch's id so that a retry of a call that did
+        # commit is ignored by the database
+        batch_id = str(uuid.uuid4())
+        if filled:
+            self._attempt(f"fills of {len(filled)} orders", lambda: self.repos.orders.add_filled(filled, batch_id))
+        shares = {key: delta for key, delta in shares.items() if delta != (0, 0)}
+        if shares:
+            self._attempt(f"{len(shares)} positions", lambda: self.repos.positions.add_shares(shares, batch_id))
+        balances = {user_id: cents for user_id, cents in balances.items() if cents}
+        if balances:
+            self._attempt(f"balances of {len(balances)} users",
+                          lambda: self.repos.users.add_balances(balances, batch_id))
+        if markets:
+            self._attempt(f"stats of {len(markets)} markets", lambda: self.repos.markets.add_trades(markets, batch_id))
@@ -1,11 +1,17 @@
 from flask import Blueprint, request, jsonify, render_template, g, current_app
 from api.auth import login_required, admin_required
-from api.utils import bootstrap_market, get_or_create_orderbook
+from api.utils import bootstrap_market, bootstrap_quotes, discard_orderbook, get_or_create_orderbook, engine_best_prices, engine_orderbook_response
+from api.repositories import WritesPending
+from api.units import MAX_PRICE, MIN_PRICE, PAYOUT, to_cents, to_dollars, to_shares
 import uuid
 from datetime import datetime, timedelta, timezone
 
 markets_bp = Blueprint('markets', __name__)
 
+# Seconds resolve_market waits for a market's last trades to be recorded
+# before paying out
+RESOLVE_FLUSH_TIMEOUT = 60.0
+
 def get_current_user_id():
     """Helper function to extract user ID from g.current_user"""
     current_user = g.current_user
@@ -24,20 +30,16 @@ def create_market_page():
 @markets_bp.route('/markets')
 @login_required
 def markets_page():
-    supabase = current_app.supabase
     try:
-        markets_resp = supabase.table('markets').select('*').eq('status', 'active').execute()
-        available_markets = markets_resp.data if markets_resp.data else []
+        available_markets = current_app.repos.markets.list(status='active')
         return render_template('markets.html', markets=available_markets)
     except Exception as e:
         return render_template('markets.html', markets=[], error=str(e))
 
 @markets_bp.route('/api/markets', methods=['GET'])
 def get_markets():
-    supabase = current_app.supabase
     try:
-        markets_resp = supabase.table('markets').select('*').eq('status', 'active').execute()
-        return jsonify({'success': True, 'markets': markets_resp.data if markets_resp.data else []})
+        return jsonify({'success': True, 'markets': current_app.repos.markets.list(status='active')})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -65,6 +67,24 @@ def create_market():
         if end_date <= datetime.now(timezone.utc):
             return jsonify({'error': 'End date must be in the future'}), 400
         
+        # Tick size in dollars; a whole number of ticks must make up $1.00
+        try:
+            tick_size = to_cents(data.get('tick_size', '0.01'))
+        except ValueError:
+            return jsonify({'error': 'tick_size must be a whole number of cents that divides $1.00'}), 400
+        if tick_size < 1 or tick_size > PAYOUT // 2 or PAYOUT % tick_size != 0:
+            return jsonify({'error': 'tick_size must be a whole number of cents that divides $1.00'}), 400
+        
+        # The opening YES price, in cents
+        try:
+            initial_price = to_cents(data.get('initial_probability', '0.5'))
+        except ValueError:
+            return jsonify({'error': 'initial_probability must be a whole number of cents'}), 400
+        if not MIN_PRICE <= initial_price <= MAX_PRICE:
+            return jsonify({'error': 'initial_probability must be between 0.01 and 0.99'}), 400
+        if bootstrap_quotes(initial_price, tick_size) is None:
+            return jsonify({'error': 'tick_size is too coarse to open a market at this initial_probability'}), 400
+        
         # Generate market ID
         market_id = str(uuid.uuid4())
         
@@ -76,31 +96,29 @@ def create_market():
             'end_date': end_date.isoformat(),
             'status': 'active',
             'category': data.get('category', 'football'),
-            'yes_price': data.get('initial_probability', 0.5),
-            'no_price': 1.0 - data.get('initial_probability', 0.5),
+            'yes_price': to_dollars(initial_price),
+            'no_price': to_dollars(PAYOUT - initial_price),
             'total_volume': 0,
             'token': data.get('token', 'MARKET'),
+            'tick_size': to_dollars(tick_size),
             'created_at': datetime.now(timezone.utc).isoformat()
         }
         
-        supabase = current_app.supabase
-        
         # Insert market into database
-        market_resp = supabase.table('markets').insert(market_data).execute()
+        created = current_app.repos.markets.insert(market_data)
         
-        if not market_resp.data:
+        if not created:
             return jsonify({'error': 'Failed to create market'}), 500
         
         # Bootstrap the market with initial liquidity
-        initial_prob = data.get('initial_probability', 0.5)
-        if not bootstrap_market(market_id, initial_prob):
+        if not bootstrap_market(market_id, initial_price, tick_size):
             # If bootstrap fails, still return success but log warning
             print(f"Warning: Failed to bootstrap market {market_id}")
         
         return jsonify({
             'success': True, 
             'message': 'Market created successfully',
-            'market': market_resp.data[0]
+            'market': created[0]
         })
         
     except Exception as e:
@@ -110,39 +128,23 @@ def create_market():
 @markets_bp.route('/markets/<market_id>')
 @login_required
 def market_detail(market_id):
-    supabase = current_app.supabase
+    repos = current_app.repos
     try:
-        market_resp = supabase.table('markets').select('*').eq('id', market_id).single().execute()
-        if not market_resp.data:
+        market = repos.markets.get(market_id)
+        if not market:
             return "Market not found", 404
         
-        market = market_resp.data
-        
         # Get current market prices from database (best bid/ask)
         market_prices = {
-            'yes_price': float(market.get('yes_price', 0.5)), 
-            'no_price': float(market.get('no_price', 0.5))
+            'yes_price': to_dollars(to_cents(market.get('yes_price', '0.5'))),
+            'no_price': to_dollars(to_cents(market.get('no_price', '0.5')))
         }
         
+        # Best bid/ask straight from the in-memory book
+        orderbook = get_or_create_orderbook(market_id)
         try:
-            # Get best YES bid (highest buy price)
-            yes_bid_resp = supabase.table('orders').select('price').eq('market_id', market_id).eq('token', 'YES').eq('side', 'buy').eq('status', 'open').order('price', desc=True).limit(1).execute()
-            if yes_bid_resp.data:
-                market_prices['yes_bid'] = float(yes_bid_resp.data[0]['price'])
-            
-            # Get best YES ask (lowest sell price)
-            yes_ask_resp = supabase.table('orders').select('price').eq('market_id', market_id).eq('token', 'YES').eq('side', 'sell').eq('status', 'open').order('price', desc=False).limit(1).execute()
-            if yes_ask_resp.data:
-                market_prices['yes_ask'] = float(yes_ask_resp.data[0]['price'])
-            
-            # Get best NO bid and ask
-            no_bid_resp = supabase.table('orders').select('price').eq('market_id', market_id).eq('token', 'NO').eq('side', 'buy').eq('status', 'open').order('price', desc=True).limit(1).execute()
-            if no_bid_resp.data:
-                market_prices['no_bid'] = float(no_bid_resp.data[0]['price'])
-            
-            no_ask_resp = supabase.table('orders').select('price').eq('market_id', market_id).eq('token', 'NO').eq('side', 'sell').eq('status', 'open').order('price', desc=False).limit(1).execute()
-            if no_ask_resp.data:
-                market_prices['no_ask'] = float(no_ask_resp.data[0]['price'])
+            if orderbook:
+                market_prices.update(engine_best_prices(orderbook))
         except Exception as e:
             print(f"Error getting market prices: {e}")
         
@@ -150,6 +152,8 @@ def market_detail(market_id):
                              market=market, 
                              market_prices=market_prices,
                              current_user=getattr(g, 'current_user', None))
+    except WritesPending as e:
+        return str(e), 503
     except Exception as e:
         import traceback; traceback.print_exc()
         return f"Error loading market: {e}", 500
@@ -166,45 +170,60 @@ def resolve_market(market_id):
         if outcome not in [True, False]:
             return jsonify({'error': 'Outcome must be true or false'}), 400
         
-        supabase = current_app.supabase
+        repos = current_app.repos
         
         # Check if market exists and is active
-        market_resp = supabase.table('markets').select('*').eq('id', market_id).single().execute()
-        if not market_resp.data:
+        market = repos.markets.get(market_id)
+        if not market:
             return jsonify({'error': 'Market not found'}), 404
         
-        market = market_resp.data
         if market['status'] != 'active':
             return jsonify({'error': 'Market is not active'}), 400
         
+        # Nothing changes while the write queue is failing to drain
+        writes = current_app.writes
+        if not writes.flush():
+            return jsonify({'error': 'Recent trades are still being recorded, try again'}), 503
+        
         # Update market status and outcome
         resolve_date = datetime.now(timezone.utc)
-        update_resp = supabase.table('markets').update({
+        resolved = repos.markets.update(market_id, {
             'status': 'resolved',
             'resolution': outcome,
             'resolved_at': resolve_date.isoformat(),
             'resolve_date': resolve_date.isoformat()
-        }).eq('id', market_id).execute()
+        })
         
-        if not update_resp.data:
+        if not resolved:
             return jsonify({'error': 'Failed to resolve market'}), 500
         
-        # Cancel all open orders for this market
-        cancel_resp = supabase.table('orders').update({
-            'status': 'cancelled'
-        }).eq('market_id', market_id).eq('status', 'open').execute()
-        
-        # Remove orderbook from memory
-        if market_id in current_app.markets:
-            del current_app.markets[market_id]
-        
-        # Process payouts to users based on their positions
-        process_market_payouts(market_id, outcome, supabase)
+        # Cancel all open orders for this market, once queued order inserts
+        # have landed so none is left open after the bulk cancel. Until the
+        # book is cancelled the resolution can still be undone.
+        if not writes.flush():
+            repos.markets.update(market_id, {'status': 'active', 'resolution': None,
+                                             'resolved_at': None, 'resolve_date': market.get('resolve_date')})
+            return jsonify({'error': 'Recent trades are still being recorded, try again'}), 503
+        repos.orders.cancel_open(market_id)
+        
+        # Cancel the book's orders, so its journal replays to an empty book,
+        # then drop it from memory (both are no-ops if another request got there first)
+        current_app.markets.cancel_all(market_id)
+        discard_orderbook(market_id)
+        
+        # Process payouts to users based on their positions, once the
+        # market's queued fills have reached them. Queued writes are never
+        # dropped, so this waits out a slow database rather than pay out
+        # on positions that are missing trades.
+        if not writes.flush(RESOLVE_FLUSH_TIMEOUT):
+            return jsonify({'error': 'Market resolved, but its last trades are still being recorded; '
+                                     'payouts were not made'}), 503
+        process_market_payouts(market_id, outcome, repos)
         
         return jsonify({
             'success': True, 
             'message': f'Market resolved as {"YES" if outcome else "NO"}',
-            'market': update_resp.data[0]
+            'market': resolved
         })
         
     except Exception as e:
@@ -222,11 +241,8 @@ def preview_resolution(market_id):
         if outcome not in [True, False]:
             return jsonify({'error': 'Outcome must be true or false'}), 400
         
-        supabase = current_app.supabase
-        
         # Get all user positions for this market
-        positions_resp = supabase.table('positions').select('*').eq('market_id', market_id).execute()
-        positions = positions_resp.data if positions_resp.data else []
+        positions = current_app.repos.positions.for_market(market_id)
         
         # Calculate preview payouts
         preview_data = {
@@ -242,13 +258,13 @@ def preview_resolution(market_id):
             losing_shares = 0
             
             if outcome:  # YES wins
-                winning_shares = float(position.get('yes_shares', 0))
-                losing_shares = float(position.get('no_shares', 0))
+                winning_shares = to_shares(position.get('yes_shares', 0))
+                losing_shares = to_shares(position.get('no_shares', 0))
             else:  # NO wins
-                winning_shares = float(position.get('no_shares', 0))
-                losing_shares = float(position.get('yes_shares', 0))
+                winning_shares = to_shares(position.get('no_shares', 0))
+                losing_shares = to_shares(position.get('yes_shares', 0))
             
-            user_payout = winning_shares  # Each winning share pays $1
+            user_payout = winning_shares * PAYOUT  # cents; each winning share pays $1
             
             if winning_shares > 0:
                 preview_data['winner_count'] += 1
@@ -258,12 +274,13 @@ def preview_resolution(market_id):
             preview_data['total_payout'] += user_payout
             preview_data['user_payouts'].append({
                 'user_id': position['user_id'],
-                'yes_shares': float(position.get('yes_shares', 0)),
-                'no_shares': float(position.get('no_shares', 0)),
+                'yes_shares': to_shares(position.get('yes_shares', 0)),
+                'no_shares': to_shares(position.get('no_shares', 0)),
                 'winning_shares': winning_shares,
                 'losing_shares': losing_shares,
-                'payout': user_payout
+                'payout': to_dollars(user_payout)
             })
+        preview_data['total_payout'] = to_dollars(preview_data['total_payout'])
         
         return jsonify({
             'success': True, 
@@ -279,14 +296,11 @@ def preview_resolution(market_id):
 def can_resolve_market(market_id):
     """Check if current user can resolve this market"""
     try:
-        supabase = current_app.supabase
-        
         # Get market details
-        market_resp = supabase.table('markets').select('*').eq('id', market_id).single().execute()
-        if not market_resp.data:
+        market = current_app.repos.markets.get(market_id)
+        if not market:
             return jsonify({'error': 'Market not found'}), 404
         
-        market = market_resp.data
         current_user = g.current_user
         
         # Extract user info safely
@@ -328,108 +342,47 @@ def can_resolve_market(market_id):
 @markets_bp.route('/api/markets/<market_id>/orderbook', methods=['GET'])
 @login_required
 def get_orderbook(market_id):
-    """Get current orderbook state for a market"""
+    """Get current orderbook depth from the in-memory book, answering 304 when
+    the client's ETag still matches"""
     try:
-        supabase = current_app.supabase
-        
-        # Check if market exists
-        market_resp = supabase.table('markets').select('id').eq('id', market_id).single().execute()
-        if not market_resp.data:
-            return jsonify({'error': 'Market not found'}), 404
-        
-        # Get active orders from database
-        orders_resp = supabase.table('orders').select('*').eq('market_id', market_id).eq('status', 'open').execute()
-        orders = orders_resp.data if orders_resp.data else []
-        
-        # Organize orders by token and side
-        yes_bids = []
-        yes_asks = []
-        no_bids = []
-        no_asks = []
-        
-        for order in orders:
-            remaining_size = float(order['size']) - float(order.get('filled', 0))
-            if remaining_size <= 0:
-                continue
-                
-            order_info = {
-                'price': float(order['price']),
-                'size': remaining_size,
-                'user_id': order['user_id'],
-                'order_id': order['id']
-            }
-            
-            if order['token'] == 'YES':
-                if order['side'] == 'buy':
-                    yes_bids.append(order_info)
-                else:
-                    yes_asks.append(order_info)
-            else:  # NO token
-                if order['side'] == 'buy':
-                    no_bids.append(order_info)
-                else:
-                    no_asks.append(order_info)
-        
-        # Sort orders (bids descending by price, asks ascending by price)
-        yes_bids.sort(key=lambda x: x['price'], reverse=True)
-        yes_asks.sort(key=lambda x: x['price'])
-        no_bids.sort(key=lambda x: x['price'], reverse=True)
-        no_asks.sort(key=lambda x: x['price'])
-        
-        return jsonify({
-            'success': True,
-            'orderbook': {
-                'yes_token': {
-                    'bids': yes_bids,
-                    'asks': yes_asks
-                },
-                'no_token': {
-                    'bids': no_bids,
-                    'asks': no_asks
-                }
-            }
-        })
-        
+        return engine_orderbook_response(market_id)
+    except WritesPending as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         import traceback; traceback.print_exc()
         return jsonify({'error': f'Failed to get orderbook: {str(e)}'}), 500
 
-def process_market_payouts(market_id, outcome, supabase):
+def process_market_payouts(market_id, outcome, repos):
     """Process payouts to users when market resolves"""
     try:
         # Get all positions for this market
-        positions_resp = supabase.table('positions').select('*').eq('market_id', market_id).execute()
-        positions = positions_resp.data if positions_resp.data else []
+        positions = repos.positions.for_market(market_id)
         
+        credits = {}
         for position in positions:
             user_id = position['user_id']
             
             # Calculate payout based on outcome
             if outcome:  # YES wins
-                payout = float(position.get('yes_shares', 0))
+                payout = to_shares(position.get('yes_shares', 0)) * PAYOUT
             else:  # NO wins
-                payout = float(position.get('no_shares', 0))
+                payout = to_shares(position.get('no_shares', 0)) * PAYOUT
             
             if payout > 0:
-                # Add payout to user balance
-                user_resp = supabase.table('users').select('balance').eq('id', user_id).single().execute()
-                if user_resp.data:
-                    current_balance = float(user_resp.data['balance'])
-                    new_balance = current_balance + payout
-                    
-                    supabase.table('users').update({
-                        'balance': new_balance
-                    }).eq('id', user_id).execute()
-                    
-                    # Record transaction
-                    supabase.table('transactions').insert({
-                        'user_id': user_id,
-                        'amount': payout,
-                        'type': 'market_payout',
-                        'description': f'Market resolution payout',
-                        'market_id': market_id,
-                        'created_at': datetime.now(timezone.utc).isoformat()
-                    }).execute()
+                credits[user_id] = credits.get(user_id, 0) + payout
+        
+        # Credit every winner in one atomic call, then record a payout
+        # transaction for each user it found, in one insert
+        paid = repos.users.add_balances(credits)
+        now = datetime.now(timezone.utc).isoformat()
+        repos.transactions.insert([{
+            'user_id': user['id'],
+            'amount': to_dollars(credits[user['id']]),
+            'type': 'market_payout',
+            'description': f'Market resolution payout',
+            'market_id': market_id,
+            'created_at': now
+        } for user in paid])
         
         print(f"Processed payouts for market {market_id}")
         
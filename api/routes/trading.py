@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify, g, current_app as app
 from api.auth import login_required
-from api.utils import get_or_create_orderbook, bootstrap_market, ORDERBOOK_AVAILABLE, match_orders_database_only
+from api.utils import get_or_create_orderbook, add_engine_order, amend_engine_order, quote_engine_order, committed_sell_shares, cancel_engine_user_orders, engine_orderbook_response
+from api.repositories import WritesPending
+from api.units import PAYOUT, STARTING_BALANCE, price_error, tick_size_of, to_cents, to_dollars, to_shares
 from datetime import datetime, timezone
 import uuid
 
@@ -22,21 +24,21 @@ def get_current_user_id():
         print(f"DEBUG: Converting current_user to string: {str(current_user)}")
         return str(current_user)
 
-def ensure_user_profile_exists(user_id, email=None, supabase_client=None):
+def ensure_user_profile_exists(user_id, email=None, repos=None):
     """
     Ensure a user profile exists in the users table.
     Creates one if it doesn't exist.
     """
-    if not supabase_client:
-        supabase_client = app.supabase
+    if not repos:
+        repos = app.repos
     
     try:
         # Check if user profile already exists
-        user_resp = supabase_client.table('users').select('*').eq('id', user_id).execute()
+        user = repos.users.get(user_id)
         
-        if user_resp.data and len(user_resp.data) > 0:
+        if user:
             # User exists, return the profile
-            return user_resp.data[0]
+            return user
         
         # User doesn't exist, create profile
         print(f"Creating user profile for {user_id}")
@@ -45,11 +47,11 @@ def ensure_user_profile_exists(user_id, email=None, supabase_client=None):
         if email:
             username = email.split('@')[0]
         else:
-            # Try to get email from auth.users
+            # Try to get email from the user's own row
             try:
-                auth_user = supabase_client.table('auth.users').select('email').eq('id', user_id).single().execute()
-                if auth_user.data and auth_user.data.get('email'):
-                    username = auth_user.data['email'].split('@')[0]
+                profile = repos.users.get(user_id, 'email')
+                if profile and profile.get('email'):
+                    username = profile['email'].split('@')[0]
                 else:
                     username = f'user_{user_id[:8]}'
             except:
@@ -60,17 +62,17 @@ def ensure_user_profile_exists(user_id, email=None, supabase_client=None):
             'id': user_id,
             'username': username,
             'display_name': username,
-            'balance': 1000.00,
+            'balance': to_dollars(STARTING_BALANCE),
             'total_volume': 0.0,
             'is_admin': False,
             'created_at': datetime.now(timezone.utc).isoformat()
         }
         
-        insert_resp = supabase_client.table('users').insert(profile_data).execute()
+        created = repos.users.insert(profile_data)
         
-        if insert_resp.data:
+        if created:
             print(f"Successfully created user profile for {user_id}")
-            return insert_resp.data[0]
+            return created[0]
         else:
             print(f"Failed to create user profile for {user_id}")
             return None
@@ -79,7 +81,7 @@ def ensure_user_profile_exists(user_id, email=None, supabase_client=None):
         print(f"Error ensuring user profile exists: {e}")
         return None
 
-def create_default_user_profile(user_id, supabase):
+def create_default_user_profile(user_id, repos):
     """Create a default user profile with starting balance"""
     try:
         # Get user info from auth
@@ -87,30 +89,46 @@ def create_default_user_profile(user_id, supabase):
         user_email = getattr(user, 'email', None)
         username = user_email.split('@')[0] if user_email else f'user_{str(user_id)[:8]}'
         
-        # Use admin client to bypass RLS
-        admin_client = getattr(app, 'supabase_admin', supabase)
-        
         # Create user profile
         user_data = {
             'id': user_id,  # Changed back to 'id'
             'username': username,
             'display_name': username,
-            'balance': 1000.00,
+            'balance': to_dollars(STARTING_BALANCE),
             'total_volume': 0.0,
             'created_at': datetime.now(timezone.utc).isoformat()
         }
         
-        result = admin_client.table('users').upsert(user_data).execute()
+        repos.users.upsert(user_data)
         print(f"Successfully created user profile for {user_id}")
         return True
     except Exception as e:
         print(f"Failed to create user profile: {e}")
         return False
 
+def available_balance(user_id, repos):
+    """The user's balance in cents with their queued balance writes counted,
+    or None if they have no profile"""
+    user, pending = app.writes.read_balance(user_id, lambda: repos.users.get(user_id, 'balance'))
+    if not user:
+        return None
+    return to_cents(user['balance']) + pending
+
+def available_position(user_id, market_id, repos):
+    """The user's (YES, NO) shares in a market with their queued position
+    writes counted, or None if they have no position"""
+    position, pending = app.writes.read_position(
+        user_id, market_id, lambda: repos.positions.get(user_id, market_id, 'yes_shares, no_shares'))
+    if not position and pending == (0, 0):
+        return None
+    position = position or {}
+    return (to_shares(position.get('yes_shares') or 0) + pending[0],
+            to_shares(position.get('no_shares') or 0) + pending[1])
+
 @trading_bp.route('/api/markets/<market_id>/orders', methods=['POST'])
 @login_required
 def place_order(market_id):
-    """Place a trading order on a market - serverless compatible"""
+    """Place a trading order on a market"""
     try:
         data = request.get_json()
         print(f"DEBUG: Received data: {data}")
@@ -132,32 +150,27 @@ def place_order(market_id):
         if token not in ['YES', 'NO']:
             return jsonify({'error': 'Token must be YES or NO'}), 400
         
+        # Price in cents, size in whole shares
         try:
-            price = float(data['price'])
-            size = float(data['size'])
-        except (ValueError, TypeError):
-            return jsonify({'error': 'Invalid price or size format'}), 400
-        
-        # Validate price range (0.01 to 0.99)
-        if not (0.01 <= price <= 0.99):
-            return jsonify({'error': 'Price must be between 0.01 and 0.99'}), 400
+            price = to_cents(data['price'])
+            size = to_shares(data['size'])
+        except ValueError as e:
+            return jsonify({'error': f'Invalid price or size: {e}'}), 400
         
         # Validate size
         if size <= 0:
             return jsonify({'error': 'Size must be positive'}), 400
         
-        supabase = app.supabase
+        repos = app.repos
         
         # Check if market exists and is active - ADD DEBUG
         print(f"DEBUG: Looking up market {market_id}")
         try:
-            market_resp = supabase.table('markets').select('*').eq('id', market_id).single().execute()
-            print(f"DEBUG: Market response: {market_resp}")
+            market = repos.markets.get(market_id)
             
-            if not market_resp.data:
+            if not market:
                 return jsonify({'error': 'Market not found'}), 404
             
-            market = market_resp.data
             print(f"DEBUG: Found market: {market['title']}, status: {market['status']}")
             
         except Exception as e:
@@ -172,27 +185,29 @@ def place_order(market_id):
         if datetime.now(timezone.utc) >= end_date:
             return jsonify({'error': 'Market has ended for trading'}), 400
         
+        # Price must be inside (0, $1) and on the market's tick grid
+        error = price_error(price, tick_size_of(market))
+        if error:
+            return jsonify({'error': error}), 400
+        
+        orderbook = get_or_create_orderbook(market_id)
+        if orderbook is None:
+            return jsonify({'error': 'Market not found'}), 404
+        
         # Get user info - ADD DEBUG
         user_id = get_current_user_id()
         print(f"DEBUG: Current user ID: {user_id}")
         
         # Check user balance for buy orders - ADD DEBUG
         if side == 'buy':
-            cost = price * size if token == 'YES' else (1 - price) * size
+            # Prices are per share of the token being bought, YES or NO
+            cost = price * size
             print(f"DEBUG: Buy order cost: {cost}")
             
             try:
-                # First, let's check if user exists at all
-                user_check_resp = supabase.table('users').select('*').eq('id', user_id).execute()
-                print(f"DEBUG: User check response: {user_check_resp}")
-                print(f"DEBUG: User check data: {user_check_resp.data}")
-                print(f"DEBUG: User check count: {len(user_check_resp.data) if user_check_resp.data else 0}")
-                
-                user_resp = supabase.table('users').select('balance').eq('id', user_id).single().execute()
-                print(f"DEBUG: User balance response: {user_resp}")
+                user_balance = available_balance(user_id, repos)
                 
-                if user_resp.data:
-                    user_balance = float(user_resp.data['balance'])
+                if user_balance is not None:
                     print(f"DEBUG: User balance: {user_balance}")
                     
                     if user_balance < cost:
@@ -200,8 +215,8 @@ def place_order(market_id):
                 else:
                     # User doesn't exist, create default profile
                     print(f"DEBUG: User {user_id} not found, creating default profile")
-                    create_default_user_profile(user_id, supabase)
-                    user_balance = 1000.00
+                    create_default_user_profile(user_id, repos)
+                    user_balance = STARTING_BALANCE
                     print(f"DEBUG: Created user with default balance: {user_balance}")
                     
                     if user_balance < cost:
@@ -212,8 +227,8 @@ def place_order(market_id):
                 # Try to create user profile and retry
                 try:
                     print(f"DEBUG: Attempting to create user profile for {user_id}")
-                    create_default_user_profile(user_id, supabase)
-                    user_balance = 1000.00
+                    create_default_user_profile(user_id, repos)
+                    user_balance = STARTING_BALANCE
                     print(f"DEBUG: Created user with default balance: {user_balance}")
                     
                     if user_balance < cost:
@@ -228,17 +243,14 @@ def place_order(market_id):
         if side == 'sell':
             print(f"DEBUG: Checking sell order for {token} shares")
             try:
-                # Use execute() without single() first to see if position exists
-                position_resp = supabase.table('positions').select('*').eq('user_id', user_id).eq('market_id', market_id).execute()
-                print(f"DEBUG: Position response: {position_resp}")
+                position = available_position(user_id, market_id, repos)
+                print(f"DEBUG: Position: {position}")
                 
-                if position_resp.data and len(position_resp.data) > 0:
-                    position = position_resp.data[0]  # Get first position
-                    if token == 'YES':
-                        available_shares = float(position.get('yes_shares', 0))
-                    else:
-                        available_shares = float(position.get('no_shares', 0))
+                if position:
+                    available_shares = position[0] if token == 'YES' else position[1]
                     
+                    # Shares already promised to resting sells are not available again
+                    available_shares -= committed_sell_shares(orderbook, user_id, token)
                     print(f"DEBUG: Available {token} shares: {available_shares}")
                     
                     if available_shares < size:
@@ -255,17 +267,14 @@ def place_order(market_id):
         order_id = str(uuid.uuid4())
         print(f"DEBUG: Generated order ID: {order_id}")
         
-        # Create order object for matching
-        db_side = token.upper()  # 'YES' or 'NO' goes to side column
-        db_token = side.upper()  # 'BUY' or 'SELL' goes to token column
-        
+        # Create order object for matching (same row layout as bootstrap orders)
         new_order = {
             'id': order_id,
             'market_id': market_id,
             'user_id': user_id,
-            'side': db_side,      # 'YES' or 'NO' (token type)
-            'token': db_token,    # 'BUY' or 'SELL' (direction)
-            'price': price,
+            'side': side,         # 'buy' or 'sell' (direction)
+            'token': token,       # 'YES' or 'NO' (token type)
+            'price': to_dollars(price),
             'size': size,
             'filled': 0,
             'status': 'open',
@@ -274,9 +283,17 @@ def place_order(market_id):
         
         print(f"DEBUG: Order to insert: {new_order}")
         
-        # Skip C++ orderbook for now to simplify debugging
-        matches = []
-        filled_amount = 0
+        # Everything from here on is recorded by the write-behind worker;
+        # turn the order away now rather than match what cannot be queued
+        if not app.writes.has_room():
+            return jsonify({'error': 'Too many orders are waiting to be recorded, try again'}), 503
+        
+        # Match in the C++ orderbook; whatever is left rests there under the DB id
+        try:
+            fills = add_engine_order(orderbook, side, token, price, size, user_id, order_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        filled_amount = sum(fill['quantity'] for fill in fills)
         
         # Update order with filled amount
         new_order['filled'] = filled_amount
@@ -286,65 +303,43 @@ def place_order(market_id):
             new_order['status'] = 'filled'
             new_order['filled_at'] = datetime.now(timezone.utc).isoformat()
         
-        # Insert order into database
-        try:
-            print(f"DEBUG: Inserting order into database...")
-            order_resp = supabase.table('orders').insert(new_order).execute()
-            print(f"DEBUG: Order insert response: {order_resp}")
-            
-            if not order_resp.data:
-                return jsonify({'error': 'Failed to record order'}), 500
-        except Exception as e:
-            print(f"DEBUG: Database insert failed: {e}")
-            return jsonify({'error': f'Database insert failed: {str(e)}'}), 500
+        # Queue the order row ahead of the fills that refer to it
+        writes = app.writes
+        writes.insert('orders', new_order)
+        
+        # Settle fills against the resting orders they matched
+        trades = settle_fills(market_id, fills, writes) if fills else []
+        if trades:
+            update_market_stats(market_id, trades, writes)
         
         # Deduct cost from user balance for unfilled buy orders
         if side == 'buy' and remaining_size > 0:
-            remaining_cost = price * remaining_size if token == 'YES' else (1 - price) * remaining_size
+            remaining_cost = price * remaining_size
             print(f"DEBUG: Deducting {remaining_cost} from user balance")
             
-            # Use admin client for balance deduction and transaction recording
-            admin_client = getattr(app, 'supabase_admin', supabase)
-            
-            try:
-                # Deduct from balance
-                user_resp = admin_client.table('users').select('balance').eq('id', user_id).single().execute()
-                if user_resp.data:
-                    current_balance = float(user_resp.data['balance'])
-                    new_balance = current_balance - remaining_cost
-                    
-                    admin_client.table('users').update({
-                        'balance': new_balance
-                    }).eq('id', user_id).execute()
-                    print(f"DEBUG: Updated user balance from {current_balance} to {new_balance}")
-                else:
-                    print(f"DEBUG: User not found for balance update")
-            except Exception as e:
-                print(f"Error deducting user balance: {e}")
+            deduct_user_balance(user_id, remaining_cost, writes)
             
             # Record transaction
-            try:
-                admin_client.table('transactions').insert({
-                    'user_id': user_id,
-                    'amount': -remaining_cost,
-                    'type': 'order_placed',
-                    'description': f'Placed {side} order for {remaining_size} {token} shares',
-                    'market_id': market_id,
-                    'order_id': order_id,
-                    'created_at': datetime.now(timezone.utc).isoformat()
-                }).execute()
-                print(f"DEBUG: Transaction recorded successfully")
-            except Exception as e:
-                print(f"Error recording transaction: {e}")
+            writes.insert('transactions', {
+                'user_id': user_id,
+                'amount': to_dollars(-remaining_cost),
+                'type': 'order_placed',
+                'description': f'Placed {side} order for {remaining_size} {token} shares',
+                'market_id': market_id,
+                'order_id': order_id,
+                'created_at': datetime.now(timezone.utc).isoformat()
+            })
         
         return jsonify({
             'success': True,
-            'order': order_resp.data[0],
-            'trades': [],
+            'order': new_order,
+            'trades': [dict(trade, quantity=trade['size']) for trade in trades],
             'filled_amount': filled_amount,
             'remaining_size': remaining_size
         })
         
+    except WritesPending as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         import traceback; traceback.print_exc()
         return jsonify({'error': f'Order placement failed: {str(e)}'}), 500
@@ -352,164 +347,270 @@ def place_order(market_id):
 
 @trading_bp.route('/api/markets/<market_id>/orderbook', methods=['GET'])
 def get_orderbook(market_id):
-    """Get current orderbook state"""
+    """Get current orderbook depth from the in-memory book, answering 304 when
+    the client's ETag still matches"""
     try:
-        supabase = app.supabase
+        return engine_orderbook_response(market_id)
+    except WritesPending as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        return jsonify({'error': f'Failed to get orderbook: {str(e)}'}), 500
+
+@trading_bp.route('/api/markets/<market_id>/quote', methods=['GET'])
+def quote_order(market_id):
+    """Price an order of a given size from the in-memory orderbook, without
+    placing it. Query args: side, token, size and, optionally, a limit price."""
+    try:
+        side = request.args.get('side', '').lower()
+        token = request.args.get('token', '').upper()
+        if side not in ['buy', 'sell']:
+            return jsonify({'error': 'Side must be buy or sell'}), 400
+        if token not in ['YES', 'NO']:
+            return jsonify({'error': 'Token must be YES or NO'}), 400
+        
+        try:
+            size = to_shares(request.args['size'])
+            price = to_cents(request.args['price']) if request.args.get('price') else None
+        except KeyError:
+            return jsonify({'error': 'Missing size'}), 400
+        except ValueError as e:
+            return jsonify({'error': f'Invalid price or size: {e}'}), 400
+        if size <= 0:
+            return jsonify({'error': 'Size must be a positive whole number of shares'}), 400
         
-        # Check if market exists
-        market_resp = supabase.table('markets').select('id').eq('id', market_id).single().execute()
-        if not market_resp.data:
+        market = app.repos.markets.get(market_id, 'tick_size')
+        if not market:
             return jsonify({'error': 'Market not found'}), 404
+        error = price_error(price, tick_size_of(market)) if price is not None else None
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Get active orders from database
-        orders_resp = supabase.table('orders').select('*').eq('market_id', market_id).eq('status', 'open').execute()
-        orders = orders_resp.data if orders_resp.data else []
-        
-        # Organize orders by token and side
-        # Based on your schema: side = token type (YES/NO), token = direction (BUY/SELL)
-        yes_bids = []
-        yes_asks = []
-        no_bids = []
-        no_asks = []
-        
-        for order in orders:
-            remaining_size = float(order['size']) - float(order.get('filled', 0))
-            if remaining_size <= 0:
-                continue
-                
-            order_info = {
-                'price': float(order['price']),
-                'size': remaining_size,
-                'user_id': order['user_id'],
-                'order_id': order['id']
-            }
-            
-            # side = token type (YES/NO), token = direction (BUY/SELL)
-            if order['side'] == 'YES':  # YES token orders
-                if order['token'] == 'BUY':  # Buying YES tokens
-                    yes_bids.append(order_info)
-                else:  # Selling YES tokens
-                    yes_asks.append(order_info)
-            else:  # NO token orders (side == 'NO')
-                if order['token'] == 'BUY':  # Buying NO tokens
-                    no_bids.append(order_info)
-                else:  # Selling NO tokens
-                    no_asks.append(order_info)
-        
-        # Sort orders (bids descending, asks ascending)
-        yes_bids.sort(key=lambda x: x['price'], reverse=True)
-        yes_asks.sort(key=lambda x: x['price'])
-        no_bids.sort(key=lambda x: x['price'], reverse=True)
-        no_asks.sort(key=lambda x: x['price'])
+        orderbook = get_or_create_orderbook(market_id)
+        if orderbook is None:
+            return jsonify({'error': 'Market not found'}), 404
         
+        quote = quote_engine_order(orderbook, side, token, size, price)
         return jsonify({
             'success': True,
-            'orderbook': {
-                'yes_token': {
-                    'bids': yes_bids,
-                    'asks': yes_asks
-                },
-                'no_token': {
-                    'bids': no_bids,
-                    'asks': no_asks
-                }
-            }
+            'quote': dict(quote, side=side, token=token, size=size,
+                          price=None if price is None else to_dollars(price))
         })
-            
+        
+    except WritesPending as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         import traceback; traceback.print_exc()
-        return jsonify({'error': f'Failed to get orderbook: {str(e)}'}), 500
+        return jsonify({'error': f'Failed to quote order: {str(e)}'}), 500
 
 @trading_bp.route('/api/markets/<market_id>/cancel/<order_id>', methods=['DELETE'])
 @login_required
 def cancel_order(market_id, order_id):
     """Cancel an order"""
     try:
-        supabase = app.supabase
+        repos = app.repos
+        writes = app.writes
         
         # Get user info
         user_id = get_current_user_id()
         
-        # Get order details
-        order_resp = supabase.table('orders').select('*').eq('id', order_id).eq('user_id', user_id).single().execute()
-        if not order_resp.data:
+        # Get order details, with the user's queued writes landed first
+        if not writes.flush():
+            return jsonify({'error': 'Recent trades are still being recorded, try again'}), 503
+        order = repos.orders.find(order_id, user_id=user_id)
+        if not order:
             return jsonify({'error': 'Order not found or not owned by user'}), 404
         
-        order = order_resp.data
-        
         # Check if order is cancellable
         if order['status'] != 'open':
             return jsonify({'error': 'Order cannot be cancelled'}), 400
         
-        # Cancel in C++ orderbook if available
-        if ORDERBOOK_AVAILABLE:
-            orderbook = get_or_create_orderbook(market_id)
-            if orderbook:
-                try:
-                    import orderbook_cpp as ob
-                    orderbook.cancel_order(order_id)
-                except Exception as e:
-                    print(f"Failed to cancel order in C++ orderbook: {e}")
+        if not writes.has_room():
+            return jsonify({'error': 'Too many orders are waiting to be recorded, try again'}), 503
         
-        # Update order status in database
-        update_resp = supabase.table('orders').update({
-            'status': 'cancelled'
-        }).eq('id', order_id).execute()
+        # Cancel in the C++ orderbook (engine orders are keyed by DB id). The
+        # order may have traded since it was read, so what is refunded is
+        # what the engine actually took off the book.
+        orderbook = get_or_create_orderbook(market_id)
+        if orderbook is None:
+            return jsonify({'error': 'Market not found'}), 404
+        remaining_size = orderbook.cancel_order(order_id)
+        if not remaining_size:
+            return jsonify({'error': 'Order is no longer open'}), 400
         
-        if not update_resp.data:
-            return jsonify({'error': 'Failed to cancel order'}), 500
+        # Update order status in database
+        writes.update('orders', order_id, {'status': 'cancelled'})
         
         # Refund user balance for buy orders
-        # Remember: side = token type (YES/NO), token = direction (BUY/SELL)
-        if order['token'] == 'BUY':  # This was a buy order
-            remaining_size = float(order['size']) - float(order.get('filled', 0))
+        if order['side'] == 'buy':  # This was a buy order
             if remaining_size > 0:
-                token_type = order['side']  # YES or NO
-                price = float(order['price'])
-                refund_amount = price * remaining_size if token_type == 'YES' else (1 - price) * remaining_size
+                refund_amount = to_cents(order['price']) * remaining_size
                 
-                # Add refund to user balance
-                user_resp = supabase.table('users').select('balance').eq('id', user_id).single().execute()
-                if user_resp.data:
-                    current_balance = float(user_resp.data['balance'])
-                    new_balance = current_balance + refund_amount
-                    
-                    supabase.table('users').update({
-                        'balance': new_balance
-                    }).eq('id', user_id).execute()
-                    
-                    # Record refund transaction
-                    admin_client = getattr(app, 'supabase_admin', supabase)
-                    try:
-                        admin_client.table('transactions').insert({
-                            'user_id': user_id,
-                            'amount': refund_amount,
-                            'type': 'order_cancelled',
-                            'description': f'Order cancellation refund',
-                            'market_id': market_id,
-                            'order_id': order_id,
-                            'created_at': datetime.now(timezone.utc).isoformat()
-                        }).execute()
-                    except Exception as e:
-                        print(f"Error recording refund transaction: {e}")
+                # Add refund to user balance and record the refund transaction
+                deduct_user_balance(user_id, -refund_amount, writes)
+                writes.insert('transactions', {
+                    'user_id': user_id,
+                    'amount': to_dollars(refund_amount),
+                    'type': 'order_cancelled',
+                    'description': f'Order cancellation refund',
+                    'market_id': market_id,
+                    'order_id': order_id,
+                    'created_at': datetime.now(timezone.utc).isoformat()
+                })
         
         return jsonify({
             'success': True,
             'message': f'Order {order_id} cancelled',
-            'order': update_resp.data[0]
+            'order': dict(order, status='cancelled')
         })
         
+    except WritesPending as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         import traceback; traceback.print_exc()
         return jsonify({'error': f'Failed to cancel order: {str(e)}'}), 500
 
+@trading_bp.route('/api/markets/<market_id>/orders/<order_id>', methods=['PATCH'])
+@login_required
+def amend_order(market_id, order_id):
+    """Change an open order's price and/or size without cancelling it.
+    Shrinking it at the same price keeps its place in the queue; a new
+    price may trade straight away like a fresh order."""
+    try:
+        data = request.get_json() or {}
+        if 'price' not in data and 'size' not in data:
+            return jsonify({'error': 'Nothing to amend: give a new price and/or size'}), 400
+        
+        repos = app.repos
+        writes = app.writes
+        user_id = get_current_user_id()
+        
+        # The order as it stands, with the user's queued writes landed first
+        if not writes.flush():
+            return jsonify({'error': 'Recent trades are still being recorded, try again'}), 503
+        order = repos.orders.find(order_id, user_id=user_id, market_id=market_id)
+        if not order:
+            return jsonify({'error': 'Order not found or not owned by user'}), 404
+        
+        if order['status'] != 'open':
+            return jsonify({'error': 'Order cannot be amended'}), 400
+        
+        old_price = to_cents(order['price'])
+        filled = to_shares(order.get('filled', 0))
+        old_remaining = to_shares(order['size']) - filled
+        try:
+            price = to_cents(data['price']) if 'price' in data else old_price
+            size = to_shares(data.get('size', order['size']))  # new total size, fills included
+        except ValueError as e:
+            return jsonify({'error': f'Invalid price or size: {e}'}), 400
+        
+        remaining_size = size - filled
+        if remaining_size <= 0:
+            return jsonify({'error': f'Size must be more than the {filled} shares already filled'}), 400
+        
+        market = repos.markets.get(market_id, 'status, tick_size')
+        if not market:
+            return jsonify({'error': 'Market not found'}), 404
+        if market['status'] != 'active':
+            return jsonify({'error': 'Market is not active for trading'}), 400
+        
+        error = price_error(price, tick_size_of(market))
+        if error:
+            return jsonify({'error': error}), 400
+        
+        orderbook = get_or_create_orderbook(market_id)
+        if orderbook is None:
+            return jsonify({'error': 'Market not found'}), 404
+        
+        # A resting buy has paid for its open shares at its own price; only
+        # the difference to the amended order is charged or refunded. Shares
+        # filling before the engine amend only lower the charge at a higher
+        # price, so a lower one is checked as if all of them fill.
+        if order['side'] == 'buy':
+            extra_cost = max(price * remaining_size - old_price * old_remaining,
+                             price * (remaining_size - old_remaining))
+            if extra_cost > 0:
+                user_balance = available_balance(user_id, repos)
+                if user_balance is None or user_balance < extra_cost:
+                    return jsonify({'error': 'Insufficient balance'}), 400
+        elif remaining_size > old_remaining:
+            position = available_position(user_id, market_id, repos) or (0, 0)
+            available_shares = position[0] if order['token'] == 'YES' else position[1]
+            # Other resting sells keep their shares; this order's own are being re-promised
+            available_shares -= committed_sell_shares(orderbook, user_id, order['token']) - old_remaining
+            if available_shares < remaining_size:
+                return jsonify({'error': f"Insufficient {order['token']} shares. You have {available_shares}"}), 400
+        
+        if not writes.has_room():
+            return jsonify({'error': 'Too many orders are waiting to be recorded, try again'}), 503
+        
+        # Amend in the C++ orderbook (engine orders are keyed by DB id). The
+        # order may have traded as a maker since it was read; the engine takes
+        # those shares off the new size under its lock and reports what was
+        # really open, which the rest of the amend is worked out from.
+        fills, previous_remaining = [], old_remaining
+        try:
+            amended = amend_engine_order(orderbook, order_id, price, remaining_size, old_remaining)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if amended is None:
+            print(f"Order {order_id} was not resting in the C++ orderbook")
+        else:
+            fills, previous_remaining = amended
+        filled_since = old_remaining - previous_remaining
+        open_size = remaining_size - filled_since
+        filled_now = sum(fill['quantity'] for fill in fills)
+        
+        # New terms for the order row; fills, the maker ones that raced the
+        # amend included, go in as increments so none is overwritten
+        update = {'price': to_dollars(price), 'size': size}
+        writes.update('orders', order_id, update)
+        if filled_now:
+            writes.add_filled(order_id, filled_now)
+        filled_total = filled + filled_since + filled_now
+        update['filled'] = filled_total
+        if filled_total >= size:
+            update['status'] = 'filled'
+        
+        trades = settle_fills(market_id, fills, writes) if fills else []
+        if trades:
+            update_market_stats(market_id, trades, writes)
+        
+        # Fills were charged at their execution price by settle_fills; what
+        # still rests is reserved at the new price
+        if order['side'] == 'buy':
+            balance_change = price * (open_size - filled_now) - old_price * previous_remaining
+            if balance_change:
+                deduct_user_balance(user_id, balance_change, writes)
+                writes.insert('transactions', {
+                    'user_id': user_id,
+                    'amount': to_dollars(-balance_change),
+                    'type': 'order_amended',
+                    'description': f'Amended buy order to {size} {order["token"]} shares at {to_dollars(price):.2f}',
+                    'market_id': market_id,
+                    'order_id': order_id,
+                    'created_at': datetime.now(timezone.utc).isoformat()
+                })
+        
+        return jsonify({
+            'success': True,
+            'order': dict(order, **update),
+            'trades': [dict(trade, quantity=trade['size']) for trade in trades],
+            'filled_amount': filled_now,
+            'remaining_size': open_size - filled_now
+        })
+        
+    except WritesPending as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        return jsonify({'error': f'Failed to amend order: {str(e)}'}), 500
+
 @trading_bp.route('/api/user/orders', methods=['GET'])
 @login_required
 def get_user_orders():
     """Get all orders for the current user"""
     try:
-        supabase = app.supabase
-        
         # Get user info
         user_id = get_current_user_id()
         
@@ -517,48 +618,88 @@ def get_user_orders():
         market_id = request.args.get('market_id')
         status = request.args.get('status')
         
-        # Build query
-        query = supabase.table('orders').select('*').eq('user_id', user_id)
+        if not app.writes.flush():
+            return jsonify({'error': 'Recent trades are still being recorded, try again'}), 503
+        orders = app.repos.orders.for_user(user_id, market_id=market_id, status=status)
         
-        if market_id:
-            query = query.eq('market_id', market_id)
+        return jsonify({
+            'success': True,
+            'orders': orders
+        })
         
-        if status:
-            query = query.eq('status', status)
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        return jsonify({'error': f'Failed to get user orders: {str(e)}'}), 500
+
+@trading_bp.route('/api/user/orders', methods=['DELETE'])
+@login_required
+def cancel_user_orders():
+    """Cancel all of the current user's open orders, optionally only in one market (?market_id=)"""
+    try:
+        repos = app.repos
+        writes = app.writes
+        user_id = get_current_user_id()
+        market_id = request.args.get('market_id')
         
-        # Execute query with ordering
-        orders_resp = query.order('created_at', desc=True).execute()
-        orders = orders_resp.data if orders_resp.data else []
+        # Orders the user just placed are in the database before looking for them
+        if not writes.flush():
+            return jsonify({'error': 'Recent trades are still being recorded, try again'}), 503
+        if not writes.has_room():
+            return jsonify({'error': 'Too many orders are waiting to be recorded, try again'}), 503
+        
+        # The engine indexes resting orders by user, so it cancels them
+        # without a query and reports exactly what it took off the book
+        cancelled = cancel_engine_user_orders(user_id, market_id)
+        
+        order_ids = [order['id'] for orders in cancelled.values() for order in orders]
+        if order_ids:
+            writes.update_many('orders', order_ids, {'status': 'cancelled'}, [('status', 'eq', 'open')])
+        
+        # Resting buys paid for their open shares up front; refund them in one balance update
+        now = datetime.now(timezone.utc).isoformat()
+        refund_cents = [(cancelled_market, order['id'], order['price'] * order['remaining'])
+                        for cancelled_market, orders in cancelled.items() for order in orders
+                        if order['side'] == 'buy' and order['remaining'] > 0]
+        refunds = [{
+            'user_id': user_id,
+            'amount': to_dollars(amount),
+            'type': 'order_cancelled',
+            'description': 'Order cancellation refund',
+            'market_id': cancelled_market,
+            'order_id': order_id,
+            'created_at': now
+        } for cancelled_market, order_id, amount in refund_cents]
+        total_refund = sum(amount for _, _, amount in refund_cents)
+        if total_refund:
+            deduct_user_balance(user_id, -total_refund, writes)
+            writes.insert('transactions', refunds)
         
         return jsonify({
             'success': True,
-            'orders': orders
+            'cancelled': len(order_ids),
+            'order_ids': order_ids,
+            'refund': to_dollars(total_refund)
         })
         
+    except WritesPending as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         import traceback; traceback.print_exc()
-        return jsonify({'error': f'Failed to get user orders: {str(e)}'}), 500
+        return jsonify({'error': f'Failed to cancel orders: {str(e)}'}), 500
 
 @trading_bp.route('/api/user/positions', methods=['GET'])
 @login_required
 def get_user_positions():
     """Get all positions for the current user"""
     try:
-        supabase = app.supabase
-        
         # Get user info
         user_id = get_current_user_id()
         
         market_id = request.args.get('market_id')
         
-        # Build query
-        query = supabase.table('positions').select('*').eq('user_id', user_id)
-        
-        if market_id:
-            query = query.eq('market_id', market_id)
-        
-        positions_resp = query.execute()
-        positions = positions_resp.data if positions_resp.data else []
+        if not app.writes.flush():
+            return jsonify({'error': 'Recent trades are still being recorded, try again'}), 503
+        positions = app.repos.positions.for_user(user_id, market_id=market_id)
         
         return jsonify({
             'success': True,
@@ -573,18 +714,20 @@ def get_user_positions():
 def get_user_balance():
     """Get current user balance"""
     try:
-        supabase = app.supabase
+        repos = app.repos
         
         # Get user info
         user_id = get_current_user_id()
         
+        if not app.writes.flush():
+            return jsonify({'error': 'Recent trades are still being recorded, try again'}), 503
         try:
-            user_resp = supabase.table('users').select('balance, total_volume').eq('id', user_id).single().execute()
-            if user_resp.data:
+            user = repos.users.get(user_id, 'balance, total_volume')
+            if user:
                 return jsonify({
                     'success': True,
-                    'balance': float(user_resp.data['balance']),
-                    'total_volume': float(user_resp.data.get('total_volume', 0))
+                    'balance': to_dollars(to_cents(user['balance'])),
+                    'total_volume': to_dollars(to_cents(user.get('total_volume') or 0))
                 })
         except Exception as e:
             # User doesn't exist in database, create default profile
@@ -593,26 +736,25 @@ def get_user_balance():
         # Create default user profile
         try:
             # Get user email from auth
-            user_info = app.supabase.auth.get_user(request.cookies.get('access_token'))
-            user_email = getattr(user_info, 'user', {}).get('email', '')
+            user_email = ''
+            if app.supabase:
+                user_info = app.supabase.auth.get_user(request.cookies.get('access_token'))
+                user_email = getattr(user_info, 'user', {}).get('email', '')
             username = user_email.split('@')[0] if user_email else f'user_{user_id[:8]}'
             
-            # Use admin client to bypass RLS policies
-            admin_client = getattr(app, 'supabase_admin', supabase)
-            
             # Insert default user profile
-            admin_client.table('users').insert({
+            repos.users.insert({
                 'id': user_id,  # Changed back to 'id'
                 'username': username,
                 'display_name': username,
-                'balance': 1000.00,  # Starting balance
+                'balance': to_dollars(STARTING_BALANCE),
                 'total_volume': 0.0,
                 'created_at': datetime.now(timezone.utc).isoformat()
-            }).execute()
+            })
             
             return jsonify({
                 'success': True,
-                'balance': 1000.00,
+                'balance': to_dollars(STARTING_BALANCE),
                 'total_volume': 0.0
             })
             
@@ -621,7 +763,7 @@ def get_user_balance():
             # Return default values if creation fails
             return jsonify({
                 'success': True,
-                'balance': 1000.00,
+                'balance': to_dollars(STARTING_BALANCE),
                 'total_volume': 0.0
             })
         
@@ -633,15 +775,12 @@ def get_user_balance():
 def get_market_trades(market_id):
     """Get recent trades for a market"""
     try:
-        supabase = app.supabase
-        
         # Get query parameters
         limit = int(request.args.get('limit', 50))
         offset = int(request.args.get('offset', 0))
         
         # Get trades for this market
-        trades_resp = supabase.table('trades').select('*').eq('market_id', market_id).order('created_at', desc=True).limit(limit).offset(offset).execute()
-        trades = trades_resp.data if trades_resp.data else []
+        trades = app.repos.trades.for_market(market_id, limit=limit, offset=offset)
         
         return jsonify({
             'success': True,
@@ -653,125 +792,91 @@ def get_market_trades(market_id):
 
 # Helper Functions
 
-def update_user_position(user_id, market_id, token_type, direction, size, price, supabase):
+def update_user_position(user_id, market_id, token_type, direction, size, price, writes):
     """
-    Update user position after a trade
+    Queue the change to a user's position from a trade
     token_type: 'YES' or 'NO' 
     direction: 'buy' or 'sell'
     """
-    try:
-        # Get existing position
-        position_resp = supabase.table('positions').select('*').eq('user_id', user_id).eq('market_id', market_id).single().execute()
-        
-        if position_resp.data:
-            # Update existing position
-            position = position_resp.data
-            yes_shares = float(position.get('yes_shares', 0))
-            no_shares = float(position.get('no_shares', 0))
-            
-            if direction == 'buy':
-                if token_type == 'YES':
-                    yes_shares += size
-                else:
-                    no_shares += size
-            else:  # sell
-                if token_type == 'YES':
-                    yes_shares -= size
-                else:
-                    no_shares -= size
-            
-            supabase.table('positions').update({
-                'yes_shares': max(0, yes_shares),
-                'no_shares': max(0, no_shares),
-                'updated_at': datetime.now(timezone.utc).isoformat()
-            }).eq('user_id', user_id).eq('market_id', market_id).execute()
-        else:
-            # Create new position
-            yes_shares = size if (direction == 'buy' and token_type == 'YES') else 0
-            no_shares = size if (direction == 'buy' and token_type == 'NO') else 0
-            
-            supabase.table('positions').insert({
-                'user_id': user_id,
-                'market_id': market_id,
-                'yes_shares': yes_shares,
-                'no_shares': no_shares,
-                'updated_at': datetime.now(timezone.utc).isoformat()
-            }).execute()
-            
-    except Exception as e:
-        print(f"Error updating user position: {e}")
+    shares = size if direction == 'buy' else -size
+    if token_type == 'YES':
+        writes.add_shares(user_id, market_id, yes_shares=shares)
+    else:
+        writes.add_shares(user_id, market_id, no_shares=shares)
 
-def update_user_balances(taker_id, maker_id, taker_direction, size, price, token_type, supabase):
+def update_user_balances(taker_id, maker_id, taker_direction, size, price, token_type, writes):
     """
     Update user balances after a trade
     taker_direction: 'buy' or 'sell'
     token_type: 'YES' or 'NO'
+    price: cents, size: whole shares
     """
-    try:
-        trade_value = price * size if token_type == 'YES' else (1 - price) * size
-        
-        if taker_direction == 'buy':
-            # Maker (seller) receives payment
-            maker_resp = supabase.table('users').select('balance').eq('id', maker_id).single().execute()
-            if maker_resp.data:
-                maker_balance = float(maker_resp.data['balance'])
-                supabase.table('users').update({
-                    'balance': maker_balance + trade_value
-                }).eq('id', maker_id).execute()
-        else:
-            # Taker (seller) receives payment
-            taker_resp = supabase.table('users').select('balance').eq('id', taker_id).single().execute()
-            if taker_resp.data:
-                taker_balance = float(taker_resp.data['balance'])
-                supabase.table('users').update({
-                    'balance': taker_balance + trade_value
-                }).eq('id', taker_id).execute()
-                
-    except Exception as e:
-        print(f"Error updating user balances: {e}")
+    trade_value = price * size if token_type == 'YES' else (PAYOUT - price) * size
+    # The seller receives payment: the maker when the taker buys, else the taker
+    deduct_user_balance(maker_id if taker_direction == 'buy' else taker_id, -trade_value, writes)
 
-def deduct_user_balance(user_id, amount, supabase):
-    """Deduct amount from user balance"""
-    try:
-        user_resp = supabase.table('users').select('balance').eq('id', user_id).single().execute()
-        if user_resp.data:
-            current_balance = float(user_resp.data['balance'])
-            new_balance = current_balance - amount
-            supabase.table('users').update({
-                'balance': new_balance
-            }).eq('id', user_id).execute()
-    except Exception as e:
-        print(f"Error deducting user balance: {e}")
-
-def update_market_stats(market_id, trades, supabase):
-    """Update market statistics after trades"""
-    try:
-        # Calculate total volume from trades
-        total_trade_volume = sum(float(trade['size']) * float(trade['price']) for trade in trades)
+def settle_fills(market_id, fills, writes):
+    """
+    Queue the database side of engine fills (see decode_fills): maker order
+    progress, both users' positions and balances, and the trades table.
+    The taker's own order row is written by the caller.
+    Returns the trade rows as they will be recorded.
+    """
+    trades = []
+    now = datetime.now(timezone.utc).isoformat()
+    
+    for fill in fills:
+        quantity = fill['quantity']
+        token = fill['token']
+        taker_side = fill['side']
+        # The maker trades the other side of the same token, or, for a mint,
+        # buys the complementary token
+        if fill['mint']:
+            maker_token, maker_side = ('NO' if token == 'YES' else 'YES'), 'buy'
+        else:
+            maker_token, maker_side = token, ('sell' if taker_side == 'buy' else 'buy')
         
-        # Get latest trade price for market price update
-        latest_trade = trades[-1]
-        latest_price = float(latest_trade['price'])
+        writes.add_filled(fill['maker_order_id'], quantity)
+        update_user_position(fill['taker_user_id'], market_id, token, taker_side, quantity, fill['taker_price'], writes)
+        update_user_position(fill['maker_user_id'], market_id, maker_token, maker_side, quantity, fill['maker_price'], writes)
         
-        # Update market
-        market_resp = supabase.table('markets').select('total_volume').eq('id', market_id).single().execute()
-        if market_resp.data:
-            current_volume = float(market_resp.data.get('total_volume', 0))
-            
-            # Update market prices based on latest trade
-            update_data = {
-                'total_volume': current_volume + total_trade_volume
-            }
-            
-            # Update prices based on the token that was traded
-            if latest_trade.get('token') == 'YES':
-                update_data['yes_price'] = latest_price
-                update_data['no_price'] = 1 - latest_price
-            else:
-                update_data['no_price'] = latest_price
-                update_data['yes_price'] = 1 - latest_price
-            
-            supabase.table('markets').update(update_data).eq('id', market_id).execute()
-            
-    except Exception as e:
-        print(f"Error updating market stats: {e}")
\ No newline at end of file
+        # A resting buy already paid for itself at its own price, which is
+        # the maker's execution price; the taker pays or is paid now
+        taker_value = fill['taker_price'] * quantity
+        deduct_user_balance(fill['taker_user_id'], taker_value if taker_side == 'buy' else -taker_value, writes)
+        if maker_side == 'sell':
+            deduct_user_balance(fill['maker_user_id'], -fill['maker_price'] * quantity, writes)
+        
+        taker_is_buyer = taker_side == 'buy'
+        trades.append({
+            'market_id': market_id,
+            'buyer_order_id': fill['taker_order_id'] if taker_is_buyer else fill['maker_order_id'],
+            'seller_order_id': fill['maker_order_id'] if taker_is_buyer else fill['taker_order_id'],
+            'buyer_id': fill['taker_user_id'] if taker_is_buyer else fill['maker_user_id'],
+            'seller_id': fill['maker_user_id'] if taker_is_buyer else fill['taker_user_id'],
+            'token': token,
+            'price': to_dollars(fill['taker_price']),
+            'size': quantity,
+            'match_type': 'mint' if fill['mint'] else 'direct',
+            'created_at': now
+        })
+    
+    # All of the order's trades in one insert
+    writes.insert('trades', trades)
+    return trades
+
+def deduct_user_balance(user_id, amount, writes):
+    """Queue deducting amount (cents) from user balance (a negative amount credits it)"""
+    writes.add_balance(user_id, -amount)
+
+def update_market_stats(market_id, trades, writes):
+    """Queue the market's volume and price update after trades"""
+    # Calculate total volume from trades
+    total_trade_volume = sum(to_shares(trade['size']) * to_cents(trade['price']) for trade in trades)
+    
+    # The latest trade sets the market price, seen from the YES token
+    latest_trade = trades[-1]
+    latest_price = to_cents(latest_trade['price'])
+    yes_price = latest_price if latest_trade.get('token') == 'YES' else PAYOUT - latest_price
+    
+    writes.add_trades(market_id, total_trade_volume, yes_price)
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, render_template, g, current_app, redirect, url_for, make_response, flash
 from api.auth import login_required, get_current_user_id
 from datetime import datetime, timezone
+from api.units import STARTING_BALANCE, to_cents, to_dollars
 
 def get_user_dict(user_obj):
     if user_obj is None:
@@ -47,7 +48,7 @@ def profile():
     user_id = getattr(user, 'id', None)
     user_email = getattr(user, 'email', None)
     username = user_email.split('@')[0] if user_email else f'user_{str(user_id)[:8]}'
-    supabase = current_app.supabase
+    repos = current_app.repos
 
     user_profile = None
     balance = None
@@ -58,42 +59,40 @@ def profile():
 
     if user_id:
         try:
-            profile_resp = supabase.table('users').select('*').eq('id', user_id).single().execute()
-            if not getattr(profile_resp, 'data', None):
+            # The user's queued trade writes land first, as for /api/user/balance
+            if not current_app.writes.flush():
+                return "Recent trades are still being recorded, try again", 503
+            # The profile row carries the balance too, so one read serves both
+            profile_row = repos.users.get(user_id)
+            if not profile_row:
                 # Try to create the user row if missing
-                supabase.table('users').insert({
+                created = repos.users.insert({
                     'id': user_id,  # Changed back to 'id'
                     'username': username,
                     'display_name': username,
-                }).execute()
-                profile_resp = supabase.table('users').select('*').eq('id', user_id).single().execute()
-            if getattr(profile_resp, 'data', None):
-                user_profile = profile_resp.data
-            else:
-                user_profile = {'id': user_id, 'username': username, 'email': user_email}
+                })
+                profile_row = created[0] if created else None
+            user_profile = profile_row or {'id': user_id, 'username': username, 'email': user_email}
         except Exception as e:
+            profile_row = None
             user_profile = {'id': user_id, 'username': username, 'email': user_email}
         try:
-            balance_resp = supabase.table('users').select('balance').eq('id', user_id).single().execute()
-            if balance_resp.data and 'balance' in balance_resp.data:
-                balance = balance_resp.data['balance']
+            if profile_row and profile_row.get('balance') is not None:
+                balance = to_dollars(to_cents(profile_row['balance']))
             else:
-                balance = 1000.00
+                balance = to_dollars(STARTING_BALANCE)
         except Exception as e:
-            balance = 1000.00
+            balance = to_dollars(STARTING_BALANCE)
         try:
-            pos_resp = supabase.table('positions').select('*').eq('user_id', user_id).limit(5).execute()
-            positions = pos_resp.data if hasattr(pos_resp, 'data') and pos_resp.data else []
+            positions = repos.positions.for_user(user_id, limit=5)
         except Exception as e:
             errors.append(f'Error fetching positions: {e}')
         try:
-            notif_resp = supabase.table('notifications').select('*').eq('user_id', user_id).order('created_at', desc=True).limit(5).execute()
-            notifications = notif_resp.data if hasattr(notif_resp, 'data') and notif_resp.data else []
+            notifications = repos.notifications.recent(user_id, limit=5)
         except Exception as e:
             errors.append(f'Error fetching notifications: {e}')
         try:
-            tx_resp = supabase.table('transactions').select('*').eq('user_id', user_id).order('created_at', desc=True).limit(5).execute()
-            transactions = tx_resp.data if hasattr(tx_resp, 'data') and tx_resp.data else []
+            transactions = repos.transactions.recent(user_id, limit=5)
         except Exception as e:
             errors.append(f'Error fetching transactions: {e}')
     else:
@@ -165,29 +164,25 @@ def signup():
             username = email.split('@')[0] if email else f'user_{user_id[:8]}'
             try:
                 # Use upsert to avoid conflicts if user already exists
-                # Use admin client to bypass RLS policies
-                admin_client = getattr(current_app, 'supabase_admin', current_app.supabase)
-                
-                admin_client.table('users').upsert({
+                current_app.repos.users.upsert({
                     'id': user_id,  # Changed back to 'id'
                     'username': username,
                     'display_name': username,
-                    'balance': 1000.00,  # Starting balance
+                    'balance': to_dollars(STARTING_BALANCE),
                     'total_volume': 0.0,
                     'created_at': datetime.now(timezone.utc).isoformat()
-                }).execute()
+                })
                 print(f"Successfully created user profile for {user_id}")
             except Exception as db_error:
                 # Log the error but don't fail the signup
                 print(f"Error creating user profile: {db_error}")
                 # Try again with just the essential fields
                 try:
-                    admin_client = getattr(current_app, 'supabase_admin', current_app.supabase)
-                    admin_client.table('users').upsert({
+                    current_app.repos.users.upsert({
                         'id': user_id,  # Changed back to 'id'
                         'username': username,
-                        'balance': 1000.00
-                    }).execute()
+                        'balance': to_dollars(STARTING_BALANCE)
+                    })
                     print(f"Created minimal user profile for {user_id}")
                 except Exception as retry_error:
                     print(f"Failed to create even minimal user profile: {retry_error}")
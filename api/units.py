@@ -0,0 +1,60 @@
+"""Fixed-point units shared by the routes, the matching engine and the database.
+
+Prices are integer cents per share, the engine's own price unit (a market's
+tick size is a whole number of cents). Quantities are whole shares. Money -
+balances, costs, refunds, payouts, volume - is integer cents, so price x size
+is exact. Dollars only exist at the edges: request JSON, the numeric columns
+in the database and response JSON. They are converted there through Decimal,
+never by multiplying a binary float.
+"""
+from decimal import Decimal, InvalidOperation
+
+CENTS_PER_DOLLAR = 100
+PAYOUT = 100  # cents a winning share pays out
+MIN_PRICE = 1
+MAX_PRICE = 99
+DEFAULT_TICK_SIZE = 1
+STARTING_BALANCE = 100_000  # $1,000.00
+
+def _decimal(value):
+    # str() of a float is its shortest repr, so 0.29 parses as 0.29, not 0.28999...
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"not a number: {value!r}")
+    if not number.is_finite():
+        raise ValueError(f"not a number: {value!r}")
+    return number
+
+def to_cents(dollars):
+    """Dollars (a JSON number or a numeric string) as integer cents.
+    Raises ValueError unless it is a whole number of cents."""
+    cents = _decimal(dollars) * CENTS_PER_DOLLAR
+    if cents != cents.to_integral_value():
+        raise ValueError(f"not a whole number of cents: {dollars!r}")
+    return int(cents)
+
+def to_shares(value):
+    """A share count from JSON or the database. Raises ValueError unless it is whole"""
+    shares = _decimal(value)
+    if shares != shares.to_integral_value():
+        raise ValueError(f"not a whole number of shares: {value!r}")
+    return int(shares)
+
+def to_dollars(cents):
+    """Integer cents as dollars for JSON and numeric columns. cents / 100 is the
+    double nearest the exact decimal, so it serializes as e.g. 0.29"""
+    return cents / CENTS_PER_DOLLAR
+
+def tick_size_of(market):
+    """A market row's tick size in cents (the column is in dollars, default one cent)"""
+    tick_size = market.get('tick_size')
+    return DEFAULT_TICK_SIZE if tick_size is None else to_cents(tick_size)
+
+def price_error(price, tick_size=DEFAULT_TICK_SIZE):
+    """Why a price in cents cannot trade on a market with this tick size, or None"""
+    if not MIN_PRICE <= price <= MAX_PRICE:
+        return f'Price must be between {to_dollars(MIN_PRICE):.2f} and {to_dollars(MAX_PRICE):.2f}'
+    if price % tick_size:
+        return f'Price must be a multiple of the tick size {to_dollars(tick_size):.2f}'
+    return None
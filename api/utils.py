@@ -1,9 +1,16 @@
+import mmap
 import os
+import struct
 import sys
-from flask import current_app
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, jsonify, request
 from datetime import datetime, timezone
 import uuid
-from supabase import create_client, Client
+from api.repositories import WritesPending
+from api.units import PAYOUT, STARTING_BALANCE, tick_size_of, to_cents, to_dollars, to_shares
 
 # Add orderbook folder to Python path
 orderbook_path = os.path.join(os.path.dirname(__file__), 'orderbook')
@@ -11,270 +18,783 @@ sys.path.append(orderbook_path)
 
 try:
     import orderbook_cpp as ob
-    ORDERBOOK_AVAILABLE = True
 except ImportError as e:
-    ORDERBOOK_AVAILABLE = False
-    print(f"Warning: C++ orderbook not available: {e}")
+    # Same interface and byte formats, so snapshots and journals carry over
+    print(f"Warning: C++ orderbook not available ({e}); using the pure-Python engine")
+    import orderbook_py as ob
+
+def new_orderbook(market):
+    """Create an engine book on the market's tick size"""
+    return ob.Orderbook(tick_size=tick_size_of(market))
+
+def decode_fills(fills):
+    """Unpack engine fill records (ob.FILL_RECORD_FORMAT) into dicts, prices in cents"""
+    decoded = []
+    for (_, _, _, taker_price, maker_price, quantity, token, side, match_type,
+         taker_order_id, maker_order_id, taker_user_id, maker_user_id) in struct.iter_unpack(ob.FILL_RECORD_FORMAT, fills):
+        decoded.append({
+            'taker_order_id': taker_order_id.rstrip(b'\0').decode(),
+            'maker_order_id': maker_order_id.rstrip(b'\0').decode(),
+            'taker_user_id': taker_user_id.rstrip(b'\0').decode(),
+            'maker_user_id': maker_user_id.rstrip(b'\0').decode(),
+            'token': 'YES' if token == int(ob.Token.YES) else 'NO',  # the taker's token and side
+            'side': 'buy' if side == int(ob.Side.Buy) else 'sell',
+            'mint': match_type == int(ob.MatchType.Mint),
+            'taker_price': taker_price,
+            'maker_price': maker_price,
+            'quantity': quantity
+        })
+    return decoded
+
+def add_engine_order(orderbook, side, token, price, size, user_id, order_id):
+    """Match a good-till-cancel order (price in cents, whole shares) in the
+    engine; any remainder rests under the DB order id. Returns the decoded fills."""
+    result = orderbook.add_order(
+        ob.OrderType.GoodTillCancel,
+        ob.Side.Buy if side == 'buy' else ob.Side.Sell,
+        price,
+        size,
+        str(user_id),
+        ob.Token.YES if token == 'YES' else ob.Token.NO,
+        order_id
+    )
+    return decode_fills(result.fills)
+
+def engine_best_prices(orderbook):
+    """Best bid/ask of both tokens from the engine, in dollars, keyed like
+    market_detail's market_prices (yes_bid, yes_ask, no_bid, no_ask). A
+    token's ask is the cheaper of its own best ask and the implied one
+    (PAYOUT less the other token's best bid), which a buy mints against."""
+    tops = {token: orderbook.get_bbo(token) for token in (ob.Token.YES, ob.Token.NO)}
+    prices = {}
+    for prefix, token, other in (('yes', ob.Token.YES, ob.Token.NO), ('no', ob.Token.NO, ob.Token.YES)):
+        top, other_bid = tops[token], tops[other].bid
+        if top.bid:
+            prices[f'{prefix}_bid'] = to_dollars(top.bid.price)
+        asks = ([top.ask.price] if top.ask else []) + ([PAYOUT - other_bid.price] if other_bid else [])
+        if asks:
+            prices[f'{prefix}_ask'] = to_dollars(min(asks))
+    return prices
+
+def engine_orderbook_depth(view):
+    """The orderbook endpoints' body from an engine MarketView: aggregated
+    levels of both tokens (best first) and their best bid/ask, in dollars.
+    Each token's asks include the implied ones a buy mints against, PAYOUT
+    less the other token's bids, marked implied; at equal prices the direct
+    level comes first, as matching takes it first."""
+    depth = {}
+    for key, levels, other in (('yes_token', view.yes, view.no), ('no_token', view.no, view.yes)):
+        bids = [{
+            'price': to_dollars(level.price),
+            'quantity': level.quantity,
+            'order_count': level.order_count
+        } for level in levels.get_bids()]
+        asks = sorted([(level.price, False, level) for level in levels.get_asks()] +
+                      [(PAYOUT - level.price, True, level) for level in other.get_bids()],
+                      key=lambda ask: ask[:2])
+        asks = [{
+            'price': to_dollars(price),
+            'quantity': level.quantity,
+            'order_count': level.order_count,
+            'implied': implied
+        } for price, implied, level in asks]
+        depth[key] = {
+            'bids': bids,
+            'asks': asks,
+            'best_bid': bids[0]['price'] if bids else None,
+            'best_ask': asks[0]['price'] if asks else None
+        }
+    return {'success': True, 'orderbook': depth}
+
+def engine_orderbook_response(market_id):
+    """Depth response for a market, revalidated by ETag. The ETag is the view's
+    content digest, so it survives restarts; a matching If-None-Match gets a
+    304 without touching the body."""
+    orderbook = get_or_create_orderbook(market_id)
+    if orderbook is None:
+        return jsonify({'error': 'Market not found'}), 404
+    view = orderbook.market_view()
+    etag = f'{view.digest:016x}'
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(engine_orderbook_depth(view))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Orderbook-Sequence'] = str(view.sequence)
+    return response
+
+def quote_engine_order(orderbook, side, token, size, price=None):
+    """Price an order against the engine without placing it: how much would
+    fill now (up to the limit price in cents, if given) and at what cost, in dollars"""
+    quote = orderbook.quote(
+        ob.Side.Buy if side == 'buy' else ob.Side.Sell,
+        ob.Token.YES if token == 'YES' else ob.Token.NO,
+        size,
+        price
+    )
+    return {
+        'fillable': quote.quantity,
+        'total_cost': to_dollars(quote.total_cost),
+        'average_price': to_dollars(quote.average_price) if quote.quantity else None,
+        'worst_price': to_dollars(quote.worst_price) if quote.quantity else None
+    }
+
+def amend_engine_order(orderbook, order_id, price, remaining_size, expected_size):
+    """Reprice (cents) and/or resize a resting order in the engine by its DB id.
+    expected_size is the open quantity the caller read; whatever filled since
+    is taken off remaining_size. Returns (decoded fills a reprice produced,
+    open quantity just before the amend), or None if it is not resting."""
+    result = orderbook.amend_order(order_id, price, remaining_size, expected_size)
+    return None if result is None else (decode_fills(result.fills), result.previous_quantity)
+
+def committed_sell_shares(orderbook, user_id, token):
+    """Shares of one token the user's resting sell orders already promise"""
+    exposure = orderbook.open_exposure(str(user_id))
+    return exposure.get(ob.Token.YES if token == 'YES' else ob.Token.NO).sell_quantity
+
+def cancel_engine_user_orders(user_id, market_id=None):
+    """Cancel a user's resting orders in the engine, in one market or in all of
+    them. Returns {market_id: [order dicts]} of what was cancelled, prices in cents"""
+    if market_id is None:
+        # Books are loaded lazily, so first load every market the user has
+        # orders resting in
+        open_orders = current_app.repos.orders.for_user(user_id, status='open', columns='market_id')
+        for open_market in {order['market_id'] for order in open_orders}:
+            get_or_create_orderbook(open_market)
+        cancelled = current_app.markets.cancel_all_for_user(str(user_id))
+    else:
+        orderbook = get_or_create_orderbook(market_id)
+        cancelled = {market_id: orderbook.cancel_all_for_user(str(user_id))} if orderbook else {}
+    return {
+        cancelled_market: [{
+            'id': order.get_external_id(),
+            'side': 'buy' if order.get_side() == ob.Side.Buy else 'sell',
+            'token': 'YES' if order.get_token() == ob.Token.YES else 'NO',
+            'price': order.get_price(),
+            'remaining': order.get_remaining_quantity()
+        } for order in orders if order.get_external_id()]
+        for cancelled_market, orders in cancelled.items() if orders
+    }
+
+def journal_path(market_id):
+    """Journal file for a market's book, or None when journaling is off"""
+    journal_dir = current_app.config.get('ORDERBOOK_JOURNAL_DIR')
+    return os.path.join(journal_dir, f"{market_id}.journal") if journal_dir else None
+
+def resume_orderbook(market_id):
+    """Rebuild a market's book from its journal and keep journaling to it; None if there is no journal"""
+    path = journal_path(market_id)
+    if not path or not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    return ob.Orderbook.replay(path, resume=True)
+
+def start_journal(market_id, orderbook):
+    """Start journaling a freshly built book, if journaling is configured"""
+    path = journal_path(market_id)
+    if path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        orderbook.open_journal(path)
+
+# Books are hydrated on first touch and can be evicted when idle. One lock
+# guards the markets being loaded or evicted (each with an Event its waiters
+# block on) and the least recently used order of the loaded books.
+_orderbook_lock = threading.Lock()
+_orderbook_pending = {}
+_orderbook_last_used = OrderedDict()  # market_id -> (monotonic, wall clock), oldest first
+_orderbook_last_sweep = 0.0
+_boot_snapshot = None
+
+# Seconds between eviction sweeps, run from the request that crosses it
+ORDERBOOK_SWEEP_INTERVAL = 30
+# Books used more recently than this are never evicted, so a request still
+# holding one does not lose its writes
+ORDERBOOK_EVICT_MIN_IDLE = 5
 
 def get_or_create_orderbook(market_id):
-    """Get existing orderbook or create new one for market"""
-    # Check if we're in a serverless environment (Vercel)
-    if not ORDERBOOK_AVAILABLE:
-        print("C++ orderbook not available in serverless environment")
+    """The market's book, hydrated on first touch; None if there is no such market.
+    Concurrent first touches of the same market share one load; the others
+    wait for it (or for an eviction in progress) and then take the loaded book."""
+    markets = current_app.markets
+    while True:
+        with _orderbook_lock:
+            pending = _orderbook_pending.get(market_id)
+            if pending is None:
+                orderbook = markets.get(market_id)
+                if orderbook is None:
+                    # This request loads it
+                    pending = _orderbook_pending[market_id] = threading.Event()
+                    break
+                # Looked up and marked used in one step, so an eviction
+                # either sees the use or has already taken the book away
+                sweep = mark_orderbook_used(market_id)
+        if pending is None:
+            if sweep:
+                evict_orderbooks()
+            return orderbook
+        pending.wait()
+    return hydrate_orderbook(market_id, pending)
+
+def mark_orderbook_used(market_id):
+    """Record a use of a loaded book; call with _orderbook_lock held.
+    Returns whether an eviction sweep is due."""
+    global _orderbook_last_sweep
+    now = time.monotonic()
+    _orderbook_last_used[market_id] = (now, datetime.now(timezone.utc))
+    _orderbook_last_used.move_to_end(market_id)
+    if now - _orderbook_last_sweep < ORDERBOOK_SWEEP_INTERVAL:
+        return False
+    _orderbook_last_sweep = now
+    return True
+
+def touch_orderbook(market_id):
+    """Mark a loaded book as just used, and sweep for idle books when one is due"""
+    with _orderbook_lock:
+        sweep = mark_orderbook_used(market_id)
+    if sweep:
+        evict_orderbooks()
+
+def hydrate_orderbook(market_id, pending):
+    """Load a market's book into the registry, for the request that claimed
+    the load by registering pending (the Event its waiters block on)"""
+    orderbook = None
+    try:
+        orderbook = build_orderbook(market_id)
+        if orderbook is not None:
+            current_app.markets.add(market_id, orderbook)
+    finally:
+        with _orderbook_lock:
+            if orderbook is not None:
+                mark_orderbook_used(market_id)
+            del _orderbook_pending[market_id]
+        pending.set()
+    if orderbook is not None:
+        # A new book may have taken memory over budget
+        evict_orderbooks(idle=False)
+    return orderbook
+
+def build_orderbook(market_id):
+    """Build a market's book as it stands (see restore_orderbook), reading
+    from the database only the open orders it lacks. Returns None if there
+    is no such market."""
+    started = time.perf_counter()
+    try:
+        market = current_app.repos.markets.get(market_id, 'id, tick_size, status')
+        if not market:
+            return None
+    except Exception:
         return None
-        
+    # Queued order inserts and fills must be in the rows read back, or an
+    # evicted book comes back without new orders or with filled ones at full size
+    if not current_app.writes.flush():
+        raise WritesPending('Recent trades are still being recorded, try again')
+    orderbook, snapshot_at = restore_orderbook(market)
+    if orderbook is not None and snapshot_at is None:
+        return orderbook
+    if orderbook is None:
+        orderbook = new_orderbook(market)
+    rows, added = stream_orders_into_books(current_app.repos, {market_id: orderbook},
+                                           snapshot_at.isoformat() if snapshot_at else None,
+                                           current_app.config['ORDERBOOK_LOAD_PAGE_SIZE'])
+    start_journal(market_id, orderbook)
+    print(f"Hydrated orderbook for market {market_id}{' from snapshot' if snapshot_at else ''} "
+          f"({added} of {rows} open orders) in {time.perf_counter() - started:.3f}s")
+    return orderbook
+
+def restore_orderbook(market):
+    """A market's book from local files. Returns (book, None) from its
+    journal, which is exact; (book, taken_at) from its eviction snapshot or
+    the ORDERBOOK_SNAPSHOT_PATH file, which lack the orders placed after
+    taken_at (the orders they hold are reconciled with the database, see
+    reconcile_orderbook); or (None, None). Queued writes must be flushed first."""
+    market_id = market['id']
+    try:
+        orderbook = resume_orderbook(market_id)
+    except (RuntimeError, ValueError) as e:
+        print(f"Ignoring orderbook journal for market {market_id}: {e}")
+        orderbook = None
+    if orderbook is not None:
+        return orderbook, None
+    # A settled market's orders were cancelled in the database, not in any snapshot
+    if market.get('status', 'active') != 'active':
+        return None, None
+    for restore in (restore_evicted_orderbook, restore_boot_orderbook):
+        restored, taken_at = restore(market_id)
+        if restored is not None and restored.get_tick_size() == tick_size_of(market):
+            changed = reconcile_orderbook(restored)
+            if changed:
+                print(f"Reconciled {changed} orders of market {market_id} restored from a snapshot")
+            return restored, taken_at
+    return None, None
+
+def reconcile_orderbook(orderbook):
+    """Bring the orders of a book restored from a snapshot in line with the
+    database, where they may have been cancelled, filled or amended since:
+    cancel those no longer open, shrink those filled since, and rest again
+    at their current terms those amended since (losing their place in the
+    queue, as the amend did). Returns how many orders changed."""
+    resting = {order.get_external_id(): order for order in orderbook.all_orders() if order.get_external_id()}
+    external_ids = list(resting)
+    rows = {}
+    for i in range(0, len(external_ids), ORDERBOOK_RECONCILE_BATCH_SIZE):
+        batch = external_ids[i:i + ORDERBOOK_RECONCILE_BATCH_SIZE]
+        for row in current_app.repos.orders.get_many(batch, 'id, user_id, side, token, price, size, filled, status'):
+            rows[str(row['id'])] = row
+    changed, rest_again = 0, []
+    for external_id, order in resting.items():
+        row = rows.get(external_id)
+        if row is None or row['status'] != 'open':
+            remaining, price = 0, None
+        else:
+            remaining = to_shares(row['size']) - to_shares(row.get('filled') or 0)
+            price = to_cents(row['price'])
+        if price == order.get_price() and remaining == order.get_remaining_quantity():
+            continue
+        changed += 1
+        if remaining > 0 and price == order.get_price() and remaining < order.get_remaining_quantity():
+            # Shrinking at the same price keeps its place and cannot trade
+            orderbook.amend_order(external_id, price, remaining)
+        else:
+            orderbook.cancel_order(external_id)
+            if remaining > 0:
+                rest_again.append(row)
+    for row in rest_again:
+        load_engine_order(orderbook, row)
+    return changed
+
+def eviction_snapshot_path(market_id):
+    """Where an evicted book is snapshotted, or None when eviction snapshots are off"""
+    evict_dir = current_app.config.get('ORDERBOOK_EVICT_DIR')
+    return os.path.join(evict_dir, f"{market_id}.snapshot") if evict_dir else None
+
+def restore_evicted_orderbook(market_id):
+    """(book, taken_at) from the market's eviction snapshot, consuming it; (None, None) if there is none"""
+    path = eviction_snapshot_path(market_id)
+    if not path or not os.path.exists(path):
+        return None, None
+    try:
+        taken_at, books = read_orderbook_snapshots(path)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring eviction snapshot {path}: {e}")
+        return None, None
+    finally:
+        remove_eviction_snapshot(market_id)
+    return books.get(str(market_id)), taken_at
+
+def restore_boot_orderbook(market_id):
+    """(book, taken_at) from the ORDERBOOK_SNAPSHOT_PATH file, indexed on first use; (None, None) if it has none"""
+    global _boot_snapshot
+    path = current_app.config.get('ORDERBOOK_SNAPSHOT_PATH')
+    if not path:
+        return None, None
+    with _orderbook_lock:
+        if _boot_snapshot is None and not os.path.exists(path):
+            _boot_snapshot = False
+        elif _boot_snapshot is None:
+            try:
+                _boot_snapshot = OrderbookSnapshotIndex(path)
+                print(f"Indexed {len(_boot_snapshot.entries)} orderbooks in snapshot taken at "
+                      f"{_boot_snapshot.taken_at.isoformat()}")
+            except (OSError, ValueError) as e:
+                print(f"Ignoring orderbook snapshot {path}: {e}")
+                _boot_snapshot = False
+        index = _boot_snapshot
+    if not index:
+        return None, None
+    return index.restore(market_id), index.taken_at
+
+def remove_eviction_snapshot(market_id):
+    """Delete a market's eviction snapshot, if it has one"""
+    path = eviction_snapshot_path(market_id)
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def evict_orderbooks(idle=True):
+    """Evict books idle longer than ORDERBOOK_IDLE_SECONDS (when idle is set)
+    and then least recently used ones while the books' estimated memory is
+    over ORDERBOOK_MEMORY_BUDGET_MB. Either limit is off at 0. Returns the
+    ids of the evicted markets."""
+    idle_seconds = current_app.config['ORDERBOOK_IDLE_SECONDS'] if idle else 0
+    budget = current_app.config['ORDERBOOK_MEMORY_BUDGET_MB'] * 1024 * 1024
+    if not idle_seconds and not budget:
+        return []
+    now = time.monotonic()
+    with _orderbook_lock:
+        least_recent = [(market_id, used) for market_id, (used, _) in _orderbook_last_used.items()]
+    victims = {market_id: None for market_id, used in least_recent
+               if idle_seconds and now - used >= max(idle_seconds, ORDERBOOK_EVICT_MIN_IDLE)}
+    if budget:
+        stats = current_app.markets.all_stats()
+        total = sum(book.memory_bytes for market_id, book in stats.items() if market_id not in victims)
+        for market_id, used in least_recent:
+            if total <= budget:
+                break
+            if market_id not in victims and market_id in stats and now - used >= ORDERBOOK_EVICT_MIN_IDLE:
+                victims[market_id] = None
+                total -= stats[market_id].memory_bytes
+    evicted = [market_id for market_id in victims if evict_orderbook(market_id)]
+    if evicted:
+        print(f"Evicted {len(evicted)} orderbooks, {len(current_app.markets)} still loaded")
+    return evicted
+
+def evict_orderbook(market_id):
+    """Take a book out of memory, snapshotting it first if ORDERBOOK_EVICT_DIR
+    is set; it is hydrated again on its next touch. Returns False if it was
+    used again meanwhile, or is already gone or being loaded."""
     markets = current_app.markets
-    supabase = current_app.supabase
-    if market_id not in markets:
-        try:
-            market_resp = supabase.table('markets').select('id').eq('id', market_id).single().execute()
-            if market_resp.data:
-                markets[market_id] = ob.Orderbook()
-            else:
-                return None
-        except:
+    with _orderbook_lock:
+        last_used = _orderbook_last_used.get(market_id)
+        if market_id in _orderbook_pending or last_used is None:
+            return False
+        if time.monotonic() - last_used[0] < ORDERBOOK_EVICT_MIN_IDLE:
+            return False
+        del _orderbook_last_used[market_id]
+        orderbook = markets.get(market_id)
+        if orderbook is None:
+            return False
+        # Touches of this market wait until the book is written out
+        pending = _orderbook_pending[market_id] = threading.Event()
+    try:
+        markets.drop(market_id)
+        # A journaled book resumes from its journal instead
+        path = None if journal_path(market_id) else eviction_snapshot_path(market_id)
+        if path:
+            # Orders placed since the book's last use are read again on
+            # hydration; the engine rejects the ones it already holds
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_orderbook_snapshots(path, [(market_id, orderbook)], last_used[1])
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"Could not snapshot evicted orderbook for market {market_id}: {e}")
+        remove_eviction_snapshot(market_id)
+    finally:
+        with _orderbook_lock:
+            del _orderbook_pending[market_id]
+        pending.set()
+    return True
+
+def clear_eviction_snapshots():
+    """Delete every eviction snapshot at startup. They are only trusted
+    within the process that wrote them; across restarts the snapshot file
+    and the database take over."""
+    evict_dir = current_app.config.get('ORDERBOOK_EVICT_DIR')
+    if evict_dir and os.path.isdir(evict_dir):
+        for name in os.listdir(evict_dir):
+            if name.endswith('.snapshot'):
+                os.remove(os.path.join(evict_dir, name))
+
+def discard_orderbook(market_id):
+    """Drop a settled market's book for good, with its eviction snapshot"""
+    with _orderbook_lock:
+        _orderbook_last_used.pop(market_id, None)
+    current_app.markets.drop(market_id)
+    remove_eviction_snapshot(market_id)
+
+def bootstrap_quotes(initial_price, tick_size=1, spread=5):
+    """The platform's opening YES and NO bids in cents: spread below each
+    token's price, on the tick grid, and together under PAYOUT so the two
+    can never mint against each other. None when the tick leaves no room
+    for such a pair (a coarse tick rounds both bids up to the minimum)."""
+    def on_tick(price):
+        return max(tick_size, min(PAYOUT - tick_size, price // tick_size * tick_size))
+    
+    yes_buy = on_tick(initial_price - spread)
+    no_buy = on_tick(PAYOUT - initial_price - spread)
+    # Pull the dearer bid in until the pair no longer crosses
+    while yes_buy + no_buy >= PAYOUT:
+        if yes_buy >= no_buy and yes_buy > tick_size:
+            yes_buy -= tick_size
+        elif no_buy > tick_size:
+            no_buy -= tick_size
+        else:
             return None
-    return markets[market_id]
+    return yes_buy, no_buy
 
-def bootstrap_market(market_id, initial_probability=0.50):
-    """Add initial platform liquidity to new market and persist to DB"""
+def bootstrap_market(market_id, initial_price=50, tick_size=1):
+    """Add initial platform liquidity to new market and persist to DB.
+    initial_price is the YES price in cents, i.e. the probability in percent."""
     try:
-        supabase = current_app.supabase
+        repos = current_app.repos
         
-        yes_price = initial_probability
-        no_price = 1.0 - initial_probability
-        spread = 0.05
-        yes_buy = max(0.01, min(0.99, yes_price - spread))
-        yes_sell = max(0.01, min(0.99, yes_price + spread))
-        no_buy = max(0.01, min(0.99, no_price - spread))
-        no_sell = max(0.01, min(0.99, no_price + spread))
+        quotes = bootstrap_quotes(initial_price, tick_size)
+        if quotes is None:
+            print(f"No opening quotes fit tick size {tick_size} at {initial_price}%")
+            return False
+        yes_buy, no_buy = quotes
         
         PLATFORM_USER_ID = "9d626b36-4f08-4f7b-b0ea-036ac880be3e"
         qty = 10000
+        yes_buy_id = f"{market_id}-yes-buy-{yes_buy}"
+        no_buy_id = f"{market_id}-no-buy-{no_buy}"
         
         # Create platform user if doesn't exist
         try:
-            supabase.table('users').upsert({
+            repos.users.upsert({
                 'id': PLATFORM_USER_ID,
                 'username': 'platform',
                 'display_name': 'Platform Liquidity',
-                'balance': 1000000.0,  # Large balance for platform
+                'balance': to_dollars(100_000_000),  # $1,000,000 for the platform
                 'is_admin': True,
                 'created_at': datetime.now(timezone.utc).isoformat()
-            }).execute()
+            })
         except Exception as e:
             print(f"Platform user creation error (may already exist): {e}")
         
-        # Try C++ orderbook if available
-        if ORDERBOOK_AVAILABLE:
-            try:
-                orderbook = get_or_create_orderbook(market_id)
-                if orderbook:
-                    # Add to C++ orderbook
-                    orderbook.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, int(yes_buy * 100), qty, PLATFORM_USER_ID, ob.Token.YES)
-                    orderbook.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, int(yes_sell * 100), qty, PLATFORM_USER_ID, ob.Token.YES)
-                    orderbook.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, int(no_buy * 100), qty, PLATFORM_USER_ID, ob.Token.NO)
-                    orderbook.add_order(ob.OrderType.GoodTillCancel, ob.Side.Sell, int(no_sell * 100), qty, PLATFORM_USER_ID, ob.Token.NO)
-            except Exception as e:
-                print(f"C++ orderbook bootstrap failed, using database only: {e}")
-        
-        # Always add to database (works for both local and serverless)
-        orders_to_create = [
-            # YES token orders
-            {
-                'id': f"{market_id}-yes-buy-{int(yes_buy*100)}",
-                'market_id': market_id,
-                'user_id': PLATFORM_USER_ID,
-                'side': 'buy',  # Correct lowercase
-                'token': 'YES',
-                'price': yes_buy,
-                'size': qty,
-                'filled': 0,
-                'status': 'open',
-                'created_at': datetime.now(timezone.utc).isoformat()
-            },
-            {
-                'id': f"{market_id}-yes-sell-{int(yes_sell*100)}",
-                'market_id': market_id,
-                'user_id': PLATFORM_USER_ID,
-                'side': 'sell',  # Correct lowercase
-                'token': 'YES',
-                'price': yes_sell,
-                'size': qty,
-                'filled': 0,
-                'status': 'open',
-                'created_at': datetime.now(timezone.utc).isoformat()
-            },
-            # NO token orders
-            {
-                'id': f"{market_id}-no-buy-{int(no_buy*100)}",
-                'market_id': market_id,
-                'user_id': PLATFORM_USER_ID,
-                'side': 'buy',  # Correct lowercase
-                'token': 'NO',
-                'price': no_buy,
-                'size': qty,
-                'filled': 0,
-                'status': 'open',
-                'created_at': datetime.now(timezone.utc).isoformat()
-            },
-            {
-                'id': f"{market_id}-no-sell-{int(no_sell*100)}",
-                'market_id': market_id,
-                'user_id': PLATFORM_USER_ID,
-                'side': 'sell',  # Correct lowercase
-                'token': 'NO',
-                'price': no_sell,
-                'size': qty,
-                'filled': 0,
-                'status': 'open',
-                'created_at': datetime.utcnow().isoformat()
-            }
-        ]
-        
-        # Insert orders
-        for order in orders_to_create:
-            try:
-                supabase.table('orders').upsert(order).execute()
-            except Exception as e:
-                print(f"Error inserting bootstrap order: {e}")
+        # The engine matches a YES buy against a NO buy at the complementary
+        # price (minting a pair), so the NO bid doubles as the YES ask and vice
+        # versa: two buy quotes give both tokens a two-sided market without
+        # the platform holding any shares.
+        orderbook = get_or_create_orderbook(market_id)
+        if orderbook is None:
+            print(f"No orderbook for market {market_id} to bootstrap")
+            return False
+        # Neither quote may trade on entry: the fills would never be recorded
+        for price, token, order_id in ((yes_buy, ob.Token.YES, yes_buy_id), (no_buy, ob.Token.NO, no_buy_id)):
+            result = orderbook.add_order(ob.OrderType.GoodTillCancel, ob.Side.Buy, price, qty,
+                                         PLATFORM_USER_ID, token, order_id)
+            assert not decode_fills(result.fills), f"bootstrap quote {order_id} traded on entry"
         
-        # Create platform position to enable selling
+        # Record both quotes in the database, in one call
+        now = datetime.now(timezone.utc).isoformat()
+        orders_to_create = [{
+            'id': order_id,
+            'market_id': market_id,
+            'user_id': PLATFORM_USER_ID,
+            'side': 'buy',
+            'token': token,
+            'price': to_dollars(price),
+            'size': qty,
+            'filled': 0,
+            'status': 'open',
+            'created_at': now
+        } for price, token, order_id in ((yes_buy, 'YES', yes_buy_id), (no_buy, 'NO', no_buy_id))]
         try:
-            supabase.table('positions').upsert({
-                'user_id': PLATFORM_USER_ID,
-                'market_id': market_id,
-                'yes_shares': qty * 2,  # For both buy and sell orders
-                'no_shares': qty * 2,
-                'updated_at': datetime.now(timezone.utc).isoformat()
-            }).execute()
+            repos.orders.upsert(orders_to_create)
         except Exception as e:
-            print(f"Error creating platform position: {e}")
+            print(f"Error inserting bootstrap orders: {e}")
         
-        print(f"Bootstrapped market {market_id} with initial probability {initial_probability}")
+        print(f"Bootstrapped market {market_id} with initial probability {initial_price}%")
         return True
         
     except Exception as e:
         print(f"Error bootstrapping market: {e}")
         return False
 
+# Orderbook snapshot file: a header (magic, version, market count, unix time
+# the snapshot was taken), then per market a u16 id length, u64 blob length,
+# the market id and the engine's own Orderbook.snapshot() bytes.
+SNAPSHOT_FILE_MAGIC = b'OBKS'
+SNAPSHOT_FILE_VERSION = 1
+SNAPSHOT_FILE_HEADER = struct.Struct('<4sHxxId')
+SNAPSHOT_ENTRY_HEADER = struct.Struct('<HQ')
+
+def write_orderbook_snapshots(path, books, taken_at):
+    """Write (market_id, orderbook) pairs to one snapshot file, replacing it atomically"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_FILE_HEADER.pack(SNAPSHOT_FILE_MAGIC, SNAPSHOT_FILE_VERSION, len(books), taken_at.timestamp()))
+        for market_id, orderbook in books:
+            key = str(market_id).encode()
+            blob = orderbook.snapshot()
+            f.write(SNAPSHOT_ENTRY_HEADER.pack(len(key), len(blob)))
+            f.write(key)
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+def save_orderbook_snapshots(path):
+    """Write every in-memory orderbook to one snapshot file; returns the number of markets saved"""
+    # Taken before the books are read, so an order that lands meanwhile is
+    # replayed on load and rejected as a duplicate rather than lost
+    taken_at = datetime.now(timezone.utc)
+    markets = current_app.markets.items()
+    write_orderbook_snapshots(path, markets, taken_at)
+    return len(markets)
+
+def scan_orderbook_snapshots(view):
+    """Parse a snapshot file's headers without restoring anything.
+    Returns (taken_at, {market_id: (offset, length)} of each book's blob in view);
+    raises ValueError if the file is malformed."""
+    entries = {}
+    try:
+        magic, version, count, timestamp = SNAPSHOT_FILE_HEADER.unpack_from(view)
+        if magic != SNAPSHOT_FILE_MAGIC or version != SNAPSHOT_FILE_VERSION:
+            raise ValueError(f"not a version {SNAPSHOT_FILE_VERSION} orderbook snapshot file")
+        offset = SNAPSHOT_FILE_HEADER.size
+        for _ in range(count):
+            key_length, blob_length = SNAPSHOT_ENTRY_HEADER.unpack_from(view, offset)
+            offset += SNAPSHOT_ENTRY_HEADER.size
+            market_id = bytes(view[offset:offset + key_length]).decode()
+            offset += key_length
+            if offset + blob_length > len(view):
+                raise ValueError("snapshot file is truncated")
+            entries[market_id] = (offset, blob_length)
+            offset += blob_length
+    except struct.error as e:
+        raise ValueError(f"snapshot file is truncated: {e}")
+    return datetime.fromtimestamp(timestamp, timezone.utc), entries
+
+def read_orderbook_snapshots(path):
+    """Restore the books in a snapshot file, reading it through mmap.
+    Returns (taken_at, {market_id: orderbook}); raises ValueError if the file is malformed."""
+    books = {}
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            taken_at, entries = scan_orderbook_snapshots(view)
+            for market_id, (offset, length) in entries.items():
+                # Restored straight from the mapped pages, no intermediate copy
+                with view[offset:offset + length] as blob:
+                    books[market_id] = ob.Orderbook.restore(blob)
+    return taken_at, books
+
+class OrderbookSnapshotIndex:
+    """A snapshot file kept mapped, so books can be restored one market at a
+    time as they are first needed. Opening it only reads the entry headers."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with memoryview(self.mapped) as view:
+            self.taken_at, self.entries = scan_orderbook_snapshots(view)
+        self.lock = threading.Lock()
+
+    def restore(self, market_id):
+        """The market's book as of the snapshot, or None. Each book is handed
+        out once: after that the live book, its journal or its eviction
+        snapshot is newer than this one."""
+        with self.lock:
+            entry = self.entries.pop(str(market_id), None)
+        if entry is None:
+            return None
+        offset, length = entry
+        with memoryview(self.mapped) as view, view[offset:offset + length] as blob:
+            return ob.Orderbook.restore(blob)
+
+# Markets per stream of open orders: each shard's ids go in one `in` filter,
+# which has to fit in a request URL
+ORDERBOOK_LOAD_SHARD_SIZE = 100
+# Order ids per `in` filter when reconciling a restored book, for the same reason
+ORDERBOOK_RECONCILE_BATCH_SIZE = 100
+
+def load_engine_order(orderbook, order):
+    """Rest a DB order row's unfilled remainder on its book; returns whether it was added"""
+    try:
+        order_type = ob.OrderType.GoodTillCancel
+        # Fix side mapping - try uppercase first
+        side = ob.Side.Buy if order['side'].upper() == 'BUY' else ob.Side.Sell
+        price = to_cents(order['price'])
+        # Handle remaining size vs total size
+        remaining_size = to_shares(order['size']) - to_shares(order.get('filled', 0))
+        if remaining_size <= 0:
+            return False
+        user_id = str(order['user_id'])
+        token = ob.Token.YES if order.get('token', 'YES').upper() == 'YES' else ob.Token.NO
+        # Key the engine order by its DB id so routes can cancel it in memory
+        orderbook.add_order(order_type, side, price, remaining_size, user_id, token, str(order['id']))
+        return True
+    except Exception as e:
+        print(f"Error loading order {order.get('id')}: {e}")
+        return False
+
+def stream_orders_into_books(repos, books, created_after=None, page_size=1000):
+    """Feed the open orders of books' markets ({market_id: orderbook}) into
+    them page by page, oldest first so time priority is kept. Only one page
+    is held at a time. Returns (rows read, orders added)."""
+    rows = added = 0
+    for page in repos.orders.open_pages(books, created_after=created_after, page_size=page_size):
+        rows += len(page)
+        for order in page:
+            added += load_engine_order(books[order['market_id']], order)
+    return rows, added
+
 def load_all_orderbooks_from_db():
-    """Load all active markets - simplified for serverless compatibility"""
-    if not ORDERBOOK_AVAILABLE:
-        print("Orderbook C++ extension not available; running in serverless mode.")
-        return
-    
+    """Build the book of every active market not yet loaded, each the way
+    hydration would (see restore_orderbook), streaming in the open orders
+    they lack. Used at startup with ORDERBOOK_LAZY_LOAD=0 and before saving
+    a snapshot file."""
     try:
-        supabase = current_app.supabase
+        repos = current_app.repos
         markets = current_app.markets
+        started = time.perf_counter()
         
         # Get all active markets
-        markets_resp = supabase.table('markets').select('id').eq('status', 'active').execute()
-        active_markets = markets_resp.data if markets_resp.data else []
+        active_markets = repos.markets.list(status='active', columns='id, tick_size')
         
+        # Queued order inserts and fills are read back with the rest
+        if not current_app.writes.flush():
+            raise WritesPending('Recent trades are still being recorded, try again')
+        
+        # Books still missing orders, grouped by the time their orders are
+        # needed from: all of them for a fresh book (None), only the newer
+        # ones for a book restored from a snapshot
+        missing, loaded_ids = {}, []
         for market in active_markets:
             market_id = market['id']
-            # Create orderbook for this market if not already present
-            if market_id not in markets:
-                markets[market_id] = ob.Orderbook()
-            orderbook = markets[market_id]
-            
-            # Load all open orders for this market
-            orders_resp = supabase.table('orders').select('*').eq('market_id', market_id).eq('status', 'open').execute()
-            open_orders = orders_resp.data if orders_resp.data else []
-            
-            for order in open_orders:
-                try:
-                    order_type = ob.OrderType.GoodTillCancel
-                    # Fix side mapping - try uppercase first
-                    side = ob.Side.Buy if order['side'].upper() == 'BUY' else ob.Side.Sell
-                    price = int(float(order['price']) * 100)
-                    # Handle remaining size vs total size
-                    remaining_size = int(float(order['size']) - float(order.get('filled', 0)))
-                    if remaining_size <= 0:
-                        continue
-                    user_id = str(order['user_id'])
-                    token = ob.Token.YES if order.get('token', 'YES').upper() == 'YES' else ob.Token.NO
-                    orderbook.add_order(order_type, side, price, remaining_size, user_id, token)
-                except Exception as e:
-                    print(f"Error loading order {order.get('id')}: {e}")
-        
-        print(f"Loaded orderbooks for {len(active_markets)} markets from DB.")
-        
-    except Exception as e:
-        print(f"Error loading orderbooks from DB: {e}")
-
-# Serverless-compatible order matching (database-only)
-def match_orders_database_only(market_id, new_order, supabase):
-    """Simple order matching using database only (for serverless environments)"""
-    try:
-        matches = []
+            if market_id in markets:
+                continue
+            orderbook, snapshot_at = restore_orderbook(market)
+            loaded_ids.append(market_id)
+            if orderbook is not None and snapshot_at is None:
+                # A journal holds the book's exact state, so nothing else is needed
+                markets.add(market_id, orderbook)
+                continue
+            created_after = snapshot_at.isoformat() if snapshot_at else None
+            missing.setdefault(created_after, {})[market_id] = orderbook if orderbook is not None else new_orderbook(market)
         
-        # Get opposite side orders that can match
-        opposite_side = 'sell' if new_order['side'] == 'buy' else 'buy'
-        token = new_order['token']
+        # One keyset-paginated stream per shard of markets rather than a query
+        # per market. Shards share no market, so they can load concurrently.
+        shards = []
+        for created_after, books in missing.items():
+            market_ids = list(books)
+            for i in range(0, len(market_ids), ORDERBOOK_LOAD_SHARD_SIZE):
+                shard = {market_id: books[market_id] for market_id in market_ids[i:i + ORDERBOOK_LOAD_SHARD_SIZE]}
+                shards.append((shard, created_after))
+        page_size = current_app.config['ORDERBOOK_LOAD_PAGE_SIZE']
+        workers = max(1, min(current_app.config['ORDERBOOK_LOAD_WORKERS'], len(shards)))
         
-        # Build query for matching orders
-        query = supabase.table('orders').select('*').eq('market_id', market_id).eq('side', opposite_side).eq('token', token).eq('status', 'open')
+        def load_shard(shard):
+            books, created_after = shard
+            shard_started = time.perf_counter()
+            rows, added = stream_orders_into_books(repos, books, created_after, page_size)
+            print(f"Loaded {added} of {rows} open orders for {len(books)} markets "
+                  f"in {time.perf_counter() - shard_started:.2f}s")
+            return rows, added
         
-        if new_order['side'] == 'buy':
-            # Buy order matches with sell orders at or below our price
-            matching_orders_resp = query.lte('price', new_order['price']).order('price').execute()
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                loaded = list(pool.map(load_shard, shards))
         else:
-            # Sell order matches with buy orders at or above our price
-            matching_orders_resp = query.gte('price', new_order['price']).order('price', desc=True).execute()
+            loaded = [load_shard(shard) for shard in shards]
         
-        matching_orders = matching_orders_resp.data if matching_orders_resp.data else []
-        
-        remaining_size = new_order['size']
-        
-        for order in matching_orders:
-            if remaining_size <= 0:
-                break
-                
-            order_remaining = float(order['size']) - float(order.get('filled', 0))
-            if order_remaining <= 0:
-                continue
-            
-            # Calculate match size
-            match_size = min(remaining_size, order_remaining)
-            match_price = float(order['price'])  # Take maker's price
-            
-            # Record the match
-            matches.append({
-                'size': match_size,
-                'price': match_price,
-                'maker_order_id': order['id'],
-                'maker_user_id': order['user_id']
-            })
-            
-            # Update filled amounts
-            new_filled = float(order.get('filled', 0)) + match_size
-            new_status = 'filled' if new_filled >= float(order['size']) else 'open'
-            
-            supabase.table('orders').update({
-                'filled': new_filled,
-                'status': new_status,
-                'filled_at': datetime.now(timezone.utc).isoformat() if new_status == 'filled' else None
-            }).eq('id', order['id']).execute()
-            
-            remaining_size -= match_size
+        # Publish the books and journal them from the loaded state onwards
+        for books in missing.values():
+            for market_id, orderbook in books.items():
+                markets.add(market_id, orderbook)
+                try:
+                    start_journal(market_id, orderbook)
+                except (RuntimeError, ValueError) as e:
+                    print(f"Could not start orderbook journal for market {market_id}: {e}")
+        for market_id in loaded_ids:
+            touch_orderbook(market_id)
         
-        return matches, remaining_size
+        rows = sum(shard_rows for shard_rows, _ in loaded)
+        added = sum(shard_added for _, shard_added in loaded)
+        print(f"Loaded orderbooks for {len(loaded_ids)} markets from DB "
+              f"({added} of {rows} open orders, {len(shards)} streams, {workers} workers) "
+              f"in {time.perf_counter() - started:.2f}s.")
         
+    except WritesPending:
+        raise
     except Exception as e:
-        print(f"Error in database-only order matching: {e}")
-        return [], new_order['size']
+        print(f"Error loading orderbooks from DB: {e}")
 
-def ensure_user_profile_exists(user_id, supabase_client):
+def ensure_user_profile_exists(user_id, repos):
     """Ensure a user profile exists in the database, create if missing"""
     try:
         # Try to get existing user
-        user_resp = supabase_client.table('users').select('*').eq('id', user_id).execute()
+        user = repos.users.get(user_id)
         
-        if user_resp.data and len(user_resp.data) > 0:
+        if user:
             # User exists, return the profile
-            return user_resp.data[0]
+            return user
         
         # User doesn't exist, create default profile
         print(f"Creating default user profile for {user_id}")
@@ -296,16 +816,16 @@ def ensure_user_profile_exists(user_id, supabase_client):
             'id': user_id,
             'username': username,
             'display_name': username,
-            'balance': 1000.00,  # Starting balance
+            'balance': to_dollars(STARTING_BALANCE),
             'total_volume': 0.0,
             'created_at': datetime.now(timezone.utc).isoformat()
         }
         
-        insert_resp = supabase_client.table('users').upsert(profile_data).execute()
+        stored = repos.users.upsert(profile_data)
         
-        if insert_resp.data:
+        if stored:
             print(f"Successfully created user profile for {user_id}")
-            return insert_resp.data[0]
+            return stored[0]
         else:
             print(f"Failed to create user profile for {user_id}")
             return None
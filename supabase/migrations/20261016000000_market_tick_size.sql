@@ -0,0 +1,5 @@
+-- Per-market tick size in dollars. The matching engine only accepts prices
+-- on this grid, and bootstrap quotes are snapped to it.
+alter table public.markets
+    add column if not exists tick_size numeric not null default 0.01
+    check (tick_size > 0 and tick_size <= 0.5);
@@ -0,0 +1,28 @@
+-- Fills settled from the matching engine. buyer/seller are seen from the
+-- taker: for a mint both sides are buyers, and the seller columns hold the
+-- buyer of the complementary token. price is the taker's execution price.
+create table if not exists public.trades (
+    id uuid primary key default gen_random_uuid(),
+    market_id uuid not null,
+    created_at timestamptz not null default now()
+);
+
+alter table public.trades
+    add column if not exists buyer_order_id text,
+    add column if not exists seller_order_id text,
+    add column if not exists buyer_id uuid,
+    add column if not exists seller_id uuid,
+    add column if not exists token text check (token in ('YES', 'NO')),
+    add column if not exists price numeric,
+    add column if not exists size numeric,
+    add column if not exists match_type text not null default 'direct' check (match_type in ('direct', 'mint'));
+
+create index if not exists trades_market_created_at_idx on public.trades (market_id, created_at desc);
+
+-- Orders placed through the API used to store the token in `side` and the
+-- direction in `token`. Bring them in line with bootstrap orders and the
+-- orderbook loader: side = 'buy' / 'sell', token = 'YES' / 'NO'.
+update public.orders
+   set side = lower(token),
+       token = side
+ where side in ('YES', 'NO');
@@ -0,0 +1,29 @@
+-- Store prices, money and shares in fixed point, matching the app's units:
+-- prices and amounts of money are whole cents (numeric with two decimals,
+-- exact, never floating point) and share counts are whole numbers. Rows
+-- written as floats before are rounded onto that grid once here.
+alter table public.markets
+    alter column tick_size type numeric(3, 2) using round(tick_size, 2),
+    alter column yes_price type numeric(3, 2) using round(yes_price, 2),
+    alter column no_price type numeric(3, 2) using round(no_price, 2),
+    alter column total_volume type numeric(14, 2) using round(total_volume, 2);
+
+alter table public.orders
+    alter column price type numeric(3, 2) using round(price, 2),
+    alter column size type bigint using round(size),
+    alter column filled type bigint using round(filled);
+
+alter table public.trades
+    alter column price type numeric(3, 2) using round(price, 2),
+    alter column size type bigint using round(size);
+
+alter table public.positions
+    alter column yes_shares type bigint using round(yes_shares),
+    alter column no_shares type bigint using round(no_shares);
+
+alter table public.users
+    alter column balance type numeric(14, 2) using round(balance, 2),
+    alter column total_volume type numeric(14, 2) using round(total_volume, 2);
+
+alter table public.transactions
+    alter column amount type numeric(14, 2) using round(amount, 2);
@@ -0,0 +1,4 @@
+-- The orderbook loader streams every open order oldest first, a page at a
+-- time, resuming each page after the (created_at, id) of the last row.
+-- Filled and cancelled orders, the bulk of the table, stay out of the index.
+create index if not exists orders_open_keyset_idx on public.orders (created_at, id) where status = 'open';
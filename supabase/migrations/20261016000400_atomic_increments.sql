@@ -0,0 +1,82 @@
+-- Increments the app applies in one statement each, for many rows per
+-- call, instead of reading a row and writing back a changed copy. Every
+-- function takes a JSON array of deltas, applies them in one transaction and
+-- returns the changed rows. Money arrives in whole cents and is added to the
+-- dollar columns exactly. The functions run as the caller (security invoker),
+-- so they can do no more than the caller's own updates could.
+
+-- [{"user_id": uuid, "cents": int}]: credit (or, negative, debit) balances
+create or replace function public.add_balances(deltas jsonb)
+returns setof public.users
+language sql
+as $$
+    update public.users as u
+    set balance = u.balance + d.cents / 100.0
+    from (
+        select user_id, sum(cents) as cents
+        from jsonb_to_recordset(deltas) as r(user_id uuid, cents bigint)
+        group by user_id
+    ) as d
+    where u.id = d.user_id
+    returning u.*;
+$$;
+
+-- [{"user_id": uuid, "market_id": uuid, "yes_shares": int, "no_shares": int}]:
+-- add to positions, never below zero, creating missing ones
+create unique index if not exists positions_user_market_idx on public.positions (user_id, market_id);
+
+create or replace function public.add_position_shares(deltas jsonb)
+returns setof public.positions
+language sql
+as $$
+    insert into public.positions (user_id, market_id, yes_shares, no_shares, updated_at)
+    select distinct user_id, market_id, 0, 0, now()
+    from jsonb_to_recordset(deltas) as r(user_id uuid, market_id uuid)
+    on conflict (user_id, market_id) do nothing;
+
+    update public.positions as p
+    set yes_shares = greatest(0, p.yes_shares + d.yes_shares),
+        no_shares = greatest(0, p.no_shares + d.no_shares),
+        updated_at = now()
+    from (
+        select user_id, market_id, sum(yes_shares) as yes_shares, sum(no_shares) as no_shares
+        from jsonb_to_recordset(deltas) as r(user_id uuid, market_id uuid, yes_shares bigint, no_shares bigint)
+        group by user_id, market_id
+    ) as d
+    where p.user_id = d.user_id and p.market_id = d.market_id
+    returning p.*;
+$$;
+
+-- [{"order_id": text, "quantity": int}]: add to orders' filled shares,
+-- marking the ones that are now complete filled
+create or replace function public.add_order_fills(fills jsonb)
+returns setof public.orders
+language sql
+as $$
+    update public.orders as o
+    set filled = o.filled + d.quantity,
+        status = case when o.filled + d.quantity >= o.size then 'filled' else o.status end,
+        filled_at = case when o.filled + d.quantity >= o.size then now() else o.filled_at end
+    from (
+        select order_id, sum(quantity) as quantity
+        from jsonb_to_recordset(fills) as r(order_id text, quantity bigint)
+        group by order_id
+    ) as d
+    where o.id = d.order_id
+    returning o.*;
+$$;
+
+-- [{"market_id": uuid, "volume_cents": int, "yes_price_cents": int}]: add
+-- traded value to markets' volume and set both prices from the last YES price
+create or replace function public.add_market_trades(trades jsonb)
+returns setof public.markets
+language sql
+as $$
+    update public.markets as m
+    set total_volume = coalesce(m.total_volume, 0) + d.volume_cents / 100.0,
+        yes_price = d.yes_price_cents / 100.0,
+        no_price = (100 - d.yes_price_cents) / 100.0
+    from jsonb_to_recordset(trades) as d(market_id uuid, volume_cents bigint, yes_price_cents bigint)
+    where m.id = d.market_id
+    returning m.*;
+$$;
@@ -0,0 +1,139 @@
+-- The increment functions of 20261016000400_atomic_increments.sql, made safe
+-- to retry. The write-behind worker retries a call whose response it never
+-- saw, which may have committed, so each call now carries the id of the
+-- batch it belongs to. The function records (batch_id, function name) in the
+-- same transaction as the update and does nothing, returning no rows, when
+-- the pair is already recorded. A null batch_id applies the deltas
+-- unconditionally, as before.
+--
+-- add_order_fills also stops reviving orders: only an open order becomes
+-- filled, so fills that land after a cancel leave it cancelled.
+
+create table if not exists public.applied_batches (
+    batch_id uuid not null,
+    function_name text not null,
+    applied_at timestamptz not null default now(),
+    primary key (batch_id, function_name)
+);
+create index if not exists applied_batches_applied_at_idx on public.applied_batches (applied_at);
+
+-- Record a batch's call of a function; false if it was recorded before.
+-- Retries come within minutes, so ids older than a day are dropped.
+create or replace function public.claim_batch(batch_id uuid, function_name text)
+returns boolean
+language plpgsql
+as $$
+begin
+    if batch_id is null then
+        return true;
+    end if;
+    delete from public.applied_batches where applied_at < now() - interval '1 day';
+    insert into public.applied_batches (batch_id, function_name)
+    values (claim_batch.batch_id, claim_batch.function_name)
+    on conflict do nothing;
+    return found;
+end;
+$$;
+
+drop function if exists public.add_balances(jsonb);
+drop function if exists public.add_position_shares(jsonb);
+drop function if exists public.add_order_fills(jsonb);
+drop function if exists public.add_market_trades(jsonb);
+
+-- [{"user_id": uuid, "cents": int}]: credit (or, negative, debit) balances
+create or replace function public.add_balances(deltas jsonb, batch_id uuid default null)
+returns setof public.users
+language plpgsql
+as $$
+begin
+    if not public.claim_batch(batch_id, 'add_balances') then
+        return;
+    end if;
+    return query
+    update public.users as u
+    set balance = u.balance + d.cents / 100.0
+    from (
+        select user_id, sum(cents) as cents
+        from jsonb_to_recordset(deltas) as r(user_id uuid, cents bigint)
+        group by user_id
+    ) as d
+    where u.id = d.user_id
+    returning u.*;
+end;
+$$;
+
+-- [{"user_id": uuid, "market_id": uuid, "yes_shares": int, "no_shares": int}]:
+-- add to positions, never below zero, creating missing ones
+create or replace function public.add_position_shares(deltas jsonb, batch_id uuid default null)
+returns setof public.positions
+language plpgsql
+as $$
+begin
+    if not public.claim_batch(batch_id, 'add_position_shares') then
+        return;
+    end if;
+    insert into public.positions (user_id, market_id, yes_shares, no_shares, updated_at)
+    select distinct r.user_id, r.market_id, 0, 0, now()
+    from jsonb_to_recordset(deltas) as r(user_id uuid, market_id uuid)
+    on conflict (user_id, market_id) do nothing;
+
+    return query
+    update public.positions as p
+    set yes_shares = greatest(0, p.yes_shares + d.yes_shares),
+        no_shares = greatest(0, p.no_shares + d.no_shares),
+        updated_at = now()
+    from (
+        select r.user_id, r.market_id, sum(r.yes_shares) as yes_shares, sum(r.no_shares) as no_shares
+        from jsonb_to_recordset(deltas) as r(user_id uuid, market_id uuid, yes_shares bigint, no_shares bigint)
+        group by r.user_id, r.market_id
+    ) as d
+    where p.user_id = d.user_id and p.market_id = d.market_id
+    returning p.*;
+end;
+$$;
+
+-- [{"order_id": text, "quantity": int}]: add to orders' filled shares,
+-- marking the open ones that are now complete filled
+create or replace function public.add_order_fills(fills jsonb, batch_id uuid default null)
+returns setof public.orders
+language plpgsql
+as $$
+begin
+    if not public.claim_batch(batch_id, 'add_order_fills') then
+        return;
+    end if;
+    return query
+    update public.orders as o
+    set filled = o.filled + d.quantity,
+        status = case when o.status = 'open' and o.filled + d.quantity >= o.size then 'filled' else o.status end,
+        filled_at = case when o.status = 'open' and o.filled + d.quantity >= o.size then now() else o.filled_at end
+    from (
+        select order_id, sum(quantity) as quantity
+        from jsonb_to_recordset(fills) as r(order_id text, quantity bigint)
+        group by order_id
+    ) as d
+    where o.id = d.order_id
+    returning o.*;
+end;
+$$;
+
+-- [{"market_id": uuid, "volume_cents": int, "yes_price_cents": int}]: add
+-- traded value to markets' volume and set both prices from the last YES price
+create or replace function public.add_market_trades(trades jsonb, batch_id uuid default null)
+returns setof public.markets
+language plpgsql
+as $$
+begin
+    if not public.claim_batch(batch_id, 'add_market_trades') then
+        return;
+    end if;
+    return query
+    update public.markets as m
+    set total_volume = coalesce(m.total_volume, 0) + d.volume_cents / 100.0,
+        yes_price = d.yes_price_cents / 100.0,
+        no_price = (100 - d.yes_price_cents) / 100.0
+    from jsonb_to_recordset(trades) as d(market_id uuid, volume_cents bigint, yes_price_cents bigint)
+    where m.id = d.market_id
+    returning m.*;
+end;
+$$;